@@ -0,0 +1,179 @@
+-- Durable job queue for background work (extraction, analysis, URL imports)
+-- Used when JOB_QUEUE_BACKEND=postgres: the web process enqueues, `python worker.py` leases.
+-- Run this in Supabase SQL Editor to add the table and RPC functions
+
+CREATE TABLE IF NOT EXISTS public.job_queue (
+  job_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  kind TEXT NOT NULL,
+  payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+  priority INTEGER NOT NULL DEFAULT 0,
+  status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'leased', 'dead')),
+  attempts INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL DEFAULT 5,
+  run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  lease_token UUID,
+  leased_by TEXT,
+  lease_expires_at TIMESTAMPTZ,
+  last_error TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Ready jobs in lease order, and expired leases
+CREATE INDEX IF NOT EXISTS idx_job_queue_ready ON public.job_queue (priority DESC, run_at) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_job_queue_leases ON public.job_queue (lease_expires_at) WHERE status = 'leased';
+
+-- Only the service role touches the queue
+ALTER TABLE public.job_queue ENABLE ROW LEVEL SECURITY;
+
+-- Add a job (delay_seconds_param postpones its first run)
+CREATE OR REPLACE FUNCTION enqueue_job(
+  kind_param TEXT,
+  payload_param JSONB,
+  priority_param INTEGER DEFAULT 0,
+  max_attempts_param INTEGER DEFAULT 5,
+  delay_seconds_param DOUBLE PRECISION DEFAULT 0
+) RETURNS UUID AS $$
+DECLARE
+  new_job_id UUID;
+BEGIN
+  INSERT INTO public.job_queue (kind, payload, priority, max_attempts, run_at)
+  VALUES (
+    kind_param,
+    COALESCE(payload_param, '{}'::jsonb),
+    priority_param,
+    GREATEST(max_attempts_param, 1),
+    NOW() + make_interval(secs => GREATEST(delay_seconds_param, 0))
+  )
+  RETURNING job_id INTO new_job_id;
+  RETURN new_job_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Lease the next runnable job: highest priority first, then oldest run_at.
+-- Jobs whose lease expired (worker died) are runnable again until they run out of attempts.
+-- SKIP LOCKED lets any number of workers lease concurrently without blocking each other.
+CREATE OR REPLACE FUNCTION lease_job(
+  worker_param TEXT,
+  kinds_param TEXT[] DEFAULT NULL,
+  visibility_seconds_param DOUBLE PRECISION DEFAULT 300
+) RETURNS SETOF public.job_queue AS $$
+BEGIN
+  -- Expired leases with no attempts left are dead
+  UPDATE public.job_queue
+  SET status = 'dead',
+      lease_token = NULL,
+      last_error = COALESCE(last_error, 'Lease expired on the last attempt'),
+      updated_at = NOW()
+  WHERE status = 'leased'
+    AND lease_expires_at <= NOW()
+    AND attempts >= max_attempts;
+
+  RETURN QUERY
+  UPDATE public.job_queue q
+  SET status = 'leased',
+      attempts = q.attempts + 1,
+      lease_token = gen_random_uuid(),
+      leased_by = worker_param,
+      lease_expires_at = NOW() + make_interval(secs => visibility_seconds_param),
+      updated_at = NOW()
+  WHERE q.job_id = (
+    SELECT job_id FROM public.job_queue
+    WHERE ((status = 'queued' AND run_at <= NOW())
+           OR (status = 'leased' AND lease_expires_at <= NOW()))
+      AND (kinds_param IS NULL OR kind = ANY(kinds_param))
+    ORDER BY priority DESC, run_at, created_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING q.*;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Push a held lease further out (returns FALSE if the lease was lost)
+CREATE OR REPLACE FUNCTION extend_job_lease(
+  job_id_param UUID,
+  lease_token_param UUID,
+  visibility_seconds_param DOUBLE PRECISION DEFAULT 300
+) RETURNS BOOLEAN AS $$
+BEGIN
+  UPDATE public.job_queue
+  SET lease_expires_at = NOW() + make_interval(secs => visibility_seconds_param),
+      updated_at = NOW()
+  WHERE job_id = job_id_param AND lease_token = lease_token_param AND status = 'leased';
+  RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Finished jobs are removed
+CREATE OR REPLACE FUNCTION complete_job(
+  job_id_param UUID,
+  lease_token_param UUID
+) RETURNS BOOLEAN AS $$
+BEGIN
+  DELETE FROM public.job_queue
+  WHERE job_id = job_id_param AND lease_token = lease_token_param AND status = 'leased';
+  RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Record a failed attempt: retry after retry_delay_seconds_param, or mark dead when out of attempts.
+-- Returns the new status ('queued' or 'dead'), NULL if the lease was lost.
+CREATE OR REPLACE FUNCTION fail_job(
+  job_id_param UUID,
+  lease_token_param UUID,
+  error_param TEXT,
+  retry_delay_seconds_param DOUBLE PRECISION DEFAULT 0
+) RETURNS TEXT AS $$
+DECLARE
+  new_status TEXT;
+BEGIN
+  UPDATE public.job_queue
+  SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+      run_at = NOW() + make_interval(secs => GREATEST(retry_delay_seconds_param, 0)),
+      lease_token = NULL,
+      leased_by = NULL,
+      lease_expires_at = NULL,
+      last_error = LEFT(error_param, 2000),
+      updated_at = NOW()
+  WHERE job_id = job_id_param AND lease_token = lease_token_param AND status = 'leased'
+  RETURNING status INTO new_status;
+  RETURN new_status;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Hand a job back untried (worker shutting down); the attempt is not counted
+CREATE OR REPLACE FUNCTION release_job(
+  job_id_param UUID,
+  lease_token_param UUID
+) RETURNS BOOLEAN AS $$
+BEGIN
+  UPDATE public.job_queue
+  SET status = 'queued',
+      attempts = GREATEST(attempts - 1, 0),
+      run_at = NOW(),
+      lease_token = NULL,
+      leased_by = NULL,
+      lease_expires_at = NULL,
+      updated_at = NOW()
+  WHERE job_id = job_id_param AND lease_token = lease_token_param AND status = 'leased';
+  RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Job counts per status (for health checks)
+CREATE OR REPLACE FUNCTION job_queue_stats()
+RETURNS TABLE(status TEXT, jobs BIGINT) AS $$
+BEGIN
+  RETURN QUERY
+  SELECT q.status, COUNT(*)::BIGINT FROM public.job_queue q GROUP BY q.status;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+GRANT EXECUTE ON FUNCTION enqueue_job(TEXT, JSONB, INTEGER, INTEGER, DOUBLE PRECISION) TO service_role;
+GRANT EXECUTE ON FUNCTION lease_job(TEXT, TEXT[], DOUBLE PRECISION) TO service_role;
+GRANT EXECUTE ON FUNCTION extend_job_lease(UUID, UUID, DOUBLE PRECISION) TO service_role;
+GRANT EXECUTE ON FUNCTION complete_job(UUID, UUID) TO service_role;
+GRANT EXECUTE ON FUNCTION fail_job(UUID, UUID, TEXT, DOUBLE PRECISION) TO service_role;
+GRANT EXECUTE ON FUNCTION release_job(UUID, UUID) TO service_role;
+GRANT EXECUTE ON FUNCTION job_queue_stats() TO service_role;
@@ -0,0 +1,59 @@
+-- Server-side merge of memory tree facts (used by MemoryTreeBatch.flush in memory_tree.py)
+-- The merge happens inside the UPDATE, so facts written concurrently by other sources of the
+-- same scope and edits made in the node editor since the batch started are kept.
+-- Run this in Supabase SQL Editor after memory_tree_schema.sql
+
+-- Same rules as memory_tree.merge_data: lists are unioned by value (first-seen order),
+-- objects are shallow-merged (new keys win), any other value is replaced by the new one
+CREATE OR REPLACE FUNCTION public.memory_merge_data(
+  current_data JSONB,
+  new_data JSONB
+) RETURNS JSONB AS $$
+  SELECT COALESCE(jsonb_object_agg(pairs.k,
+    CASE
+      WHEN pairs.old_value IS NULL OR pairs.old_value = 'null'::jsonb THEN pairs.new_value
+      WHEN pairs.new_value IS NULL OR pairs.new_value = 'null'::jsonb THEN pairs.old_value
+      WHEN jsonb_typeof(pairs.old_value) = 'array' AND jsonb_typeof(pairs.new_value) = 'array' THEN (
+        SELECT COALESCE(jsonb_agg(u.item ORDER BY u.first_pos), '[]'::jsonb)
+        FROM (
+          SELECT e.item, MIN(e.pos) AS first_pos
+          FROM jsonb_array_elements(pairs.old_value || pairs.new_value) WITH ORDINALITY AS e(item, pos)
+          GROUP BY e.item
+        ) AS u
+      )
+      WHEN jsonb_typeof(pairs.old_value) = 'object' AND jsonb_typeof(pairs.new_value) = 'object'
+        THEN pairs.old_value || pairs.new_value
+      ELSE pairs.new_value
+    END
+  ), '{}'::jsonb)
+  FROM (
+    SELECT keys.k,
+           COALESCE(current_data, '{}'::jsonb) -> keys.k AS old_value,
+           COALESCE(new_data, '{}'::jsonb) -> keys.k AS new_value
+    FROM (
+      SELECT jsonb_object_keys(COALESCE(current_data, '{}'::jsonb)) AS k
+      UNION
+      SELECT jsonb_object_keys(COALESCE(new_data, '{}'::jsonb))
+    ) AS keys
+  ) AS pairs;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Merge buffered facts into existing nodes: nodes_param is [{"id": ..., "data": {...}}, ...].
+-- Returns the ids that were updated (a missing id means the node was deleted meanwhile).
+CREATE OR REPLACE FUNCTION public.merge_memory_nodes(
+  user_uuid UUID,
+  nodes_param JSONB
+) RETURNS TABLE(id UUID) AS $$
+BEGIN
+  RETURN QUERY
+  UPDATE public.memory_nodes n
+  SET data = public.memory_merge_data(n.data, u.data),
+      updated_at = NOW()
+  FROM jsonb_to_recordset(nodes_param) AS u(id UUID, data JSONB)
+  WHERE n.id = u.id AND n.user_id = user_uuid
+  RETURNING n.id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+GRANT EXECUTE ON FUNCTION public.memory_merge_data(JSONB, JSONB) TO service_role;
+GRANT EXECUTE ON FUNCTION public.merge_memory_nodes(UUID, JSONB) TO service_role;
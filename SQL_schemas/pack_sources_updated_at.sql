@@ -0,0 +1,13 @@
+-- Keep pack_sources.updated_at current on every write (read by pack_exports.source_fingerprint)
+-- Stored pack exports are reused while a source's fingerprint is unchanged, so any edit to a
+-- source row (re-analysis, rename, status change) has to move updated_at.
+-- Run this in Supabase SQL Editor after supabase_complete_schema.sql
+
+ALTER TABLE public.pack_sources
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+DROP TRIGGER IF EXISTS set_pack_sources_updated_at ON public.pack_sources;
+
+CREATE TRIGGER set_pack_sources_updated_at
+  BEFORE UPDATE ON public.pack_sources
+  FOR EACH ROW EXECUTE FUNCTION public.handle_updated_at();
@@ -0,0 +1,233 @@
+"""
+Content-addressed cache for chunk analysis results.
+
+Analysis output depends only on the request sent to OpenAI, so results are
+stored under a hash of everything that shapes that request: the rendered
+user prompt (which covers the chunk text and the prompt template), the
+system prompt, the model and the sampling parameters. Re-uploading the same
+export, or adding it to a second pack, then skips those OpenAI calls.
+
+Two tiers:
+    - a local on-disk tier bounded by size with LRU eviction
+    - an optional shared remote tier (R2), so results survive restarts and
+      are shared between instances
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+# Bump to invalidate every cached entry (e.g. when the result format changes)
+CACHE_VERSION = "v1"
+
+
+def make_cache_key(
+    prompt: str,
+    system_prompt: str,
+    model: str,
+    temperature: float,
+    max_completion_tokens: Optional[int] = None,
+) -> str:
+    """
+    Build the content-addressed key for an analysis request.
+
+    Args:
+        prompt: Rendered user prompt (template + chunk text)
+        system_prompt: System prompt sent with the request
+        model: Model name
+        temperature: Sampling temperature
+        max_completion_tokens: Completion token cap
+
+    Returns:
+        Hex SHA-256 digest identifying the request
+    """
+    digest = hashlib.sha256()
+    for part in (CACHE_VERSION, model, repr(float(temperature)), str(max_completion_tokens), system_prompt, prompt):
+        encoded = part.encode("utf-8", errors="replace")
+        # Length-prefix each part so boundaries cannot be confused
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Two-tier (local disk LRU + optional remote) store of analysis results.
+
+    Values are small JSON-serialisable dicts. All methods are thread-safe and
+    blocking; call them through asyncio.to_thread from async code.
+    """
+
+    def __init__(
+        self,
+        local_dir: str,
+        max_local_bytes: int = 512 * 1024 * 1024,
+        remote_get: Optional[Callable[[str], Optional[bytes]]] = None,
+        remote_put: Optional[Callable[[str, bytes], bool]] = None,
+        remote_prefix: str = "analysis_cache",
+    ):
+        self.local_dir = local_dir
+        self.max_local_bytes = max_local_bytes
+        self.remote_get = remote_get
+        self.remote_put = remote_put
+        self.remote_prefix = remote_prefix.rstrip("/")
+
+        self._lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._local_bytes = 0
+        self.stats: Dict[str, int] = {"local_hits": 0, "remote_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        os.makedirs(self.local_dir, exist_ok=True)
+        self._load_index()
+
+    # ------------------------------------------------------------------
+    # Paths
+    # ------------------------------------------------------------------
+
+    def _local_path(self, key: str) -> str:
+        return os.path.join(self.local_dir, key[:2], f"{key}.json")
+
+    def _remote_key(self, key: str) -> str:
+        return f"{self.remote_prefix}/{CACHE_VERSION}/{key[:2]}/{key}.json"
+
+    def _load_index(self) -> None:
+        """Rebuild the LRU index from the files on disk (oldest access first)."""
+        entries = []
+        for root, _dirs, files in os.walk(self.local_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _mtime, key, size in sorted(entries):
+            self._index[key] = size
+            self._local_bytes += size
+        self._evict()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached result (local tier first, then remote).
+
+        Args:
+            key: Key from make_cache_key()
+
+        Returns:
+            Cached result dict, or None on a miss
+        """
+        value = self._get_local(key)
+        if value is not None:
+            with self._lock:
+                self.stats["local_hits"] += 1
+            return value
+
+        if self.remote_get is not None:
+            try:
+                data = self.remote_get(self._remote_key(key))
+            except Exception as e:
+                print(f"⚠️ Analysis cache remote read failed: {e}")
+                data = None
+            if data:
+                try:
+                    value = json.loads(data)
+                except (ValueError, TypeError):
+                    value = None
+                if value is not None:
+                    self._put_local(key, data if isinstance(data, bytes) else data.encode("utf-8"))
+                    with self._lock:
+                        self.stats["remote_hits"] += 1
+                    return value
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        """
+        Store a result in both tiers.
+
+        Args:
+            key: Key from make_cache_key()
+            value: JSON-serialisable result dict
+        """
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self._put_local(key, data)
+        if self.remote_put is not None:
+            try:
+                self.remote_put(self._remote_key(key), data)
+            except Exception as e:
+                print(f"⚠️ Analysis cache remote write failed: {e}")
+        with self._lock:
+            self.stats["stores"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and local tier usage, for health/metrics endpoints."""
+        with self._lock:
+            return {**self.stats, "local_entries": len(self._index), "local_bytes": self._local_bytes}
+
+    # ------------------------------------------------------------------
+    # Local tier
+    # ------------------------------------------------------------------
+
+    def _get_local(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        path = self._local_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = json.loads(f.read())
+            os.utime(path)  # Keep recency across restarts
+            return value
+        except (OSError, ValueError):
+            self._drop_local(key)
+            return None
+
+    def _put_local(self, key: str, data: bytes) -> None:
+        path = self._local_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Analysis cache local write failed: {e}")
+            return
+        with self._lock:
+            self._local_bytes -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._local_bytes += len(data)
+            self._evict()
+
+    def _drop_local(self, key: str) -> None:
+        with self._lock:
+            self._local_bytes -= self._index.pop(key, 0)
+        try:
+            os.remove(self._local_path(key))
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until under the size bound (lock held)."""
+        while self._local_bytes > self.max_local_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._local_bytes -= size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(self._local_path(key))
+            except OSError:
+                pass
@@ -0,0 +1,258 @@
+"""
+Checkpoints and durable records for source analysis jobs.
+
+analyze_source_chunks runs as a background task and used to keep every
+chunk result in memory until the end. A deploy or crash late in a large
+source lost all the OpenAI work done so far, and the source stayed in
+"analyzing" forever. Two pieces make analyses resumable:
+
+- AnalysisCheckpoints writes each chunk's result to R2 as soon as it
+  completes ({source_dir}/checkpoints/chunk_NNNNN.json). A restarted
+  analysis loads them and only sends the missing chunks to OpenAI. Every
+  checkpoint carries a fingerprint of the request it answers (chunk text,
+  system prompt, file name, chunk count), so a checkpoint never answers a
+  different request.
+- AnalysisJobRegistry keeps a record per running analysis under
+  analysis_jobs/active/ with everything needed to restart it (user, pack,
+  limits, prompt). The owning process heartbeats its records. Records
+  whose heartbeat goes stale belong to a process that died, and are
+  claimed and resumed by the recovery pass. Analyses run from the job
+  queue (worker.py) have no record: only the web process heartbeats and
+  recovers records, and the queue lease already re-runs a job whose
+  worker died.
+
+Storage functions are injected (synchronous, like AnalysisWriter's) and
+are called from threads.
+"""
+
+import hashlib
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+REGISTRY_PREFIX = "analysis_jobs/active"
+
+
+def chunk_fingerprint(chunk: str, system_prompt: str, filename: str, total_chunks: int) -> str:
+    """Identity of the analysis request for one chunk (what a checkpoint must match)."""
+    digest = hashlib.sha256()
+    for part in (chunk, system_prompt, filename, str(total_chunks)):
+        encoded = part.encode("utf-8", errors="replace")
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()[:32]
+
+
+class AnalysisCheckpoints:
+    """
+    Per-chunk analysis results of one source, persisted as they complete.
+
+    Usage:
+        checkpoints = AnalysisCheckpoints(f"{source_dir}/checkpoints", put, get_many, list_keys, delete_many)
+        done = checkpoints.load(fingerprints)        # {index: result}
+        checkpoints.save(index, fingerprints[index], result)
+        checkpoints.clear()                          # once analyzed.txt is written
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        put: Callable[[str, str], bool],
+        get_many: Callable[[List[str]], Dict[str, Optional[str]]],
+        list_keys: Callable[[str], List[str]],
+        delete_many: Callable[[List[str]], int],
+    ):
+        self.prefix = prefix.rstrip("/")
+        self._put = put
+        self._get_many = get_many
+        self._list_keys = list_keys
+        self._delete_many = delete_many
+
+    def key(self, index: int) -> str:
+        return f"{self.prefix}/chunk_{index:05d}.json"
+
+    def load(self, fingerprints: List[str]) -> Dict[int, Dict[str, Any]]:
+        """
+        Read the checkpoints that still answer the current requests.
+
+        Args:
+            fingerprints: chunk_fingerprint() per chunk index
+
+        Returns:
+            Mapping of chunk index -> saved result
+        """
+        wanted = {self.key(index): index for index in range(len(fingerprints))}
+        keys = [key for key in self._list_keys(self.prefix + "/") if key in wanted]
+        if not keys:
+            return {}
+
+        results: Dict[int, Dict[str, Any]] = {}
+        for key, raw in self._get_many(keys).items():
+            if not raw:
+                continue
+            try:
+                saved = json.loads(raw)
+            except ValueError:
+                continue
+            index = wanted[key]
+            if saved.get("fingerprint") == fingerprints[index] and isinstance(saved.get("result"), dict):
+                results[index] = saved["result"]
+        return results
+
+    def save(self, index: int, fingerprint: str, result: Dict[str, Any]) -> bool:
+        """Persist one chunk's result; returns False (and logs) when the write failed."""
+        payload = json.dumps({"fingerprint": fingerprint, "result": result})
+        try:
+            ok = self._put(self.key(index), payload)
+        except Exception as e:
+            print(f"⚠️ Failed to checkpoint chunk {index + 1}: {e}")
+            return False
+        if not ok:
+            print(f"⚠️ Failed to checkpoint chunk {index + 1}")
+        return bool(ok)
+
+    def clear(self) -> int:
+        """Delete all checkpoints of the source; returns the number deleted."""
+        keys = self._list_keys(self.prefix + "/")
+        return self._delete_many(keys) if keys else 0
+
+
+class AnalysisJobRegistry:
+    """
+    Durable records of running analyses, with heartbeats and stale-job claiming.
+
+    Usage:
+        registry = AnalysisJobRegistry(put, get, list_keys, delete)
+        registry.start(source_id, {...restart parameters...})
+        registry.heartbeat_all()                     # periodically
+        for record in registry.claim_stale(): resume(record)
+        registry.finish(source_id)
+    """
+
+    def __init__(
+        self,
+        put: Callable[[str, str], bool],
+        get: Callable[[str], Optional[str]],
+        list_keys: Callable[[str], List[str]],
+        delete: Callable[[str], bool],
+        stale_after_seconds: float = 180,
+        instance_id: Optional[str] = None,
+    ):
+        """
+        Args:
+            put: (key, text) -> success
+            get: key -> text, None when missing
+            list_keys: prefix -> keys
+            delete: key -> success
+            stale_after_seconds: Heartbeat age after which a job's owner is presumed dead
+            instance_id: Identity of this process (random by default)
+        """
+        self._put = put
+        self._get = get
+        self._list_keys = list_keys
+        self._delete = delete
+        self.stale_after_seconds = stale_after_seconds
+        self.instance_id = instance_id or uuid.uuid4().hex
+        self._owned: Dict[str, Dict[str, Any]] = {}
+        self.stats: Dict[str, int] = {"started": 0, "finished": 0, "claimed": 0, "heartbeat_failures": 0}
+
+    @staticmethod
+    def key(source_id: str) -> str:
+        return f"{REGISTRY_PREFIX}/{source_id}.json"
+
+    def _write(self, record: Dict[str, Any]) -> bool:
+        record["owner"] = self.instance_id
+        record["heartbeat_at"] = time.time()
+        return bool(self._put(self.key(record["source_id"]), json.dumps(record)))
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self._get(key)
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    def start(self, source_id: str, params: Dict[str, Any]) -> None:
+        """
+        Record that this process is analysing source_id.
+
+        Args:
+            source_id: Source being analysed
+            params: JSON-serializable parameters needed to restart the analysis
+        """
+        previous = self._owned.get(source_id) or {}
+        record = {
+            **params,
+            "source_id": source_id,
+            # A claimed (resumed) job keeps the attempt count claim_stale() gave it
+            "attempts": previous.get("attempts", 1),
+            "started_at": previous.get("started_at") or datetime.utcnow().isoformat(),
+        }
+        self._owned[source_id] = record
+        if not self._write(dict(record)):
+            print(f"⚠️ Could not record analysis job for source {source_id}; it will not be resumable")
+        self.stats["started"] += 1
+
+    def finish(self, source_id: str) -> None:
+        """Drop the record once the analysis completed, failed or was cancelled."""
+        self._owned.pop(source_id, None)
+        try:
+            self._delete(self.key(source_id))
+        except Exception as e:
+            print(f"⚠️ Could not remove analysis job record for source {source_id}: {e}")
+        self.stats["finished"] += 1
+
+    def heartbeat_all(self) -> None:
+        """Refresh the heartbeat of every job this process owns."""
+        for source_id, record in list(self._owned.items()):
+            try:
+                ok = self._write(dict(record))
+            except Exception:
+                ok = False
+            if not ok:
+                self.stats["heartbeat_failures"] += 1
+
+    def claim_stale(self, confirm_delay: float = 1.0) -> List[Dict[str, Any]]:
+        """
+        Take over jobs whose owner stopped heartbeating.
+
+        A claim is written, then read back after confirm_delay; if another
+        process claimed the same job in between, its claim wins.
+
+        Returns:
+            Records of the claimed jobs (now owned by this process)
+        """
+        now = time.time()
+        candidates = []
+        for key in self._list_keys(REGISTRY_PREFIX + "/"):
+            record = self._read(key)
+            if record is None or record.get("source_id") in self._owned:
+                continue
+            if now - float(record.get("heartbeat_at", 0)) >= self.stale_after_seconds:
+                record["attempts"] = int(record.get("attempts", 1)) + 1
+                if self._write(record):
+                    candidates.append(record)
+        if not candidates:
+            return []
+
+        time.sleep(confirm_delay)
+        claimed = []
+        for record in candidates:
+            current = self._read(self.key(record["source_id"]))
+            if current is not None and current.get("owner") == self.instance_id:
+                self._owned[record["source_id"]] = current
+                claimed.append(current)
+        self.stats["claimed"] += len(claimed)
+        return claimed
+
+    def owned(self) -> Iterable[str]:
+        return list(self._owned)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters for health/metrics endpoints."""
+        return {"instance_id": self.instance_id, "running": len(self._owned), **self.stats}
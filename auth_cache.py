@@ -0,0 +1,84 @@
+"""
+Cache of verified JWT claims.
+
+During analysis the frontend polls status endpoints several times a second
+with the same bearer token, and every request re-ran HS256 verification
+(twice for tokens with a non-default audience). TokenCache remembers the
+claims of tokens that verified successfully, keyed by a SHA-256 digest of
+the token so raw tokens are never held in memory. Entries never outlive the
+token's own "exp" claim.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class TokenCache:
+    """
+    LRU + TTL cache of verified token claims.
+
+    Usage:
+        claims = token_cache.get(token)
+        if claims is None:
+            claims = verify(token)
+            token_cache.put(token, claims)
+    """
+
+    def __init__(self, max_entries: int = 10000, max_ttl_seconds: float = 300):
+        self.max_entries = max(1, max_entries)
+        self.max_ttl_seconds = max_ttl_seconds
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """Return cached claims for token, or None on a miss or an expired entry."""
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, claims = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return claims
+
+    def put(self, token: str, claims: Dict[str, Any]) -> None:
+        """
+        Cache the claims of a verified token.
+
+        Args:
+            token: Raw bearer token
+            claims: Verified payload; its "exp" bounds the entry lifetime
+        """
+        expires_at = time.time() + self.max_ttl_seconds
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        if expires_at <= time.time():
+            return
+        key = self._key(token)
+        self._entries[key] = (expires_at, claims)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Hit/miss counters for health/metrics endpoints."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": len(self._entries),
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            **self.stats,
+        }
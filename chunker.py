@@ -0,0 +1,205 @@
+"""
+Single-pass, tokenizer-aware chunking.
+
+Extracted texts (messages / paragraphs) are split into segments on
+paragraph boundaries. Every segment is encoded exactly once, using batched
+tiktoken calls. Chunks are then cut on a prefix sum of the segment token
+counts, so no text is re-tokenized, and the overlap between consecutive
+chunks is measured in tokens. Each chunk's token count is returned as well,
+so later steps never need to count again.
+
+The module only depends on the standard library and tiktoken, so it can run
+in worker processes without importing the web app.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Callable, Iterable, List, Optional, Tuple
+
+
+ENCODING_NAME = "cl100k_base"
+
+# Default chunk shape (same budget as the previous character-window chunker)
+MAX_CHUNK_TOKENS = 100000
+OVERLAP_TOKENS = 5000
+
+# Segments longer than this are split further (line, sentence, word, then hard cut)
+MAX_SEGMENT_CHARS = 20000
+
+# Segments encoded per tiktoken batch call
+ENCODE_BATCH_SIZE = 2048
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SOFT_BREAKS = ("\n", ". ", " ")
+
+_encoding = None
+
+
+def get_encoding():
+    """Return the shared tiktoken encoding, or None when tiktoken is unavailable."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(ENCODING_NAME)
+        except Exception as e:
+            print(f"⚠️ tiktoken unavailable, estimating tokens from length: {e}")
+            _encoding = False
+    return _encoding or None
+
+
+def count_segment_tokens(segments: List[str], batch_size: int = ENCODE_BATCH_SIZE) -> List[int]:
+    """
+    Count tokens for each segment, encoding every segment exactly once.
+
+    Args:
+        segments: Texts to count
+        batch_size: Segments per batched encode call
+
+    Returns:
+        Token count per segment
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        return [len(segment) // 4 for segment in segments]
+
+    counts: List[int] = []
+    for start in range(0, len(segments), batch_size):
+        batch = segments[start:start + batch_size]
+        counts.extend(len(tokens) for tokens in encoding.encode_ordinary_batch(batch))
+    return counts
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    """Split text into pieces of at most max_chars, preferring soft boundaries."""
+    pieces = []
+    start = 0
+    while len(text) - start > max_chars:
+        window_end = start + max_chars
+        cut = -1
+        for separator in _SOFT_BREAKS:
+            found = text.rfind(separator, start + max_chars // 2, window_end)
+            if found != -1:
+                cut = found + len(separator)
+                break
+        if cut == -1:
+            cut = window_end
+        pieces.append(text[start:cut])
+        start = cut
+    pieces.append(text[start:])
+    return pieces
+
+
+def split_segments(texts: Iterable[str], separator: str = "\n\n", max_chars: int = MAX_SEGMENT_CHARS) -> List[str]:
+    """
+    Split texts into contiguous segments on paragraph and message boundaries.
+
+    Segments keep their trailing separators, so "".join(segments) equals
+    separator.join(texts).
+
+    Args:
+        texts: Extracted texts (each message or paragraph is a boundary)
+        separator: Text placed between consecutive texts
+        max_chars: Upper bound on segment length
+
+    Returns:
+        Ordered list of segments
+    """
+    segments: List[str] = []
+    previous = None
+    for text in texts:
+        if previous is not None:
+            segments[-1] += separator
+        previous = text
+        if not text:
+            segments.append("")
+            continue
+
+        start = 0
+        for match in _PARAGRAPH_BREAK.finditer(text):
+            paragraph = text[start:match.end()]
+            start = match.end()
+            segments.extend(_split_long(paragraph, max_chars) if len(paragraph) > max_chars else [paragraph])
+        tail = text[start:]
+        if tail or start == 0:
+            segments.extend(_split_long(tail, max_chars) if len(tail) > max_chars else [tail])
+    return [segment for segment in segments if segment]
+
+
+def plan_chunks(
+    token_counts: List[int],
+    max_tokens: int = MAX_CHUNK_TOKENS,
+    overlap_tokens: int = OVERLAP_TOKENS,
+) -> List[Tuple[int, int]]:
+    """
+    Choose chunk boundaries from segment token counts.
+
+    Each chunk is the longest run of whole segments that fits max_tokens. The
+    next chunk starts at the earliest segment that keeps the overlap within
+    overlap_tokens, and always at least one segment further on.
+
+    Args:
+        token_counts: Token count per segment
+        max_tokens: Token budget per chunk
+        overlap_tokens: Tokens shared between consecutive chunks
+
+    Returns:
+        (start, end) segment index ranges, end exclusive
+    """
+    total_segments = len(token_counts)
+    if total_segments == 0:
+        return []
+    prefix = [0] + list(accumulate(token_counts))
+
+    ranges = []
+    start = 0
+    while start < total_segments:
+        # Longest run of whole segments within budget (at least one segment)
+        end = bisect_right(prefix, prefix[start] + max_tokens) - 1
+        end = min(max(end, start + 1), total_segments)
+        ranges.append((start, end))
+        if end >= total_segments:
+            break
+        # Start the next chunk inside this one to keep up to overlap_tokens of context
+        next_start = bisect_left(prefix, prefix[end] - overlap_tokens, start + 1, end)
+        start = max(start + 1, min(next_start, end))
+    return ranges
+
+
+def chunk_texts(
+    texts: Iterable[str],
+    max_tokens: int = MAX_CHUNK_TOKENS,
+    overlap_tokens: int = OVERLAP_TOKENS,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    separator: str = "\n\n",
+) -> Tuple[List[str], List[int]]:
+    """
+    Chunk extracted texts on token budgets in a single tokenization pass.
+
+    Args:
+        texts: Extracted texts (joined with separator, as in extracted.txt)
+        max_tokens: Token budget per chunk
+        overlap_tokens: Tokens shared between consecutive chunks
+        progress_callback: Optional callable(chunk_count, progress_pct)
+        separator: Text placed between consecutive texts
+
+    Returns:
+        (chunks, token_counts) with one token count per chunk
+    """
+    segments = split_segments(texts, separator)
+    counts = count_segment_tokens(segments)
+    ranges = plan_chunks(counts, max_tokens, overlap_tokens)
+    prefix = [0] + list(accumulate(counts))
+
+    chunks: List[str] = []
+    chunk_tokens: List[int] = []
+    for start, end in ranges:
+        chunks.append("".join(segments[start:end]))
+        chunk_tokens.append(prefix[end] - prefix[start])
+        if progress_callback and len(chunks) % 10 == 0:
+            progress_callback(len(chunks), int(end / len(segments) * 100))
+
+    if progress_callback and chunks:
+        progress_callback(len(chunks), 99)
+    return chunks, chunk_tokens
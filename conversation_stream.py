@@ -0,0 +1,241 @@
+"""
+Streaming extraction for ChatGPT conversations.json exports.
+
+A full export is one large JSON array of conversations. Loading it with
+json.loads keeps the raw bytes, the decoded string and the parsed tree in
+memory at the same time. This module reads the array incrementally from any
+binary stream (typically a ZIP member opened with ZipFile.open) and parses
+one conversation at a time. Peak memory is bounded by the largest single
+conversation rather than by the file.
+"""
+
+import codecs
+import json
+from typing import Any, BinaryIO, Iterator, List, Optional
+
+
+# Bytes read from the underlying stream per refill
+READ_SIZE = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _TextReader:
+    """Incremental UTF-8 decoding over a binary stream (BOM tolerant)."""
+
+    def __init__(self, stream: BinaryIO, read_size: int = READ_SIZE):
+        self.stream = stream
+        self.read_size = read_size
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        self.eof = False
+
+    def read(self, min_chars: int) -> str:
+        """Read at least min_chars characters, or whatever is left before EOF."""
+        pieces = []
+        count = 0
+        while count < min_chars and not self.eof:
+            data = self.stream.read(max(self.read_size, min_chars - count))
+            if not data:
+                self.eof = True
+                text = self.decoder.decode(b"", final=True)
+            else:
+                text = self.decoder.decode(data)
+            if text:
+                pieces.append(text)
+                count += len(text)
+        return "".join(pieces)
+
+
+def iter_json_array(stream: BinaryIO, read_size: int = READ_SIZE) -> Iterator[Any]:
+    """
+    Yield the elements of a top-level JSON array one at a time.
+
+    Each element is decoded with JSONDecoder.raw_decode once its text is
+    fully buffered. When an element is still incomplete, at least as many
+    characters as are already buffered are read before the next attempt.
+    The number of failed attempts is therefore logarithmic in the element
+    size.
+
+    Args:
+        stream: Binary file-like object positioned at the start of the JSON
+        read_size: Bytes to read per refill
+
+    Yields:
+        Parsed array elements
+
+    Raises:
+        ValueError: If the document is not a JSON array or is malformed
+    """
+    reader = _TextReader(stream, read_size)
+    buffer = reader.read(1)
+    pos = 0
+
+    def skip_whitespace() -> None:
+        nonlocal buffer, pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or reader.eof:
+                return
+            buffer, pos = reader.read(1), 0
+
+    skip_whitespace()
+    if pos >= len(buffer) or buffer[pos] != "[":
+        raise ValueError("Expected a JSON array at the top level")
+    pos += 1
+
+    first = True
+    while True:
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ValueError("Unexpected end of JSON array")
+        if buffer[pos] == "]":
+            return
+        if not first:
+            if buffer[pos] != ",":
+                raise ValueError(f"Expected ',' between array elements, found {buffer[pos]!r}")
+            pos += 1
+            skip_whitespace()
+        first = False
+
+        while True:
+            try:
+                element, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if reader.eof:
+                    raise ValueError("Malformed JSON element in array")
+                # Drop consumed text so the buffer only holds the current element
+                buffer, pos = buffer[pos:], 0
+                buffer += reader.read(len(buffer))
+                continue
+            if end == len(buffer) and not reader.eof:
+                # A bare number could continue in the next read - buffer more first
+                more = reader.read(1)
+                if more:
+                    buffer += more
+                    continue
+            break
+
+        pos = end
+        yield element
+
+
+def iter_conversation_texts(conversation: Any) -> Iterator[str]:
+    """
+    Yield the raw texts of one ChatGPT conversation in export order.
+
+    Follows the export schema: the title, then for every node in "mapping"
+    the message content parts (strings, or dicts carrying "text"), plus
+    content "text" fields used by code and execution output messages.
+
+    Args:
+        conversation: One parsed element of conversations.json
+
+    Yields:
+        Uncleaned text strings
+    """
+    if not isinstance(conversation, dict):
+        return
+
+    title = conversation.get("title")
+    if isinstance(title, str):
+        yield title
+
+    mapping = conversation.get("mapping")
+    if not isinstance(mapping, dict):
+        return
+
+    for node in mapping.values():
+        if not isinstance(node, dict):
+            continue
+        message = node.get("message")
+        if not isinstance(message, dict):
+            continue
+        content = message.get("content")
+        if not isinstance(content, dict):
+            continue
+
+        for part in content.get("parts") or []:
+            if isinstance(part, str):
+                yield part
+            elif isinstance(part, dict) and isinstance(part.get("text"), str):
+                yield part["text"]
+
+        text = content.get("text")
+        if isinstance(text, str):
+            yield text
+
+
+def is_chatgpt_conversation(obj: Any) -> bool:
+    """True if obj looks like one conversation from a ChatGPT export."""
+    return isinstance(obj, dict) and isinstance(obj.get("mapping"), dict)
+
+
+def peek_is_json_array(stream: BinaryIO, limit: int = 4096) -> bool:
+    """
+    Check whether a seekable stream holds a JSON array, then rewind it.
+
+    Args:
+        stream: Seekable binary stream
+        limit: Bytes to inspect
+
+    Returns:
+        True if the first non-whitespace character is "["
+    """
+    start = stream.tell()
+    head = stream.read(limit)
+    stream.seek(start)
+    if head.startswith(codecs.BOM_UTF8):
+        head = head[len(codecs.BOM_UTF8):]
+    return head.lstrip().startswith(b"[")
+
+
+def collect_texts(
+    stream: BinaryIO,
+    clean,
+    fallback=None,
+    progress_callback=None,
+    progress_every: int = 500,
+) -> List[str]:
+    """
+    Stream a conversations.json array and collect cleaned, de-duplicated texts.
+
+    Args:
+        stream: Binary stream of the JSON array
+        clean: Callable mapping a raw string to its cleaned form, or None to drop it
+        fallback: Optional callable(element) -> List[str] for elements that are
+            not ChatGPT conversations
+        progress_callback: Optional callable(message) for progress logging
+        progress_every: Conversations between progress messages
+
+    Returns:
+        Extracted texts in export order
+    """
+    texts: List[str] = []
+    seen = set()
+
+    def add(raw: str) -> None:
+        cleaned: Optional[str] = clean(raw)
+        if cleaned and cleaned not in seen:
+            seen.add(cleaned)
+            texts.append(cleaned)
+
+    count = 0
+    for element in iter_json_array(stream):
+        count += 1
+        if is_chatgpt_conversation(element):
+            for raw in iter_conversation_texts(element):
+                add(raw)
+        elif fallback is not None:
+            for raw in fallback(element):
+                add(raw)
+        # Release the parsed conversation before reading the next one
+        element = None
+
+        if progress_callback and count % progress_every == 0:
+            progress_callback(f"Processed {count} conversations ({len(texts)} texts)")
+
+    if progress_callback:
+        progress_callback(f"Processed {count} conversations ({len(texts)} texts)")
+    return texts
@@ -0,0 +1,144 @@
+"""
+Process pool for CPU-bound extraction and chunking.
+
+Text extraction and tokenization are pure Python/CPU work. In the default
+thread executor they serialize on the GIL, so two concurrent uploads share
+one core and starve the threads that make database calls. CpuPool runs them
+in a bounded ProcessPoolExecutor instead.
+
+Jobs must be module-level functions with picklable arguments and results
+(see extraction and chunker). Workers use the "spawn" start method, so they
+never inherit the web app's sockets or locks. Workers are recycled after
+about max_tasks_per_child jobs each, to return memory from large uploads to
+the OS. This is done by retiring the whole executor rather than with
+ProcessPoolExecutor(max_tasks_per_child=...), which can deadlock on
+Python 3.11. A retiring executor is drained and shut down before the next
+one starts, so no more than max_workers worker processes ever exist.
+"""
+
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+
+class CpuPool:
+    """
+    Lazily started process pool with a thread fallback.
+
+    Usage:
+        cpu_pool = CpuPool(max_workers=4, max_tasks_per_child=20)
+        result = await cpu_pool.run(extract_upload_content, path, filename)
+
+    With max_workers=0 the pool is disabled and jobs run via asyncio.to_thread.
+    """
+
+    def __init__(self, max_workers: int, max_tasks_per_child: Optional[int] = None):
+        self.max_workers = max(0, max_workers)
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_tasks = 0
+        # Jobs submitted to each executor that have not finished yet
+        self._in_flight: Dict[ProcessPoolExecutor, int] = {}
+        self._cond: Optional[asyncio.Condition] = None
+        self.stats: Dict[str, int] = {"submitted": 0, "completed": 0, "failed": 0, "pool_restarts": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_workers > 0
+
+    def _recycle_due(self) -> bool:
+        recycle_after = self.max_tasks_per_child and self.max_tasks_per_child * self.max_workers
+        return bool(recycle_after) and self._executor_tasks >= recycle_after
+
+    async def _acquire_executor(self) -> ProcessPoolExecutor:
+        """Executor for the next job; waits while a worn-out executor drains and shuts down."""
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            while self._executor is not None and self._recycle_due():
+                retired = self._executor
+                if self._in_flight.get(retired):
+                    # Its jobs still run on max_workers processes: wait instead of opening a second pool
+                    await self._cond.wait()
+                    continue
+                self._executor = None
+                self.stats["pool_restarts"] += 1
+                await asyncio.to_thread(retired.shutdown)
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._executor_tasks = 0
+                print(f"⚙️ Started CPU pool: {self.max_workers} worker processes "
+                      f"(recycled every {self.max_tasks_per_child or '∞'} tasks per worker)")
+            executor = self._executor
+            self._executor_tasks += 1
+            self._in_flight[executor] = self._in_flight.get(executor, 0) + 1
+            return executor
+
+    async def _release_executor(self, executor: ProcessPoolExecutor, broken: bool = False) -> None:
+        async with self._cond:
+            remaining = self._in_flight.get(executor, 1) - 1
+            if remaining > 0:
+                self._in_flight[executor] = remaining
+            else:
+                self._in_flight.pop(executor, None)
+            if broken and self._executor is executor:
+                # Drop a broken pool (e.g. a worker was OOM-killed) so the next job starts a fresh one
+                self._executor = None
+                self.stats["pool_restarts"] += 1
+                executor.shutdown(wait=False, cancel_futures=True)
+            self._cond.notify_all()
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run func(*args, **kwargs) in a worker process.
+
+        Args:
+            func: Module-level function (must be importable by the workers)
+            *args: Picklable positional arguments
+            **kwargs: Picklable keyword arguments
+
+        Returns:
+            The function's (picklable) result
+        """
+        call = functools.partial(func, *args, **kwargs)
+        if not self.enabled:
+            return await asyncio.to_thread(call)
+
+        executor = await self._acquire_executor()
+        self.stats["submitted"] += 1
+        broken = False
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(executor, call)
+        except BrokenProcessPool:
+            self.stats["failed"] += 1
+            broken = True
+            raise
+        except BaseException:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            await asyncio.shield(self._release_executor(executor, broken))
+        self.stats["completed"] += 1
+        return result
+
+    def shutdown(self) -> None:
+        """Stop the worker processes (called on app shutdown)."""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Pool configuration and counters, for health/metrics endpoints."""
+        return {
+            "max_workers": self.max_workers,
+            "max_tasks_per_child": self.max_tasks_per_child,
+            "started": self._executor is not None,
+            "in_flight": sum(self._in_flight.values()),
+            **self.stats,
+        }
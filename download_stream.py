@@ -0,0 +1,189 @@
+"""
+Byte-range streaming of downloads assembled from R2 objects.
+
+Download endpoints used to read every object into one Python string,
+encode it and wrap it in BytesIO, so a download held the whole pack in
+memory (several times over) before the first byte went out. A
+DownloadStream describes a response as a list of parts instead: literal
+text (headers written between sources), R2 objects and local files. Only
+the sizes are looked up in advance. The body is produced by streaming each
+object's contents in fixed-size pieces, so memory per download stays
+constant regardless of pack size.
+
+Because every part's size is known up front, the total length is known
+too, and single byte ranges ("Range: bytes=a-b") can be served for resumed
+downloads of content that has a strong ETag to validate them. Only the parts overlapping the range are fetched, each with its
+own ranged GET.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Tuple
+
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies outside the content (HTTP 416)."""
+
+
+@dataclass(frozen=True)
+class Part:
+    """One piece of a download: literal bytes, an R2 object or a local file."""
+    size: int
+    data: Optional[bytes] = None
+    key: Optional[str] = None
+    path: Optional[str] = None
+
+    @classmethod
+    def text(cls, text: str) -> "Part":
+        data = text.encode("utf-8")
+        return cls(size=len(data), data=data)
+
+    @classmethod
+    def r2_object(cls, key: str, size: int) -> "Part":
+        return cls(size=size, key=key)
+
+    @classmethod
+    def local_file(cls, path: str, size: int) -> "Part":
+        return cls(size=size, path=path)
+
+
+def parse_range(header: Optional[str], total: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header.
+
+    Args:
+        header: Raw Range header value
+        total: Content length in bytes
+
+    Returns:
+        (start, end) inclusive, or None to serve the full content (no header,
+        malformed header or multiple ranges, which RFC 9110 allows ignoring)
+
+    Raises:
+        RangeNotSatisfiable: If the range starts beyond the content
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header)
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    first, last = match.group(1), match.group(2)
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or total == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, total - length), total - 1
+    start = int(first)
+    end = int(last) if last else total - 1
+    if start >= total or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, total - 1)
+
+
+def is_strong_etag(etag: Optional[str]) -> bool:
+    """Whether etag is a strong validator (present and not W/-prefixed), as Range responses need."""
+    return bool(etag) and not etag.startswith("W/")
+
+
+def if_range_matches(if_range: Optional[str], etag: Optional[str]) -> bool:
+    """
+    Whether a Range request may be honoured under its If-Range precondition.
+
+    If-Range uses the strong comparison (RFC 9110 section 13.1.5): both tags
+    must be strong and identical. Dates are never matched, since downloads
+    carry no Last-Modified.
+
+    Args:
+        if_range: Raw If-Range header value (None when absent)
+        etag: Current quoted ETag of the content, None when it has none
+
+    Returns:
+        True to serve the range, False to send the full content
+    """
+    if not is_strong_etag(etag):
+        return False
+    if not if_range:
+        return True
+    return if_range.strip() == etag
+
+
+class DownloadStream:
+    """
+    Sized, range-addressable byte stream over a list of parts.
+
+    Usage:
+        stream = DownloadStream([Part.text(header), Part.r2_object(key, size)], r2_client.iter_object)
+        for piece in stream.iter_bytes(start, end): ...
+    """
+
+    def __init__(
+        self,
+        parts: List[Part],
+        open_object: Callable[..., Iterator[bytes]],
+        chunk_size: int = CHUNK_SIZE,
+    ):
+        """
+        Args:
+            parts: Parts in output order
+            open_object: (key, start, end, chunk_size) -> iterator over the object's bytes in [start, end]
+            chunk_size: Bytes per yielded piece (bounds the per-download buffer)
+        """
+        self.parts = [part for part in parts if part.size > 0]
+        self._open_object = open_object
+        self.chunk_size = chunk_size
+
+    @property
+    def size(self) -> int:
+        return sum(part.size for part in self.parts)
+
+    def iter_bytes(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Yield the bytes in [start, end] (inclusive), part by part.
+
+        Raises:
+            RuntimeError: If an object turns out shorter than its recorded size
+                (the response is then cut short rather than padded)
+        """
+        if end is None:
+            end = self.size - 1
+        offset = 0
+        for part in self.parts:
+            part_start, part_end = offset, offset + part.size - 1
+            offset += part.size
+            if part_end < start or part_start > end:
+                continue
+            first = max(start, part_start) - part_start
+            last = min(end, part_end) - part_start
+            sent = 0
+            for piece in self._iter_part(part, first, last):
+                sent += len(piece)
+                yield piece
+            if sent != last - first + 1:
+                raise RuntimeError(f"Download part {part.key or part.path} changed while streaming "
+                                   f"({sent} of {last - first + 1} bytes)")
+
+    def _iter_part(self, part: Part, first: int, last: int) -> Iterator[bytes]:
+        if part.data is not None:
+            for position in range(first, last + 1, self.chunk_size):
+                yield part.data[position:min(position + self.chunk_size, last + 1)]
+        elif part.key is not None:
+            whole = first == 0 and last == part.size - 1
+            yield from self._open_object(
+                part.key, first, None if whole else last, self.chunk_size
+            )
+        else:
+            with open(part.path, "rb") as f:
+                f.seek(first)
+                remaining = last - first + 1
+                while remaining > 0:
+                    piece = f.read(min(self.chunk_size, remaining))
+                    if not piece:
+                        return
+                    remaining -= len(piece)
+                    yield piece
@@ -0,0 +1,675 @@
+"""
+Text extraction for uploaded sources.
+
+Pure functions (no app, database or storage state) that turn uploaded files
+into lists of text passages: ChatGPT exports, ZIP archives, PDF, DOCX and
+plain text. Inputs and outputs are plain picklable values, so the same
+functions run in threads or in the CPU worker pool (see cpu_pool).
+"""
+
+import io
+import json
+import re
+import time
+import zipfile
+from typing import Any, BinaryIO, List, Optional, Tuple, Union
+
+from PyPDF2 import PdfReader
+
+from conversation_stream import collect_texts, peek_is_json_array
+from upload_spool import open_spooled
+
+
+# Pre-compile regex patterns for better performance
+_UUID_PATTERN = re.compile(r'^[a-f0-9\-]{8,}$', re.IGNORECASE)
+_NUMBERS_PATTERN = re.compile(r'^[\d\-\s\.]+$')
+_LETTERS_PATTERN = re.compile(r'[a-zA-Z]')
+# ChatGPT conversation IDs like "978dfdf8faef413a-LHR" or standalone alphanumeric IDs
+_CONVERSATION_ID_PATTERN = re.compile(r'^[a-f0-9]{12,20}-[A-Z]{3}$', re.IGNORECASE)
+# Generic conversation/message IDs (standalone alphanumeric strings 8+ chars)
+_GENERIC_ID_PATTERN = re.compile(r'^[a-f0-9]{8,}$', re.IGNORECASE)
+# Line numbers/conversation indices like "22.", "23.", etc.
+_LINE_NUMBER_PATTERN = re.compile(r'^\d{1,3}\.?\s*$')
+# File references: UUIDs with extensions, random file IDs, screenshot filenames
+_FILE_REFERENCE_PATTERN = re.compile(r'^([a-f0-9\-]{30,}|file-[a-zA-Z0-9]{15,}|screenshot\s+\d{4}-\d{2}-\d{2}\s+at\s+[\d\.\s:]+\s*(am|pm)?)\.(jpe?g|png|pdf|gif|webp|mp4|mov)$', re.IGNORECASE)
+
+# Pre-define technical patterns set for faster lookup
+_TECHNICAL_PATTERNS = {
+    'http://', 'https://', '.com', '.org', '.net', '.json', '.txt', '.py', '.edu', '.gov',
+    'client-created', 'message_type', 'model_slug', 'gpt-', 'claude-',
+    'request_id', 'timestamp_', 'content_type', 'conversation_id',
+    'finished_successfully', 'absolute', 'metadata', 'system',
+    'user_editable_context', 'is_visually_hidden', 'role:', 'author:',
+    'create_time', 'update_time', 'parent_id', 'children', 'mapping',
+    'finish_details', 'stop_tokens', 'citations', 'content_references', 'file-service://',
+    '-lhr', '-iad', '-syd', '-fra',  # Common ChatGPT server suffixes
+    '[pdf]', 'citeturn', 'common data set', 'self service', 'catalog',
+    'annual report', 'financial report', 'mediafiles', 'eventreg'
+}
+
+# Pre-define common JSON elements set
+_JSON_ELEMENTS = {'true', 'false', 'null', 'user', 'assistant', 'system', 'all'}
+
+def is_meaningful_text(text: str) -> bool:
+    """OPTIMIZED: Check if text is meaningful conversation content"""
+    if not isinstance(text, str):
+        return False
+    
+    # Clean and normalize - single strip operation
+    text = text.strip()
+    
+    # Skip if too short or empty
+    if len(text) < 3:
+        return False
+    
+    # OPTIMIZED: Use pre-compiled patterns - filter out conversation IDs and other technical identifiers
+    if (_NUMBERS_PATTERN.match(text) or _UUID_PATTERN.match(text) or 
+        _CONVERSATION_ID_PATTERN.match(text) or _GENERIC_ID_PATTERN.match(text) or
+        _LINE_NUMBER_PATTERN.match(text) or _FILE_REFERENCE_PATTERN.match(text)):
+        return False
+    
+    # OPTIMIZED: Use set lookup instead of list iteration
+    text_lower = text.lower()
+    if any(pattern in text_lower for pattern in _TECHNICAL_PATTERNS):
+        return False
+    
+    # OPTIMIZED: Single regex check for letters
+    if not _LETTERS_PATTERN.search(text):
+        return False
+    
+    # Skip very short single words unless they're meaningful
+    if len(text.split()) == 1 and len(text) < 8:
+        return False
+    
+    # OPTIMIZED: Set lookup instead of list check
+    if text_lower in _JSON_ELEMENTS:
+        return False
+    
+    return True
+
+# Pre-compile commonly used regex patterns for performance
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+_TIMESTAMP_PATTERN = re.compile(r'^\[\d{4}-\d{2}-\d{2}.*?\]')
+_TIME_PATTERN = re.compile(r'^\d{1,2}:\d{2}(:\d{2})?\s*(AM|PM)?', re.IGNORECASE)
+_USERNAME_PATTERN = re.compile(r'^[A-Za-z]+:')
+
+
+def clean_extracted_text(obj: Any) -> Optional[str]:
+    """Normalize one candidate string; returns None if it is not meaningful text"""
+    # OPTIMIZED: Pre-filter before expensive operations
+    if not isinstance(obj, str) or len(obj) < 3 or not obj.strip():  # Quick length and whitespace check first
+        return None
+    if not is_meaningful_text(obj):
+        return None
+    
+    # OPTIMIZED: Streamlined text cleaning
+    cleaned_text = obj.strip()
+    
+    # Only do unicode processing if needed
+    if '\\u' in cleaned_text:
+        try:
+            cleaned_text = cleaned_text.encode('utf-8').decode('unicode_escape')
+        except:
+            pass  # Keep original if decode fails
+    
+    # Single regex operation for whitespace normalization
+    cleaned_text = _WHITESPACE_PATTERN.sub(' ', cleaned_text).strip()
+    if not cleaned_text:
+        return None
+    
+    # Only do expensive unicode validation if we're going to keep it
+    try:
+        cleaned_text.encode('utf-8')  # Quick encoding test
+        return cleaned_text
+    except UnicodeEncodeError:
+        # Fallback: aggressive cleaning only when needed
+        import unicodedata
+        safe_text = ''.join(char for char in cleaned_text 
+                          if ord(char) < 65536 and unicodedata.category(char) != 'Cs')
+        return safe_text or None
+
+
+def extract_text_from_structure(obj: Any, extracted_texts=None, depth=0, progress_callback=None, total_items=None, current_item=None, seen_objects=None, text_set=None) -> List[str]:
+    """Recursively extract meaningful text from any data structure - OPTIMIZED for speed"""
+    if extracted_texts is None:
+        extracted_texts = []
+        text_set = set()  # Use set for O(1) duplicate checking
+    elif text_set is None:
+        text_set = set(extracted_texts)  # Convert existing list to set for speed
+    
+    if seen_objects is None:
+        seen_objects = set()
+    
+    # Prevent infinite recursion - keep aggressive limit
+    if depth > 50:
+        return extracted_texts
+    
+    # Check for circular references
+    obj_id = id(obj)
+    if obj_id in seen_objects:
+        return extracted_texts
+    
+    # Only track container objects to avoid memory issues
+    if isinstance(obj, (dict, list)):
+        seen_objects.add(obj_id)
+    
+    try:
+        if isinstance(obj, dict):
+            # Look for common text-containing keys first (prioritized extraction)
+            text_keys = ['parts', 'content', 'text', 'message', 'body', 'data', 'value', 'title', 'response']
+            for key in text_keys:
+                if key in obj:
+                    extract_text_from_structure(obj[key], extracted_texts, depth + 1, progress_callback, total_items, current_item, seen_objects, text_set)
+            
+            # Then check all other keys with improved batching
+            processed = 0
+            for key, value in obj.items():
+                if key not in text_keys and processed < 500:  # Keep comprehensive limit
+                    extract_text_from_structure(value, extracted_texts, depth + 1, progress_callback, total_items, current_item, seen_objects, text_set)
+                    processed += 1
+                    
+        elif isinstance(obj, list):
+            # OPTIMIZED: Reduce progress callback frequency dramatically
+            list_len = min(len(obj), 5000)
+            progress_interval = max(200, list_len // 20)  # Report progress every 200 items OR 5% chunks
+            
+            for i, item in enumerate(obj[:5000]):
+                # OPTIMIZED: Much less frequent progress updates (10x reduction)
+                if progress_callback and len(obj) > 500 and i % progress_interval == 0:
+                    progress = (i + 1) / list_len * 100
+                    progress_callback(f"Processing item {i+1}/{list_len} ({progress:.1f}%)")
+                
+                extract_text_from_structure(item, extracted_texts, depth + 1, progress_callback, total_items, current_item, seen_objects, text_set)
+                
+        elif isinstance(obj, str):
+            cleaned_text = clean_extracted_text(obj)
+            # OPTIMIZED: Use set for O(1) duplicate checking instead of O(n) list search
+            if cleaned_text and cleaned_text not in text_set:
+                extracted_texts.append(cleaned_text)
+                text_set.add(cleaned_text)
+    
+    finally:
+        # Remove from seen objects when done (for dict/list only)
+        if isinstance(obj, (dict, list)) and obj_id in seen_objects:
+            seen_objects.discard(obj_id)
+    
+    return extracted_texts
+
+def extract_texts_from_conversations_stream(stream) -> List[str]:
+    """
+    Extract texts from a conversations.json stream one conversation at a time.
+    
+    Peak memory is bounded by the largest single conversation instead of the
+    whole export (see conversation_stream). Elements that are not ChatGPT
+    conversations fall back to extract_text_from_structure.
+    """
+    def fallback(element):
+        return extract_text_from_structure(element)
+    
+    def log_progress(message):
+        print(f"💬 {message}")
+    
+    return collect_texts(stream, clean_extracted_text, fallback=fallback, progress_callback=log_progress)
+
+
+def find_conversations_member(zip_file: zipfile.ZipFile) -> Optional[str]:
+    """Name of the conversations.json member of a ZIP, if any"""
+    for file_name in zip_file.namelist():
+        if file_name.endswith('conversations.json'):
+            return file_name
+    return None
+
+
+def extract_conversation_texts_from_zip(zip_source) -> Optional[List[str]]:
+    """
+    Stream-extract texts from the conversations.json inside a ZIP.
+    
+    Args:
+        zip_source: Path or seekable binary file object of the ZIP
+    
+    Returns:
+        Extracted texts, or None if the archive has no conversations.json
+        (or it is not a JSON array)
+    """
+    try:
+        with zipfile.ZipFile(zip_source) as zip_file:
+            member = find_conversations_member(zip_file)
+            if not member:
+                return None
+            print(f"📦 Streaming conversations.json from ZIP: {member}")
+            with zip_file.open(member) as member_stream:
+                head = member_stream.read(4096).lstrip(b'\xef\xbb\xbf \t\r\n')
+            if not head.startswith(b'['):
+                return None
+            with zip_file.open(member) as member_stream:
+                return extract_texts_from_conversations_stream(member_stream)
+    except zipfile.BadZipFile:
+        raise ValueError("Invalid ZIP file")
+    except ValueError as e:
+        raise ValueError(f"Error extracting ZIP: {str(e)}")
+
+
+def extract_conversations_from_zip(zip_bytes: bytes) -> str:
+    """Extract conversations.json from a ZIP file"""
+    try:
+        with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zip_file:
+            # Look for conversations.json in the ZIP
+            for file_info in zip_file.namelist():
+                if file_info.endswith('conversations.json'):
+                    print(f"📦 Found conversations.json in ZIP: {file_info}")
+                    return zip_file.read(file_info).decode('utf-8')
+            raise ValueError("conversations.json not found in ZIP file")
+    except zipfile.BadZipFile:
+        raise ValueError("Invalid ZIP file")
+    except Exception as e:
+        raise ValueError(f"Error extracting ZIP: {str(e)}")
+
+def _as_binary_stream(source: Union[bytes, BinaryIO]) -> BinaryIO:
+    """Wrap raw bytes in BytesIO; file-like objects (files, mmaps) pass through"""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
+
+def extract_text_from_zip(zip_bytes: Union[bytes, BinaryIO]) -> str:
+    """Extract supported text content from a ZIP file (bytes or seekable file object).
+
+    Priority:
+    1. If the archive contains conversations.json, return that content directly.
+    2. Otherwise, unpack supported files and combine their extracted text.
+    """
+    try:
+        with zipfile.ZipFile(_as_binary_stream(zip_bytes)) as zip_file:
+            names = zip_file.namelist()
+
+            for file_name in names:
+                if file_name.endswith('conversations.json'):
+                    print(f"📦 Found conversations.json in ZIP: {file_name}")
+                    return zip_file.read(file_name).decode('utf-8')
+
+            extracted_sections = []
+            supported_extensions = (
+                '.txt', '.md', '.markdown', '.csv', '.json',
+                '.pdf', '.docx', '.doc'
+            )
+
+            for file_name in names:
+                normalized_name = file_name.lower()
+                if file_name.endswith('/') or normalized_name.startswith('__macosx/'):
+                    continue
+                if not normalized_name.endswith(supported_extensions):
+                    continue
+
+                try:
+                    file_bytes = zip_file.read(file_name)
+                    if not file_bytes:
+                        continue
+
+                    if normalized_name.endswith('.pdf'):
+                        extracted_text = extract_text_from_pdf(file_bytes)
+                    elif normalized_name.endswith(('.docx', '.doc')):
+                        extracted_text = extract_text_from_docx(file_bytes)
+                    else:
+                        try:
+                            extracted_text = file_bytes.decode('utf-8')
+                        except UnicodeDecodeError:
+                            extracted_text = file_bytes.decode('utf-8', errors='ignore')
+
+                    if extracted_text and extracted_text.strip():
+                        extracted_sections.append(
+                            f"\n\n===== FILE: {file_name} =====\n{extracted_text.strip()}"
+                        )
+                except Exception as file_error:
+                    print(f"⚠️ Skipping ZIP entry {file_name}: {file_error}")
+
+            if extracted_sections:
+                print(f"📦 Extracted {len(extracted_sections)} supported file(s) from ZIP")
+                return ''.join(extracted_sections).strip()
+
+            raise ValueError(
+                "ZIP file did not contain supported files. Include txt, md, csv, json, pdf, docx, or conversations.json."
+            )
+    except zipfile.BadZipFile:
+        raise ValueError("Invalid ZIP file")
+    except Exception as e:
+        raise ValueError(f"Error extracting ZIP: {str(e)}")
+
+def _extract_pdf_page(page: Any, page_num: int) -> Optional[str]:
+    """Extract one PDF page and fix word-per-line formatting"""
+    try:
+        text = page.extract_text()
+        if not text or not text.strip():
+            return None
+        # CRITICAL FIX: Check if this is word-per-line formatting
+        lines = [line.strip() for line in text.split('\n') if line.strip()]
+        
+        # If most lines are very short (1-3 words), rejoin them
+        short_line_count = sum(1 for line in lines if len(line.split()) <= 3)
+        if len(lines) > 10 and short_line_count > len(lines) * 0.7:
+            # Word-per-line formatting detected - rejoin into continuous text
+            print(f"  📄 Page {page_num}: Detected word-per-line formatting, rejoining...")
+            text = ' '.join(lines)
+        
+        return text
+    except Exception as page_error:
+        print(f"  Warning: Could not extract text from page {page_num}: {page_error}")
+        return None
+
+def extract_text_from_pdf(pdf_bytes: Union[bytes, BinaryIO]) -> str:
+    """Extract text from PDF (bytes or seekable file object) using PyPDF2 and fix word-per-line formatting"""
+    try:
+        pdf_file = _as_binary_stream(pdf_bytes)
+        pdf_reader = PdfReader(pdf_file)
+        
+        extracted_text = []
+        for page_num, page in enumerate(pdf_reader.pages, 1):
+            text = _extract_pdf_page(page, page_num)
+            if text:
+                extracted_text.append(text)
+        
+        combined_text = "\n\n".join(extracted_text)
+        
+        return combined_text
+    except Exception as e:
+        print(f"❌ Error extracting PDF: {e}")
+        raise ValueError(f"Failed to extract PDF content: {str(e)}")
+
+def count_pdf_pages(file_path: str) -> int:
+    """Number of pages in a PDF file (raises ValueError if it cannot be read)"""
+    try:
+        with open_spooled(file_path) as stream:
+            return len(PdfReader(stream).pages)
+    except Exception as e:
+        raise ValueError(f"Failed to read PDF: {str(e)}")
+
+def extract_pdf_page_range(file_path: str, start: int, end: int, deadline: Optional[float] = None) -> Tuple[List[str], int]:
+    """
+    Extract pages [start, end) of a PDF file and split them into passages.
+    
+    Worker-pool job for page-parallel extraction: each worker opens the file
+    itself (memory-mapped), so only the path crosses the process boundary.
+    
+    Args:
+        file_path: Path of the PDF on disk
+        start: First page index (0-based)
+        end: Page index to stop before
+        deadline: Optional wall-clock time (time.time()) after which no further
+            pages are started
+    
+    Returns:
+        (passages, pages_done) - pages_done < end - start means the deadline hit
+    """
+    page_texts = []
+    pages_done = 0
+    with open_spooled(file_path) as stream:
+        pdf_reader = PdfReader(stream)
+        for page_index in range(start, end):
+            if deadline is not None and time.time() > deadline:
+                break
+            text = _extract_pdf_page(pdf_reader.pages[page_index], page_index + 1)
+            if text:
+                page_texts.append(text)
+            pages_done += 1
+    
+    passages = extract_from_text_content("\n\n".join(page_texts)) if page_texts else []
+    return passages, pages_done
+
+def extract_text_from_docx(docx_bytes: Union[bytes, BinaryIO]) -> str:
+    """Extract text from DOCX files (bytes or seekable file object) using python-docx"""
+    try:
+        from docx import Document
+    except ImportError:
+        raise ValueError("DOCX support is not available: install python-docx")
+    try:
+        
+        docx_file = _as_binary_stream(docx_bytes)
+        doc = Document(docx_file)
+        
+        extracted_text = []
+        
+        # Extract text from paragraphs
+        for paragraph in doc.paragraphs:
+            text = paragraph.text.strip()
+            if text:
+                extracted_text.append(text)
+        
+        # Extract text from tables
+        for table in doc.tables:
+            for row in table.rows:
+                row_text = []
+                for cell in row.cells:
+                    cell_text = cell.text.strip()
+                    if cell_text:
+                        row_text.append(cell_text)
+                if row_text:
+                    extracted_text.append(' | '.join(row_text))
+        
+        combined_text = "\n\n".join(extracted_text)
+        
+        if not combined_text.strip():
+            raise ValueError("No text content found in DOCX file")
+        
+        return combined_text
+    except Exception as e:
+        print(f"❌ Error extracting DOCX: {e}")
+        raise ValueError(f"Failed to extract DOCX content: {str(e)}")
+
+def extract_upload_content(file_path: str, filename: str) -> List[str]:
+    """
+    Extract a spooled upload for extract_and_chunk_source.
+    
+    Extractors read straight from the spooled file (memory-mapped where
+    possible). ChatGPT exports (a ZIP with conversations.json, or a bare JSON
+    array) are parsed as a stream, so the decoded file and its full parse tree
+    never exist in memory at once. Everything else is decoded and filtered by
+    extract_from_text_content here, in the same worker, so only the filtered
+    passages are sent back to the parent process.
+    
+    Returns:
+        Extracted text passages
+    
+    Raises:
+        ValueError: If the file cannot be extracted
+    """
+    filename_lower = filename.lower()
+    with open_spooled(file_path) as stream:
+        if filename_lower.endswith('.zip'):
+            extracted_texts = extract_conversation_texts_from_zip(stream)
+            if extracted_texts is not None:
+                return extracted_texts
+            return extract_from_text_content(extract_text_from_zip(stream))
+        if filename_lower.endswith('.pdf'):
+            return extract_from_text_content(extract_text_from_pdf(stream))
+        if filename_lower.endswith(('.docx', '.doc')):
+            return extract_from_text_content(extract_text_from_docx(stream))
+        
+        if filename_lower.endswith('.json') and peek_is_json_array(stream):
+            try:
+                return extract_texts_from_conversations_stream(stream)
+            except ValueError as e:
+                print(f"⚠️ Streaming JSON parse failed, falling back to text extraction: {e}")
+            stream.seek(0)
+        
+        content = stream.read()
+    
+    # Plain text or other format - use UTF-8 decoding with error handling
+    try:
+        text = content.decode('utf-8')
+    except UnicodeDecodeError:
+        # Fall back to ignoring errors for binary/non-UTF8 files
+        text = content.decode('utf-8', errors='ignore')
+    content = None
+    return extract_from_text_content(text)
+
+def extract_from_text_content(file_content: str) -> List[str]:
+    """OPTIMIZED: Extract meaningful text from plain text content with better context preservation"""
+    extracted_texts = []
+    text_set = set()  # For exact duplicate checking
+    semantic_set = set()  # For semantic duplicate detection
+    
+    try:
+        # Try to detect if it's actually structured data in text format
+        content_stripped = file_content.strip()
+        if content_stripped.startswith(('{', '[')):
+            try:
+                data = json.loads(file_content)
+                return extract_text_from_structure(data)
+            except:
+                pass  # Continue with text processing
+        
+        # Filter patterns for metadata and navigation elements
+        metadata_patterns = [
+            r'^\[PDF\].*',  # PDF metadata
+            r'^https?://.*',  # URLs
+            r'^www\..*',  # WWW URLs
+            r'^\d+\s*-\s*\d+$',  # Page numbers like "1 - 2"
+            r'^(Common Data Set|Self Service|Annual Report|Catalog|Financial Report).*',  # Navigation items
+            r'^citeturn\d+.*',  # Citation metadata
+            r'^mediafiles\..*',  # Media file references
+            r'^eventreg\..*',  # Event registration URLs
+            r'\.edu$',  # Domain endings
+            r'\.com$',
+            r'\.org$',
+            r'^(assistant|user|sent|attachment omitted|powered by openai).*',  # Chat metadata
+            r'.*:\s*$',  # Lines ending with colon (speaker tags)
+        ]
+        
+        # Compile metadata patterns
+        metadata_regex = re.compile('|'.join(metadata_patterns), re.IGNORECASE)
+        
+        # Patterns for quoted replies and chat artifacts
+        quote_pattern = re.compile(r'^>\s*')  # Email-style quotes
+        speaker_pattern = re.compile(r'^(assistant|user|chatgpt|human|ai):\s*', re.IGNORECASE)
+        
+        # IMPROVED: Split into paragraphs with more flexible approach
+        # Try double newlines first, but also handle single newlines for PDFs
+        paragraphs = re.split(r'\n\s*\n|\r\n\s*\r\n', file_content)
+        
+        # If we only got 1-2 paragraphs but have lots of content, try single newlines
+        if len(paragraphs) <= 2 and len(file_content) > 500:
+            # This is likely a PDF with poor paragraph separation
+            # Split on single newlines and group into logical paragraphs
+            lines = file_content.split('\n')
+            paragraphs = []
+            current_para = []
+            
+            for line in lines:
+                line = line.strip()
+                # Start new paragraph on certain conditions
+                if len(line) == 0:
+                    if current_para:
+                        paragraphs.append('\n'.join(current_para))
+                    current_para = []
+                elif len(current_para) > 0 and (
+                    # New paragraph indicators
+                    len(current_para[-1]) > 50 and not current_para[-1].endswith((',', 'and', 'or', 'the', 'a', 'an')) or
+                    line[0].isupper() and len(line) > 40  # Likely start of new sentence/paragraph
+                ):
+                    # Check if we should continue or start new
+                    if len('\n'.join(current_para)) > 200:  # Current para is substantial
+                        paragraphs.append('\n'.join(current_para))
+                        current_para = [line]
+                    else:
+                        current_para.append(line)
+                else:
+                    current_para.append(line)
+            
+            if current_para:
+                paragraphs.append('\n'.join(current_para))
+        
+        for para in paragraphs:
+            # Clean up the paragraph
+            para = para.strip()
+            
+            # RELAXED: Reduced minimum length from 10 to 5 for short but meaningful content
+            if len(para) < 5:
+                continue
+            
+            # Skip metadata and navigation
+            if metadata_regex.match(para):
+                continue
+            
+            # RELAXED: Skip if it's mostly punctuation or numbers (but be less strict)
+            alphanumeric_count = sum(c.isalnum() for c in para)
+            if alphanumeric_count < len(para) * 0.2:  # Reduced from 0.3 to 0.2
+                continue
+                
+            # Try to preserve multi-line content as paragraphs
+            lines = para.split('\n')
+            current_paragraph = []
+            
+            for line in lines:
+                cleaned_line = line.strip()
+            
+                # RELAXED: Skip empty or very short lines (reduced from 5 to 3)
+                if len(cleaned_line) < 3:
+                    continue
+            
+                # Remove quoted reply markers
+                cleaned_line = quote_pattern.sub('', cleaned_line)
+                
+                # Remove speaker tags at start of line
+                cleaned_line = speaker_pattern.sub('', cleaned_line)
+                
+                # Remove timestamps and username prefixes
+                cleaned_line = _TIMESTAMP_PATTERN.sub('', cleaned_line)
+                cleaned_line = _TIME_PATTERN.sub('', cleaned_line)
+                cleaned_line = _USERNAME_PATTERN.sub('', cleaned_line)
+                cleaned_line = cleaned_line.strip()
+                
+                # Skip metadata lines
+                if metadata_regex.match(cleaned_line):
+                    continue
+            
+                # IMPROVED: For regular documents (not conversations), be much less strict
+                # Check if line has reasonable content - letters and reasonable length
+                has_letters = any(c.isalpha() for c in cleaned_line)
+                is_reasonable_length = len(cleaned_line) >= 3
+                
+                # Only use strict filtering for obvious technical junk
+                is_technical_junk = (
+                    _UUID_PATTERN.match(cleaned_line) or
+                    _CONVERSATION_ID_PATTERN.match(cleaned_line) or
+                    _GENERIC_ID_PATTERN.match(cleaned_line) or
+                    _FILE_REFERENCE_PATTERN.match(cleaned_line) or
+                    _NUMBERS_PATTERN.match(cleaned_line)
+                )
+                
+                if has_letters and is_reasonable_length and not is_technical_junk:
+                    current_paragraph.append(cleaned_line)
+            
+            # Join lines into a cohesive paragraph
+            if current_paragraph:
+                # Combine lines that seem to be part of the same thought
+                combined = ' '.join(current_paragraph)
+                
+                # Detect conversation roles and tag content
+                # Check first few words for role indicators
+                first_words = combined[:100].lower()
+                role_prefix = ""
+                
+                # User/Human indicators
+                if any(marker in first_words for marker in ['you said', 'you asked', 'i said', 'i asked', 'question:', 'user:']):
+                    role_prefix = "<user> "
+                # Assistant/AI indicators  
+                elif any(marker in first_words for marker in ['i can help', 'here is', "here's", 'assistant:', 'chatgpt:', 'let me']):
+                    role_prefix = "<assistant> "
+                
+                # Apply role prefix if detected
+                if role_prefix:
+                    combined = role_prefix + combined
+                
+                # Semantic duplicate detection: normalize for comparison
+                # Only collapse whitespace and lowercase - preserve numbers and meaningful punctuation
+                semantic_hash = ' '.join(combined.lower().split())[:250]
+                
+                # RELAXED: Reduced minimum length from 20 to 10 for shorter but meaningful content
+                if combined not in text_set and semantic_hash not in semantic_set and len(combined) > 10:
+                    extracted_texts.append(combined)
+                    text_set.add(combined)
+                    semantic_set.add(semantic_hash)
+    
+    except Exception as e:
+        print(f"Error processing text content: {e}")
+
+
+    return extracted_texts
@@ -0,0 +1,428 @@
+"""
+Durable job queue for background work.
+
+Extraction, analysis and URL imports used to run inside the web process
+(asyncio.create_task / BackgroundTasks), so heavy analyses competed with
+API latency and died with the web process. With a queue backend configured
+the web process only enqueues, and `python worker.py` leases and runs the
+jobs. Workers scale separately from web nodes.
+
+Semantics (identical for both backends):
+
+- Jobs are leased highest priority first, then by run_at.
+- A lease is valid for a visibility timeout. Workers extend it while the
+  job runs. A job whose lease expires (worker died) becomes runnable again.
+- A failed attempt is retried after a jittered exponential backoff, until
+  max_attempts. It is then marked dead and kept for inspection.
+- Lease tokens fence stale workers: completing, failing or extending a job
+  requires the token of the current lease.
+
+Backends:
+
+- PostgresJobQueue: the job_queue table and RPC functions in
+  SQL_schemas/job_queue_schema.sql (FOR UPDATE SKIP LOCKED), called through
+  the async PostgREST client.
+- SQLiteJobQueue: a local file for single-machine runs, used from threads.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+
+@dataclass
+class Job:
+    """One leased job."""
+    job_id: str
+    kind: str
+    payload: Dict[str, Any]
+    priority: int
+    attempts: int
+    max_attempts: int
+    lease_token: str
+
+
+def retry_delay(attempts: int, base_seconds: float, max_seconds: float) -> float:
+    """
+    Backoff before the next attempt: exponential in attempts, with jitter.
+
+    Args:
+        attempts: Attempts made so far (1 after the first failure)
+        base_seconds: Delay after the first failure
+        max_seconds: Cap
+
+    Returns:
+        Seconds to wait, between half and all of the capped exponential delay
+    """
+    delay = min(max_seconds, base_seconds * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobQueue:
+    """
+    Queue interface shared by the backends.
+
+    Usage:
+        job_id = await queue.enqueue("analyze_source", {...}, priority=5)
+        job = await queue.lease(worker_id, visibility_timeout=300)
+        ...
+        await queue.complete(job)        # or: await queue.fail(job, str(error))
+    """
+
+    name = "base"
+
+    def __init__(self, backoff_base_seconds: float = 10, backoff_max_seconds: float = 900):
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.counters: Dict[str, int] = {"enqueued": 0, "leased": 0, "completed": 0, "retried": 0, "dead": 0, "lost_leases": 0}
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], priority: int = 0, max_attempts: int = 5, delay_seconds: float = 0) -> str:
+        """
+        Add a job.
+
+        Args:
+            kind: Job type (selects the worker handler)
+            payload: JSON-serializable handler arguments
+            priority: Higher runs first
+            max_attempts: Attempts before the job is marked dead
+            delay_seconds: Postpone the first run
+
+        Returns:
+            The job id
+        """
+        job_id = await self._enqueue(kind, payload, priority, max(1, max_attempts), max(0.0, delay_seconds))
+        self.counters["enqueued"] += 1
+        return job_id
+
+    async def lease(self, worker_id: str, kinds: Optional[Sequence[str]] = None, visibility_timeout: float = 300) -> Optional[Job]:
+        """Lease the next runnable job (None when the queue has nothing ready)."""
+        job = await self._lease(worker_id, list(kinds) if kinds else None, visibility_timeout)
+        if job is not None:
+            self.counters["leased"] += 1
+        return job
+
+    async def extend(self, job: Job, visibility_timeout: float = 300) -> bool:
+        """Extend a held lease; False means the lease was lost to another worker."""
+        ok = await self._extend(job, visibility_timeout)
+        if not ok:
+            self.counters["lost_leases"] += 1
+        return ok
+
+    async def complete(self, job: Job) -> bool:
+        ok = await self._complete(job)
+        if ok:
+            self.counters["completed"] += 1
+        return ok
+
+    async def fail(self, job: Job, error: str) -> Optional[str]:
+        """
+        Record a failed attempt.
+
+        Returns:
+            "queued" (retry scheduled with backoff), "dead" (out of attempts),
+            or None if the lease was lost
+        """
+        delay = retry_delay(job.attempts, self.backoff_base_seconds, self.backoff_max_seconds)
+        status = await self._fail(job, error, delay)
+        if status == "queued":
+            self.counters["retried"] += 1
+        elif status == "dead":
+            self.counters["dead"] += 1
+        return status
+
+    async def release(self, job: Job) -> bool:
+        """Hand a job back untried (e.g. worker shutdown); the attempt is not counted."""
+        return await self._release(job)
+
+    async def stats(self) -> Dict[str, int]:
+        """Job counts per status."""
+        return await self._stats()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters for health/metrics endpoints."""
+        return {"backend": self.name, **self.counters}
+
+    async def close(self) -> None:
+        pass
+
+    async def _enqueue(self, kind, payload, priority, max_attempts, delay_seconds) -> str:
+        raise NotImplementedError
+
+    async def _lease(self, worker_id, kinds, visibility_timeout) -> Optional[Job]:
+        raise NotImplementedError
+
+    async def _extend(self, job, visibility_timeout) -> bool:
+        raise NotImplementedError
+
+    async def _complete(self, job) -> bool:
+        raise NotImplementedError
+
+    async def _fail(self, job, error, delay) -> Optional[str]:
+        raise NotImplementedError
+
+    async def _release(self, job) -> bool:
+        raise NotImplementedError
+
+    async def _stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+
+class PostgresJobQueue(JobQueue):
+    """Queue in the Postgres job_queue table, through the RPCs in SQL_schemas/job_queue_schema.sql."""
+
+    name = "postgres"
+
+    def __init__(self, db, **kwargs):
+        """
+        Args:
+            db: AsyncSupabase client (rpc(name, params).execute())
+        """
+        super().__init__(**kwargs)
+        self._db = db
+
+    async def _rpc(self, name: str, params: Dict[str, Any]) -> Any:
+        return (await self._db.rpc(name, params).execute()).data
+
+    async def _enqueue(self, kind, payload, priority, max_attempts, delay_seconds) -> str:
+        return str(await self._rpc("enqueue_job", {
+            "kind_param": kind,
+            "payload_param": payload,
+            "priority_param": priority,
+            "max_attempts_param": max_attempts,
+            "delay_seconds_param": delay_seconds,
+        }))
+
+    async def _lease(self, worker_id, kinds, visibility_timeout) -> Optional[Job]:
+        rows = await self._rpc("lease_job", {
+            "worker_param": worker_id,
+            "kinds_param": kinds,
+            "visibility_seconds_param": visibility_timeout,
+        })
+        if isinstance(rows, dict):
+            rows = [rows]
+        if not rows:
+            return None
+        row = rows[0]
+        return Job(
+            job_id=str(row["job_id"]),
+            kind=row["kind"],
+            payload=row.get("payload") or {},
+            priority=row.get("priority", 0),
+            attempts=row.get("attempts", 1),
+            max_attempts=row.get("max_attempts", 1),
+            lease_token=str(row["lease_token"]),
+        )
+
+    def _lease_params(self, job: Job) -> Dict[str, Any]:
+        return {"job_id_param": job.job_id, "lease_token_param": job.lease_token}
+
+    async def _extend(self, job, visibility_timeout) -> bool:
+        return bool(await self._rpc("extend_job_lease", {**self._lease_params(job), "visibility_seconds_param": visibility_timeout}))
+
+    async def _complete(self, job) -> bool:
+        return bool(await self._rpc("complete_job", self._lease_params(job)))
+
+    async def _fail(self, job, error, delay) -> Optional[str]:
+        return await self._rpc("fail_job", {
+            **self._lease_params(job),
+            "error_param": error,
+            "retry_delay_seconds_param": delay,
+        }) or None
+
+    async def _release(self, job) -> bool:
+        return bool(await self._rpc("release_job", self._lease_params(job)))
+
+    async def _stats(self) -> Dict[str, int]:
+        rows = await self._rpc("job_queue_stats", {}) or []
+        return {row["status"]: int(row["jobs"]) for row in rows}
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_queue (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at REAL NOT NULL,
+    lease_token TEXT,
+    leased_by TEXT,
+    lease_expires_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_job_queue_ready ON job_queue (status, priority DESC, run_at);
+"""
+
+
+class SQLiteJobQueue(JobQueue):
+    """Queue in a local SQLite file (for local runs: web and worker on one machine)."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, **kwargs):
+        """
+        Args:
+            path: Database file (created with its directory if missing)
+        """
+        super().__init__(**kwargs)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SQLITE_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _write(self, sql: str, params: Sequence[Any]) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).rowcount
+        finally:
+            conn.close()
+
+    def _enqueue_sync(self, kind, payload, priority, max_attempts, delay_seconds) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._write(
+            "INSERT INTO job_queue (job_id, kind, payload, priority, max_attempts, run_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), priority, max_attempts, now + delay_seconds, now),
+        )
+        return job_id
+
+    def _lease_sync(self, worker_id, kinds, visibility_timeout) -> Optional[Job]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE takes the write lock up front, so two workers never lease the same row
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE job_queue SET status = 'dead', lease_token = NULL, "
+                "last_error = COALESCE(last_error, 'Lease expired on the last attempt') "
+                "WHERE status = 'leased' AND lease_expires_at <= ? AND attempts >= max_attempts",
+                (now,),
+            )
+            sql = (
+                "SELECT * FROM job_queue WHERE ((status = 'queued' AND run_at <= ?) "
+                "OR (status = 'leased' AND lease_expires_at <= ?))"
+            )
+            params: List[Any] = [now, now]
+            if kinds:
+                sql += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+                params.extend(kinds)
+            row = conn.execute(sql + " ORDER BY priority DESC, run_at, created_at LIMIT 1", params).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE job_queue SET status = 'leased', attempts = attempts + 1, lease_token = ?, "
+                "leased_by = ?, lease_expires_at = ? WHERE job_id = ?",
+                (token, worker_id, now + visibility_timeout, row["job_id"]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return Job(
+            job_id=row["job_id"],
+            kind=row["kind"],
+            payload=json.loads(row["payload"]),
+            priority=row["priority"],
+            attempts=row["attempts"] + 1,
+            max_attempts=row["max_attempts"],
+            lease_token=token,
+        )
+
+    _HELD = "WHERE job_id = ? AND lease_token = ? AND status = 'leased'"
+
+    def _fail_sync(self, job, error, delay) -> Optional[str]:
+        status = "dead" if job.attempts >= job.max_attempts else "queued"
+        updated = self._write(
+            "UPDATE job_queue SET status = ?, run_at = ?, lease_token = NULL, leased_by = NULL, "
+            f"lease_expires_at = NULL, last_error = ? {self._HELD}",
+            (status, time.time() + delay, error[:2000], job.job_id, job.lease_token),
+        )
+        return status if updated else None
+
+    def _stats_sync(self) -> Dict[str, int]:
+        conn = self._connect()
+        try:
+            return {row[0]: row[1] for row in conn.execute("SELECT status, COUNT(*) FROM job_queue GROUP BY status")}
+        finally:
+            conn.close()
+
+    async def _enqueue(self, kind, payload, priority, max_attempts, delay_seconds) -> str:
+        return await asyncio.to_thread(self._enqueue_sync, kind, payload, priority, max_attempts, delay_seconds)
+
+    async def _lease(self, worker_id, kinds, visibility_timeout) -> Optional[Job]:
+        return await asyncio.to_thread(self._lease_sync, worker_id, kinds, visibility_timeout)
+
+    async def _extend(self, job, visibility_timeout) -> bool:
+        return bool(await asyncio.to_thread(
+            self._write, f"UPDATE job_queue SET lease_expires_at = ? {self._HELD}",
+            (time.time() + visibility_timeout, job.job_id, job.lease_token),
+        ))
+
+    async def _complete(self, job) -> bool:
+        return bool(await asyncio.to_thread(
+            self._write, f"DELETE FROM job_queue {self._HELD}", (job.job_id, job.lease_token),
+        ))
+
+    async def _fail(self, job, error, delay) -> Optional[str]:
+        return await asyncio.to_thread(self._fail_sync, job, error, delay)
+
+    async def _release(self, job) -> bool:
+        return bool(await asyncio.to_thread(
+            self._write,
+            "UPDATE job_queue SET status = 'queued', attempts = MAX(attempts - 1, 0), run_at = ?, "
+            f"lease_token = NULL, leased_by = NULL, lease_expires_at = NULL {self._HELD}",
+            (time.time(), job.job_id, job.lease_token),
+        ))
+
+    async def _stats(self) -> Dict[str, int]:
+        return await asyncio.to_thread(self._stats_sync)
+
+
+def create_job_queue(backend: str, db=None, sqlite_path: str = ".cache/job_queue.sqlite3", **kwargs) -> Optional[JobQueue]:
+    """
+    Build the configured queue.
+
+    Args:
+        backend: "inline" (no queue: jobs run in the web process), "postgres" or "sqlite"
+        db: AsyncSupabase client (postgres backend)
+        sqlite_path: Database file (sqlite backend)
+
+    Returns:
+        The queue, or None for inline execution
+
+    Raises:
+        ValueError: For an unknown backend, or postgres without a database client
+    """
+    backend = (backend or "inline").lower()
+    if backend == "inline":
+        return None
+    if backend == "postgres":
+        if db is None:
+            raise ValueError("JOB_QUEUE_BACKEND=postgres requires Supabase credentials")
+        return PostgresJobQueue(db, **kwargs)
+    if backend == "sqlite":
+        return SQLiteJobQueue(sqlite_path, **kwargs)
+    raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {backend}")
@@ -0,0 +1,255 @@
+"""
+Resolution of job files across legacy R2 key layouts.
+
+Job files may live under the current user directory or under one of four
+older layouts (user_{id}/, {id}/, users/{id}/, prod/{id}/). The download
+helper used to try them one after another with a full signed GET each, so
+a missing file cost five GETs plus five local-storage reads, multiplied by
+every file and source an endpoint looks at.
+
+KeyResolver checks the layouts with concurrent HEAD requests and remembers
+which layout worked for each user directory, so later lookups try that
+layout first. Keys confirmed missing (404) are negative-cached for a short
+TTL, so repeated lookups of an absent file cost nothing until it expires or
+the key is written. Probe and cache counters are kept for the health
+endpoint.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+_USER_ID = re.compile(r"user_([a-f0-9-]{36})")
+
+# Older user directory layouts, in the order they are preferred
+LEGACY_LAYOUTS = ("user_{user_id}", "{user_id}", "users/{user_id}", "prod/{user_id}")
+
+
+def layout_candidates(primary_key: str, job_id: str, filename: str) -> List[Tuple[str, str]]:
+    """
+    Keys a job file may live under, as (layout, key) pairs.
+
+    Args:
+        primary_key: Key under the user's current directory
+        job_id: Job (or source) id
+        filename: File name within the job directory
+
+    Returns:
+        The primary key first, then the legacy layouts (when the primary key
+        carries a user id), without duplicates
+    """
+    candidates = [("primary", primary_key)]
+    match = _USER_ID.search(primary_key)
+    if match:
+        user_id = match.group(1)
+        for layout in LEGACY_LAYOUTS:
+            key = f"{layout.format(user_id=user_id)}/{job_id}/{filename}"
+            if key != primary_key:
+                candidates.append((layout, key))
+    return candidates
+
+
+def _user_directory(primary_key: str, job_id: str, filename: str) -> str:
+    suffix = f"/{job_id}/{filename}"
+    if primary_key.endswith(suffix):
+        return primary_key[:-len(suffix)]
+    return primary_key.rsplit("/", 2)[0]
+
+
+class KeyResolver:
+    """
+    Finds the layout holding a job file, with layout and negative caches.
+
+    Usage:
+        resolver = KeyResolver(r2_client.head)
+        found = resolver.resolve(f"{user_dir}/{job_id}/summary.json", job_id, "summary.json")
+        if found:
+            key, size = found
+    """
+
+    def __init__(
+        self,
+        head: Callable[[str], Optional[int]],
+        layout_ttl_seconds: float = 3600,
+        negative_ttl_seconds: float = 15,
+        max_entries: int = 10000,
+        max_workers: int = 8,
+    ):
+        """
+        Args:
+            head: key -> object size, None on 404; raises on other failures
+            layout_ttl_seconds: How long a user directory's working layout is remembered
+            negative_ttl_seconds: How long a key confirmed missing is skipped
+            max_entries: Cap for each cache (least recently used first)
+            max_workers: Concurrent HEAD requests
+        """
+        self._head = head
+        self.layout_ttl_seconds = layout_ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.max_workers = max(1, max_workers)
+        self._layouts: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats: Dict[str, int] = {
+            "resolutions": 0, "found": 0, "not_found": 0, "probes": 0, "probe_errors": 0,
+            "layout_hits": 0, "negative_hits": 0, "fallback_layout_used": 0,
+        }
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="r2-resolve")
+        return self._executor
+
+    @staticmethod
+    def _bounded_put(cache: "OrderedDict", key: Any, value: Any, limit: int) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+
+    def _is_missing(self, key: str, now: float) -> bool:
+        expires_at = self._missing.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= now:
+            del self._missing[key]
+            return False
+        return True
+
+    def candidates(self, primary_key: str, job_id: str, filename: str) -> List[Tuple[str, str]]:
+        """
+        Layout candidates worth trying, best first.
+
+        The layout that last worked for this user directory comes first;
+        keys confirmed missing within the negative TTL are left out.
+        """
+        candidates = layout_candidates(primary_key, job_id, filename)
+        user_dir = _user_directory(primary_key, job_id, filename)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._layouts.get(user_dir)
+            if cached is not None and cached[0] <= now:
+                del self._layouts[user_dir]
+                cached = None
+            if cached is not None:
+                self.stats["layout_hits"] += 1
+                candidates.sort(key=lambda candidate: candidate[0] != cached[1])
+            available = [candidate for candidate in candidates if not self._is_missing(candidate[1], now)]
+            self.stats["negative_hits"] += len(candidates) - len(available)
+        return available
+
+    def remember(self, primary_key: str, job_id: str, filename: str, key: str) -> None:
+        """Record that key (one of the file's candidates) exists."""
+        for layout, candidate in layout_candidates(primary_key, job_id, filename):
+            if candidate == key:
+                user_dir = _user_directory(primary_key, job_id, filename)
+                with self._lock:
+                    self._missing.pop(key, None)
+                    self._bounded_put(self._layouts, user_dir, (time.monotonic() + self.layout_ttl_seconds, layout), self.max_entries)
+                return
+
+    def mark_missing(self, key: str) -> None:
+        """Negative-cache a key confirmed missing (e.g. after a 404 on GET)."""
+        with self._lock:
+            self._bounded_put(self._missing, key, time.monotonic() + self.negative_ttl_seconds, self.max_entries)
+
+    def forget(self, key: str) -> None:
+        """Clear the negative entry of a key that was just written."""
+        with self._lock:
+            self._missing.pop(key, None)
+
+    def _probe(self, key: str) -> Tuple[Optional[int], bool]:
+        """HEAD one key: (size, confirmed) where confirmed means the answer was 200/404."""
+        try:
+            return self._head(key), True
+        except Exception as e:
+            print(f"⚠️ R2 HEAD probe failed for {key}: {e}")
+            return None, False
+
+    def probe_many(self, keys: Iterable[str]) -> Dict[str, Optional[int]]:
+        """
+        Look up several keys with concurrent HEADs (negative-cached keys are not sent).
+
+        Only keys R2 answered 404 for are negative-cached; an object that
+        exists but is empty keeps its size of 0.
+
+        Returns:
+            Mapping of key -> size (0 for empty objects, None for missing or
+            failed lookups), in input order
+        """
+        keys = list(dict.fromkeys(keys))
+        now = time.monotonic()
+        with self._lock:
+            skipped = {key for key in keys if self._is_missing(key, now)}
+            self.stats["negative_hits"] += len(skipped)
+        to_probe = [key for key in keys if key not in skipped]
+        results = dict(zip(to_probe, self._pool().map(self._probe, to_probe)))
+
+        sizes: Dict[str, Optional[int]] = {}
+        with self._lock:
+            self.stats["probes"] += len(to_probe)
+            for key in keys:
+                size, confirmed = results.get(key, (None, True))
+                if not confirmed:
+                    self.stats["probe_errors"] += 1
+                elif size is None and key in results:
+                    self._bounded_put(self._missing, key, now + self.negative_ttl_seconds, self.max_entries)
+                sizes[key] = size
+        return sizes
+
+    def resolve(self, primary_key: str, job_id: str, filename: str, skip: Iterable[str] = ()) -> Optional[Tuple[str, int]]:
+        """
+        Find the key holding a job file.
+
+        Args:
+            primary_key: Key under the user's current directory
+            job_id: Job (or source) id
+            filename: File name within the job directory
+            skip: Keys already known to be missing
+
+        Returns:
+            (key, size) of the preferred existing non-empty object, or None
+        """
+        skip = set(skip)
+        candidates = [c for c in self.candidates(primary_key, job_id, filename) if c[1] not in skip]
+        sizes = self.probe_many(key for _, key in candidates) if candidates else {}
+
+        with self._lock:
+            self.stats["resolutions"] += 1
+        for layout, key in candidates:
+            if sizes.get(key):
+                self.remember(primary_key, job_id, filename, key)
+                with self._lock:
+                    self.stats["found"] += 1
+                    if layout != "primary":
+                        self.stats["fallback_layout_used"] += 1
+                if layout != "primary":
+                    print(f"🔎 {filename} for {job_id} found in {layout} layout ({len(candidates)} probes)")
+                return key, sizes[key]
+
+        with self._lock:
+            self.stats["not_found"] += 1
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Probe and cache counters for health/metrics endpoints."""
+        with self._lock:
+            return {
+                "cached_layouts": len(self._layouts),
+                "negative_entries": len(self._missing),
+                "negative_ttl_seconds": self.negative_ttl_seconds,
+                **self.stats,
+            }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
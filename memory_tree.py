@@ -15,7 +15,12 @@ Key Features:
 Usage:
     from memory_tree import apply_chunk_to_memory_tree, export_pack_from_tree
     
-    # During analysis:
+    # During analysis (bulk: one batch per source, flushed periodically):
+    batch = MemoryTreeBatch(user_id, pack_id, scope)
+    batch.add_chunk(json_data, source_id, chunk_index)
+    batch.flush()
+    
+    # Single chunk:
     apply_chunk_to_memory_tree(
         structured_facts=json_data,
         scope="user_profile",
@@ -33,6 +38,7 @@ import os
 import json
 from typing import Dict, List, Optional, Any
 from datetime import datetime
+from urllib.parse import quote
 
 # DON'T import from simple_backend at module level (causes circular import)
 # Instead, import when needed inside functions
@@ -163,35 +169,40 @@ def get_or_create_node(
     raise Exception(f"Failed to create node: {node_type} in {scope}")
 
 
-def merge_node_data(node_id: str, new_data: Dict[str, Any]) -> None:
+def _union_lists(old_list: List[Any], new_list: List[Any]) -> List[Any]:
+    """Union two lists by value, keeping first-seen order (works for dict items too)."""
+    seen = set()
+    merged = []
+    for item in old_list + new_list:
+        marker = json.dumps(item, sort_keys=True, default=str) if isinstance(item, (dict, list)) else item
+        try:
+            if marker in seen:
+                continue
+            seen.add(marker)
+        except TypeError:
+            pass
+        merged.append(item)
+    return merged
+
+
+def merge_data(current_data: Dict[str, Any], new_data: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Merge new data into an existing node.
+    Merge new node data into existing node data (pure, no I/O).
     
     Merging rules:
     - For list fields: union by value (no duplicates)
     - For scalar fields: new value overwrites old (latest wins)
-    - For dict fields: deep merge
+    - For dict fields: shallow merge (new keys win)
     
     Args:
-        node_id: UUID of the node to update
+        current_data: Existing node data
         new_data: New data to merge
-    """
-    sb = _ensure_supabase()
-    if not sb:
-        raise Exception("Supabase client not initialized")
-    
-    # Get current node data
-    result = sb.table("memory_nodes").select("data").eq("id", node_id).single().execute()
     
-    if not result.data:
-        raise Exception(f"Node {node_id} not found")
-    
-    current_data = result.data.get("data", {})
-    
-    # Merge logic
+    Returns:
+        Merged data dictionary
+    """
     merged_data = {}
     all_keys = set(current_data.keys()) | set(new_data.keys())
-    merge_operations = []
     
     for key in all_keys:
         old_value = current_data.get(key)
@@ -200,29 +211,45 @@ def merge_node_data(node_id: str, new_data: Dict[str, Any]) -> None:
         # If only one exists, use it
         if old_value is None:
             merged_data[key] = new_value
-            merge_operations.append(f"{key}: added")
         elif new_value is None:
             merged_data[key] = old_value
         # Both exist - merge based on type
         elif isinstance(old_value, list) and isinstance(new_value, list):
-            # Union of lists (remove duplicates)
-            merged_data[key] = list(set(old_value + new_value))
-            merge_operations.append(f"{key}: merged {len(new_value)} items")
+            merged_data[key] = _union_lists(old_value, new_value)
         elif isinstance(old_value, dict) and isinstance(new_value, dict):
-            # Deep merge dicts
             merged_data[key] = {**old_value, **new_value}
-            merge_operations.append(f"{key}: deep merged")
         else:
             # Scalar: new value wins
             merged_data[key] = new_value
-            merge_operations.append(f"{key}: updated")
+    
+    return merged_data
+
+
+def merge_node_data(node_id: str, new_data: Dict[str, Any]) -> None:
+    """
+    Merge new data into an existing node (see merge_data for the rules).
+    
+    Args:
+        node_id: UUID of the node to update
+        new_data: New data to merge
+    """
+    sb = _ensure_supabase()
+    if not sb:
+        raise Exception("Supabase client not initialized")
+    
+    # Get current node data
+    result = sb.table("memory_nodes").select("data").eq("id", node_id).single().execute()
+    
+    if not result.data:
+        raise Exception(f"Node {node_id} not found")
+    
+    merged_data = merge_data(result.data.get("data") or {}, new_data)
     
     # Update node
     sb.table("memory_nodes") \
         .update({"data": merged_data, "updated_at": datetime.utcnow().isoformat()}) \
         .eq("id", node_id) \
         .execute()
-    
 
 
 def create_evidence(
@@ -269,6 +296,220 @@ def create_evidence(
     raise Exception("Failed to create evidence record")
 
 
+# ============================================================================
+# BULK MERGE (merge in memory, write back in bulk)
+# ============================================================================
+
+# Rows per request for bulk writes (keeps PostgREST payloads reasonable)
+BULK_WRITE_BATCH_SIZE = 500
+
+# Label lookups are GET requests with the labels in the query string: cap labels
+# per request and their encoded length so the URL stays well below gateway limits
+LABEL_LOOKUP_MAX_LABELS = 50
+LABEL_LOOKUP_MAX_URL_CHARS = 4000
+
+
+def label_batches(labels: List[str], max_labels: int = LABEL_LOOKUP_MAX_LABELS,
+                  max_chars: int = LABEL_LOOKUP_MAX_URL_CHARS) -> List[List[str]]:
+    """
+    Split labels into groups whose in.(...) filter fits in a URL.
+    
+    Args:
+        labels: Labels to look up
+        max_labels: Labels per group
+        max_chars: Encoded characters per group (quoted, URL-encoded, comma-separated)
+    
+    Returns:
+        Groups of labels, in order; a single over-long label gets a group of its own
+    """
+    batches: List[List[str]] = []
+    current: List[str] = []
+    size = 0
+    for label in labels:
+        encoded = len(quote('"' + label.replace('"', '\\"') + '"', safe="")) + 3  # + encoded comma
+        if current and (len(current) >= max_labels or size + encoded > max_chars):
+            batches.append(current)
+            current, size = [], 0
+        current.append(label)
+        size += encoded
+    if current:
+        batches.append(current)
+    return batches
+
+
+class MemoryTreeBatch:
+    """
+    In-memory merge buffer for one (user, pack, scope).
+    
+    Facts from any number of chunks are merged in memory, and flush() writes
+    them back with one merge RPC for existing nodes, one bulk insert for new
+    nodes and one bulk insert for evidence, instead of 3-4 round trips per fact.
+    
+    Only the facts added since the last flush are sent. They are merged into
+    the stored node data by the merge_memory_nodes RPC
+    (SQL_schemas/merge_memory_nodes_rpc.sql), so facts written by other sources
+    of the same scope and node edits made meanwhile are kept. Node ids are
+    looked up when a node is first flushed (or preloaded with load()).
+    
+    Not safe for concurrent use: add facts and flush from one caller.
+    
+    Usage:
+        batch = MemoryTreeBatch(user_id, pack_id, "user_profile")
+        batch.add_chunk(structured_facts, source_id, chunk_index)
+        batch.flush()
+    """
+    
+    def __init__(self, user_id: str, pack_id: str, scope: str):
+        self.user_id = user_id
+        self.pack_id = pack_id
+        self.scope = scope
+        
+        # (node_type, label) -> node id, for nodes known to exist
+        self._node_ids: Dict[tuple, str] = {}
+        # (node_type, label) -> facts merged since the last flush
+        self._pending: Dict[tuple, Dict[str, Any]] = {}
+        self._pending_evidence: List[tuple] = []
+        
+        self.stats = {"facts": 0, "nodes_inserted": 0, "nodes_updated": 0, "evidence_inserted": 0, "round_trips": 0}
+    
+    def _node_query(self, sb):
+        query = sb.table("memory_nodes").select("id, node_type, label") \
+            .eq("user_id", self.user_id) \
+            .eq("scope", self.scope)
+        if self.pack_id:
+            query = query.eq("pack_id", self.pack_id)
+        return query
+    
+    def _remember(self, rows: List[Dict[str, Any]]) -> None:
+        # Keep the oldest node when duplicates exist (rows come oldest first)
+        for row in rows:
+            self._node_ids.setdefault((row["node_type"], row.get("label")), row["id"])
+    
+    def load(self) -> None:
+        """Preload the ids of every existing node for this user/pack/scope (paginated, optional)."""
+        sb = _ensure_supabase()
+        if not sb:
+            raise Exception("Supabase client not initialized")
+        
+        page_size = 1000
+        offset = 0
+        while True:
+            result = self._node_query(sb).order("created_at", desc=False).range(offset, offset + page_size - 1).execute()
+            self.stats["round_trips"] += 1
+            
+            rows = result.data or []
+            self._remember(rows)
+            if len(rows) < page_size:
+                break
+            offset += page_size
+        
+        print(f"   🌳 [TREE] Preloaded {len(self._node_ids)} node ids for scope {self.scope}")
+    
+    def add_chunk(self, structured_facts: Dict[str, Any], source_id: str, chunk_index: int) -> int:
+        """
+        Merge one chunk's facts into the pending node updates.
+        
+        Args:
+            structured_facts: JSON object with extracted facts
+            source_id: Source identifier
+            chunk_index: Chunk number
+        
+        Returns:
+            Number of facts applied
+        """
+        applied = 0
+        for node_type, label, data, snippet in _iter_fact_updates(structured_facts, self.scope):
+            key = (node_type, label)
+            self._pending[key] = merge_data(self._pending.get(key) or {}, data)
+            self._pending_evidence.append((key, {
+                "user_id": self.user_id,
+                "pack_id": self.pack_id,
+                "source_id": source_id,
+                "chunk_index": chunk_index,
+                "snippet": snippet[:250] if snippet else None  # Limit snippet length
+            }))
+            applied += 1
+        
+        self.stats["facts"] += applied
+        return applied
+    
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending or self._pending_evidence)
+    
+    def _resolve_ids(self, sb, keys: List[tuple]) -> None:
+        """Look up ids of nodes created since load() (or without it), by label."""
+        labels = sorted({key[1] for key in keys if key[1] is not None})
+        for batch_labels in label_batches(labels):
+            result = self._node_query(sb).in_("label", batch_labels) \
+                .order("created_at", desc=False).execute()
+            self.stats["round_trips"] += 1
+            self._remember(result.data or [])
+    
+    def flush(self) -> None:
+        """Merge pending facts and evidence into Supabase in bulk."""
+        if not self.has_pending:
+            return
+        
+        sb = _ensure_supabase()
+        if not sb:
+            raise Exception("Supabase client not initialized")
+        
+        unknown = [key for key in self._pending if key not in self._node_ids]
+        if unknown:
+            self._resolve_ids(sb, unknown)
+        
+        # 1. Merge into existing nodes on the server (nodes deleted meanwhile are re-created below)
+        existing_keys = [key for key in self._pending if key in self._node_ids]
+        merged = 0
+        for i in range(0, len(existing_keys), BULK_WRITE_BATCH_SIZE):
+            batch_keys = existing_keys[i:i + BULK_WRITE_BATCH_SIZE]
+            result = sb.rpc("merge_memory_nodes", {
+                "user_uuid": self.user_id,
+                "nodes_param": [{"id": self._node_ids[key], "data": self._pending[key]} for key in batch_keys]
+            }).execute()
+            self.stats["round_trips"] += 1
+            updated = {row["id"] for row in (result.data or [])}
+            for key in batch_keys:
+                if self._node_ids[key] in updated:
+                    merged += 1
+                else:
+                    del self._node_ids[key]
+        self.stats["nodes_updated"] += merged
+        
+        # 2. One bulk insert for new nodes (ids are needed for evidence)
+        new_keys = [key for key in self._pending if key not in self._node_ids]
+        for i in range(0, len(new_keys), BULK_WRITE_BATCH_SIZE):
+            batch_keys = new_keys[i:i + BULK_WRITE_BATCH_SIZE]
+            rows = [{
+                "user_id": self.user_id,
+                "pack_id": self.pack_id,
+                "scope": self.scope,
+                "node_type": key[0],
+                "label": key[1],
+                "data": self._pending[key]
+            } for key in batch_keys]
+            result = sb.table("memory_nodes").insert(rows).execute()
+            self.stats["round_trips"] += 1
+            inserted = {(row["node_type"], row.get("label")): row for row in (result.data or [])}
+            for key in batch_keys:
+                if key not in inserted:
+                    raise Exception(f"Failed to create node: {key[0]} in {self.scope}")
+                self._node_ids[key] = inserted[key]["id"]
+        self.stats["nodes_inserted"] += len(new_keys)
+        self._pending = {}
+        
+        # 3. One bulk insert for evidence
+        evidence_rows = [{**row, "node_id": self._node_ids[key]} for key, row in self._pending_evidence]
+        for i in range(0, len(evidence_rows), BULK_WRITE_BATCH_SIZE):
+            sb.table("memory_evidence").insert(evidence_rows[i:i + BULK_WRITE_BATCH_SIZE]).execute()
+            self.stats["round_trips"] += 1
+        self.stats["evidence_inserted"] += len(evidence_rows)
+        self._pending_evidence = []
+        
+        print(f"   💾 [TREE] Flushed {merged} merged + {len(new_keys)} new nodes, {len(evidence_rows)} evidence rows")
+
+
 # ============================================================================
 # HIGH-LEVEL APPLICATION FUNCTIONS
 # ============================================================================
@@ -284,6 +525,9 @@ def apply_chunk_to_memory_tree(
     """
     Apply structured facts from a chunk to the memory tree.
     
+    Uses a single-chunk MemoryTreeBatch; callers processing many chunks
+    should keep one batch per source and flush it periodically instead.
+    
     Args:
         structured_facts: JSON object with extracted facts
         scope: Memory scope ('user_profile' or 'knowledge:topic')
@@ -292,244 +536,95 @@ def apply_chunk_to_memory_tree(
         source_id: Source identifier
         chunk_index: Chunk number
     """
-    user_id = user.user_id
-    
+    batch = MemoryTreeBatch(user.user_id, pack_id, scope)
+    applied = batch.add_chunk(structured_facts, source_id, chunk_index)
+    batch.flush()
+    print(f"\n   🎉 SUMMARY: {applied} nodes processed for {scope}")
+
+
+def _as_list(value: Any) -> List[Any]:
+    return value if isinstance(value, list) else []
+
 
+def _snippet(preferred: Any, fallback: Any) -> str:
+    """Evidence snippet: the preferred text field, else the JSON of the fact."""
+    text = preferred if isinstance(preferred, str) and preferred else json.dumps(fallback, default=str)
+    return text[:250]
+
+
+def _iter_fact_updates(facts: Dict[str, Any], scope: str):
+    """
+    Translate extracted facts into node updates.
     
-    # Route based on scope
+    Args:
+        facts: JSON object with extracted facts
+        scope: Memory scope ('user_profile' or 'knowledge:topic')
+    
+    Yields:
+        (node_type, label, data, snippet) tuples
+    """
+    if not isinstance(facts, dict):
+        return
     if scope == "user_profile":
-        _apply_user_profile_facts(structured_facts, user_id, pack_id, source_id, chunk_index)
+        yield from _user_profile_updates(facts)
     elif scope.startswith("knowledge:"):
-        _apply_knowledge_facts(structured_facts, user_id, pack_id, source_id, chunk_index, scope)
+        yield from _knowledge_updates(facts)
 
 
-def _apply_user_profile_facts(
-    facts: Dict[str, Any],
-    user_id: str,
-    pack_id: str,
-    source_id: str,
-    chunk_index: int
-) -> None:
-    """Apply user_profile scope facts (identity, preferences, projects, etc.)"""
-    
-    nodes_created = 0
-    nodes_updated = 0
+def _user_profile_updates(facts: Dict[str, Any]):
+    """Node updates for user_profile scope facts (identity, preferences, projects, etc.)"""
     
     # Identity node (single)
     identity_data = facts.get("identity")
-    if identity_data and any(identity_data.values()):
-        node = get_or_create_node(
-            user_id=user_id,
-            pack_id=pack_id,
-            scope="user_profile",
-            node_type="Identity",
-            label="User Identity"
-        )
-        merge_node_data(node["id"], identity_data)
-        create_evidence(
-            user_id=user_id,
-            node_id=node["id"],
-            pack_id=pack_id,
-            source_id=source_id,
-            chunk_index=chunk_index,
-            snippet=json.dumps(identity_data)[:250]
-        )
+    if isinstance(identity_data, dict) and any(identity_data.values()):
+        yield "Identity", "User Identity", identity_data, json.dumps(identity_data)[:250]
     
     # Preferences (multiple)
-    for pref in facts.get("preferences", []):
+    for pref in _as_list(facts.get("preferences")):
         if not pref or not isinstance(pref, str):
             continue
-        node = get_or_create_node(
-            user_id=user_id,
-            pack_id=pack_id,
-            scope="user_profile",
-            node_type="Preference",
-            label=pref[:120]
-        )
-        merge_node_data(node["id"], {"text": pref})
-        create_evidence(
-            user_id=user_id,
-            node_id=node["id"],
-            pack_id=pack_id,
-            source_id=source_id,
-            chunk_index=chunk_index,
-            snippet=pref[:250]
-        )
+        yield "Preference", pref[:120], {"text": pref}, pref[:250]
     
     # Projects (multiple)
-    for proj in facts.get("projects", []):
+    for proj in _as_list(facts.get("projects")):
         if not proj or not isinstance(proj, dict):
             continue
-        name = proj.get("name", "Unnamed Project")
-        node = get_or_create_node(
-            user_id=user_id,
-            pack_id=pack_id,
-            scope="user_profile",
-            node_type="Project",
-            label=name[:120]
-        )
-        merge_node_data(node["id"], proj)
-        snippet = proj.get("description", json.dumps(proj))[:250]
-        create_evidence(
-            user_id=user_id,
-            node_id=node["id"],
-            pack_id=pack_id,
-            source_id=source_id,
-            chunk_index=chunk_index,
-            snippet=snippet
-        )
+        name = str(proj.get("name") or "Unnamed Project")
+        yield "Project", name[:120], proj, _snippet(proj.get("description"), proj)
     
     # Skills, Goals, Constraints, Facts (similar pattern)
     for field_name in ["skills", "goals", "constraints", "facts"]:
-        items = facts.get(field_name, [])
-        if not isinstance(items, list):
-            continue
-        
-        item_count = 0
-        for item in items:
+        node_type = field_name.capitalize()[:-1]  # "skills" → "Skill"
+        for item in _as_list(facts.get(field_name)):
             if not item or not isinstance(item, str):
                 continue
-            
-            node = get_or_create_node(
-                user_id=user_id,
-                pack_id=pack_id,
-                scope="user_profile",
-                node_type=field_name.capitalize()[:-1],  # "skills" → "Skill"
-                label=item[:120]
-            )
-            merge_node_data(node["id"], {"text": item})
-            create_evidence(
-                user_id=user_id,
-                node_id=node["id"],
-                pack_id=pack_id,
-                source_id=source_id,
-                chunk_index=chunk_index,
-                snippet=item[:250]
-            )
-            item_count += 1
-        
-        if item_count > 0:
-            nodes_created += item_count
-    
-    print(f"\n   🎉 USER PROFILE SUMMARY: {nodes_created} nodes processed")
+            yield node_type, item[:120], {"text": item}, item[:250]
 
 
-def _apply_knowledge_facts(
-    facts: Dict[str, Any],
-    user_id: str,
-    pack_id: str,
-    source_id: str,
-    chunk_index: int,
-    scope: str
-) -> None:
-    """Apply knowledge scope facts (sections, events, entities, concepts)"""
+def _knowledge_updates(facts: Dict[str, Any]):
+    """Node updates for knowledge scope facts (sections, events, entities, concepts)"""
     
-    nodes_created = 0
-    
-    # Sections
-    for section in facts.get("sections", []):
-        if not section or not isinstance(section, dict):
-            continue
-        title = section.get("title", "Untitled Section")
-        node = get_or_create_node(
-            user_id=user_id,
-            pack_id=pack_id,
-            scope=scope,
-            node_type="Section",
-            label=title[:120]
-        )
-        merge_node_data(node["id"], section)
-        snippet = section.get("summary", json.dumps(section))[:250]
-        create_evidence(
-            user_id=user_id,
-            node_id=node["id"],
-            pack_id=pack_id,
-            source_id=source_id,
-            chunk_index=chunk_index,
-            snippet=snippet
-        )
-    
-    # Events
-    for event in facts.get("events", []):
-        if not event or not isinstance(event, dict):
-            continue
-        name = event.get("name", "Unnamed Event")
-        node = get_or_create_node(
-            user_id=user_id,
-            pack_id=pack_id,
-            scope=scope,
-            node_type="Event",
-            label=name[:120]
-        )
-        merge_node_data(node["id"], event)
-        snippet = event.get("summary", json.dumps(event))[:250]
-        create_evidence(
-            user_id=user_id,
-            node_id=node["id"],
-            pack_id=pack_id,
-            source_id=source_id,
-            chunk_index=chunk_index,
-            snippet=snippet
-        )
-    
-    # Entities
-    for entity in facts.get("entities", []):
-        if not entity or not isinstance(entity, dict):
-            continue
-        name = entity.get("name", "Unnamed Entity")
-        node = get_or_create_node(
-            user_id=user_id,
-            pack_id=pack_id,
-            scope=scope,
-            node_type="Entity",
-            label=name[:120]
-        )
-        merge_node_data(node["id"], entity)
-        snippet = entity.get("summary", json.dumps(entity))[:250]
-        create_evidence(
-            user_id=user_id,
-            node_id=node["id"],
-            pack_id=pack_id,
-            source_id=source_id,
-            chunk_index=chunk_index,
-            snippet=snippet
-        )
+    # Sections, events and entities share the same shape
+    for field_name, node_type, label_key, default_label in [
+        ("sections", "Section", "title", "Untitled Section"),
+        ("events", "Event", "name", "Unnamed Event"),
+        ("entities", "Entity", "name", "Unnamed Entity"),
+    ]:
+        for item in _as_list(facts.get(field_name)):
+            if not item or not isinstance(item, dict):
+                continue
+            label = str(item.get(label_key) or default_label)
+            yield node_type, label[:120], item, _snippet(item.get("summary"), item)
     
     # Concepts (can be simple strings or rich objects)
-    concept_count = 0
-    for concept in facts.get("concepts", []):
+    for concept in _as_list(facts.get("concepts")):
         if not concept:
             continue
-        
         if isinstance(concept, str):
-            # Simple string concept
-            node = get_or_create_node(
-                user_id=user_id,
-                pack_id=pack_id,
-                scope=scope,
-                node_type="Concept",
-                label=concept[:120]
-            )
-            merge_node_data(node["id"], {"text": concept})
-            create_evidence(
-                user_id=user_id,
-                node_id=node["id"],
-                pack_id=pack_id,
-                source_id=source_id,
-                chunk_index=chunk_index,
-                snippet=concept[:250]
-            )
-            concept_count += 1
+            yield "Concept", concept[:120], {"text": concept}, concept[:250]
         elif isinstance(concept, dict):
             # Rich concept with name, definition, category
-            name = concept.get("name", "Unnamed Concept")
-            node = get_or_create_node(
-                user_id=user_id,
-                pack_id=pack_id,
-                scope=scope,
-                node_type="Concept",
-                label=name[:120]
-            )
+            name = str(concept.get("name") or "Unnamed Concept")
             
             # Create a text field from definition or other descriptive fields
             text_content = concept.get("definition", "")
@@ -539,104 +634,26 @@ def _apply_knowledge_facts(
                 # Fallback: construct from name and category
                 text_content = f"{name}: {concept.get('category', 'concept')}"
             
-            # Merge with text field added
-            concept_data = {**concept, "text": text_content}
-            merge_node_data(node["id"], concept_data)
-            
-            snippet = concept.get("definition", json.dumps(concept))[:250]
-            create_evidence(
-                user_id=user_id,
-                node_id=node["id"],
-                pack_id=pack_id,
-                source_id=source_id,
-                chunk_index=chunk_index,
-                snippet=snippet
-            )
-            concept_count += 1
-    
-    if concept_count > 0:
-        nodes_created += concept_count
+            yield "Concept", name[:120], {**concept, "text": text_content}, _snippet(concept.get("definition"), concept)
     
     # Facts (for knowledge conversations)
-    fact_count = 0
-    for fact in facts.get("facts", []):
+    for fact in _as_list(facts.get("facts")):
         if not fact:
             continue
-        
         if isinstance(fact, str):
-            # Simple string fact
-            node = get_or_create_node(
-                user_id=user_id,
-                pack_id=pack_id,
-                scope=scope,
-                node_type="Fact",
-                label=fact[:120]
-            )
-            merge_node_data(node["id"], {"text": fact})
-            create_evidence(
-                user_id=user_id,
-                node_id=node["id"],
-                pack_id=pack_id,
-                source_id=source_id,
-                chunk_index=chunk_index,
-                snippet=fact[:250]
-            )
-            fact_count += 1
+            yield "Fact", fact[:120], {"text": fact}, fact[:250]
         elif isinstance(fact, dict):
             # Rich fact with statement and category
             statement = fact.get("statement", "")
-            if statement:
-                node = get_or_create_node(
-                    user_id=user_id,
-                    pack_id=pack_id,
-                    scope=scope,
-                    node_type="Fact",
-                    label=statement[:120]
-                )
-                merge_node_data(node["id"], fact)
-                create_evidence(
-                    user_id=user_id,
-                    node_id=node["id"],
-                    pack_id=pack_id,
-                    source_id=source_id,
-                    chunk_index=chunk_index,
-                    snippet=statement[:250]
-                )
-                fact_count += 1
-    
-    if fact_count > 0:
-        nodes_created += fact_count
+            if statement and isinstance(statement, str):
+                yield "Fact", statement[:120], fact, statement[:250]
     
     # Code patterns (for technical conversations)
-    pattern_count = 0
-    for pattern in facts.get("code_patterns", []):
+    for pattern in _as_list(facts.get("code_patterns")):
         if not pattern or not isinstance(pattern, dict):
             continue
-        
-        purpose = pattern.get("purpose", "Code Pattern")
-        node = get_or_create_node(
-            user_id=user_id,
-            pack_id=pack_id,
-            scope=scope,
-            node_type="CodePattern",
-            label=purpose[:120]
-        )
-        merge_node_data(node["id"], pattern)
-        snippet = pattern.get("pattern", json.dumps(pattern))[:250]
-        create_evidence(
-            user_id=user_id,
-            node_id=node["id"],
-            pack_id=pack_id,
-            source_id=source_id,
-            chunk_index=chunk_index,
-            snippet=snippet
-        )
-        pattern_count += 1
-    
-    if pattern_count > 0:
-        nodes_created += pattern_count
-    
-    print(f"\n   🎉 KNOWLEDGE SUMMARY: {nodes_created} nodes processed for {scope}")
+        purpose = str(pattern.get("purpose") or "Code Pattern")
+        yield "CodePattern", purpose[:120], pattern, _snippet(pattern.get("pattern"), pattern)
 
 
 
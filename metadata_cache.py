@@ -0,0 +1,136 @@
+"""
+Short-lived read-through cache for pack and source metadata lookups.
+
+One request flow often looks up the same pack or source several times
+(ownership check, status check, credit check), and polling clients repeat
+the same lookups every few seconds. MetadataCache keeps each result for a
+few seconds and shares one in-flight load between concurrent callers.
+Entries are grouped by owner (the user id), so a write can invalidate
+everything cached for that user. A load that overlaps an invalidation is
+returned to its caller but not cached, so a write is never followed by a
+stale read from this process.
+"""
+
+import asyncio
+import copy
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set, Tuple
+
+
+class MetadataCache:
+    """
+    TTL + LRU cache keyed by (kind, owner, id) tuples.
+
+    Usage:
+        cache = MetadataCache(ttl_seconds=5)
+        result = await cache.get_or_load(("pack", user_id, pack_id), user_id, load_pack)
+        cache.invalidate_owner(user_id)
+    """
+
+    def __init__(self, ttl_seconds: float = 5.0, max_entries: int = 5000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Hashable, Any]]" = OrderedDict()
+        self._owner_keys: Dict[Hashable, Set[Hashable]] = {}
+        # Logical clock: owner -> tick of its last invalidation, load key -> tick it started at
+        self._clock = 0
+        self._invalidated_at: Dict[Hashable, int] = {}
+        self._inflight: Dict[Hashable, Tuple[int, asyncio.Future]] = {}
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "shared_loads": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    async def get_or_load(self, key: Hashable, owner: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value for key, loading it on a miss.
+
+        Args:
+            key: Cache key, e.g. ("pack", user_id, pack_id)
+            owner: Invalidation group (user id)
+            loader: Async callable producing the value
+
+        Returns:
+            A copy of the cached value, so callers may mutate it freely
+        """
+        if not self.enabled:
+            return await loader()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, _, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return copy.deepcopy(value)
+            self._drop(key)
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["shared_loads"] += 1
+            shared = pending[1]
+            try:
+                return copy.deepcopy(await asyncio.shield(shared))
+            except asyncio.CancelledError:
+                if not shared.cancelled():
+                    raise
+                # The request that started the load was cancelled - load it ourselves
+                return await loader()
+
+        self.stats["misses"] += 1
+        started = self._clock
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (started, future)
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        future.set_result(value)
+        if self._invalidated_at.get(owner, -1) <= started:
+            self._store(key, owner, value)
+        return copy.deepcopy(value)
+
+    def _store(self, key: Hashable, owner: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, owner, value)
+        self._entries.move_to_end(key)
+        self._owner_keys.setdefault(owner, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        owner = entry[1]
+        keys = self._owner_keys.get(owner)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._owner_keys[owner]
+
+    def invalidate_owner(self, owner: Hashable) -> None:
+        """Drop every entry of owner and keep in-flight loads from caching their results."""
+        self._clock += 1
+        self._invalidated_at[owner] = self._clock
+        for key in self._owner_keys.pop(owner, ()):
+            self._entries.pop(key, None)
+        self.stats["invalidations"] += 1
+        if len(self._invalidated_at) > self.max_entries:
+            # Ticks only matter to loads still in flight; forget the ones all of them postdate
+            oldest = min((started for started, _ in self._inflight.values()), default=self._clock)
+            self._invalidated_at = {o: tick for o, tick in self._invalidated_at.items() if tick > oldest}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters for health/metrics endpoints."""
+        return {"entries": len(self._entries), "ttl_seconds": self.ttl_seconds, **self.stats}
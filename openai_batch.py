@@ -0,0 +1,344 @@
+"""
+OpenAI Batch API runs for large, non-interactive analyses.
+
+Sources big enough to end in an email notification do not need answers
+within seconds. Sent through the Batch API, their chunk requests cost half
+as much and do not draw on the live rate limits that interactive users
+share. BatchRunner takes the chat-completion request bodies of a source,
+uploads them as one JSONL file, creates a batch and polls it until it ends.
+It then returns the per-request results, so the caller continues with its
+normal write-out.
+
+The batch id is stored under a state key (in R2) as soon as the batch is
+created. A restarted analysis (worker crash, deploy) re-attaches to the
+running batch instead of paying for it twice.
+
+Only requests the batch answered with an error are meant to be retried
+interactively. A batch that cannot be submitted raises BatchSubmitError
+(nothing was paid for, so the caller may fall back to interactive calls).
+A batch stopped by the caller raises BatchCancelled, and a batch that
+failed as a whole or ran past the deadline raises BatchFailed. In both
+cases the stored state is removed, so a later run does not re-attach to
+the dead batch.
+
+The transport is pluggable. HttpBatchTransport talks to the OpenAI REST
+API (or any compatible server at base_url, such as a local fake batch
+server). Any object with the same five coroutines can be used instead.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+
+class BatchError(Exception):
+    """Base class for batch run failures."""
+
+
+class BatchSubmitError(BatchError):
+    """The batch could not be created; no request was submitted."""
+
+
+class BatchCancelled(BatchError):
+    """The caller asked to stop and the batch was cancelled."""
+
+
+class BatchFailed(BatchError):
+    """The batch failed as a whole, or was cancelled after running past the deadline."""
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# Batch statuses after which nothing changes any more
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Input files above this size are rejected by the API (200 MB), keep a margin
+MAX_INPUT_BYTES = 190 * 1024 * 1024
+
+
+def build_jsonl(requests: List[Tuple[str, Dict[str, Any]]]) -> bytes:
+    """
+    Encode (custom_id, chat-completion body) pairs as a batch input file.
+
+    Returns:
+        One JSON request per line
+    """
+    return "".join(
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}) + "\n"
+        for custom_id, body in requests
+    ).encode("utf-8")
+
+
+def parse_results(*files: Optional[bytes]) -> Dict[str, Dict[str, Any]]:
+    """
+    Decode batch output/error files.
+
+    Returns:
+        custom_id -> {"body": response body} for successful requests, or
+        {"error": message} for requests that failed
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    for content in files:
+        if not content:
+            continue
+        for line in content.decode("utf-8", errors="replace").splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            custom_id = record.get("custom_id")
+            if not custom_id:
+                continue
+            response = record.get("response") or {}
+            if response.get("status_code") == 200 and isinstance(response.get("body"), dict):
+                results[custom_id] = {"body": response["body"]}
+            else:
+                error = record.get("error") or (response.get("body") or {}).get("error") or {}
+                message = error.get("message") if isinstance(error, dict) else str(error)
+                results[custom_id] = {"error": message or f"status {response.get('status_code')}"}
+    return results
+
+
+class HttpBatchTransport:
+    """Files/Batches REST calls over a pooled httpx client."""
+
+    def __init__(self, api_key: str, base_url: str = "https://api.openai.com/v1", timeout: float = 120):
+        self.base_url = base_url.rstrip("/")
+        self._api_key = api_key
+        self._timeout = timeout
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self._api_key}"},
+                timeout=httpx.Timeout(self._timeout, connect=10),
+            )
+        return self._http
+
+    async def _json(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        response = await self._client().request(method, path, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def upload_file(self, filename: str, content: bytes) -> str:
+        uploaded = await self._json(
+            "POST", "/files",
+            data={"purpose": "batch"},
+            files={"file": (filename, content, "application/jsonl")},
+        )
+        return uploaded["id"]
+
+    async def create_batch(self, input_file_id: str, metadata: Dict[str, str]) -> Dict[str, Any]:
+        return await self._json("POST", "/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": BATCH_ENDPOINT,
+            "completion_window": "24h",
+            "metadata": metadata,
+        })
+
+    async def retrieve_batch(self, batch_id: str) -> Dict[str, Any]:
+        return await self._json("GET", f"/batches/{batch_id}")
+
+    async def download_file(self, file_id: str) -> bytes:
+        response = await self._client().get(f"/files/{file_id}/content")
+        response.raise_for_status()
+        return response.content
+
+    async def cancel_batch(self, batch_id: str) -> Dict[str, Any]:
+        return await self._json("POST", f"/batches/{batch_id}/cancel")
+
+    async def close(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+class BatchRunner:
+    """
+    Submits request sets as batches and waits for their results.
+
+    Usage:
+        runner = BatchRunner(transport, put_state, get_state, delete_state)
+        results = await runner.run(state_key, [(custom_id, body), ...], metadata={...})
+        # results: custom_id -> {"body": ...} | {"error": ...}
+        await runner.discard(state_key)   # after the results are safely stored
+    """
+
+    def __init__(
+        self,
+        transport,
+        put_state: Callable[[str, str], bool],
+        get_state: Callable[[str], Optional[str]],
+        delete_state: Callable[[str], bool],
+        poll_interval_seconds: float = 30,
+        max_wait_seconds: float = 25 * 3600,
+    ):
+        """
+        Args:
+            transport: HttpBatchTransport or compatible object
+            put_state / get_state / delete_state: Synchronous storage for batch state (called from threads)
+            poll_interval_seconds: Delay between status checks
+            max_wait_seconds: Give up (and cancel) after this long
+        """
+        self.transport = transport
+        self._put_state = put_state
+        self._get_state = get_state
+        self._delete_state = delete_state
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.stats: Dict[str, int] = {"submitted": 0, "reattached": 0, "completed": 0, "failed": 0, "cancelled": 0, "requests": 0}
+
+    async def _load_state(self, state_key: str) -> Optional[Dict[str, Any]]:
+        raw = await asyncio.to_thread(self._get_state, state_key)
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    async def run(
+        self,
+        state_key: str,
+        requests: List[Tuple[str, Dict[str, Any]]],
+        metadata: Optional[Dict[str, str]] = None,
+        on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Run requests as one batch (or re-attach to the batch already running for state_key).
+
+        Args:
+            state_key: Where the batch id is stored while the batch runs
+            requests: (custom_id, chat-completion body) pairs
+            metadata: Batch metadata (string values)
+            on_progress: Optional coroutine (done, total) called on every poll
+            should_stop: Optional check on every poll; when true the batch is cancelled
+
+        Returns:
+            custom_id -> {"body": ...} or {"error": ...} for every request;
+            requests an expired or cancelled batch never ran carry an error
+
+        Raises:
+            BatchSubmitError: The batch could not be created
+            BatchCancelled: should_stop() became true
+            BatchFailed: The batch failed, or did not finish within max_wait_seconds
+        """
+        wanted = {custom_id for custom_id, _ in requests}
+        state = await self._load_state(state_key)
+        if state and set(state.get("custom_ids", [])) >= wanted:
+            batch_id = state["batch_id"]
+            self.stats["reattached"] += 1
+            print(f"📦 Re-attached to OpenAI batch {batch_id}")
+        else:
+            batch_id = await self._submit(state_key, requests, wanted, metadata)
+
+        try:
+            batch = await self._wait(batch_id, on_progress, should_stop)
+            status = batch.get("status")
+            if status == "failed":
+                errors = ((batch.get("errors") or {}).get("data") or [{}])[0].get("message")
+                raise BatchFailed(f"OpenAI batch {batch_id} failed{': ' + errors if errors else ''}")
+        except BatchCancelled:
+            self.stats["cancelled"] += 1
+            await self.discard(state_key)
+            raise
+        except BatchFailed:
+            self.stats["failed"] += 1
+            await self.discard(state_key)
+            raise
+
+        if status == "completed":
+            self.stats["completed"] += 1
+        else:
+            self.stats["failed"] += 1
+            print(f"⚠️ OpenAI batch {batch_id} ended with status {status}")
+
+        files = []
+        for field in ("output_file_id", "error_file_id"):
+            if batch.get(field):
+                files.append(await self.transport.download_file(batch[field]))
+        results = parse_results(*files)
+        return {
+            custom_id: results.get(custom_id) or {"error": f"not answered (batch {status})"}
+            for custom_id in wanted
+        }
+
+    async def _submit(self, state_key: str, requests, wanted, metadata) -> str:
+        content = build_jsonl(requests)
+        if len(content) > MAX_INPUT_BYTES:
+            raise BatchSubmitError(f"Batch input of {len(content) // (1024 * 1024)} MB exceeds the API limit")
+        try:
+            file_id = await self.transport.upload_file(f"{state_key.replace('/', '_')}.jsonl", content)
+            batch = await self.transport.create_batch(file_id, metadata or {})
+        except Exception as e:
+            raise BatchSubmitError(f"Could not create batch: {e}") from e
+        batch_id = batch["id"]
+        try:
+            await asyncio.to_thread(self._put_state, state_key, json.dumps({
+                "batch_id": batch_id,
+                "custom_ids": sorted(wanted),
+                "created_at": time.time(),
+            }))
+        except Exception as e:
+            # Without the state a restart could not re-attach and would pay for the batch twice
+            await self._cancel(batch_id)
+            raise BatchSubmitError(f"Could not record batch {batch_id}: {e}") from e
+        self.stats["submitted"] += 1
+        self.stats["requests"] += len(requests)
+        print(f"📦 Submitted OpenAI batch {batch_id} ({len(requests)} requests, {len(content) // 1024} KB)")
+        return batch_id
+
+    async def _cancel(self, batch_id: str) -> None:
+        try:
+            await self.transport.cancel_batch(batch_id)
+        except Exception as e:
+            print(f"⚠️ Could not cancel batch {batch_id}: {e}")
+
+    async def _wait(self, batch_id: str, on_progress, should_stop) -> Dict[str, Any]:
+        deadline = time.monotonic() + self.max_wait_seconds
+        status = None
+        while True:
+            try:
+                batch = await self.transport.retrieve_batch(batch_id)
+            except Exception as e:
+                # The batch keeps running; check again on the next poll
+                print(f"⚠️ Could not poll OpenAI batch {batch_id}: {e}")
+            else:
+                status = batch.get("status")
+                if on_progress is not None:
+                    counts = batch.get("request_counts") or {}
+                    await on_progress(
+                        int(counts.get("completed", 0)) + int(counts.get("failed", 0)),
+                        int(counts.get("total", 0)),
+                    )
+                if status in TERMINAL_STATUSES:
+                    return batch
+            if should_stop is not None and should_stop():
+                print(f"🛑 Cancelling OpenAI batch {batch_id}")
+                await self._cancel(batch_id)
+                raise BatchCancelled(f"OpenAI batch {batch_id} cancelled")
+            if time.monotonic() >= deadline:
+                await self._cancel(batch_id)
+                raise BatchFailed(f"OpenAI batch {batch_id} still {status} after {self.max_wait_seconds:.0f}s; cancelled")
+            await asyncio.sleep(self.poll_interval_seconds)
+
+    async def discard(self, state_key: str) -> None:
+        """Forget the stored batch once its results are persisted elsewhere."""
+        await asyncio.to_thread(self._delete_state, state_key)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters for health/metrics endpoints."""
+        return dict(self.stats)
+
+    async def close(self) -> None:
+        close = getattr(self.transport, "close", None)
+        if close is not None:
+            await close()
@@ -0,0 +1,226 @@
+"""
+Token-bucket rate limiting for OpenAI requests.
+
+openai_scheduler bounds how many requests are in flight, but a window of
+concurrent 100k-token chunk prompts can still exceed the organisation's
+tokens-per-minute limit. Each of those requests then comes back as a 429
+after queueing. OpenAIRateLimiter keeps two token buckets, one for tokens
+per minute and one for requests per minute. Every request reserves its
+estimated cost before it is sent: prompt tokens (from the chunker's
+tokenizer, or a count the caller already has) plus the completion budget,
+which OpenAI counts against the limit too.
+
+The bucket sizes are learned from the x-ratelimit-limit-* headers. The
+x-ratelimit-remaining-* values cap the local level, so other processes
+sharing the key are taken into account. A 429 pauses all reservations for
+its Retry-After. Reservations are settled with the real usage once the
+response arrives. Until the first headers are seen (and without configured
+limits) nothing is throttled.
+"""
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+from chunker import count_segment_tokens
+from openai_scheduler import parse_reset_duration
+
+
+# Per-message formatting overhead of the chat format (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def backoff_delay(attempt: int, base_seconds: float = 1.0, max_seconds: float = 30.0) -> float:
+    """
+    Jittered exponential backoff ("full jitter").
+
+    Args:
+        attempt: Zero-based retry number
+        base_seconds: Upper bound of the first delay
+        max_seconds: Cap on the exponential bound
+
+    Returns:
+        A random delay between 0 and min(max_seconds, base_seconds * 2**attempt)
+    """
+    return random.uniform(0, min(max_seconds, base_seconds * (2 ** attempt)))
+
+
+class TokenBucket:
+    """Bucket refilling continuously at capacity per minute; unlimited while capacity is unknown."""
+
+    def __init__(self, capacity: Optional[float] = None):
+        self.capacity = capacity
+        self.level = capacity or 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60.0)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount is available (0 when it is, or when unlimited)."""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.capacity
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    def give(self, amount: float, now: float) -> None:
+        """Return tokens (negative amounts take more, e.g. when usage exceeded the estimate)."""
+        self._refill(now)
+        if self.capacity:
+            self.level = min(self.capacity, self.level + amount)
+
+    def learn(self, limit: float, remaining: float, now: float) -> None:
+        """Adopt the server's limit, and never assume more headroom than it reports."""
+        self._refill(now)
+        if limit > 0 and limit != self.capacity:
+            self.level = limit if self.capacity is None else self.level * limit / self.capacity
+            self.capacity = limit
+        self.level = min(self.level, remaining)
+
+
+@dataclass
+class Reservation:
+    """Budget held for one request until it is settled."""
+    tokens: int
+
+
+class OpenAIRateLimiter:
+    """
+    Requests/tokens per minute budget shared by all OpenAI calls of the process.
+
+    Usage:
+        cost = limiter.estimate(messages, max_completion_tokens)
+        reservation = await limiter.reserve(cost)
+        response = ...                                  # send the request
+        limiter.observe_headers(response_headers)
+        limiter.settle(reservation, used_tokens)        # 0 if the request failed
+    """
+
+    def __init__(self, tokens_per_minute: Optional[int] = None, requests_per_minute: Optional[int] = None):
+        """
+        Args:
+            tokens_per_minute: Initial TPM limit (learned from headers when None)
+            requests_per_minute: Initial RPM limit (learned from headers when None)
+        """
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self.stats: Dict[str, float] = {
+            "reserved": 0,
+            "delayed": 0,
+            "wait_seconds": 0.0,
+            "throttled": 0,
+            "estimated_tokens": 0,
+            "used_tokens": 0,
+        }
+
+    def estimate(self, messages: Iterable[Mapping[str, Any]], max_completion_tokens: Optional[int] = None,
+                 input_tokens: Optional[int] = None) -> int:
+        """
+        Token cost a request is charged against the TPM limit.
+
+        Args:
+            messages: Chat messages (counted with the chunker's tokenizer unless input_tokens is given)
+            max_completion_tokens: Completion budget of the request
+            input_tokens: Prompt size when the caller already knows it
+
+        Returns:
+            Estimated prompt tokens plus the completion budget
+        """
+        if input_tokens is None:
+            messages = list(messages)
+            contents = [str(message.get("content") or "") for message in messages]
+            input_tokens = sum(count_segment_tokens(contents)) + MESSAGE_OVERHEAD_TOKENS * len(contents)
+        return int(input_tokens) + int(max_completion_tokens or 0)
+
+    async def reserve(self, tokens: int) -> Reservation:
+        """
+        Wait until the request fits in both budgets, then take it out of them.
+
+        Reservations are granted in arrival order, so a large request is not
+        starved by a stream of small ones.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            waited = 0.0
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self._paused_until - now,
+                    self.tokens.wait_time(tokens, now),
+                    self.requests.wait_time(1, now),
+                )
+                if wait <= 0:
+                    break
+                # Re-check at least every few seconds: headers from other requests may change the picture
+                step = min(wait, 5.0)
+                waited += step
+                await asyncio.sleep(step)
+            now = time.monotonic()
+            self.tokens.take(tokens, now)
+            self.requests.take(1, now)
+        self.stats["reserved"] += 1
+        self.stats["estimated_tokens"] += tokens
+        if waited:
+            self.stats["delayed"] += 1
+            self.stats["wait_seconds"] += waited
+        return Reservation(tokens=tokens)
+
+    def settle(self, reservation: Reservation, used_tokens: int) -> None:
+        """Correct the token budget with the real usage (0 for a request that was not served)."""
+        self.tokens.give(reservation.tokens - used_tokens, time.monotonic())
+        self.stats["used_tokens"] += used_tokens
+
+    def observe_headers(self, headers: Optional[Mapping[str, Any]]) -> None:
+        """Learn limits and remaining budget from x-ratelimit-* response headers."""
+        if not headers:
+            return
+        now = time.monotonic()
+        for kind, bucket in (("tokens", self.tokens), ("requests", self.requests)):
+            try:
+                limit = float(headers.get(f"x-ratelimit-limit-{kind}") or 0)
+                remaining = float(headers.get(f"x-ratelimit-remaining-{kind}"))
+            except (TypeError, ValueError):
+                continue
+            if limit > 0:
+                bucket.learn(limit, remaining, now)
+                if remaining <= 0:
+                    reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                    if reset:
+                        self._pause(min(reset, 60.0))
+
+    def throttled(self, retry_after: Optional[float] = None) -> None:
+        """A 429 came back: hold all reservations for Retry-After (1 s when unknown)."""
+        self.stats["throttled"] += 1
+        self._pause(retry_after if retry_after is not None else 1.0)
+
+    def _pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, seconds))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Budget state for health/metrics endpoints."""
+        now = time.monotonic()
+        self.tokens.wait_time(0, now)
+        self.requests.wait_time(0, now)
+        return {
+            "tokens_per_minute": self.tokens.capacity,
+            "tokens_available": round(self.tokens.level) if self.tokens.capacity else None,
+            "requests_per_minute": self.requests.capacity,
+            "requests_available": round(self.requests.level, 1) if self.requests.capacity else None,
+            "paused_for_s": round(max(0.0, self._paused_until - now), 2),
+            **{key: round(value, 2) if isinstance(value, float) else value for key, value in self.stats.items()},
+        }
@@ -0,0 +1,260 @@
+"""
+Process-wide scheduler for OpenAI requests.
+
+Every chat-completion call made by the analysis and tree-extraction
+pipelines acquires a slot from a single OpenAIScheduler. The scheduler keeps
+a sliding window of in-flight requests (a slot is released as soon as its
+request finishes, so one slow chunk never holds back the others), serves
+waiting requests round-robin across users, and adapts the window size to
+the 429s and rate-limit headers returned by the API (additive increase,
+multiplicative decrease).
+"""
+
+import asyncio
+import re
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Mapping, Optional
+
+
+# Parses OpenAI reset durations such as "1s", "6m0s", "20ms", "1h2m3.5s"
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Convert an x-ratelimit-reset-* header value to seconds.
+
+    Args:
+        value: Header value (e.g. "6m0s", "250ms")
+
+    Returns:
+        Seconds until reset, or None if the value cannot be parsed
+    """
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value.strip())
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class OpenAIScheduler:
+    """
+    Sliding-window concurrency limiter with fair per-user queues.
+
+    Usage:
+        async with openai_scheduler.slot(user_id):
+            response = await call_openai()
+        openai_scheduler.observe_headers(response_headers)
+    """
+
+    def __init__(
+        self,
+        initial_concurrency: int = 5,
+        min_concurrency: int = 1,
+        max_concurrency: Optional[int] = None,
+        low_headroom_ratio: float = 0.05,
+    ):
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(max_concurrency or initial_concurrency * 4, self.min_concurrency)
+        self.limit = min(max(initial_concurrency, self.min_concurrency), self.max_concurrency)
+        self.low_headroom_ratio = low_headroom_ratio
+
+        self.in_flight = 0
+        # user_id -> waiting futures; OrderedDict order is the round-robin rotation
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._paused_until = 0.0
+        self._resume_handle: Optional[asyncio.TimerHandle] = None
+        self._successes_since_increase = 0
+        self._last_decrease = 0.0
+
+        self.stats: Dict[str, int] = {
+            "dispatched": 0,
+            "rate_limited": 0,
+            "window_increases": 0,
+            "window_decreases": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Slot acquisition
+    # ------------------------------------------------------------------
+
+    @property
+    def waiting(self) -> int:
+        """Number of requests queued for a slot."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str] = None):
+        """
+        Hold one in-flight slot for the duration of the block.
+
+        Args:
+            user_id: Tenant the request is made for (fairness key)
+        """
+        await self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user_id: Optional[str] = None) -> None:
+        """
+        Wait until a slot is granted to this request.
+
+        Args:
+            user_id: Tenant the request is made for (fairness key)
+        """
+        if not self._queues and self._can_dispatch():
+            self.in_flight += 1
+            self.stats["dispatched"] += 1
+            return
+
+        key = user_id or "anonymous"
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was granted just before cancellation - hand it back
+                self.release()
+            else:
+                self._discard_waiter(key, waiter)
+            raise
+
+    def release(self) -> None:
+        """Return a slot and wake the next waiter."""
+        self.in_flight = max(0, self.in_flight - 1)
+        self._dispatch()
+
+    def _discard_waiter(self, key: str, waiter: asyncio.Future) -> None:
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[key]
+
+    def _can_dispatch(self) -> bool:
+        return self.in_flight < self.limit and time.monotonic() >= self._paused_until
+
+    def _dispatch(self) -> None:
+        """Grant free slots round-robin across users with waiting requests."""
+        while self._queues and self._can_dispatch():
+            key, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            # Rotate: this user goes to the back of the line
+            del self._queues[key]
+            if queue:
+                self._queues[key] = queue
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            self.stats["dispatched"] += 1
+            waiter.set_result(None)
+
+        if self._queues and time.monotonic() < self._paused_until:
+            self._schedule_resume()
+
+    def _schedule_resume(self) -> None:
+        if self._resume_handle is not None and not self._resume_handle.cancelled():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        delay = max(0.0, self._paused_until - time.monotonic())
+
+        def resume():
+            self._resume_handle = None
+            self._dispatch()
+
+        self._resume_handle = loop.call_later(delay, resume)
+
+    # ------------------------------------------------------------------
+    # Feedback from responses
+    # ------------------------------------------------------------------
+
+    def record_success(self) -> None:
+        """Additive increase: grow the window by one after a full window of successes."""
+        self._successes_since_increase += 1
+        if self._successes_since_increase >= self.limit and self.limit < self.max_concurrency:
+            self.limit += 1
+            self._successes_since_increase = 0
+            self.stats["window_increases"] += 1
+            self._dispatch()
+
+    def record_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """
+        Multiplicative decrease after a 429, plus a pause before new dispatches.
+
+        Args:
+            retry_after: Seconds the API asked us to wait, if known
+        """
+        self.stats["rate_limited"] += 1
+        now = time.monotonic()
+        # Only shrink once per burst of 429s from requests already in flight
+        if now - self._last_decrease > 1.0:
+            self._shrink()
+            self._last_decrease = now
+        self._pause(retry_after if retry_after is not None else 1.0)
+
+    def observe_headers(self, headers: Optional[Mapping[str, Any]]) -> None:
+        """
+        Adapt to x-ratelimit-* response headers.
+
+        When remaining requests or tokens drop below the headroom ratio the
+        window stops growing and new dispatches pause until the reported reset.
+
+        Args:
+            headers: Response headers from the OpenAI API
+        """
+        if not headers:
+            return
+        for kind in ("requests", "tokens"):
+            try:
+                limit = float(headers.get(f"x-ratelimit-limit-{kind}") or 0)
+                remaining = float(headers.get(f"x-ratelimit-remaining-{kind}") or 0)
+            except (TypeError, ValueError):
+                continue
+            if limit <= 0:
+                continue
+            if remaining / limit < self.low_headroom_ratio:
+                self._successes_since_increase = 0
+                reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self._pause(min(reset, 60.0))
+                return
+        self.record_success()
+
+    def _shrink(self) -> None:
+        new_limit = max(self.min_concurrency, self.limit // 2)
+        if new_limit < self.limit:
+            self.limit = new_limit
+            self.stats["window_decreases"] += 1
+        self._successes_since_increase = 0
+
+    def _pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, seconds))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current window state, for health/metrics endpoints."""
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "waiting_users": len(self._queues),
+            "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            **self.stats,
+        }
@@ -0,0 +1,513 @@
+"""
+Precomputed, versioned pack exports.
+
+The compact/standard/complete export endpoint used to download every
+source's analyzed.txt and concatenate them on every request, and all three
+types returned the same text. PackExporter materializes the exports once
+per pack version and stores them in R2 next to a small manifest:
+
+    {prefix}/exports/manifest.json
+    {prefix}/exports/{version}/{export_type}.txt
+
+The version is a hash of the exported sources' fingerprints (id, name,
+updated_at, chunk counts, analysis path) and the token budgets, so any
+completed, edited, re-analysed or deleted source produces a new version
+(pack_sources.updated_at is bumped by a trigger on every write, see
+SQL_schemas/pack_sources_updated_at.sql). The
+manifest records a content ETag per export type (for conditional GETs) and
+where each source's analysis sits inside complete.txt. Regeneration reuses
+those slices for unchanged sources and only downloads the analyses of new
+or changed ones.
+
+A replaced version is not deleted straight away: downloads that are still
+streaming it, or resuming it with Range, hold its key. The manifest lists
+retired versions with the time they were replaced, and a later regeneration
+deletes those older than the retention period.
+
+Complete is the full text. Compact and standard are extractive reductions
+to a token budget: repeated lines across chunks are dropped, the budget is
+shared fairly between chunk analyses, and within a chunk analysis every
+heading's first points are kept before any heading's later points.
+
+build_exports and reduce_sections are module-level and picklable, so they
+can run in the CPU process pool.
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import time
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from chunker import count_segment_tokens
+
+
+EXPORT_TYPES = ("compact", "standard", "complete")
+
+# Sources whose text analysis is finished (tree building runs after it)
+EXPORTABLE_STATUSES = frozenset({"completed", "building_tree"})
+
+# Bump when the export format changes, so stored artifacts are rebuilt
+EXPORT_FORMAT = 2
+
+# Separator AnalysisWriter puts between chunk analyses in analyzed.txt
+_CHUNK_SEPARATOR = re.compile(r"\n\n--- Chunk \d+/\d+ ---\n\n")
+_HEADING = re.compile(r"^\s*(#{1,6}\s|\*\*[^*]+\*\*:?\s*$|[A-Z][A-Za-z0-9 /&()'-]{0,80}:\s*$)")
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+_WHITESPACE = re.compile(r"\s+")
+
+# Lines shorter than this (normalized) are never treated as duplicates
+_MIN_DEDUP_CHARS = 20
+
+
+def format_section(source_name: str, content: str) -> str:
+    """Export section for one source (same layout the endpoint always used)."""
+    return f"=== Source: {source_name} ===\n\n{content}\n\n"
+
+
+def source_fingerprint(source: Dict[str, Any], analyzed_path: str) -> str:
+    """
+    Fingerprint of everything about a source that affects its exported text.
+
+    updated_at moves on every write to the row, so an edit or re-analysis
+    that keeps the same chunk counts still changes the fingerprint.
+    """
+    fields = [
+        source.get("source_id"),
+        source.get("source_name"),
+        source.get("updated_at"),
+        source.get("processed_chunks"),
+        source.get("total_chunks"),
+        analyzed_path,
+    ]
+    return hashlib.sha256(json.dumps(fields, default=str).encode()).hexdigest()[:16]
+
+
+def export_version(fingerprints: Iterable[str], budgets: Dict[str, int]) -> str:
+    """Version of a pack's exports: changes with its sources, their order and the budgets."""
+    payload = json.dumps([EXPORT_FORMAT, list(fingerprints), sorted(budgets.items())])
+    return hashlib.sha256(payload.encode()).hexdigest()[:20]
+
+
+def content_etag(text: str) -> str:
+    """Strong ETag (quoted) for an export's contents."""
+    return '"' + hashlib.sha256(text.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches etag (weak comparison, as RFC 9110 requires).
+
+    Args:
+        if_none_match: Raw header value (may list several tags or be "*")
+        etag: Current quoted ETag
+    """
+    if not if_none_match:
+        return False
+    current = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == current:
+            return True
+    return False
+
+
+def _water_fill(sizes: List[int], budget: int) -> List[int]:
+    """Split budget so small items get everything and large items share the rest equally."""
+    allocations = [0] * len(sizes)
+    remaining = max(0, budget)
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    for position, index in enumerate(order):
+        share = remaining // (len(order) - position)
+        allocations[index] = min(sizes[index], share)
+        remaining -= allocations[index]
+    return allocations
+
+
+def _normalize(line: str) -> str:
+    return _WHITESPACE.sub(" ", _BULLET.sub("", line)).strip().lower()
+
+
+def _select_lines(lines: List[str], tokens: List[int], budget: int) -> List[int]:
+    """
+    Pick line indexes of one chunk analysis that fit budget.
+
+    Lines are grouped under their heading. Round r keeps the r-th point of
+    every heading, so a tight budget keeps the start of every topic rather
+    than the whole of the first few. A heading is kept with its first point.
+    """
+    groups: List[Tuple[Optional[int], List[int]]] = []
+    for index, line in enumerate(lines):
+        if _HEADING.match(line):
+            groups.append((index, []))
+        elif groups:
+            groups[-1][1].append(index)
+        else:
+            groups.append((None, [index]))
+
+    selected: List[int] = []
+    used = 0
+    depth = max((len(body) for _, body in groups), default=0)
+    for rank in range(depth):
+        for heading, body in groups:
+            if rank >= len(body):
+                continue
+            cost = tokens[body[rank]]
+            if rank == 0 and heading is not None:
+                cost += tokens[heading]
+            if used + cost > budget:
+                continue
+            used += cost
+            selected.append(body[rank])
+            if rank == 0 and heading is not None:
+                selected.append(heading)
+    return sorted(selected)
+
+
+def reduce_sections(sections: List[Tuple[str, str]], max_tokens: int) -> str:
+    """
+    Extractive reduction of a pack's sections to about max_tokens.
+
+    Args:
+        sections: (source_name, analyzed text) per source, in pack order
+        max_tokens: Token budget for the whole export
+
+    Returns:
+        Export text with the same per-source section layout as complete
+    """
+    # Chunk analyses as lists of non-empty lines, minus lines already seen earlier in the pack
+    seen = set()
+    units: List[Tuple[int, List[str]]] = []
+    for section_index, (_, content) in enumerate(sections):
+        for part in _CHUNK_SEPARATOR.split(content):
+            lines = []
+            for line in part.strip().split("\n"):
+                if not line.strip():
+                    continue
+                key = _normalize(line)
+                if len(key) >= _MIN_DEDUP_CHARS and not _HEADING.match(line):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                lines.append(line.rstrip())
+            if lines:
+                units.append((section_index, lines))
+
+    headers = [format_section(name, "") for name, _ in sections]
+    flat = [line for _, lines in units for line in lines]
+    counts = count_segment_tokens(headers + flat)
+    header_tokens, line_tokens = counts[:len(headers)], counts[len(headers):]
+
+    # +1 per line for its newline
+    unit_tokens: List[List[int]] = []
+    offset = 0
+    for _, lines in units:
+        unit_tokens.append([count + 1 for count in line_tokens[offset:offset + len(lines)]])
+        offset += len(lines)
+
+    budget = max_tokens - sum(header_tokens)
+    allocations = _water_fill([sum(tokens) for tokens in unit_tokens], budget)
+
+    kept: Dict[int, List[str]] = {}
+    for (section_index, lines), tokens, allocation in zip(units, unit_tokens, allocations):
+        if allocation >= sum(tokens):
+            chosen = lines
+        else:
+            chosen = [lines[i] for i in _select_lines(lines, tokens, allocation)]
+        if chosen:
+            kept.setdefault(section_index, []).append("\n".join(chosen))
+
+    return "\n".join(
+        format_section(name, "\n\n".join(kept[section_index]))
+        for section_index, (name, _) in enumerate(sections)
+        if section_index in kept
+    )
+
+
+def build_exports(sections: List[Tuple[str, str]], budgets: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Build every export type of a pack.
+
+    Args:
+        sections: (source_name, analyzed text) per source, in pack order
+        budgets: Token budget per reduced export type (compact, standard)
+
+    Returns:
+        {"texts": {export_type: text}, "spans": [(start, end), ...]} where
+        spans locate each section's analyzed text inside the complete export
+    """
+    pieces: List[str] = []
+    spans: List[Tuple[int, int]] = []
+    position = 0
+    for index, (name, content) in enumerate(sections):
+        if index:
+            pieces.append("\n")
+            position += 1
+        header = f"=== Source: {name} ===\n\n"
+        spans.append((position + len(header), position + len(header) + len(content)))
+        section = format_section(name, content)
+        pieces.append(section)
+        position += len(section)
+
+    texts = {"complete": "".join(pieces)}
+    for export_type, max_tokens in budgets.items():
+        texts[export_type] = reduce_sections(sections, max_tokens)
+    return {"texts": texts, "spans": spans}
+
+
+class PackExporter:
+    """
+    Stores and serves versioned export artifacts per pack.
+
+    Storage functions are synchronous (they run in threads); run_cpu runs
+    build_exports, typically in the CPU process pool.
+
+    Usage:
+        exporter = PackExporter(upload_to_r2, download_from_r2, download_many_from_r2,
+                                r2_client.delete_many, cpu_pool.run, budgets)
+        manifest = await exporter.ensure(prefix, exporter.exportable(sources, default_path))
+        key = exporter.artifact_key(prefix, manifest["version"], "standard")
+    """
+
+    def __init__(
+        self,
+        upload: Callable[[str, str], bool],
+        download: Callable[[str], Optional[str]],
+        download_many: Callable[[List[str]], Dict[str, Optional[str]]],
+        delete_many: Callable[[List[str]], int],
+        run_cpu: Callable[..., Awaitable[Any]],
+        budgets: Dict[str, int],
+        max_manifests: int = 1000,
+        retention_seconds: float = 3600,
+    ):
+        """
+        Args:
+            upload: (key, text) -> success
+            download: key -> text, None when missing
+            download_many: keys -> {key: text or None}
+            delete_many: keys -> number deleted
+            run_cpu: Async runner for CPU-bound functions, e.g. cpu_pool.run
+            budgets: Token budget per reduced export type
+            max_manifests: Manifests remembered in memory (saves an R2 read per request)
+            retention_seconds: How long a replaced version's artifacts stay downloadable
+        """
+        self._upload = upload
+        self._download = download
+        self._download_many = download_many
+        self._delete_many = delete_many
+        self._run_cpu = run_cpu
+        self.budgets = dict(budgets)
+        self.max_manifests = max(1, max_manifests)
+        self.retention_seconds = max(0.0, retention_seconds)
+        self._manifests: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.stats: Dict[str, int] = {
+            "served_stored": 0, "generated": 0, "sources_reused": 0, "sources_downloaded": 0,
+            "versions_deleted": 0, "failed": 0,
+        }
+
+    @staticmethod
+    def manifest_key(prefix: str) -> str:
+        return f"{prefix}/exports/manifest.json"
+
+    @staticmethod
+    def artifact_key(prefix: str, version: str, export_type: str) -> str:
+        return f"{prefix}/exports/{version}/{export_type}.txt"
+
+    @staticmethod
+    def exportable(sources: List[Dict[str, Any]], default_path: Callable[[str], str]) -> List[Tuple[Dict[str, Any], str]]:
+        """
+        Sources whose analysis belongs in the export, with their analyzed.txt keys.
+
+        Args:
+            sources: pack_sources rows in pack order
+            default_path: source_id -> analyzed.txt key for rows without r2_analyzed_path
+        """
+        return [
+            (source, source.get("r2_analyzed_path") or default_path(source.get("source_id")))
+            for source in sources
+            if source.get("status") in EXPORTABLE_STATUSES
+        ]
+
+    def version_of(self, exportable: List[Tuple[Dict[str, Any], str]]) -> str:
+        return export_version((source_fingerprint(source, path) for source, path in exportable), self.budgets)
+
+    def _remember(self, prefix: str, manifest: Dict[str, Any]) -> None:
+        self._manifests[prefix] = manifest
+        self._manifests.move_to_end(prefix)
+        while len(self._manifests) > self.max_manifests:
+            self._manifests.popitem(last=False)
+
+    async def _load_manifest(self, prefix: str) -> Optional[Dict[str, Any]]:
+        raw = await asyncio.to_thread(self._download, self.manifest_key(prefix))
+        if not raw:
+            return None
+        try:
+            manifest = json.loads(raw)
+        except ValueError:
+            return None
+        # Manifests of an older format are still returned so their artifacts get retired;
+        # their version never matches (it hashes EXPORT_FORMAT) and their spans are not reused
+        return manifest if isinstance(manifest, dict) and manifest.get("version") else None
+
+    async def ensure(self, prefix: str, exportable: List[Tuple[Dict[str, Any], str]]) -> Dict[str, Any]:
+        """
+        Return the manifest for the pack's current version, generating it if needed.
+
+        Args:
+            prefix: R2 directory of the pack ({r2_directory}/{pack_id})
+            exportable: Result of exportable() for the pack's current sources
+
+        Returns:
+            Manifest with "version" and per-type "exports" {etag, bytes}
+        """
+        version = self.version_of(exportable)
+        manifest = self._manifests.get(prefix)
+        if manifest is not None and manifest["version"] == version:
+            self._manifests.move_to_end(prefix)
+            self.stats["served_stored"] += 1
+            return manifest
+
+        lock = self._locks.get(prefix)
+        if lock is None:
+            lock = self._locks[prefix] = asyncio.Lock()
+        async with lock:
+            stored = self._manifests.get(prefix)
+            if stored is None or stored["version"] != version:
+                stored = await self._load_manifest(prefix) or stored
+            if stored is not None and stored["version"] == version:
+                self._remember(prefix, stored)
+                self.stats["served_stored"] += 1
+                return stored
+            try:
+                manifest = await self._generate(prefix, version, exportable, stored)
+            except Exception:
+                self.stats["failed"] += 1
+                raise
+            self._remember(prefix, manifest)
+            return manifest
+
+    async def _generate(
+        self,
+        prefix: str,
+        version: str,
+        exportable: List[Tuple[Dict[str, Any], str]],
+        previous: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        fingerprints = [source_fingerprint(source, path) for source, path in exportable]
+
+        # Reuse unchanged sources' analyses from the previous complete export
+        reused: Dict[str, str] = {}
+        if previous is not None and previous.get("format") == EXPORT_FORMAT:
+            spans = {entry["fingerprint"]: entry for entry in previous.get("sources", [])}
+            if any(fingerprint in spans for fingerprint in fingerprints):
+                old_complete = await asyncio.to_thread(
+                    self._download, self.artifact_key(prefix, previous["version"], "complete"))
+                if old_complete is not None:
+                    for fingerprint in fingerprints:
+                        entry = spans.get(fingerprint)
+                        if entry is not None:
+                            reused[fingerprint] = old_complete[entry["start"]:entry["end"]]
+
+        missing = [path for (_, path), fingerprint in zip(exportable, fingerprints) if fingerprint not in reused]
+        downloaded = await asyncio.to_thread(self._download_many, missing) if missing else {}
+        self.stats["sources_reused"] += len(reused)
+        self.stats["sources_downloaded"] += len(missing)
+
+        sections: List[Tuple[str, str]] = []
+        entries: List[Dict[str, Any]] = []
+        for (source, path), fingerprint in zip(exportable, fingerprints):
+            content = reused[fingerprint] if fingerprint in reused else downloaded.get(path)
+            if content:
+                sections.append((source.get("source_name") or "", content))
+                entries.append({"source_id": source.get("source_id"), "fingerprint": fingerprint})
+
+        built = await self._run_cpu(build_exports, sections, self.budgets)
+        for entry, (start, end) in zip(entries, built["spans"]):
+            entry["start"], entry["end"] = start, end
+
+        texts: Dict[str, str] = built["texts"]
+        results = await asyncio.gather(*(
+            asyncio.to_thread(self._upload, self.artifact_key(prefix, version, export_type), text)
+            for export_type, text in texts.items()
+        ))
+        if not all(results):
+            raise Exception(f"Failed to store exports for {prefix}")
+
+        manifest = {
+            "format": EXPORT_FORMAT,
+            "version": version,
+            "generated_at": datetime.utcnow().isoformat(),
+            "exports": {
+                export_type: {"etag": content_etag(text), "bytes": len(text.encode("utf-8"))}
+                for export_type, text in texts.items()
+            },
+            "sources": entries,
+            "retired": [],
+        }
+        expired = self._retire(manifest, previous)
+        if not await asyncio.to_thread(self._upload, self.manifest_key(prefix), json.dumps(manifest)):
+            raise Exception(f"Failed to store export manifest for {prefix}")
+
+        self.stats["generated"] += 1
+        print(f"📦 Exports for {prefix} generated (version {version}, "
+              f"{len(reused)} sources reused, {len(missing)} downloaded)")
+
+        if expired:
+            stale = [
+                self.artifact_key(prefix, entry["version"], export_type)
+                for entry in expired
+                for export_type in entry.get("types", [])
+            ]
+            await asyncio.to_thread(self._delete_many, stale)
+            self.stats["versions_deleted"] += len(expired)
+        return manifest
+
+    def _retire(self, manifest: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Record the replaced version in manifest["retired"] and split off expired ones.
+
+        Args:
+            manifest: New manifest (its "retired" list is filled in)
+            previous: Manifest being replaced, if any
+
+        Returns:
+            Retired entries past the retention period, whose artifacts can be deleted
+        """
+        now = time.time()
+        retired: List[Dict[str, Any]] = list(previous.get("retired", [])) if previous is not None else []
+        if previous is not None and previous["version"] != manifest["version"]:
+            retired.append({
+                "version": previous["version"],
+                "retired_at": now,
+                "types": list(previous.get("exports", {})),
+            })
+
+        kept: List[Dict[str, Any]] = []
+        expired: List[Dict[str, Any]] = []
+        for entry in retired:
+            # A version that became current again was just rewritten, so it is not retired
+            if entry["version"] == manifest["version"]:
+                continue
+            if now - entry.get("retired_at", 0) >= self.retention_seconds:
+                expired.append(entry)
+            else:
+                kept.append(entry)
+        manifest["retired"] = kept
+        return expired
+
+    def forget(self, prefix: str) -> None:
+        """Drop the remembered manifest of a pack (deleted, or its artifacts were replaced)."""
+        self._manifests.pop(prefix, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters for health/metrics endpoints."""
+        return {"manifests": len(self._manifests), "budgets": dict(self.budgets), **self.stats}
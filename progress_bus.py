@@ -0,0 +1,231 @@
+"""
+In-process publish/subscribe bus for source progress.
+
+Status writers publish every update here and SSE streams wait on it, instead
+of each open browser tab polling the database every 500 ms. The bus keeps
+the latest merged state per source, so a subscriber that wakes up late
+only sees the newest state rather than a backlog.
+
+Across several uvicorn workers, the bus can fan out through Redis pub/sub:
+set REDIS_URL and install redis>=4.2. Without Redis, streams served by a
+different worker than the one doing the work fall back to low-frequency
+database polling.
+"""
+
+import asyncio
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+try:
+    import redis.asyncio as redis_asyncio
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis_asyncio = None
+    REDIS_AVAILABLE = False
+
+
+REDIS_CHANNEL = "ucp:source_progress"
+
+
+class Subscription:
+    """One subscriber's view of a key: the latest state plus a wake-up event."""
+
+    __slots__ = ("key", "latest", "_event")
+
+    def __init__(self, key: str, latest: Optional[Dict[str, Any]]):
+        self.key = key
+        self.latest = latest
+        self._event = asyncio.Event()
+        if latest is not None:
+            self._event.set()
+
+    def _notify(self, state: Dict[str, Any]) -> None:
+        self.latest = state
+        self._event.set()
+
+    async def wait(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Wait for the next update.
+
+        Args:
+            timeout: Seconds to wait before giving up
+
+        Returns:
+            Latest merged state, or None if nothing was published in time
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._event.clear()
+        return self.latest
+
+
+class ProgressBus:
+    """
+    Latest-value pub/sub keyed by source id.
+
+    publish() may be called from any thread. Subscribers are notified on the
+    event loop that the bus is bound to, which is the first loop that
+    subscribes or calls start().
+    """
+
+    def __init__(self, max_keys: int = 10000, redis_url: Optional[str] = None):
+        self.max_keys = max_keys
+        self.redis_url = redis_url
+        self._states: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._origin = uuid.uuid4().hex
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"published": 0, "delivered": 0, "remote_received": 0}
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    async def start(self) -> None:
+        """Bind to the running loop and start the Redis listener if configured."""
+        self._loop = asyncio.get_running_loop()
+        if not self.redis_url:
+            return
+        if not REDIS_AVAILABLE:
+            print("⚠️ REDIS_URL is set but redis is not installed - progress bus is process-local")
+            return
+        try:
+            self._redis = redis_asyncio.from_url(self.redis_url)
+            pubsub = self._redis.pubsub()
+            await pubsub.subscribe(REDIS_CHANNEL)
+            self._listener = asyncio.create_task(self._listen(pubsub))
+            print("📡 Progress bus fan-out via Redis enabled")
+        except Exception as e:
+            print(f"⚠️ Progress bus Redis connection failed, staying process-local: {e}")
+            self._redis = None
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._redis is not None:
+            try:
+                await self._redis.close()
+            except Exception:
+                pass
+            self._redis = None
+
+    async def _listen(self, pubsub) -> None:
+        while True:
+            try:
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        payload = json.loads(message["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    if payload.get("origin") == self._origin:
+                        continue
+                    self.stats["remote_received"] += 1
+                    self._apply(payload["key"], payload["update"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Progress bus Redis listener error: {e}")
+                await asyncio.sleep(1)
+
+    # ------------------------------------------------------------------
+    # Publish / subscribe
+    # ------------------------------------------------------------------
+
+    def publish(self, key: str, update: Dict[str, Any]) -> None:
+        """
+        Merge a (partial) update into the key's state and wake its subscribers.
+
+        Args:
+            key: Source id
+            update: Changed fields (e.g. status, progress)
+        """
+        self.stats["published"] += 1
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self._apply(key, update)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(key, update)
+            return
+        try:
+            loop.call_soon_threadsafe(self._deliver, key, update)
+        except RuntimeError:
+            # Loop closed during shutdown - keep the state, skip notifications
+            self._apply(key, update)
+
+    def _deliver(self, key: str, update: Dict[str, Any]) -> None:
+        self._apply(key, update)
+        self._fan_out(key, update)
+
+    def _fan_out(self, key: str, update: Dict[str, Any]) -> None:
+        if self._redis is None:
+            return
+        message = json.dumps({"origin": self._origin, "key": key, "update": update}, default=str)
+
+        async def send():
+            try:
+                await self._redis.publish(REDIS_CHANNEL, message)
+            except Exception as e:
+                print(f"⚠️ Progress bus Redis publish failed: {e}")
+
+        asyncio.ensure_future(send())
+
+    def _apply(self, key: str, update: Dict[str, Any]) -> None:
+        with self._lock:
+            state = {**self._states.pop(key, {}), **update}
+            self._states[key] = state
+            while len(self._states) > self.max_keys:
+                self._states.popitem(last=False)
+            subscribers = list(self._subscribers.get(key, ()))
+        for subscription in subscribers:
+            subscription._notify(state)
+            self.stats["delivered"] += 1
+
+    def latest(self, key: str) -> Optional[Dict[str, Any]]:
+        """Latest merged state published for key in this process, if any."""
+        with self._lock:
+            state = self._states.get(key)
+            return dict(state) if state is not None else None
+
+    def subscribe(self, key: str) -> Subscription:
+        """Register a subscriber for key (call unsubscribe() when done)."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._states.get(key)
+            subscription = Subscription(key, dict(state) if state is not None else None)
+            self._subscribers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters for health/metrics endpoints."""
+        with self._lock:
+            return {
+                "tracked_keys": len(self._states),
+                "subscribers": sum(len(s) for s in self._subscribers.values()),
+                "redis": self._redis is not None,
+                **self.stats,
+            }
@@ -0,0 +1,821 @@
+"""
+R2 storage helpers shared by the analysis pipeline.
+
+Holds the pooled, signed-request R2 client, the transfer counters used to
+measure how many round trips the pipeline makes against R2, and the writer
+that commits a source's chunk analyses with a single upload per object.
+"""
+
+import base64
+import hashlib
+import hmac
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+from urllib.parse import parse_qsl, quote, urlencode, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Parts must be at least 5 MiB (except the last) for S3/R2 multipart uploads
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+
+# S3 DeleteObjects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+
+EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+
+
+# ============================================================================
+# TRANSFER COUNTERS
+# ============================================================================
+
+class TransferStats:
+    """
+    Thread-safe counters for R2 object transfers.
+
+    Every GET/PUT/DELETE issued against R2 records itself here so the
+    number of round trips (and bytes moved) per pipeline stage can be
+    compared before and after a change.
+    """
+
+    OPERATIONS = ("get", "head", "put", "delete", "list", "multipart_part")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        """Zero all counters."""
+        with self._lock:
+            self._counts = {op: 0 for op in self.OPERATIONS}
+            self._counts["bytes_in"] = 0
+            self._counts["bytes_out"] = 0
+
+    def record(self, operation: str, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        """
+        Record a single transfer.
+
+        Args:
+            operation: One of OPERATIONS
+            bytes_in: Bytes downloaded from R2
+            bytes_out: Bytes uploaded to R2
+        """
+        with self._lock:
+            self._counts[operation] = self._counts.get(operation, 0) + 1
+            self._counts["bytes_in"] += bytes_in
+            self._counts["bytes_out"] += bytes_out
+
+    def add_bytes(self, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        """Count bytes of a transfer already recorded (e.g. a streamed body read in parts)."""
+        with self._lock:
+            self._counts["bytes_in"] += bytes_in
+            self._counts["bytes_out"] += bytes_out
+
+    def snapshot(self) -> Dict[str, int]:
+        """Return a copy of the current counters."""
+        with self._lock:
+            return dict(self._counts)
+
+    @staticmethod
+    def delta(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+        """
+        Difference between two snapshots, dropping zero entries.
+
+        Args:
+            before: Snapshot taken at the start of a stage
+            after: Snapshot taken at the end of a stage
+
+        Returns:
+            Counter deltas for the stage
+        """
+        return {
+            key: after.get(key, 0) - before.get(key, 0)
+            for key in after
+            if after.get(key, 0) - before.get(key, 0)
+        }
+
+
+# Process-wide counters (exposed via /api/health)
+transfer_stats = TransferStats()
+
+
+# ============================================================================
+# REQUEST SIGNING
+# ============================================================================
+
+_signing_key_cache: Dict[Tuple[str, str, str], bytes] = {}
+_signing_key_lock = threading.Lock()
+
+
+def _hmac_sha256(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def get_signing_key(secret_key: str, datestamp: str, region: str = "auto") -> bytes:
+    """
+    Derive (and cache) the SigV4 signing key for a given day.
+
+    The four-step HMAC chain only depends on the secret, date and region,
+    so it is computed once per day instead of once per request.
+
+    Args:
+        secret_key: R2 secret access key
+        datestamp: Date in YYYYMMDD format
+        region: Signing region ("auto" for R2)
+
+    Returns:
+        Derived signing key
+    """
+    cache_key = (secret_key, datestamp, region)
+    signing_key = _signing_key_cache.get(cache_key)
+    if signing_key is None:
+        signing_key = _hmac_sha256(f"AWS4{secret_key}".encode(), datestamp)
+        signing_key = _hmac_sha256(signing_key, region)
+        signing_key = _hmac_sha256(signing_key, "s3")
+        signing_key = _hmac_sha256(signing_key, "aws4_request")
+        with _signing_key_lock:
+            # Keys for previous days are never needed again
+            _signing_key_cache.clear()
+            _signing_key_cache[cache_key] = signing_key
+    return signing_key
+
+
+def sign_request(
+    method: str,
+    url: str,
+    headers: Dict[str, str],
+    payload: Union[str, bytes],
+    access_key: str,
+    secret_key: str,
+    region: str = "auto",
+    payload_hash: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Add AWS Signature Version 4 headers for an R2 request.
+
+    Args:
+        method: HTTP method
+        url: Full request URL, including any query string
+        headers: Headers to extend (modified in place)
+        payload: Request body
+        access_key: R2 access key id
+        secret_key: R2 secret access key
+        region: Signing region ("auto" for R2)
+        payload_hash: Precomputed SHA-256 hex digest of the payload
+
+    Returns:
+        The headers with Authorization, x-amz-date and x-amz-content-sha256 set
+    """
+    parsed_url = urlparse(url)
+    host = parsed_url.netloc
+    path = parsed_url.path or "/"
+
+    # Canonical query string: sorted, URI-encoded key=value pairs
+    query_pairs = parse_qsl(parsed_url.query, keep_blank_values=True)
+    canonical_query = "&".join(
+        f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query_pairs)
+    )
+
+    t = datetime.utcnow()
+    datestamp = t.strftime("%Y%m%d")
+    timestamp = t.strftime("%Y%m%dT%H%M%SZ")
+
+    if payload_hash is None:
+        if not payload:
+            payload_hash = EMPTY_PAYLOAD_HASH
+        else:
+            payload_bytes = payload if isinstance(payload, (bytes, bytearray)) else payload.encode()
+            payload_hash = hashlib.sha256(payload_bytes).hexdigest()
+
+    canonical_headers = f"host:{host}\nx-amz-content-sha256:{payload_hash}\nx-amz-date:{timestamp}\n"
+    signed_headers = "host;x-amz-content-sha256;x-amz-date"
+    canonical_request = f"{method}\n{path}\n{canonical_query}\n{canonical_headers}\n{signed_headers}\n{payload_hash}"
+
+    algorithm = "AWS4-HMAC-SHA256"
+    credential_scope = f"{datestamp}/{region}/s3/aws4_request"
+    string_to_sign = f"{algorithm}\n{timestamp}\n{credential_scope}\n{hashlib.sha256(canonical_request.encode()).hexdigest()}"
+
+    signing_key = get_signing_key(secret_key, datestamp, region)
+    signature = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    headers.update({
+        "Authorization": f"{algorithm} Credential={access_key}/{credential_scope}, SignedHeaders={signed_headers}, Signature={signature}",
+        "x-amz-date": timestamp,
+        "x-amz-content-sha256": payload_hash,
+    })
+    return headers
+
+
+# ============================================================================
+# R2 CLIENT
+# ============================================================================
+
+def _xml_findall(root: ET.Element, name: str) -> List[ET.Element]:
+    """Find elements by local name, ignoring the S3 XML namespace."""
+    return [el for el in root.iter() if el.tag.split("}")[-1] == name]
+
+
+def _xml_text(element: ET.Element, name: str) -> Optional[str]:
+    for child in element:
+        if child.tag.split("}")[-1] == name:
+            return child.text
+    return None
+
+
+class R2Client:
+    """
+    Pooled, signed-request client for a single R2 bucket.
+
+    One instance is shared by the whole process. It keeps a sized HTTP
+    connection pool, reuses the per-day signing key, hashes each payload
+    once, and offers batch get/put/delete helpers that fan out over a
+    bounded worker pool (deletes use S3 multi-object delete).
+    """
+
+    def __init__(
+        self,
+        endpoint: Optional[str],
+        bucket: Optional[str],
+        access_key: Optional[str],
+        secret_key: Optional[str],
+        region: str = "auto",
+        pool_size: int = 32,
+        max_workers: int = 16,
+        verify: Union[bool, str] = True,
+        stats: Optional[TransferStats] = None,
+    ):
+        self.endpoint = (endpoint or "").rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.max_workers = max(1, max_workers)
+        self.stats = stats or transfer_stats
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Low-level request
+    # ------------------------------------------------------------------
+
+    def object_url(self, key: str = "", query: Optional[Mapping[str, str]] = None) -> str:
+        """
+        Build the URL for an object (or the bucket when key is empty).
+
+        Args:
+            key: Object key
+            query: Optional query parameters
+
+        Returns:
+            Fully-qualified, URI-encoded URL
+        """
+        url = f"{self.endpoint}/{self.bucket}"
+        if key:
+            url += "/" + quote(key, safe="/-_.~")
+        if query:
+            url += "?" + urlencode(query, quote_via=quote, safe="-_.~")
+        return url
+
+    def request(
+        self,
+        method: str,
+        key: str = "",
+        query: Optional[Mapping[str, str]] = None,
+        data: Union[str, bytes] = b"",
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 30,
+        stream: bool = False,
+        operation: Optional[str] = None,
+    ) -> requests.Response:
+        """
+        Sign and send a request, recording it in the transfer counters.
+
+        Args:
+            method: HTTP method
+            key: Object key ("" for bucket-level requests)
+            query: Optional query parameters
+            data: Request body
+            headers: Extra headers
+            timeout: Request timeout in seconds
+            stream: Leave the response body unread (caller iterates it)
+            operation: Counter name; derived from the method when omitted
+
+        Returns:
+            The HTTP response (any status code)
+
+        Raises:
+            requests.exceptions.RequestException: On transport errors
+        """
+        body = data.encode("utf-8") if isinstance(data, str) else data
+        url = self.object_url(key, query)
+        request_headers = dict(headers or {})
+        sign_request(method, url, request_headers, body, self.access_key, self.secret_key, self.region)
+
+        response = self.session.request(
+            method, url, data=body or None, headers=request_headers, timeout=timeout, stream=stream
+        )
+
+        if operation is None:
+            operation = {"GET": "get", "HEAD": "head", "DELETE": "delete"}.get(method, "put")
+        bytes_in = 0
+        if method == "GET" and not stream and response.status_code == 200:
+            bytes_in = len(response.content)
+        self.stats.record(operation, bytes_in=bytes_in, bytes_out=len(body or b""))
+        return response
+
+    # ------------------------------------------------------------------
+    # Single-object operations
+    # ------------------------------------------------------------------
+
+    def get(self, key: str, timeout: float = 30) -> Optional[bytes]:
+        """
+        Download an object.
+
+        Args:
+            key: Object key
+            timeout: Request timeout in seconds
+
+        Returns:
+            Object bytes, or None if the object does not exist
+
+        Raises:
+            RuntimeError: On non-404 error responses
+        """
+        response = self.request("GET", key, timeout=timeout)
+        if response.status_code == 200:
+            return response.content
+        if response.status_code == 404:
+            return None
+        raise RuntimeError(f"R2 GET {key} failed: {response.status_code} - {response.text[:200]}")
+
+    def head(self, key: str, timeout: float = 10) -> Optional[int]:
+        """
+        Look up an object's size without downloading it.
+
+        Args:
+            key: Object key
+            timeout: Request timeout in seconds
+
+        Returns:
+            Object size in bytes, or None if the object does not exist
+
+        Raises:
+            RuntimeError: On non-404 error responses
+        """
+        response = self.request("HEAD", key, timeout=timeout)
+        if response.status_code == 200:
+            return int(response.headers.get("Content-Length", 0))
+        if response.status_code == 404:
+            return None
+        raise RuntimeError(f"R2 HEAD {key} failed: {response.status_code}")
+
+    def iter_object(
+        self,
+        key: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = 64 * 1024,
+        timeout: float = 60,
+    ) -> Iterator[bytes]:
+        """
+        Stream an object's body (or a byte range of it) without buffering it.
+
+        Args:
+            key: Object key
+            start: First byte to return
+            end: Last byte to return (inclusive); None for the end of the object
+            chunk_size: Bytes read from the socket per iteration
+            timeout: Connect/read timeout in seconds
+
+        Yields:
+            Body parts of at most chunk_size bytes
+
+        Raises:
+            FileNotFoundError: If the object does not exist
+            RuntimeError: On other error responses
+        """
+        headers = {}
+        if start or end is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        response = self.request("GET", key, headers=headers, timeout=timeout, stream=True)
+        try:
+            if response.status_code == 404:
+                raise FileNotFoundError(key)
+            if response.status_code != (206 if headers else 200):
+                raise RuntimeError(f"R2 GET {key} failed: {response.status_code}")
+            for chunk in response.iter_content(chunk_size):
+                self.stats.add_bytes(bytes_in=len(chunk))
+                yield chunk
+        finally:
+            response.close()
+
+    def put(self, key: str, data: Union[str, bytes], content_type: str = "text/plain; charset=utf-8", timeout: float = 60) -> bool:
+        """
+        Upload an object in a single request.
+
+        Args:
+            key: Object key
+            data: Object contents
+            content_type: Content-Type header
+            timeout: Request timeout in seconds
+
+        Returns:
+            True on success
+        """
+        response = self.request("PUT", key, data=data, headers={"Content-Type": content_type}, timeout=timeout)
+        if response.status_code in (200, 201):
+            return True
+        print(f"❌ R2 PUT {key} failed: {response.status_code} - {response.text[:200]}")
+        return False
+
+    def delete(self, key: str, timeout: float = 30) -> bool:
+        """
+        Delete a single object (missing objects count as deleted).
+
+        Args:
+            key: Object key
+            timeout: Request timeout in seconds
+
+        Returns:
+            True on success
+        """
+        response = self.request("DELETE", key, timeout=timeout)
+        if response.status_code in (200, 204, 404):
+            return True
+        print(f"❌ R2 DELETE {key} failed: {response.status_code} - {response.text[:200]}")
+        return False
+
+    def list_keys(self, prefix: str = "") -> List[str]:
+        """
+        List every key under a prefix (ListObjectsV2, following continuation tokens).
+
+        Args:
+            prefix: Key prefix
+
+        Returns:
+            Matching object keys
+
+        Raises:
+            RuntimeError: On error responses
+        """
+        keys: List[str] = []
+        continuation_token = None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if continuation_token:
+                query["continuation-token"] = continuation_token
+            response = self.request("GET", query=query, operation="list")
+            if response.status_code != 200:
+                raise RuntimeError(f"R2 LIST {prefix} failed: {response.status_code} - {response.text[:200]}")
+
+            root = ET.fromstring(response.content)
+            for contents in _xml_findall(root, "Contents"):
+                key = _xml_text(contents, "Key")
+                if key is not None:
+                    keys.append(key)
+
+            truncated = (_xml_text(root, "IsTruncated") or "false").lower() == "true"
+            continuation_token = _xml_text(root, "NextContinuationToken")
+            if not truncated or not continuation_token:
+                return keys
+
+    def multipart_upload(
+        self,
+        key: str,
+        parts: Iterable[bytes],
+        content_type: str = "text/plain; charset=utf-8",
+        timeout: float = 120,
+    ) -> bool:
+        """
+        Upload a large object as an S3 multipart upload.
+
+        Args:
+            key: Object key
+            parts: Byte parts (each at least 5 MiB except the last)
+            content_type: Content-Type of the final object
+            timeout: Per-request timeout in seconds
+
+        Returns:
+            True on success (the upload is aborted on failure)
+        """
+        upload_id = None
+        try:
+            response = self.request("POST", key, query={"uploads": ""}, headers={"Content-Type": content_type}, timeout=timeout)
+            if response.status_code != 200:
+                print(f"❌ R2 multipart initiate failed: {response.status_code} - {response.text[:200]}")
+                return False
+            upload_id = _xml_text(ET.fromstring(response.content), "UploadId")
+            if not upload_id:
+                print(f"❌ R2 multipart initiate returned no UploadId for {key}")
+                return False
+
+            etags = []
+            total_bytes = 0
+            for part_number, part in enumerate(parts, start=1):
+                response = self.request(
+                    "PUT", key,
+                    query={"partNumber": str(part_number), "uploadId": upload_id},
+                    data=part, timeout=timeout, operation="multipart_part",
+                )
+                if response.status_code != 200:
+                    raise RuntimeError(f"part {part_number} failed: {response.status_code} - {response.text[:200]}")
+                etags.append((part_number, response.headers.get("ETag", "")))
+                total_bytes += len(part)
+
+            complete_body = "<CompleteMultipartUpload>" + "".join(
+                f"<Part><PartNumber>{n}</PartNumber><ETag>{etag.replace('&', '&amp;').replace('<', '&lt;')}</ETag></Part>"
+                for n, etag in etags
+            ) + "</CompleteMultipartUpload>"
+            response = self.request(
+                "POST", key, query={"uploadId": upload_id}, data=complete_body,
+                headers={"Content-Type": "application/xml"}, timeout=timeout,
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"complete failed: {response.status_code} - {response.text[:200]}")
+
+            print(f"✅ R2 multipart upload successful: {key} ({len(etags)} parts, {total_bytes / (1024 * 1024):.2f} MB)")
+            return True
+
+        except Exception as e:
+            print(f"❌ R2 multipart upload failed for {key}: {e}")
+            if upload_id:
+                # Abort so R2 does not keep the orphaned parts
+                try:
+                    self.request("DELETE", key, query={"uploadId": upload_id})
+                except Exception as abort_error:
+                    print(f"⚠️ Failed to abort multipart upload {upload_id}: {abort_error}")
+            return False
+
+    # ------------------------------------------------------------------
+    # Batch operations
+    # ------------------------------------------------------------------
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="r2")
+        return self._executor
+
+    def get_many(self, keys: Iterable[str], timeout: float = 30) -> Dict[str, Optional[bytes]]:
+        """
+        Download several objects concurrently over the bounded worker pool.
+
+        Args:
+            keys: Object keys
+            timeout: Per-request timeout in seconds
+
+        Returns:
+            Mapping of key -> bytes (None for missing or failed objects), in input order
+        """
+        keys = list(dict.fromkeys(keys))
+
+        def fetch(key: str) -> Optional[bytes]:
+            try:
+                return self.get(key, timeout=timeout)
+            except Exception as e:
+                print(f"⚠️ R2 batch GET failed for {key}: {e}")
+                return None
+
+        return dict(zip(keys, self._pool().map(fetch, keys)))
+
+    def head_many(self, keys: Iterable[str], timeout: float = 10) -> Dict[str, Optional[int]]:
+        """
+        Look up several objects' sizes concurrently over the bounded worker pool.
+
+        Args:
+            keys: Object keys
+            timeout: Per-request timeout in seconds
+
+        Returns:
+            Mapping of key -> size (None for missing or failed lookups), in input order
+        """
+        keys = list(dict.fromkeys(keys))
+
+        def lookup(key: str) -> Optional[int]:
+            try:
+                return self.head(key, timeout=timeout)
+            except Exception as e:
+                print(f"⚠️ R2 batch HEAD failed for {key}: {e}")
+                return None
+
+        return dict(zip(keys, self._pool().map(lookup, keys)))
+
+    def put_many(self, items: Mapping[str, Union[str, bytes]], content_type: str = "text/plain; charset=utf-8") -> Dict[str, bool]:
+        """
+        Upload several objects concurrently over the bounded worker pool.
+
+        Args:
+            items: Mapping of key -> contents
+            content_type: Content-Type for every object
+
+        Returns:
+            Mapping of key -> success
+        """
+        keys = list(items)
+
+        def store(key: str) -> bool:
+            try:
+                return self.put(key, items[key], content_type=content_type)
+            except Exception as e:
+                print(f"⚠️ R2 batch PUT failed for {key}: {e}")
+                return False
+
+        return dict(zip(keys, self._pool().map(store, keys)))
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        """
+        Delete objects with S3 multi-object delete (1000 keys per request).
+
+        Batches are sent concurrently over the bounded worker pool.
+
+        Args:
+            keys: Object keys
+
+        Returns:
+            Number of keys deleted
+        """
+        keys = list(dict.fromkeys(keys))
+        batches = [keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)]
+
+        def delete_batch(batch: List[str]) -> int:
+            body = "<Delete><Quiet>true</Quiet>" + "".join(
+                f"<Object><Key>{k.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')}</Key></Object>"
+                for k in batch
+            ) + "</Delete>"
+            body_bytes = body.encode("utf-8")
+            headers = {
+                "Content-Type": "application/xml",
+                "Content-MD5": base64.b64encode(hashlib.md5(body_bytes).digest()).decode(),
+            }
+            try:
+                response = self.request("POST", query={"delete": ""}, data=body_bytes, headers=headers, operation="delete")
+            except Exception as e:
+                print(f"⚠️ R2 batch DELETE failed ({len(batch)} keys): {e}")
+                return 0
+            if response.status_code != 200:
+                print(f"⚠️ R2 batch DELETE failed: {response.status_code} - {response.text[:200]}")
+                return 0
+            errors = _xml_findall(ET.fromstring(response.content), "Error") if response.content else []
+            for error in errors[:5]:
+                print(f"⚠️ R2 could not delete {_xml_text(error, 'Key')}: {_xml_text(error, 'Message')}")
+            return len(batch) - len(errors)
+
+        return sum(self._pool().map(delete_batch, batches))
+
+    def close(self) -> None:
+        """Shut down the worker pool and close pooled connections."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.session.close()
+
+
+# ============================================================================
+# ANALYSIS WRITER
+# ============================================================================
+
+def iter_byte_parts(text: str, part_size: int) -> Iterator[bytes]:
+    """
+    Encode text to UTF-8 and yield it in parts of at least part_size bytes.
+
+    Args:
+        text: Text to encode
+        part_size: Minimum size of every part except the last
+
+    Yields:
+        Encoded byte parts
+    """
+    buffer = bytearray()
+    # Encode in character windows so the full byte string is never built at once
+    window = max(part_size // 4, 1)
+    for start in range(0, len(text), window):
+        buffer.extend(text[start:start + window].encode("utf-8", errors="ignore"))
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+class AnalysisWriter:
+    """
+    Collects a source's chunk analyses and commits them once, in order.
+
+    Analyses may be added in any order as they complete. commit() builds the
+    per-source analyzed.txt and the appended pack-level complete_analyzed.txt
+    in a single pass and uploads each object exactly once (or as a multipart
+    upload when the object is very large), instead of re-downloading and
+    re-uploading both files after every chunk.
+
+    The on-disk format is unchanged: chunks are separated by
+    "\\n\\n--- Chunk i/n ---\\n\\n" (which build_tree_from_analysis splits on),
+    and the pack file gets a "--- SOURCE: name ---" header per source.
+    """
+
+    def __init__(self, filename: str, total_chunks: int):
+        self.filename = filename
+        self.total_chunks = total_chunks
+        self._analyses: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._analyses)
+
+    def add(self, index: int, analysis: str) -> None:
+        """
+        Buffer the analysis for a chunk.
+
+        Args:
+            index: Zero-based chunk index
+            analysis: Analysis text for the chunk
+        """
+        self._analyses[index] = analysis
+
+    def _chunk_separator(self, index: int) -> str:
+        if self.total_chunks > 1:
+            return f"\n\n--- Chunk {index + 1}/{self.total_chunks} ---\n\n"
+        return "\n\n"
+
+    def build_source_text(self) -> str:
+        """Build the contents of the per-source analyzed.txt."""
+        return "".join(
+            self._chunk_separator(index) + self._analyses[index]
+            for index in sorted(self._analyses)
+        )
+
+    def build_pack_text(self, existing_pack_content: str) -> str:
+        """
+        Build the pack-level complete_analyzed.txt with this source appended.
+
+        Args:
+            existing_pack_content: Current pack file contents ("" if none)
+
+        Returns:
+            Full pack file contents
+        """
+        if existing_pack_content:
+            source_header = f"\n\n--- SOURCE: {self.filename} ---\n\n"
+        else:
+            source_header = f"--- SOURCE: {self.filename} ---\n\n"
+
+        pieces: List[str] = [existing_pack_content, source_header]
+        for position, index in enumerate(sorted(self._analyses)):
+            if position > 0:
+                pieces.append(self._chunk_separator(index))
+            pieces.append(self._analyses[index])
+        return "".join(pieces)
+
+    def commit(
+        self,
+        source_key: str,
+        pack_key: str,
+        upload: Callable[[str, str], bool],
+        download: Callable[[str], Optional[str]],
+        multipart_upload: Optional[Callable[[str, Iterable[bytes]], bool]] = None,
+        multipart_threshold: int = 64 * 1024 * 1024,
+        part_size: int = 8 * 1024 * 1024,
+    ) -> bool:
+        """
+        Write the source and pack analysis files to storage.
+
+        The existing pack file is read once, right before the write, so
+        sources finishing concurrently in the same pack overwrite each
+        other as little as possible.
+
+        Args:
+            source_key: Storage key of the per-source analyzed.txt
+            pack_key: Storage key of the pack's complete_analyzed.txt
+            upload: Single-request upload function (key, text) -> success
+            download: Download function returning None when missing
+            multipart_upload: Optional multipart upload function (key, parts) -> success
+            multipart_threshold: Object size (in characters) above which multipart is used
+            part_size: Multipart part size in bytes
+
+        Returns:
+            True if both objects were written
+        """
+        part_size = max(part_size, MULTIPART_MIN_PART_SIZE)
+
+        def write(key: str, text: str) -> bool:
+            if multipart_upload is not None and len(text) >= multipart_threshold:
+                return multipart_upload(key, iter_byte_parts(text, part_size))
+            return upload(key, text)
+
+        source_ok = write(source_key, self.build_source_text())
+
+        existing_pack_content = download(pack_key) or ""
+        pack_ok = write(pack_key, self.build_pack_text(existing_pack_content))
+
+        return source_ok and pack_ok
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header, Request, Form, Body, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 import uvicorn
@@ -11,20 +11,20 @@ import io
 import ssl
 import urllib3
 import asyncio
+import functools
 import traceback
 import time
 import threading
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Iterable, Iterator, Tuple
 from pathlib import Path
 import tiktoken
 import zipfile
 
 # Import credit configuration
 from credit_config import get_new_user_credits
-from openai import OpenAI
-import boto3
-from botocore.config import Config
+from openai import APIConnectionError, APITimeoutError, AsyncOpenAI
+import httpx
 import html
 from html.parser import HTMLParser
 import re
@@ -35,18 +35,38 @@ import unicodedata
 import requests
 import certifi
 import traceback
-from PyPDF2 import PdfReader
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import stripe
-from collections import defaultdict
+from collections import defaultdict, deque
 from datetime import timedelta
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qsl, quote
 
 # Import custom modules
 from prompts import get_analysis_prompt, get_tree_prompt
 from errors import ChunkProcessingError, ContentPolicyError, TokenLimitError, ExtractionError, TreeBuildError
 from utils import get_progress_message, log_chunk_analysis, log_source_processing, calculate_progress_percent
+from analysis_cache import AnalysisCache, make_cache_key
+from analysis_jobs import AnalysisCheckpoints, AnalysisJobRegistry, chunk_fingerprint
+from auth_cache import TokenCache
+from chunker import ENCODING_NAME as CHUNK_ENCODING, chunk_texts, count_segment_tokens
+from cpu_pool import CpuPool
+from download_stream import DownloadStream, Part, RangeNotSatisfiable, if_range_matches, is_strong_etag, parse_range
+from extraction import count_pdf_pages, extract_from_text_content, extract_pdf_page_range, extract_upload_content
+from job_queue import create_job_queue
+from key_resolver import KeyResolver, layout_candidates
+from openai_batch import BatchCancelled, BatchRunner, BatchSubmitError, HttpBatchTransport
+from openai_limiter import OpenAIRateLimiter, backoff_delay
+from openai_scheduler import OpenAIScheduler
+from pack_exports import PackExporter, etag_matches
+from progress_bus import ProgressBus
+from state_store import AttemptLog, JobStore
+from metadata_cache import MetadataCache
+from supabase_async import AsyncSupabase
+from status_writer import StatusWriter
+from r2_storage import AnalysisWriter, R2Client, TransferStats, sign_request, transfer_stats
+from upload_spool import discard_spooled_file, iter_file_pieces, iter_upload_file, spool_pieces, spool_stream
+from zip_stream import ZipMember, stream_zip
 
 # Load environment variables with override to refresh from file
 load_dotenv(override=True)
@@ -71,8 +91,8 @@ except ImportError as e:
 try:
     from memory_tree import (
         get_scope_for_source,
-        apply_chunk_to_memory_tree,
-        export_pack_from_tree
+        export_pack_from_tree,
+        MemoryTreeBatch
     )
     MEMORY_TREE_AVAILABLE = True
 except ImportError as e:
@@ -85,6 +105,13 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SUPABASE_URL = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")  # Get this from Supabase Project Settings -> API
+# Verified JWT claims cache (entries also expire with the token's exp)
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+JWT_CACHE_MAX_TTL_SECONDS = int(os.getenv("JWT_CACHE_MAX_TTL_SECONDS", "300"))
+# Pooled connections for the async PostgREST client
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "50"))
+# Pack/source metadata lookups are cached this long per process (0 disables); writes invalidate
+METADATA_CACHE_TTL_SECONDS = float(os.getenv("METADATA_CACHE_TTL_SECONDS", "3"))
 
 # Stripe configuration
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
@@ -96,12 +123,100 @@ R2_ENDPOINT = os.getenv("R2_ENDPOINT")
 R2_ACCESS_KEY = os.getenv("R2_ACCESS_KEY")
 R2_SECRET_KEY = os.getenv("R2_SECRET_KEY") 
 R2_BUCKET = os.getenv("R2_BUCKET_NAME")
+# Analysis files larger than this are written with an R2 multipart upload
+R2_MULTIPART_THRESHOLD_MB = int(os.getenv("R2_MULTIPART_THRESHOLD_MB", "64"))
+R2_MULTIPART_PART_SIZE_MB = int(os.getenv("R2_MULTIPART_PART_SIZE_MB", "8"))
+# Connection pool size and worker count for batch R2 operations
+R2_POOL_SIZE = int(os.getenv("R2_POOL_SIZE", "32"))
+R2_BATCH_WORKERS = int(os.getenv("R2_BATCH_WORKERS", "16"))
+# Members fetched ahead of the writer when streaming pack ZIPs
+ZIP_PREFETCH = int(os.getenv("ZIP_PREFETCH", "8"))
+# Job file keys confirmed missing in R2 are not probed again for this long
+R2_NEGATIVE_CACHE_SECONDS = float(os.getenv("R2_NEGATIVE_CACHE_SECONDS", "15"))
+
+# Uploads are spooled to disk here before extraction (defaults to the system temp dir)
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+# Chunk analysis result cache (content-addressed, local disk LRU + shared R2 tier)
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", ".cache/analysis")
+ANALYSIS_CACHE_MAX_MB = int(os.getenv("ANALYSIS_CACHE_MAX_MB", "512"))
+ANALYSIS_CACHE_REMOTE = os.getenv("ANALYSIS_CACHE_REMOTE", "true").lower() == "true"
+
+# Running analyses heartbeat their job record; records older than the stale age are resumed elsewhere
+ANALYSIS_JOB_HEARTBEAT_SECONDS = float(os.getenv("ANALYSIS_JOB_HEARTBEAT_SECONDS", "60"))
+ANALYSIS_JOB_STALE_SECONDS = float(os.getenv("ANALYSIS_JOB_STALE_SECONDS", "180"))
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_JOB_MAX_ATTEMPTS", "3"))
+# A cancel can reach another process (web node or worker); running sources check for it this often
+SOURCE_CANCEL_POLL_SECONDS = float(os.getenv("SOURCE_CANCEL_POLL_SECONDS", "10"))
+
+# Background job queue: "inline" runs extraction/analysis in the web process,
+# "postgres" (SQL_schemas/job_queue_schema.sql) or "sqlite" (local runs) hands them to `python worker.py`
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "inline").lower()
+JOB_QUEUE_SQLITE_PATH = os.getenv("JOB_QUEUE_SQLITE_PATH", ".cache/job_queue.sqlite3")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_VISIBILITY_TIMEOUT_SECONDS = float(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "300"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "900"))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
 
 # Memory Tree feature flag
 MEMORY_TREE_ENABLED = os.getenv("MEMORY_TREE_ENABLED", "false").lower() == "true"
+# Tree nodes are merged in memory and written back in bulk every N chunks
+MEMORY_TREE_FLUSH_EVERY = int(os.getenv("MEMORY_TREE_FLUSH_EVERY", "10"))
+
+# Chunking budget (tokens per chunk and tokens shared between consecutive chunks)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "100000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "5000"))
+
+# Token budgets of the reduced pack exports (complete is never reduced)
+EXPORT_STANDARD_TOKENS = int(os.getenv("EXPORT_STANDARD_TOKENS", "100000"))
+EXPORT_COMPACT_TOKENS = int(os.getenv("EXPORT_COMPACT_TOKENS", "60000"))
+# How long a replaced export version stays downloadable (running and resumed downloads)
+EXPORT_RETENTION_SECONDS = float(os.getenv("EXPORT_RETENTION_SECONDS", "3600"))
+
+# CPU worker pool for extraction/chunking (0 = run in threads instead)
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+CPU_POOL_MAX_TASKS_PER_CHILD = int(os.getenv("CPU_POOL_MAX_TASKS_PER_CHILD", "10"))
+
+# PDF extraction: pages per worker task, and fail-fast limits for pathological files
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "20"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "3000"))
+PDF_TIME_BUDGET_SECONDS = int(os.getenv("PDF_TIME_BUDGET_SECONDS", "600"))
+
+# Progress streaming: optional Redis fan-out across workers, DB re-check interval for SSE streams
+REDIS_URL = os.getenv("REDIS_URL") or None
+PROGRESS_FALLBACK_POLL_SECONDS = float(os.getenv("PROGRESS_FALLBACK_POLL_SECONDS", "15"))
+# Minimum gap between progress-only status writes per source (status changes are written immediately)
+STATUS_WRITE_INTERVAL_MS = int(os.getenv("STATUS_WRITE_INTERVAL_MS", "1000"))
+
+# In-memory job state (progress, cancellation, rate limits): expiry, size cap and sweep interval
+JOB_STATE_TTL_SECONDS = int(os.getenv("JOB_STATE_TTL_SECONDS", str(6 * 3600)))
+JOB_STATE_MAX_JOBS = int(os.getenv("JOB_STATE_MAX_JOBS", "10000"))
+STATE_SWEEP_INTERVAL_SECONDS = int(os.getenv("STATE_SWEEP_INTERVAL_SECONDS", "300"))
 
 # Concurrent processing configuration
 MAX_CONCURRENT_CHUNKS = int(os.getenv("OPENAI_MAX_CONCURRENT_REQUESTS", "5"))
+# Upper bound the adaptive OpenAI window may grow to when no rate limits are hit
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", str(MAX_CONCURRENT_CHUNKS * 4)))
+# Organisation limits (learned from x-ratelimit-* headers when unset) and attempts per OpenAI call
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "0")) or None
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0")) or None
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+# Shared AsyncOpenAI connection pool (keep-alive connections reused across jobs) and per-phase timeouts
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", str(OPENAI_MAX_CONCURRENCY * 2)))
+OPENAI_KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "90"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "10"))
+OPENAI_ANALYSIS_TIMEOUT_SECONDS = float(os.getenv("OPENAI_ANALYSIS_TIMEOUT_SECONDS", "180"))
+OPENAI_TREE_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TREE_TIMEOUT_SECONDS", "90"))
+# Optional OpenAI Batch API path for large sources (cheaper, off the live rate limits, results within 24h)
+OPENAI_BATCH_ENABLED = os.getenv("OPENAI_BATCH_ENABLED", "false").lower() == "true"
+OPENAI_BATCH_MIN_CHUNKS = int(os.getenv("OPENAI_BATCH_MIN_CHUNKS", "50"))
+OPENAI_BATCH_POLL_SECONDS = float(os.getenv("OPENAI_BATCH_POLL_SECONDS", "30"))
+OPENAI_BATCH_BASE_URL = os.getenv("OPENAI_BATCH_BASE_URL", "https://api.openai.com/v1")
+# Batch requests are billed at this fraction of the synchronous price
+OPENAI_BATCH_PRICE_FACTOR = float(os.getenv("OPENAI_BATCH_PRICE_FACTOR", "0.5"))
 
 if MEMORY_TREE_ENABLED and MEMORY_TREE_AVAILABLE:
     print("🌳 Memory Tree ENABLED - will populate knowledge graph during analysis")
@@ -110,28 +225,199 @@ elif MEMORY_TREE_ENABLED:
 else:
     print("📝 Memory Tree DISABLED - using text-only mode")
 
-print(f"⚡ Concurrent chunk processing: {MAX_CONCURRENT_CHUNKS} chunks at a time")
+print(f"⚡ Concurrent chunk processing: {MAX_CONCURRENT_CHUNKS} chunks at a time (adaptive, up to {OPENAI_MAX_CONCURRENCY})")
 
-# Create a properly configured requests session with SSL verification
-r2_session = requests.Session()
-r2_session.verify = certifi.where()  # Use Mozilla's certificate bundle
+# Process-wide OpenAI scheduler: sliding window of in-flight requests shared by all users,
+# fair round-robin between users, window adapts to 429s and rate-limit headers
+openai_scheduler = OpenAIScheduler(
+    initial_concurrency=MAX_CONCURRENT_CHUNKS,
+    max_concurrency=OPENAI_MAX_CONCURRENCY
+)
+
+# Tokens/requests-per-minute budget: each call reserves its estimated cost before it is sent
+openai_limiter = OpenAIRateLimiter(
+    tokens_per_minute=OPENAI_TOKENS_PER_MINUTE,
+    requests_per_minute=OPENAI_REQUESTS_PER_MINUTE
+)
+
+# Process pool for CPU-bound extraction/chunking (started on first use, spawn workers)
+cpu_pool = CpuPool(max_workers=CPU_POOL_WORKERS, max_tasks_per_child=CPU_POOL_MAX_TASKS_PER_CHILD)
+
+# Source progress pub/sub: status writes publish here, SSE streams wait on it instead of polling
+progress_bus = ProgressBus(redis_url=REDIS_URL)
+
+# Coalescing update_source_status writer: one write per status change, progress debounced
+status_writer = StatusWriter(
+    lambda params: db.update_source_status(params),
+    min_interval=STATUS_WRITE_INTERVAL_MS / 1000
+)
+
+# Shared R2 client: pooled connections with SSL verification, cached signing key
+r2_client = R2Client(
+    endpoint=R2_ENDPOINT,
+    bucket=R2_BUCKET,
+    access_key=R2_ACCESS_KEY,
+    secret_key=R2_SECRET_KEY,
+    pool_size=R2_POOL_SIZE,
+    max_workers=R2_BATCH_WORKERS,
+    verify=certifi.where()  # Use Mozilla's certificate bundle
+)
 print(f"🔒 SSL verification enabled using certificates from: {certifi.where()}")
 
+# Finds which legacy user directory layout holds a job file (concurrent HEADs, layout + negative cache)
+key_resolver = KeyResolver(
+    r2_client.head,
+    negative_ttl_seconds=R2_NEGATIVE_CACHE_SECONDS,
+    max_workers=R2_BATCH_WORKERS
+)
+
+# Chunk analysis cache (skips OpenAI calls for chunks analyzed before with the same prompts)
+analysis_cache = None
+if ANALYSIS_CACHE_ENABLED:
+    try:
+        use_remote_cache = ANALYSIS_CACHE_REMOTE and bool(R2_ENDPOINT and R2_BUCKET)
+        analysis_cache = AnalysisCache(
+            local_dir=ANALYSIS_CACHE_DIR,
+            max_local_bytes=ANALYSIS_CACHE_MAX_MB * 1024 * 1024,
+            remote_get=r2_client.get if use_remote_cache else None,
+            remote_put=(lambda key, data: r2_client.put(key, data, content_type="application/json")) if use_remote_cache else None
+        )
+        print(f"🗃️ Analysis cache enabled ({ANALYSIS_CACHE_DIR}, {ANALYSIS_CACHE_MAX_MB} MB local{', R2 shared tier' if use_remote_cache else ''})")
+    except Exception as e:
+        print(f"⚠️ Analysis cache disabled: {e}")
+
+# Versioned pack exports stored in R2 (regenerated when a pack's exported sources change)
+pack_exporter = PackExporter(
+    upload=lambda key, text: upload_to_r2(key, text),
+    download=lambda key: download_from_r2(key, silent_404=True),
+    download_many=lambda keys: download_many_from_r2(keys),
+    delete_many=r2_client.delete_many,
+    run_cpu=cpu_pool.run,
+    budgets={"compact": EXPORT_COMPACT_TOKENS, "standard": EXPORT_STANDARD_TOKENS},
+    retention_seconds=EXPORT_RETENTION_SECONDS
+)
+
+# Large analyses and tree builds go through the OpenAI Batch API when enabled (batch ids kept in R2)
+openai_batch = None
+if OPENAI_BATCH_ENABLED and OPENAI_API_KEY:
+    openai_batch = BatchRunner(
+        HttpBatchTransport(OPENAI_API_KEY, base_url=OPENAI_BATCH_BASE_URL),
+        put_state=lambda key, text: upload_to_r2(key, text),
+        get_state=lambda key: download_from_r2(key, silent_404=True),
+        delete_state=lambda key: delete_from_r2(key),
+        poll_interval_seconds=OPENAI_BATCH_POLL_SECONDS
+    )
+    print(f"📦 OpenAI Batch API enabled for sources with {OPENAI_BATCH_MIN_CHUNKS}+ chunks")
+
+# Durable records of running analyses (resumed by another process if their owner dies)
+analysis_jobs = AnalysisJobRegistry(
+    put=lambda key, text: upload_to_r2(key, text),
+    get=lambda key: download_from_r2(key, silent_404=True),
+    list_keys=lambda prefix: list_r2_objects(prefix),
+    delete=lambda key: delete_from_r2(key),
+    stale_after_seconds=ANALYSIS_JOB_STALE_SECONDS
+)
+# Analysis tasks of this process, cancelled on shutdown so their job records stay resumable
+running_analyses: set = set()
 
 
 # Initialize Supabase client
 if SUPABASE_URL and SUPABASE_SERVICE_KEY:
     supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    # Async PostgREST client used by request handlers (the sync client stays for auth and thread-bound code)
+    db = AsyncSupabase(
+        SUPABASE_URL,
+        SUPABASE_SERVICE_KEY,
+        max_connections=SUPABASE_MAX_CONNECTIONS,
+        cache=MetadataCache(ttl_seconds=METADATA_CACHE_TTL_SECONDS)
+    )
     print(f"✅ Supabase client initialized with service role key (length: {len(SUPABASE_SERVICE_KEY)})")
     print(f"   Service key starts with: {SUPABASE_SERVICE_KEY[:20]}...")
 else:
     print("Warning: Supabase credentials not found. Running in legacy mode.")
     supabase = None
+    db = None
+
+job_queue = create_job_queue(
+    JOB_QUEUE_BACKEND,
+    db=db,
+    sqlite_path=JOB_QUEUE_SQLITE_PATH,
+    backoff_base_seconds=JOB_RETRY_BASE_SECONDS,
+    backoff_max_seconds=JOB_RETRY_MAX_SECONDS
+)
+if job_queue is not None:
+    print(f"📬 Background jobs go through the {job_queue.name} job queue (run `python worker.py`)")
 
 from contextlib import asynccontextmanager
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 
+async def sweep_state_periodically():
+    """Drop expired job state and rate-limit entries every STATE_SWEEP_INTERVAL_SECONDS."""
+    while True:
+        await asyncio.sleep(STATE_SWEEP_INTERVAL_SECONDS)
+        try:
+            expired_jobs = job_store.sweep()
+            expired_limits = rate_limit_attempts.sweep()
+            if expired_jobs or expired_limits:
+                print(f"🧹 Swept {expired_jobs} expired jobs and {expired_limits} rate-limit entries")
+        except Exception as e:
+            print(f"⚠️ State sweep failed: {e}")
+
+def start_analysis_task(**kwargs) -> asyncio.Task:
+    """Run analyze_source_chunks in the background, tracked for shutdown."""
+    task = asyncio.create_task(analyze_source_chunks(**kwargs))
+    running_analyses.add(task)
+    task.add_done_callback(running_analyses.discard)
+    return task
+
+async def resume_analysis_job(record: Dict[str, Any]):
+    """Restart a claimed analysis whose previous owner died; checkpointed chunks are not re-sent."""
+    source_id = record["source_id"]
+    user = AuthenticatedUser(record["user_id"], record.get("email"), record["r2_directory"])
+    result = await db.get_source_status_v2(user.user_id, source_id)
+    status = result.data.get("status") if isinstance(result.data, dict) else None
+    if status != "analyzing":
+        # Finished, failed or deleted since the record was written
+        await asyncio.to_thread(analysis_jobs.finish, source_id)
+        return
+    
+    attempts = int(record.get("attempts", 1))
+    if attempts > ANALYSIS_JOB_MAX_ATTEMPTS:
+        print(f"❌ Giving up on source {source_id} after {attempts - 1} interrupted attempts")
+        await set_source_status({
+            "user_uuid": user.user_id,
+            "target_source_id": source_id,
+            "status_param": "failed",
+            "error_message_param": "Analysis was interrupted repeatedly. Please retry."
+        })
+        await asyncio.to_thread(analysis_jobs.finish, source_id)
+        return
+    
+    print(f"♻️ Resuming interrupted analysis of source {source_id} (attempt {attempts})")
+    start_analysis_task(
+        pack_id=record["pack_id"],
+        source_id=source_id,
+        filename=record["filename"],
+        user=user,
+        max_chunks=record.get("max_chunks"),
+        custom_system_prompt=record.get("custom_system_prompt")
+    )
+
+async def maintain_analysis_jobs():
+    """Heartbeat this process's analyses and resume stale ones (the first pass runs at startup)."""
+    while True:
+        try:
+            await asyncio.to_thread(analysis_jobs.heartbeat_all)
+            for record in await asyncio.to_thread(analysis_jobs.claim_stale):
+                try:
+                    await resume_analysis_job(record)
+                except Exception as e:
+                    print(f"⚠️ Could not resume analysis of source {record.get('source_id')}: {e}")
+        except Exception as e:
+            print(f"⚠️ Analysis job maintenance failed: {e}")
+        await asyncio.sleep(ANALYSIS_JOB_HEARTBEAT_SECONDS)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Increase the default thread pool size to prevent starvation 
@@ -140,8 +426,35 @@ async def lifespan(app: FastAPI):
     executor = ThreadPoolExecutor(max_workers=50)
     loop.set_default_executor(executor)
     print("🚀 Configured asyncio default executor with 50 workers")
+    await progress_bus.start()
+    if OPENAI_API_KEY:
+        get_openai_client()
+    sweeper = asyncio.create_task(sweep_state_periodically())
+    # With a job queue, lease expiry already re-runs analyses whose worker died
+    job_maintainer = asyncio.create_task(maintain_analysis_jobs()) if db is not None and job_queue is None else None
     yield
+    sweeper.cancel()
+    if job_maintainer is not None:
+        job_maintainer.cancel()
+    # Interrupt running analyses before their clients close; their job records and
+    # checkpoints stay behind, so the next process resumes them
+    for task in list(running_analyses):
+        task.cancel()
+    if running_analyses:
+        await asyncio.gather(*running_analyses, return_exceptions=True)
+    await close_openai_client()
+    if openai_batch is not None:
+        await openai_batch.close()
+    await status_writer.flush_all()
+    await progress_bus.stop()
+    if job_queue is not None:
+        await job_queue.close()
+    if db is not None:
+        await db.aclose()
     executor.shutdown(wait=False)
+    cpu_pool.shutdown()
+    key_resolver.close()
+    r2_client.close()
 
 app = FastAPI(title="Simple UCP Backend", version="1.0.0", lifespan=lifespan)
 
@@ -167,30 +480,14 @@ app.add_middleware(
 
 # Authentication
 security = HTTPBearer()
+jwt_cache = TokenCache(max_entries=JWT_CACHE_SIZE, max_ttl_seconds=JWT_CACHE_MAX_TTL_SECONDS)
 
-# Rate limiting storage (in production, use Redis)
-payment_attempts = defaultdict(list)
-analysis_attempts = defaultdict(list)
+# Rate limiting storage (per process; idle users are swept after a day)
+rate_limit_attempts = AttemptLog(ttl_seconds=24 * 3600, max_keys=JOB_STATE_MAX_JOBS)
 
 def check_rate_limit(user_id: str, limit_type: str = "payment", max_attempts: int = 5, window_hours: int = 1):
     """Check if user has exceeded rate limit"""
-    now = datetime.utcnow()
-    window_start = now - timedelta(hours=window_hours)
-    
-    # Choose the right storage
-    attempts_storage = payment_attempts if limit_type == "payment" else analysis_attempts
-    
-    # Clean old attempts
-    user_attempts = [attempt for attempt in attempts_storage[user_id] if attempt > window_start]
-    attempts_storage[user_id] = user_attempts
-    
-    # Check if limit exceeded
-    if len(user_attempts) >= max_attempts:
-        return False, len(user_attempts)
-    
-    # Add current attempt
-    attempts_storage[user_id].append(now)
-    return True, len(user_attempts) + 1
+    return rate_limit_attempts.try_acquire((limit_type, user_id), max_attempts, window_hours * 3600)
 
 # Email notification service
 async def send_email_notification(user_email: str, job_id: str, chunks_processed: int, total_chunks: int, pack_id: str = None, success: bool = True):
@@ -482,27 +779,217 @@ class AuthenticatedUser:
         self.email = email
         self.r2_directory = r2_directory
 
+# Background job kinds (job_queue.py) and their priorities: extraction is short and
+# the user is waiting for it, so it goes ahead of queued analyses
+JOB_EXTRACT_SOURCE = "extract_source"
+JOB_IMPORT_URL = "import_conversation_url"
+JOB_ANALYZE_SOURCE = "analyze_source"
+JOB_PRIORITIES = {JOB_EXTRACT_SOURCE: 10, JOB_IMPORT_URL: 10, JOB_ANALYZE_SOURCE: 0}
+
+def user_payload(user: AuthenticatedUser) -> Dict[str, Any]:
+    return {"user_id": user.user_id, "email": user.email, "r2_directory": user.r2_directory}
+
+def user_from_payload(payload: Dict[str, Any]) -> AuthenticatedUser:
+    return AuthenticatedUser(payload["user_id"], payload.get("email"), payload["r2_directory"])
+
+async def dispatch_job(kind: str, payload: Dict[str, Any]):
+    """Run a background job: enqueued for a worker when a queue is configured, otherwise as a task here."""
+    if job_queue is None:
+        if kind == JOB_ANALYZE_SOURCE:
+            start_analysis_task(**analysis_job_arguments(payload))
+        else:
+            asyncio.create_task(run_job(kind, payload))
+        return
+    job_id = await job_queue.enqueue(kind, payload, priority=JOB_PRIORITIES.get(kind, 0), max_attempts=JOB_MAX_ATTEMPTS)
+    print(f"📬 Queued {kind} job {job_id} for source {payload.get('source_id')}")
+
+def analysis_job_arguments(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "pack_id": payload["pack_id"],
+        "source_id": payload["source_id"],
+        "filename": payload["filename"],
+        "user": user_from_payload(payload),
+        "max_chunks": payload.get("max_chunks"),
+        "custom_system_prompt": payload.get("custom_system_prompt")
+    }
+
+async def run_job(kind: str, payload: Dict[str, Any], queued: bool = False):
+    """
+    Execute one background job (called by worker.py, or directly in inline mode).
+    
+    Args:
+        queued: Leased from job_queue. Failures are raised for the queue to retry
+            instead of failing the source; job_gave_up fails it after the last attempt.
+    """
+    if kind == JOB_EXTRACT_SOURCE:
+        await run_extraction_job(payload, queued=queued)
+    elif kind == JOB_IMPORT_URL:
+        await process_conversation_url_for_pack(
+            pack_id=payload["pack_id"],
+            source_id=payload["source_id"],
+            url=payload["url"],
+            platform=payload.get("platform", "ChatGPT"),
+            user=user_from_payload(payload),
+            queued=queued
+        )
+    elif kind == JOB_ANALYZE_SOURCE:
+        await analyze_source_chunks(**analysis_job_arguments(payload), queued=queued)
+    else:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+async def job_gave_up(kind: str, payload: Dict[str, Any], error: str):
+    """A job ran out of attempts: drop its staged input and fail its source so it does not stay in progress forever."""
+    discard_spooled_file(payload.get("file_path"))
+    if payload.get("input_key"):
+        await asyncio.to_thread(r2_client.delete, payload["input_key"])
+    if db is None or not payload.get("source_id"):
+        return
+    await set_source_status({
+        "user_uuid": payload["user_id"],
+        "target_source_id": payload["source_id"],
+        "status_param": "failed",
+        "error_message_param": f"Processing failed after {JOB_MAX_ATTEMPTS} attempts: {error}"
+    })
+
+def stage_job_input(key: str, file_content: Optional[str], file_path: Optional[str]) -> bool:
+    """Upload a job's input (spooled file or text) to R2 so a worker on another machine can read it."""
+    if file_path is None:
+        return r2_client.put(key, (file_content or "").encode("utf-8"), content_type="application/octet-stream")
+    if os.path.getsize(file_path) > R2_MULTIPART_THRESHOLD_MB * 1024 * 1024:
+        return r2_client.multipart_upload(
+            key,
+            iter_file_pieces(file_path, R2_MULTIPART_PART_SIZE_MB * 1024 * 1024),
+            content_type="application/octet-stream"
+        )
+    with open(file_path, "rb") as f:
+        return r2_client.put(key, f.read(), content_type="application/octet-stream")
+
+async def submit_extraction(pack_id: str, source_id: str, filename: str, user: AuthenticatedUser,
+                            file_content: Optional[str] = None, file_path: Optional[str] = None):
+    """
+    Start extract_and_chunk_source for a new source.
+    
+    Takes ownership of file_path. With a job queue, the input is handed to the
+    worker by path (sqlite: same machine) or staged in R2 (postgres).
+    """
+    if job_queue is None:
+        asyncio.create_task(extract_and_chunk_source(
+            pack_id=pack_id,
+            source_id=source_id,
+            file_content=file_content,
+            filename=filename,
+            user=user,
+            file_path=file_path
+        ))
+        return
+    
+    payload = {"pack_id": pack_id, "source_id": source_id, "filename": filename, **user_payload(user)}
+    suffix = os.path.splitext(filename)[1]
+    try:
+        if job_queue.name == "sqlite":
+            if file_path is None:
+                spooled = await asyncio.to_thread(spool_pieces, [(file_content or "").encode("utf-8")], suffix, UPLOAD_SPOOL_DIR)
+                file_path = spooled.path
+            payload["file_path"] = file_path
+        else:
+            input_key = f"{user.r2_directory}/{pack_id}/{source_id}/input{suffix}"
+            if not await asyncio.to_thread(stage_job_input, input_key, file_content, file_path):
+                raise Exception("Could not stage the upload for processing")
+            discard_spooled_file(file_path)
+            payload["input_key"] = input_key
+        await dispatch_job(JOB_EXTRACT_SOURCE, payload)
+    except Exception as e:
+        print(f"❌ Could not queue extraction of source {source_id}: {e}")
+        discard_spooled_file(file_path)
+        await set_source_status({
+            "user_uuid": user.user_id,
+            "target_source_id": source_id,
+            "status_param": "failed",
+            "error_message_param": "Could not start processing. Please try again."
+        })
+
+async def run_extraction_job(payload: Dict[str, Any], queued: bool = False):
+    """
+    Extraction job: fetch the staged input if it is in R2, then extract and chunk.
+    
+    The staged input (spooled file or R2 object) is only removed once extraction
+    succeeded, so a retried attempt can read it again (job_gave_up removes it
+    when the job is dead).
+    """
+    input_key = payload.get("input_key")
+    file_path = payload.get("file_path")
+    local_copy = None
+    if input_key:
+        suffix = os.path.splitext(payload["filename"])[1]
+        spooled = await asyncio.to_thread(
+            lambda: spool_pieces(r2_client.iter_object(input_key, chunk_size=1024 * 1024), suffix, UPLOAD_SPOOL_DIR)
+        )
+        file_path = local_copy = spooled.path
+    try:
+        await extract_and_chunk_source(
+            pack_id=payload["pack_id"],
+            source_id=payload["source_id"],
+            file_content=None,
+            filename=payload["filename"],
+            user=user_from_payload(payload),
+            file_path=file_path,
+            queued=queued
+        )
+    finally:
+        discard_spooled_file(local_copy)
+    if input_key:
+        await asyncio.to_thread(r2_client.delete, input_key)
+    else:
+        discard_spooled_file(file_path)
+
 # Job logging helper
-# In-memory progress tracking for real-time updates
-job_progress = {}
-job_progress_history = {}  # Track all progress messages
-active_streams = {}  # Track active progress streams
+# In-memory progress tracking for real-time updates (TTL + LRU bounded, swept in lifespan)
+job_store = JobStore(ttl_seconds=JOB_STATE_TTL_SECONDS, max_jobs=JOB_STATE_MAX_JOBS)
+
+# Global job cancellation tracking (job and source ids; set-like view over job_store)
+cancelled_jobs = job_store.cancelled
+
+# Cancellation across processes: cancel_source_analysis also leaves a marker object in the
+# source's R2 directory (deleted with the source), and whichever process runs the source
+# (this one, another web node resuming it, or a queue worker) polls it into its own cancelled_jobs
+def cancel_marker_key(r2_directory: str, pack_id: str, source_id: str) -> str:
+    return f"{r2_directory}/{pack_id}/{source_id}/cancelled.json"
+
+async def source_cancelled(r2_directory: str, pack_id: str, source_id: str) -> bool:
+    """True once the source was cancelled from any process; also flags it in cancelled_jobs."""
+    if source_id in cancelled_jobs:
+        return True
+    try:
+        marked = await asyncio.to_thread(r2_client.head, cancel_marker_key(r2_directory, pack_id, source_id)) is not None
+    except Exception as e:
+        print(f"⚠️ Could not check cancellation of source {source_id}: {e}")
+        return False
+    if marked:
+        cancelled_jobs.add(source_id)
+    return marked
+
+async def watch_cancellation(r2_directory: str, pack_id: str, source_id: str):
+    """Poll for a cancel of a running source, so the cancelled_jobs checks also see cancels made elsewhere."""
+    while not await source_cancelled(r2_directory, pack_id, source_id):
+        await asyncio.sleep(SOURCE_CANCEL_POLL_SECONDS)
+
+async def job_cancelled(payload: Dict[str, Any]) -> bool:
+    """Whether the source a queued job works on was cancelled (checked by worker.py)."""
+    if not payload.get("source_id") or not payload.get("pack_id"):
+        return False
+    return await source_cancelled(payload["r2_directory"], payload["pack_id"], payload["source_id"])
 
 # Real-time streaming generator
 async def progress_stream_generator(job_id: str):
     """Generate progress updates in real-time for a specific job"""
 
     
-    # Initialize if not exists
-    if job_id not in job_progress_history:
-        job_progress_history[job_id] = []
-    
     last_sent_count = 0
     
     while True:
         try:
             # Check if we have new progress updates
-            current_history = job_progress_history.get(job_id, [])
+            current_history = job_store.history(job_id)
             
             # Send any new progress updates immediately
             if len(current_history) > last_sent_count:
@@ -514,7 +1001,7 @@ async def progress_stream_generator(job_id: str):
                 last_sent_count = len(current_history)
             
             # Check if job is complete
-            job_status = job_progress.get(job_id, {})
+            job_status = job_store.progress(job_id) or {}
             if job_status.get('status') == 'completed' or job_status.get('status') == 'error':
 
                 yield f"data: {json.dumps({'type': 'complete', 'status': job_status.get('status')})}\n\n"
@@ -542,23 +1029,14 @@ def update_job_progress(job_id: str, step: str, progress: int, message: str, cur
         "last_updated": datetime.utcnow().timestamp()
     }
     
-    job_progress[job_id] = progress_entry
-    
-    # Also add to history for real-time streaming
-    if job_id not in job_progress_history:
-        job_progress_history[job_id] = []
-    
-    job_progress_history[job_id].append(progress_entry)
-    
-    # Keep only last 50 progress entries to prevent memory bloat
-    if len(job_progress_history[job_id]) > 50:
-        job_progress_history[job_id] = job_progress_history[job_id][-50:]
+    # Latest entry plus the last 50 entries of history for real-time streaming
+    job_store.update_progress(job_id, progress_entry)
     
 
 
 def get_job_progress(job_id: str):
     """Get current job progress"""
-    return job_progress.get(job_id, {
+    return job_store.progress(job_id) or {
         "step": "unknown",
         "progress": 0,
         "message": "No progress available",
@@ -566,7 +1044,7 @@ def get_job_progress(job_id: str):
         "total_chunks": None,
         "timestamp": datetime.utcnow().isoformat(),
         "last_updated": datetime.utcnow().timestamp()
-    })
+    }
 
 
 async def get_user_payment_status(user_id: str) -> dict:
@@ -577,22 +1055,22 @@ async def get_user_payment_status(user_id: str) -> dict:
     
     try:
         # Get user payment status using database function
-        result = supabase.rpc("get_user_payment_status", {"user_uuid": user_id}).execute()
+        result = await db.rpc("get_user_payment_status", {"user_uuid": user_id}).execute()
         if result.data:
             return result.data
         else:
             # Fallback to manual calculation
-            profile_result = supabase.rpc("get_user_profile_for_backend", {"user_uuid": user_id}).execute()
+            profile_result = await db.rpc("get_user_profile_for_backend", {"user_uuid": user_id}).execute()
             if not profile_result.data:
                 # Create profile if it doesn't exist
-                create_result = supabase.rpc("create_user_profile_for_backend", {
+                create_result = await db.rpc("create_user_profile_for_backend", {
                     "user_uuid": user_id,
                     "user_email": "unknown@example.com",  # We don't have email here
                     "r2_dir": f"user_{user_id}"
                 }).execute()
                 
             # Get profile data directly
-            profile = supabase.table('user_profiles').select('*').eq('id', user_id).execute()
+            profile = await db.table('user_profiles').select('*').eq('id', user_id).execute()
             if profile.data and len(profile.data) > 0:
                 user_data = profile.data[0]
                 return {
@@ -625,22 +1103,18 @@ async def ensure_user_profile_exists(user_id: str, email: str) -> str:
     try:
         # Quick check if profile exists
         import asyncio
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("get_user_profile_for_backend", {"user_uuid": user_id}).execute()
-        )
+        result = await db.rpc("get_user_profile_for_backend", {"user_uuid": user_id}).execute()
         
         if result.data:
             return result.data.get("r2_user_directory", f"user_{user_id}")
         
         # Profile doesn't exist, create it
         r2_directory = f"user_{user_id}"
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("create_user_profile_for_backend", {
-                "user_uuid": user_id,
-                "user_email": email,
-                "r2_dir": r2_directory
-            }).execute()
-        )
+        result = await db.rpc("create_user_profile_for_backend", {
+            "user_uuid": user_id,
+            "user_email": email,
+            "r2_dir": r2_directory
+        }).execute()
         
         if result.data:
             return result.data.get("r2_user_directory", r2_directory)
@@ -661,23 +1135,27 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if not SUPABASE_JWT_SECRET:
             raise HTTPException(status_code=500, detail="JWT secret not configured")
         
-        try:
-            # First try with full verification
-            payload = jwt.decode(
-                token, 
-                SUPABASE_JWT_SECRET, 
-                algorithms=["HS256"],
-                audience="authenticated",
-                options={"verify_aud": True, "verify_signature": True}
-            )
-        except jwt.InvalidAudienceError:
-            # Try without audience verification but keep signature verification
-            payload = jwt.decode(
-                token, 
-                SUPABASE_JWT_SECRET, 
-                algorithms=["HS256"],
-                options={"verify_aud": False, "verify_signature": True}
-            )
+        # Tokens verified before skip the signature check until they (or the cache entry) expire
+        payload = jwt_cache.get(token)
+        if payload is None:
+            try:
+                # First try with full verification
+                payload = jwt.decode(
+                    token, 
+                    SUPABASE_JWT_SECRET, 
+                    algorithms=["HS256"],
+                    audience="authenticated",
+                    options={"verify_aud": True, "verify_signature": True}
+                )
+            except jwt.InvalidAudienceError:
+                # Try without audience verification but keep signature verification
+                payload = jwt.decode(
+                    token, 
+                    SUPABASE_JWT_SECRET, 
+                    algorithms=["HS256"],
+                    options={"verify_aud": False, "verify_signature": True}
+                )
+            jwt_cache.put(token, payload)
         
         user_id = payload.get("sub")
         email = payload.get("email")
@@ -716,7 +1194,7 @@ async def update_job_status_in_db(user: AuthenticatedUser, job_id: str, status:
 
     try:
         # First, let's check if the job exists using our backend function
-        job_check_result = supabase.rpc("check_job_exists_for_backend", {
+        job_check_result = await db.rpc("check_job_exists_for_backend", {
             "user_uuid": user.user_id,
             "target_job_id": job_id
         }).execute()
@@ -741,7 +1219,7 @@ async def update_job_status_in_db(user: AuthenticatedUser, job_id: str, status:
             total_cost = metadata.get("total_cost")
         
         # Use enhanced backend function to update job status with costs
-        result = supabase.rpc("update_job_status_with_costs_for_backend", {
+        result = await db.rpc("update_job_status_with_costs_for_backend", {
             "user_uuid": user.user_id,
             "target_job_id": job_id,
             "status_param": status,
@@ -765,42 +1243,89 @@ async def update_job_status_in_db(user: AuthenticatedUser, job_id: str, status:
 
 
 # Initialize clients
-# Default OpenAI client (fallback)
-default_openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 encoder = tiktoken.get_encoding("cl100k_base")
 
-def get_openai_client(api_key: str = None) -> OpenAI:
+# Shared OpenAI client: created in lifespan (or on first use), one keep-alive pool for every job
+openai_client: Optional[AsyncOpenAI] = None
+
+def openai_timeout(read_seconds: float) -> httpx.Timeout:
+    """Request timeout for one pipeline phase (connect and pool waits stay short)."""
+    return httpx.Timeout(read_seconds, connect=OPENAI_CONNECT_TIMEOUT_SECONDS, pool=OPENAI_CONNECT_TIMEOUT_SECONDS)
+
+OPENAI_ANALYSIS_TIMEOUT = openai_timeout(OPENAI_ANALYSIS_TIMEOUT_SECONDS)
+OPENAI_TREE_TIMEOUT = openai_timeout(OPENAI_TREE_TIMEOUT_SECONDS)
+
+def get_openai_client(api_key: str = None) -> AsyncOpenAI:
     """
-    Get OpenAI client - always uses server's API key now
+    Get the shared OpenAI client - always uses server's API key now
     """
-    # Always reload the current API key from environment
-    current_api_key = os.getenv("OPENAI_API_KEY")
+    global openai_client
+    if openai_client is not None:
+        return openai_client
     
+    current_api_key = os.getenv("OPENAI_API_KEY")
     if not current_api_key:
         print("❌ No OpenAI API key found in environment variables")
         raise HTTPException(status_code=500, detail="Server OpenAI API key not configured")
     
-    
     try:
-        return OpenAI(api_key=current_api_key)
+        openai_client = AsyncOpenAI(
+            api_key=current_api_key,
+            # openai_call_with_retry does the retrying (through the rate limiter)
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_SECONDS
+                ),
+                timeout=OPENAI_ANALYSIS_TIMEOUT
+            )
+        )
     except Exception as e:
         print(f"❌ Error creating OpenAI client: {e}")
         raise HTTPException(status_code=500, detail="Failed to initialize OpenAI client")
+    print(f"🔌 OpenAI client ready ({OPENAI_MAX_CONNECTIONS} pooled connections, {OPENAI_KEEPALIVE_SECONDS:.0f}s keep-alive)")
+    return openai_client
+
+async def close_openai_client():
+    global openai_client
+    if openai_client is not None:
+        client, openai_client = openai_client, None
+        await client.close()
 
-async def openai_call_with_retry(openai_client, max_retries=3, job_id=None, **kwargs):
+def _openai_retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after')) if headers.get('retry-after') else None
+    except (TypeError, ValueError):
+        return None
+
+async def openai_call_with_retry(openai_client, max_retries=OPENAI_MAX_RETRIES, job_id=None, user_id=None, estimated_input_tokens=None, **kwargs):
     """
-    Make OpenAI API calls with retry logic for connection issues and quota handling
+    Make OpenAI API calls with rate limiting and retry logic
+    
+    Every attempt holds a slot from the process-wide openai_scheduler (fair per user_id)
+    and reserves its estimated token cost from openai_limiter before it is sent.
+    429s (not quota), 5xx and connection errors are retried with jittered exponential
+    backoff (never sooner than Retry-After); quota, policy and context errors are not.
     Supports cancellation checking if job_id is provided
-    """
-    import time
-    import asyncio
-    from openai import OpenAI
     
+    Args:
+        estimated_input_tokens: Prompt size if already known (otherwise counted here)
+    """
     # Check for cancellation before starting
     if job_id and job_id in cancelled_jobs:
         print(f"🚫 OpenAI call cancelled before starting for job {job_id}")
         raise Exception(f"Job {job_id} was cancelled")
     
+    messages = kwargs.get("messages", [])
+    max_completion_tokens = kwargs.get("max_completion_tokens") or kwargs.get("max_tokens")
+    if estimated_input_tokens is None:
+        cost = await asyncio.to_thread(openai_limiter.estimate, messages, max_completion_tokens)
+    else:
+        cost = openai_limiter.estimate(messages, max_completion_tokens, input_tokens=estimated_input_tokens)
+    
     for attempt in range(max_retries):
         try:
             # Check for cancellation before each attempt
@@ -808,8 +1333,19 @@ async def openai_call_with_retry(openai_client, max_retries=3, job_id=None, **kw
                 print(f"🚫 OpenAI call cancelled during retry attempt {attempt + 1} for job {job_id}")
                 raise Exception(f"Job {job_id} was cancelled")
             
-            # Run the blocking OpenAI call in a thread pool to avoid blocking the event loop
-            response = await asyncio.to_thread(openai_client.chat.completions.create, **kwargs)
+            # Hold a scheduler slot only while the request waits for budget and is in flight
+            async with openai_scheduler.slot(user_id):
+                reservation = await openai_limiter.reserve(cost)
+                try:
+                    raw_response = await openai_client.chat.completions.with_raw_response.create(**kwargs)
+                except BaseException:
+                    openai_limiter.settle(reservation, 0)
+                    raise
+            openai_scheduler.observe_headers(raw_response.headers)
+            openai_limiter.observe_headers(raw_response.headers)
+            response = raw_response.parse()
+            usage = getattr(response, "usage", None)
+            openai_limiter.settle(reservation, (usage.prompt_tokens + usage.completion_tokens) if usage else cost)
             
             # Check for cancellation after call completes
             if job_id and job_id in cancelled_jobs:
@@ -825,43 +1361,51 @@ async def openai_call_with_retry(openai_client, max_retries=3, job_id=None, **kw
                 raise e
                 
             error_str = str(e).lower()
+            status_code = getattr(e, 'status_code', None)
             if attempt == 0:  # Only log on first attempt to reduce noise
                 print(f"❌ OpenAI API error on attempt {attempt + 1}: {e}")
                 print(f"🔍 Error type: {type(e).__name__}")
             
-            # Don't retry quota/billing errors - fail immediately
-            if any(term in error_str for term in ['quota', 'insufficient_quota', 'billing', 'plan']):
+            if status_code == 429 and 'insufficient_quota' not in error_str:
+                # Rate limited: shrink the shared window, pause new reservations, back off
+                retry_after = _openai_retry_after(e)
+                openai_scheduler.record_rate_limited(retry_after)
+                openai_limiter.throttled(retry_after)
+                wait_time = max(retry_after or 0.0, backoff_delay(attempt))
+                reason = f"rate limited (window now {openai_scheduler.limit})"
+            elif any(term in error_str for term in ['quota', 'insufficient_quota', 'billing', 'plan']):
+                # Don't retry quota/billing errors - fail immediately
                 print(f"💳 Quota/billing error detected - not retrying")
                 raise e
-            
-            # Don't retry content policy errors - fail immediately
-            if any(term in error_str for term in ['content_policy', 'policy', 'safety']):
+            elif any(term in error_str for term in ['content_policy', 'policy', 'safety']):
+                # Don't retry content policy errors - fail immediately
                 print(f"🚫 Content policy error detected - not retrying")
                 raise e
-            
-            # Don't retry context length errors - fail immediately  
-            if any(term in error_str for term in ['context_length', 'token limit', 'too long']):
+            elif any(term in error_str for term in ['context_length', 'token limit', 'too long']):
+                # Don't retry context length errors - fail immediately
                 print(f"📏 Context length error detected - not retrying")
                 raise e
-            
-            # Retry connection/network errors
-            if attempt < max_retries - 1 and any(term in error_str for term in [
-                'connection', 'timeout', 'network', 'ssl', 'socket', 'read timed out'
-            ]):
-                wait_time = (attempt + 1) * 2  # Exponential backoff: 2, 4, 6 seconds
-                print(f"🔄 Retrying in {wait_time} seconds due to connection error...")
-                
-                # Check for cancellation during wait
-                for i in range(wait_time):
-                    if job_id and job_id in cancelled_jobs:
-                        print(f"🚫 Job {job_id} cancelled during retry wait")
-                        raise Exception(f"Job {job_id} was cancelled")
-                    await asyncio.sleep(1)  # Sleep 1 second at a time to check cancellation
-                continue
+            elif (status_code is not None and status_code >= 500) or isinstance(e, (APIConnectionError, APITimeoutError)) or any(
+                term in error_str for term in ['connection', 'timeout', 'network', 'ssl', 'socket', 'read timed out']
+            ):
+                wait_time = backoff_delay(attempt)
+                reason = f"server error {status_code}" if status_code else "connection error"
             else:
-                # Re-raise the exception if it's not a connection issue or we've exceeded retries
-                print(f"❌ Not retrying - either not a connection error or max retries exceeded")
+                print(f"❌ Not retrying - {type(e).__name__} is not retryable")
+                raise e
+            
+            if attempt >= max_retries - 1:
+                print(f"❌ Giving up after {max_retries} attempts ({reason})")
                 raise e
+            print(f"🔄 Retrying in {wait_time:.1f}s: {reason}")
+            
+            # Check for cancellation during wait
+            deadline = time.monotonic() + wait_time
+            while (remaining := deadline - time.monotonic()) > 0:
+                if job_id and job_id in cancelled_jobs:
+                    print(f"🚫 Job {job_id} cancelled during retry wait")
+                    raise Exception(f"Job {job_id} was cancelled")
+                await asyncio.sleep(min(1.0, remaining))
     
     raise Exception(f"OpenAI API failed after {max_retries} attempts")
 
@@ -872,49 +1416,8 @@ import hmac
 from datetime import datetime
 
 def sign_aws_request(method, url, headers, payload, access_key, secret_key, region='auto'):
-    """Create AWS Signature Version 4 for R2"""
-    
-    # Parse URL
-    parsed_url = urlparse(url)
-    host = parsed_url.netloc
-    path = parsed_url.path or '/'
-    
-    # Create timestamp
-    t = datetime.utcnow()
-    datestamp = t.strftime('%Y%m%d')
-    timestamp = t.strftime('%Y%m%dT%H%M%SZ')
-    
-    # Step 1: Create canonical request
-    canonical_headers = f"host:{host}\nx-amz-content-sha256:{hashlib.sha256(payload.encode()).hexdigest()}\nx-amz-date:{timestamp}\n"
-    signed_headers = "host;x-amz-content-sha256;x-amz-date"
-    canonical_request = f"{method}\n{path}\n\n{canonical_headers}\n{signed_headers}\n{hashlib.sha256(payload.encode()).hexdigest()}"
-    
-    # Step 2: Create string to sign
-    algorithm = "AWS4-HMAC-SHA256"
-    credential_scope = f"{datestamp}/{region}/s3/aws4_request"
-    string_to_sign = f"{algorithm}\n{timestamp}\n{credential_scope}\n{hashlib.sha256(canonical_request.encode()).hexdigest()}"
-    
-    # Step 3: Calculate signature
-    def sign(key, msg):
-        return hmac.new(key, msg.encode(), hashlib.sha256).digest()
-    
-    signing_key = sign(f"AWS4{secret_key}".encode(), datestamp)
-    signing_key = sign(signing_key, region)
-    signing_key = sign(signing_key, "s3")
-    signing_key = sign(signing_key, "aws4_request")
-    
-    signature = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
-    
-    # Step 4: Add signing info to headers
-    authorization = f"{algorithm} Credential={access_key}/{credential_scope}, SignedHeaders={signed_headers}, Signature={signature}"
-    
-    headers.update({
-        'Authorization': authorization,
-        'x-amz-date': timestamp,
-        'x-amz-content-sha256': hashlib.sha256(payload.encode()).hexdigest()
-    })
-    
-    return headers
+    """Create AWS Signature Version 4 for R2 (signing key is cached per day)"""
+    return sign_request(method, url, headers, payload, access_key, secret_key, region)
 
 def calculate_upload_timeout(content_size_bytes: int) -> int:
     """Calculate dynamic timeout based on content size"""
@@ -938,23 +1441,13 @@ def upload_to_r2_direct(key: str, content: str, max_retries: int = 3):
     # Retry loop with exponential backoff
     for attempt in range(max_retries):
         try:
-            # Construct the URL
-            url = f"{R2_ENDPOINT}/{R2_BUCKET}/{key}"
-            
-            # Prepare headers
-            headers = {
-                'Content-Type': 'text/plain; charset=utf-8',
-                'Host': urlparse(R2_ENDPOINT).netloc
-            }
+            headers = {'Content-Type': 'text/plain; charset=utf-8'}
             
-            # Sign the request
-            headers = sign_aws_request('PUT', url, headers, content, R2_ACCESS_KEY, R2_SECRET_KEY)
-            
-            # Make the request with proper SSL verification and better Unicode handling
+            # Make the signed request over the pooled client with better Unicode handling
             try:
                 # Clean the content of any surrogate characters before encoding
                 clean_content = content_bytes.decode('utf-8')
-                response = r2_session.put(url, data=content_bytes, headers=headers, timeout=timeout)
+                response = r2_client.request('PUT', key, data=content_bytes, headers=headers, timeout=timeout)
             except requests.exceptions.SSLError as ssl_error:
                 print(f"❌ SSL verification failed for R2 upload: {ssl_error}")
                 print(f"❌ Cannot upload to R2 due to SSL issues")
@@ -966,7 +1459,7 @@ def upload_to_r2_direct(key: str, content: str, max_retries: int = 3):
                 clean_content = ''.join(char for char in content if unicodedata.category(char) != 'Cs')
                 content_bytes = clean_content.encode('utf-8')
                 try:
-                    response = r2_session.put(url, data=content_bytes, headers=headers, timeout=timeout)
+                    response = r2_client.request('PUT', key, data=content_bytes, headers=headers, timeout=timeout)
                 except requests.exceptions.SSLError as ssl_error:
                     print(f"❌ SSL verification failed on retry: {ssl_error}")
                     print(f"❌ Cannot upload to R2 due to SSL issues")
@@ -1017,9 +1510,6 @@ def upload_to_r2_direct(key: str, content: str, max_retries: int = 3):
     # Should not reach here, but return False as safety
     return False
 
-# Disable boto3 for now and use direct upload
-r2_client = None
-
 # Using local storage for now until R2 SSL issue is resolved
 
 
@@ -1030,6 +1520,7 @@ def upload_to_r2(key: str, content: str):
     success = upload_to_r2_direct(key, content)
     
     if success:
+        key_resolver.forget(key)
 
         return True
     else:
@@ -1039,22 +1530,9 @@ def upload_to_r2(key: str, content: str):
 def download_from_r2(key: str, silent_404: bool = False) -> str:
     """Download content from R2 bucket with proper SSL verification."""
     try:
-        # Try R2 first
-        url = f"{R2_ENDPOINT}/{R2_BUCKET}/{key}"
-        
-
-        
-        # Prepare headers for GET request
-        headers = {
-            'Host': urlparse(R2_ENDPOINT).netloc
-        }
-        
-        # Sign the request
-        headers = sign_aws_request('GET', url, headers, '', R2_ACCESS_KEY, R2_SECRET_KEY)
-        
-        # Make the request with proper SSL verification
+        # Try R2 first (signed request over the pooled client)
         try:
-            response = r2_session.get(url, headers=headers, timeout=30)
+            response = r2_client.request('GET', key, timeout=30)
         except requests.exceptions.SSLError as ssl_error:
             if not silent_404:
                 print(f"🔒 SSL verification failed for R2 download: {ssl_error}")
@@ -1120,40 +1598,62 @@ def download_from_r2(key: str, silent_404: bool = False) -> str:
                 print(f"Error downloading from local storage: {local_error}")
             return None
 
+def read_local_storage(key: str) -> Optional[str]:
+    """Read a file written to local storage while R2 was unreachable (None if absent)."""
+    try:
+        with open(f"local_storage/{key}", 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def get_r2_text(key: str) -> Tuple[Optional[str], bool]:
+    """
+    GET one object as text.
+
+    Returns:
+        (content, confirmed_missing) - content is None for missing or failed reads
+        and "" for an empty object; confirmed_missing is True only when R2 answered 404
+    """
+    try:
+        data = r2_client.get(key)
+    except Exception as e:
+        print(f"⚠️ R2 GET failed for {key}: {e}")
+        return None, False
+    if data is None:
+        return None, True
+    return data.decode('utf-8', errors='replace'), False
+
 def download_from_r2_with_fallback(primary_key: str, job_id: str, filename: str, silent_404: bool = False) -> str:
-    """Try to download from multiple possible paths based on different user directory formats."""
-    
-    # First try the primary key (current user directory)
-    content = download_from_r2(primary_key, silent_404=True)
-    if content:
-        if not silent_404:
-            print(f"✅ Found file at primary path: {primary_key}")
-        return content
-    
-    # Extract the user ID from the primary key if possible
-    import re
-    user_id_match = re.search(r'user_([a-f0-9-]{36})', primary_key)
-    if user_id_match:
-        user_id = user_id_match.group(1)
-        
-        # Try alternative path formats
-        alternative_paths = [
-            f"user_{user_id}/{job_id}/{filename}",
-            f"{user_id}/{job_id}/{filename}",
-            f"users/{user_id}/{job_id}/{filename}",
-            f"prod/{user_id}/{job_id}/{filename}",
-        ]
+    """
+    Download a job file from whichever user directory layout holds it.
+
+    The layout that last worked for the user directory is fetched directly.
+    Only on a miss are the remaining layouts probed, with concurrent HEADs
+    (see KeyResolver). Local storage is the last resort.
+    """
+    candidates = key_resolver.candidates(primary_key, job_id, filename)
+    if candidates:
+        _, key = candidates[0]
+        content, missing = get_r2_text(key)
+        if content:
+            key_resolver.remember(primary_key, job_id, filename, key)
+            return content
+        if missing:
+            key_resolver.mark_missing(key)
         
-        for alt_path in alternative_paths:
-            if alt_path == primary_key:
-                continue  # Skip if it's the same as primary
-                
-            content = download_from_r2(alt_path, silent_404=True)
+        found = key_resolver.resolve(primary_key, job_id, filename, skip=[key])
+        if found:
+            content, _ = get_r2_text(found[0])
             if content:
                 if not silent_404:
-                    print(f"✅ Found file at alternative path: {alt_path}")
+                    print(f"✅ Found file at alternative path: {found[0]}")
                 return content
     
+    for _, key in layout_candidates(primary_key, job_id, filename):
+        content = read_local_storage(key)
+        if content:
+            return content
+    
     # If all paths failed, return None
     if not silent_404:
         print(f"❌ File not found at any path for job {job_id}, filename {filename}")
@@ -1174,50 +1674,115 @@ async def upload_to_r2_async(key: str, content: str) -> bool:
     return await asyncio.to_thread(upload_to_r2, key, content)
 
 
+def download_many_from_r2(keys: List[str]) -> Dict[str, Optional[str]]:
+    """Download several objects concurrently; misses fall back to local storage."""
+    results = {}
+    for key, data in r2_client.get_many(keys).items():
+        if data is not None:
+            results[key] = data.decode('utf-8', errors='replace')
+            continue
+        try:
+            with open(f"local_storage/{key}", 'r', encoding='utf-8') as f:
+                results[key] = f.read()
+        except Exception:
+            results[key] = None
+    return results
+
+def r2_download_parts(keys: List[str]) -> Dict[str, Optional[Part]]:
+    """
+    Size up objects for streaming with concurrent HEAD requests.
+
+    Objects missing from R2 fall back to local storage, like download_from_r2.
+    Empty objects count as missing.
+
+    Returns:
+        Mapping of key -> Part (None when the object exists nowhere)
+    """
+    parts = {}
+    for key, size in r2_client.head_many(keys).items():
+        if size:
+            parts[key] = Part.r2_object(key, size)
+            continue
+        local_path = f"local_storage/{key}"
+        local_size = os.path.getsize(local_path) if os.path.isfile(local_path) else 0
+        parts[key] = Part.local_file(local_path, local_size) if local_size else None
+    return parts
+
+def r2_download_part(key: str) -> Optional[Part]:
+    """Size up a single object for streaming (None when it exists nowhere)."""
+    return r2_download_parts([key])[key]
+
+def find_r2_part_with_fallback(primary_key: str, job_id: str, filename: str) -> Optional[Part]:
+    """Streaming counterpart of download_from_r2_with_fallback: the preferred existing layout wins."""
+    found = key_resolver.resolve(primary_key, job_id, filename)
+    if found:
+        return Part.r2_object(*found)
+    for _, key in layout_candidates(primary_key, job_id, filename):
+        local_path = f"local_storage/{key}"
+        if os.path.isfile(local_path) and os.path.getsize(local_path):
+            return Part.local_file(local_path, os.path.getsize(local_path))
+    return None
+
+def stream_download_response(
+    parts: List[Part],
+    filename: str,
+    range_header: Optional[str] = None,
+    media_type: str = "text/plain",
+    etag: Optional[str] = None,
+    if_range: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Stream parts to the client with a constant-size buffer, honouring single Range requests.
+
+    A Range is only honoured when the content has a strong ETag: without a
+    validator a resumed download could splice bytes of two different
+    versions together, so the full content is sent instead.
+
+    Args:
+        parts: Download parts in order (text, R2 objects, local files)
+        filename: Attachment filename
+        range_header: Request's Range header
+        media_type: Response media type
+        etag: Strong ETag of the content, if it has one (Range needs it)
+        if_range: Request's If-Range header; a Range is only honoured when it strongly matches etag
+        headers: Extra response headers
+
+    Returns:
+        200 with the full body, 206 with the requested range, or 416
+    """
+    stream = DownloadStream(parts, r2_client.iter_object)
+    total = stream.size
+    ranges_allowed = is_strong_etag(etag)
+    response_headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "bytes" if ranges_allowed else "none",
+        **(headers or {})
+    }
+    if etag:
+        response_headers["ETag"] = etag
+    
+    byte_range = None
+    if ranges_allowed and if_range_matches(if_range, etag):
+        try:
+            byte_range = parse_range(range_header, total)
+        except RangeNotSatisfiable:
+            response_headers["Content-Range"] = f"bytes */{total}"
+            return Response(status_code=416, headers=response_headers)
+    
+    if byte_range is None:
+        response_headers["Content-Length"] = str(total)
+        return StreamingResponse(stream.iter_bytes(), media_type=media_type, headers=response_headers)
+    
+    start, end = byte_range
+    response_headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    response_headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(stream.iter_bytes(start, end), status_code=206, media_type=media_type, headers=response_headers)
+
 def list_r2_objects(prefix: str = "") -> List[str]:
-    """List objects in R2 bucket with optional prefix using boto3."""
+    """List objects in R2 bucket with optional prefix."""
     try:
-        # Use boto3 to list R2 objects (r2_client global is None, so create client here)
-        import boto3
-        from botocore.config import Config
-        
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=R2_ENDPOINT,
-            aws_access_key_id=R2_ACCESS_KEY,
-            aws_secret_access_key=R2_SECRET_KEY,
-            config=Config(signature_version='s3v4'),
-            region_name='auto'
-        )
-        
-        # List objects with pagination support
-        keys = []
-        continuation_token = None
-        
-        while True:
-            if continuation_token:
-                response = s3_client.list_objects_v2(
-                    Bucket=R2_BUCKET,
-                    Prefix=prefix,
-                    ContinuationToken=continuation_token
-                )
-            else:
-                response = s3_client.list_objects_v2(
-                    Bucket=R2_BUCKET,
-                    Prefix=prefix
-                )
-            
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    keys.append(obj['Key'])
-            
-            # Check if there are more results
-            if response.get('IsTruncated'):
-                continuation_token = response.get('NextContinuationToken')
-            else:
-                break
-        
-        return keys
+        return r2_client.list_keys(prefix)
         
     except Exception as e:
         print(f"Error listing R2 objects: {e}")
@@ -1238,19 +1803,7 @@ def list_r2_objects(prefix: str = "") -> List[str]:
 def delete_from_r2(key: str) -> bool:
     """Delete a single object from R2."""
     try:
-        url = f"{R2_ENDPOINT}/{R2_BUCKET}/{key}"
-        headers = {
-            'Host': urlparse(R2_ENDPOINT).netloc
-        }
-        headers = sign_aws_request('DELETE', url, headers, '', R2_ACCESS_KEY, R2_SECRET_KEY)
-        
-        response = r2_session.delete(url, headers=headers, timeout=30)
-        
-        if response.status_code in [200, 204, 404]:  # 404 is ok (already deleted)
-            return True
-        else:
-            print(f"❌ Failed to delete from R2: {response.status_code} - {response.text}")
-            return False
+        return r2_client.delete(key)
     except Exception as e:
         print(f"❌ Error deleting from R2: {e}")
         return False
@@ -1268,12 +1821,9 @@ def delete_r2_directory(prefix: str) -> bool:
             return True
         
         print(f"Found {len(objects)} objects to delete")
-        deleted_count = 0
         
-        # Delete each object
-        for key in objects:
-            if delete_from_r2(key):
-                deleted_count += 1
+        # Multi-object delete (1000 keys per request, batches sent concurrently)
+        deleted_count = r2_client.delete_many(objects)
         
         print(f"✅ Deleted {deleted_count}/{len(objects)} objects from R2")
         
@@ -1296,504 +1846,10 @@ def count_tokens(text: str) -> int:
     except Exception:
         return len(text) // 4
 
-import re
-
-# Pre-compile regex patterns for better performance
-_UUID_PATTERN = re.compile(r'^[a-f0-9\-]{8,}$', re.IGNORECASE)
-_NUMBERS_PATTERN = re.compile(r'^[\d\-\s\.]+$')
-_LETTERS_PATTERN = re.compile(r'[a-zA-Z]')
-# ChatGPT conversation IDs like "978dfdf8faef413a-LHR" or standalone alphanumeric IDs
-_CONVERSATION_ID_PATTERN = re.compile(r'^[a-f0-9]{12,20}-[A-Z]{3}$', re.IGNORECASE)
-# Generic conversation/message IDs (standalone alphanumeric strings 8+ chars)
-_GENERIC_ID_PATTERN = re.compile(r'^[a-f0-9]{8,}$', re.IGNORECASE)
-# Line numbers/conversation indices like "22.", "23.", etc.
-_LINE_NUMBER_PATTERN = re.compile(r'^\d{1,3}\.?\s*$')
-# File references: UUIDs with extensions, random file IDs, screenshot filenames
-_FILE_REFERENCE_PATTERN = re.compile(r'^([a-f0-9\-]{30,}|file-[a-zA-Z0-9]{15,}|screenshot\s+\d{4}-\d{2}-\d{2}\s+at\s+[\d\.\s:]+\s*(am|pm)?)\.(jpe?g|png|pdf|gif|webp|mp4|mov)$', re.IGNORECASE)
-
-# Pre-define technical patterns set for faster lookup
-_TECHNICAL_PATTERNS = {
-    'http://', 'https://', '.com', '.org', '.net', '.json', '.txt', '.py', '.edu', '.gov',
-    'client-created', 'message_type', 'model_slug', 'gpt-', 'claude-',
-    'request_id', 'timestamp_', 'content_type', 'conversation_id',
-    'finished_successfully', 'absolute', 'metadata', 'system',
-    'user_editable_context', 'is_visually_hidden', 'role:', 'author:',
-    'create_time', 'update_time', 'parent_id', 'children', 'mapping',
-    'finish_details', 'stop_tokens', 'citations', 'content_references', 'file-service://',
-    '-lhr', '-iad', '-syd', '-fra',  # Common ChatGPT server suffixes
-    '[pdf]', 'citeturn', 'common data set', 'self service', 'catalog',
-    'annual report', 'financial report', 'mediafiles', 'eventreg'
-}
 
-# Pre-define common JSON elements set
-_JSON_ELEMENTS = {'true', 'false', 'null', 'user', 'assistant', 'system', 'all'}
-
-def is_meaningful_text(text: str) -> bool:
-    """OPTIMIZED: Check if text is meaningful conversation content"""
-    if not isinstance(text, str):
-        return False
-    
-    # Clean and normalize - single strip operation
-    text = text.strip()
-    
-    # Skip if too short or empty
-    if len(text) < 3:
-        return False
-    
-    # OPTIMIZED: Use pre-compiled patterns - filter out conversation IDs and other technical identifiers
-    if (_NUMBERS_PATTERN.match(text) or _UUID_PATTERN.match(text) or 
-        _CONVERSATION_ID_PATTERN.match(text) or _GENERIC_ID_PATTERN.match(text) or
-        _LINE_NUMBER_PATTERN.match(text) or _FILE_REFERENCE_PATTERN.match(text)):
-        return False
-    
-    # OPTIMIZED: Use set lookup instead of list iteration
-    text_lower = text.lower()
-    if any(pattern in text_lower for pattern in _TECHNICAL_PATTERNS):
-        return False
-    
-    # OPTIMIZED: Single regex check for letters
-    if not _LETTERS_PATTERN.search(text):
-        return False
-    
-    # Skip very short single words unless they're meaningful
-    if len(text.split()) == 1 and len(text) < 8:
-        return False
-    
-    # OPTIMIZED: Set lookup instead of list check
-    if text_lower in _JSON_ELEMENTS:
-        return False
-    
-    return True
-
-# Pre-compile commonly used regex patterns for performance
-_WHITESPACE_PATTERN = re.compile(r'\s+')
-_TIMESTAMP_PATTERN = re.compile(r'^\[\d{4}-\d{2}-\d{2}.*?\]')
-_TIME_PATTERN = re.compile(r'^\d{1,2}:\d{2}(:\d{2})?\s*(AM|PM)?', re.IGNORECASE)
-_USERNAME_PATTERN = re.compile(r'^[A-Za-z]+:')
-
-
-def extract_text_from_structure(obj: Any, extracted_texts=None, depth=0, progress_callback=None, total_items=None, current_item=None, seen_objects=None, text_set=None) -> List[str]:
-    """Recursively extract meaningful text from any data structure - OPTIMIZED for speed"""
-    if extracted_texts is None:
-        extracted_texts = []
-        text_set = set()  # Use set for O(1) duplicate checking
-    elif text_set is None:
-        text_set = set(extracted_texts)  # Convert existing list to set for speed
-    
-    if seen_objects is None:
-        seen_objects = set()
-    
-    # Prevent infinite recursion - keep aggressive limit
-    if depth > 50:
-        return extracted_texts
-    
-    # Check for circular references
-    obj_id = id(obj)
-    if obj_id in seen_objects:
-        return extracted_texts
-    
-    # Only track container objects to avoid memory issues
-    if isinstance(obj, (dict, list)):
-        seen_objects.add(obj_id)
-    
-    try:
-        if isinstance(obj, dict):
-            # Look for common text-containing keys first (prioritized extraction)
-            text_keys = ['parts', 'content', 'text', 'message', 'body', 'data', 'value', 'title', 'response']
-            for key in text_keys:
-                if key in obj:
-                    extract_text_from_structure(obj[key], extracted_texts, depth + 1, progress_callback, total_items, current_item, seen_objects, text_set)
-            
-            # Then check all other keys with improved batching
-            processed = 0
-            for key, value in obj.items():
-                if key not in text_keys and processed < 500:  # Keep comprehensive limit
-                    extract_text_from_structure(value, extracted_texts, depth + 1, progress_callback, total_items, current_item, seen_objects, text_set)
-                    processed += 1
-                    
-        elif isinstance(obj, list):
-            # OPTIMIZED: Reduce progress callback frequency dramatically
-            list_len = min(len(obj), 5000)
-            progress_interval = max(200, list_len // 20)  # Report progress every 200 items OR 5% chunks
-            
-            for i, item in enumerate(obj[:5000]):
-                # OPTIMIZED: Much less frequent progress updates (10x reduction)
-                if progress_callback and len(obj) > 500 and i % progress_interval == 0:
-                    progress = (i + 1) / list_len * 100
-                    progress_callback(f"Processing item {i+1}/{list_len} ({progress:.1f}%)")
-                
-                extract_text_from_structure(item, extracted_texts, depth + 1, progress_callback, total_items, current_item, seen_objects, text_set)
-                
-        elif isinstance(obj, str):
-            # OPTIMIZED: Pre-filter before expensive operations
-            if len(obj) >= 3 and obj.strip():  # Quick length and whitespace check first
-                if is_meaningful_text(obj):
-                    # OPTIMIZED: Streamlined text cleaning
-                    cleaned_text = obj.strip()
-                    
-                    # Only do unicode processing if needed
-                    if '\\u' in cleaned_text:
-                        try:
-                            cleaned_text = cleaned_text.encode('utf-8').decode('unicode_escape')
-                        except:
-                            pass  # Keep original if decode fails
-                    
-                    # Single regex operation for whitespace normalization
-                    cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
-                    
-                    # OPTIMIZED: Use set for O(1) duplicate checking instead of O(n) list search
-                    if cleaned_text and cleaned_text not in text_set:
-                        # Only do expensive unicode validation if we're going to add it
-                        try:
-                            cleaned_text.encode('utf-8')  # Quick encoding test
-                            extracted_texts.append(cleaned_text)
-                            text_set.add(cleaned_text)
-                        except UnicodeEncodeError:
-                            # Fallback: aggressive cleaning only when needed
-                            import unicodedata
-                            safe_text = ''.join(char for char in cleaned_text 
-                                              if ord(char) < 65536 and unicodedata.category(char) != 'Cs')
-                            if safe_text and safe_text not in text_set:
-                                extracted_texts.append(safe_text)
-                                text_set.add(safe_text)
-    
-    finally:
-        # Remove from seen objects when done (for dict/list only)
-        if isinstance(obj, (dict, list)) and obj_id in seen_objects:
-            seen_objects.discard(obj_id)
-    
-    return extracted_texts
-
-def extract_conversations_from_zip(zip_bytes: bytes) -> str:
-    """Extract conversations.json from a ZIP file"""
-    try:
-        with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zip_file:
-            # Look for conversations.json in the ZIP
-            for file_info in zip_file.namelist():
-                if file_info.endswith('conversations.json'):
-                    print(f"📦 Found conversations.json in ZIP: {file_info}")
-                    return zip_file.read(file_info).decode('utf-8')
-            raise ValueError("conversations.json not found in ZIP file")
-    except zipfile.BadZipFile:
-        raise ValueError("Invalid ZIP file")
-    except Exception as e:
-        raise ValueError(f"Error extracting ZIP: {str(e)}")
-
-def extract_text_from_zip(zip_bytes: bytes) -> str:
-    """Extract supported text content from a ZIP file.
-
-    Priority:
-    1. If the archive contains conversations.json, return that content directly.
-    2. Otherwise, unpack supported files and combine their extracted text.
-    """
-    try:
-        with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zip_file:
-            names = zip_file.namelist()
-
-            for file_name in names:
-                if file_name.endswith('conversations.json'):
-                    print(f"📦 Found conversations.json in ZIP: {file_name}")
-                    return zip_file.read(file_name).decode('utf-8')
-
-            extracted_sections = []
-            supported_extensions = (
-                '.txt', '.md', '.markdown', '.csv', '.json',
-                '.pdf', '.docx', '.doc'
-            )
-
-            for file_name in names:
-                normalized_name = file_name.lower()
-                if file_name.endswith('/') or normalized_name.startswith('__macosx/'):
-                    continue
-                if not normalized_name.endswith(supported_extensions):
-                    continue
-
-                try:
-                    file_bytes = zip_file.read(file_name)
-                    if not file_bytes:
-                        continue
-
-                    if normalized_name.endswith('.pdf'):
-                        extracted_text = extract_text_from_pdf(file_bytes)
-                    elif normalized_name.endswith(('.docx', '.doc')):
-                        extracted_text = extract_text_from_docx(file_bytes)
-                    else:
-                        try:
-                            extracted_text = file_bytes.decode('utf-8')
-                        except UnicodeDecodeError:
-                            extracted_text = file_bytes.decode('utf-8', errors='ignore')
-
-                    if extracted_text and extracted_text.strip():
-                        extracted_sections.append(
-                            f"\n\n===== FILE: {file_name} =====\n{extracted_text.strip()}"
-                        )
-                except Exception as file_error:
-                    print(f"⚠️ Skipping ZIP entry {file_name}: {file_error}")
-
-            if extracted_sections:
-                print(f"📦 Extracted {len(extracted_sections)} supported file(s) from ZIP")
-                return ''.join(extracted_sections).strip()
-
-            raise ValueError(
-                "ZIP file did not contain supported files. Include txt, md, csv, json, pdf, docx, or conversations.json."
-            )
-    except zipfile.BadZipFile:
-        raise ValueError("Invalid ZIP file")
-    except Exception as e:
-        raise ValueError(f"Error extracting ZIP: {str(e)}")
-
-def extract_text_from_pdf(pdf_bytes: bytes) -> str:
-    """Extract text from PDF using PyPDF2 and fix word-per-line formatting"""
-    try:
-        pdf_file = io.BytesIO(pdf_bytes)
-        pdf_reader = PdfReader(pdf_file)
-        
-        extracted_text = []
-        total_pages = len(pdf_reader.pages)
-        
-        for page_num, page in enumerate(pdf_reader.pages, 1):
-            try:
-                text = page.extract_text()
-                if text and text.strip():
-                    # CRITICAL FIX: Check if this is word-per-line formatting
-                    lines = [line.strip() for line in text.split('\n') if line.strip()]
-                    
-                    # If most lines are very short (1-3 words), rejoin them
-                    short_line_count = sum(1 for line in lines if len(line.split()) <= 3)
-                    if len(lines) > 10 and short_line_count > len(lines) * 0.7:
-                        # Word-per-line formatting detected - rejoin into continuous text
-                        print(f"  📄 Page {page_num}: Detected word-per-line formatting, rejoining...")
-                        text = ' '.join(lines)
-                    
-                    extracted_text.append(text)
-            except Exception as page_error:
-                print(f"  Warning: Could not extract text from page {page_num}: {page_error}")
-                continue
-        
-        combined_text = "\n\n".join(extracted_text)
-        
-        return combined_text
-    except Exception as e:
-        print(f"❌ Error extracting PDF: {e}")
-        raise ValueError(f"Failed to extract PDF content: {str(e)}")
-
-def extract_text_from_docx(docx_bytes: bytes) -> str:
-    """Extract text from DOCX files using python-docx"""
-    try:
-        from docx import Document
-    except ImportError:
-        raise ValueError("DOCX support is not available: install python-docx")
-    try:
-        
-        docx_file = io.BytesIO(docx_bytes)
-        doc = Document(docx_file)
-        
-        extracted_text = []
-        
-        # Extract text from paragraphs
-        for paragraph in doc.paragraphs:
-            text = paragraph.text.strip()
-            if text:
-                extracted_text.append(text)
-        
-        # Extract text from tables
-        for table in doc.tables:
-            for row in table.rows:
-                row_text = []
-                for cell in row.cells:
-                    cell_text = cell.text.strip()
-                    if cell_text:
-                        row_text.append(cell_text)
-                if row_text:
-                    extracted_text.append(' | '.join(row_text))
-        
-        combined_text = "\n\n".join(extracted_text)
-        
-        if not combined_text.strip():
-            raise ValueError("No text content found in DOCX file")
-        
-        return combined_text
-    except Exception as e:
-        print(f"❌ Error extracting DOCX: {e}")
-        raise ValueError(f"Failed to extract DOCX content: {str(e)}")
-
-def extract_from_text_content(file_content: str) -> List[str]:
-    """OPTIMIZED: Extract meaningful text from plain text content with better context preservation"""
-    extracted_texts = []
-    text_set = set()  # For exact duplicate checking
-    semantic_set = set()  # For semantic duplicate detection
-    
-    try:
-        # Try to detect if it's actually structured data in text format
-        content_stripped = file_content.strip()
-        if content_stripped.startswith(('{', '[')):
-            try:
-                data = json.loads(file_content)
-                return extract_text_from_structure(data)
-            except:
-                pass  # Continue with text processing
-        
-        # Filter patterns for metadata and navigation elements
-        metadata_patterns = [
-            r'^\[PDF\].*',  # PDF metadata
-            r'^https?://.*',  # URLs
-            r'^www\..*',  # WWW URLs
-            r'^\d+\s*-\s*\d+$',  # Page numbers like "1 - 2"
-            r'^(Common Data Set|Self Service|Annual Report|Catalog|Financial Report).*',  # Navigation items
-            r'^citeturn\d+.*',  # Citation metadata
-            r'^mediafiles\..*',  # Media file references
-            r'^eventreg\..*',  # Event registration URLs
-            r'\.edu$',  # Domain endings
-            r'\.com$',
-            r'\.org$',
-            r'^(assistant|user|sent|attachment omitted|powered by openai).*',  # Chat metadata
-            r'.*:\s*$',  # Lines ending with colon (speaker tags)
-        ]
-        
-        # Compile metadata patterns
-        metadata_regex = re.compile('|'.join(metadata_patterns), re.IGNORECASE)
-        
-        # Patterns for quoted replies and chat artifacts
-        quote_pattern = re.compile(r'^>\s*')  # Email-style quotes
-        speaker_pattern = re.compile(r'^(assistant|user|chatgpt|human|ai):\s*', re.IGNORECASE)
-        
-        # IMPROVED: Split into paragraphs with more flexible approach
-        # Try double newlines first, but also handle single newlines for PDFs
-        paragraphs = re.split(r'\n\s*\n|\r\n\s*\r\n', file_content)
-        
-        # If we only got 1-2 paragraphs but have lots of content, try single newlines
-        if len(paragraphs) <= 2 and len(file_content) > 500:
-            # This is likely a PDF with poor paragraph separation
-            # Split on single newlines and group into logical paragraphs
-            lines = file_content.split('\n')
-            paragraphs = []
-            current_para = []
-            
-            for line in lines:
-                line = line.strip()
-                # Start new paragraph on certain conditions
-                if len(line) == 0:
-                    if current_para:
-                        paragraphs.append('\n'.join(current_para))
-                    current_para = []
-                elif len(current_para) > 0 and (
-                    # New paragraph indicators
-                    len(current_para[-1]) > 50 and not current_para[-1].endswith((',', 'and', 'or', 'the', 'a', 'an')) or
-                    line[0].isupper() and len(line) > 40  # Likely start of new sentence/paragraph
-                ):
-                    # Check if we should continue or start new
-                    if len('\n'.join(current_para)) > 200:  # Current para is substantial
-                        paragraphs.append('\n'.join(current_para))
-                        current_para = [line]
-                    else:
-                        current_para.append(line)
-                else:
-                    current_para.append(line)
-            
-            if current_para:
-                paragraphs.append('\n'.join(current_para))
-        
-        for para in paragraphs:
-            # Clean up the paragraph
-            para = para.strip()
-            
-            # RELAXED: Reduced minimum length from 10 to 5 for short but meaningful content
-            if len(para) < 5:
-                continue
-            
-            # Skip metadata and navigation
-            if metadata_regex.match(para):
-                continue
-            
-            # RELAXED: Skip if it's mostly punctuation or numbers (but be less strict)
-            alphanumeric_count = sum(c.isalnum() for c in para)
-            if alphanumeric_count < len(para) * 0.2:  # Reduced from 0.3 to 0.2
-                continue
-                
-            # Try to preserve multi-line content as paragraphs
-            lines = para.split('\n')
-            current_paragraph = []
-            
-            for line in lines:
-                cleaned_line = line.strip()
-            
-                # RELAXED: Skip empty or very short lines (reduced from 5 to 3)
-                if len(cleaned_line) < 3:
-                    continue
-            
-                # Remove quoted reply markers
-                cleaned_line = quote_pattern.sub('', cleaned_line)
-                
-                # Remove speaker tags at start of line
-                cleaned_line = speaker_pattern.sub('', cleaned_line)
-                
-                # Remove timestamps and username prefixes
-                cleaned_line = _TIMESTAMP_PATTERN.sub('', cleaned_line)
-                cleaned_line = _TIME_PATTERN.sub('', cleaned_line)
-                cleaned_line = _USERNAME_PATTERN.sub('', cleaned_line)
-                cleaned_line = cleaned_line.strip()
-                
-                # Skip metadata lines
-                if metadata_regex.match(cleaned_line):
-                    continue
-            
-                # IMPROVED: For regular documents (not conversations), be much less strict
-                # Check if line has reasonable content - letters and reasonable length
-                has_letters = any(c.isalpha() for c in cleaned_line)
-                is_reasonable_length = len(cleaned_line) >= 3
-                
-                # Only use strict filtering for obvious technical junk
-                is_technical_junk = (
-                    _UUID_PATTERN.match(cleaned_line) or
-                    _CONVERSATION_ID_PATTERN.match(cleaned_line) or
-                    _GENERIC_ID_PATTERN.match(cleaned_line) or
-                    _FILE_REFERENCE_PATTERN.match(cleaned_line) or
-                    _NUMBERS_PATTERN.match(cleaned_line)
-                )
-                
-                if has_letters and is_reasonable_length and not is_technical_junk:
-                    current_paragraph.append(cleaned_line)
-            
-            # Join lines into a cohesive paragraph
-            if current_paragraph:
-                # Combine lines that seem to be part of the same thought
-                combined = ' '.join(current_paragraph)
-                
-                # Detect conversation roles and tag content
-                # Check first few words for role indicators
-                first_words = combined[:100].lower()
-                role_prefix = ""
-                
-                # User/Human indicators
-                if any(marker in first_words for marker in ['you said', 'you asked', 'i said', 'i asked', 'question:', 'user:']):
-                    role_prefix = "<user> "
-                # Assistant/AI indicators  
-                elif any(marker in first_words for marker in ['i can help', 'here is', "here's", 'assistant:', 'chatgpt:', 'let me']):
-                    role_prefix = "<assistant> "
-                
-                # Apply role prefix if detected
-                if role_prefix:
-                    combined = role_prefix + combined
-                
-                # Semantic duplicate detection: normalize for comparison
-                # Only collapse whitespace and lowercase - preserve numbers and meaningful punctuation
-                semantic_hash = ' '.join(combined.lower().split())[:250]
-                
-                # RELAXED: Reduced minimum length from 20 to 10 for shorter but meaningful content
-                if combined not in text_set and semantic_hash not in semantic_set and len(combined) > 10:
-                    extracted_texts.append(combined)
-                    text_set.add(combined)
-                    semantic_set.add(semantic_hash)
-    
-    except Exception as e:
-        print(f"Error processing text content: {e}")
-
-
-    return extracted_texts
-
-from fastapi.responses import StreamingResponse
-import asyncio
-from typing import AsyncGenerator
+from fastapi.responses import StreamingResponse
+import asyncio
+from typing import AsyncGenerator
 
 @app.delete("/api/jobs/{job_id}")
 async def delete_job(job_id: str):
@@ -1828,7 +1884,7 @@ async def detailed_health_check():
         try:
             if supabase:
                 db_start = time.time()
-                result = supabase.table('user_profiles').select('id').limit(1).execute()
+                result = await db.table('user_profiles').select('id').limit(1).execute()
                 db_latency = round((time.time() - db_start) * 1000, 2)
             else:
                 print("⚠️ Database connection not configured (legacy mode)")
@@ -1840,8 +1896,8 @@ async def detailed_health_check():
         active_threads = threading.active_count()
         
         # Check job queue status
-        pending_jobs = len([job for job in job_progress.values() if job.get('status') == 'pending'])
-        processing_jobs = len([job for job in job_progress.values() if job.get('status') == 'processing'])
+        pending_jobs = job_store.count_step('pending')
+        processing_jobs = job_store.count_step('processing')
         
         response_time = round((time.time() - start_time) * 1000, 2)
         
@@ -1851,15 +1907,36 @@ async def detailed_health_check():
             "response_time_ms": response_time,
             "database": {
                 "healthy": db_healthy,
-                "latency_ms": db_latency
+                "latency_ms": db_latency,
+                "requests": db.snapshot() if db else None,
+                "metadata_cache": db.cache.snapshot() if db and db.cache else None
             },
             "system": {
-                "active_threads": active_threads
+                "active_threads": active_threads,
+                "cpu_pool": cpu_pool.snapshot(),
+                "progress_bus": progress_bus.snapshot(),
+                "jwt_cache": jwt_cache.snapshot(),
+                "status_writer": status_writer.snapshot(),
+                "pack_exports": pack_exporter.snapshot(),
+                "r2_key_resolver": key_resolver.snapshot(),
+                "analysis_jobs": analysis_jobs.snapshot(),
+                "job_queue": job_queue.snapshot() if job_queue is not None else {"backend": "inline"}
             },
             "job_queue": {
                 "pending_jobs": pending_jobs,
                 "processing_jobs": processing_jobs,
-                "total_tracked_jobs": len(job_progress)
+                "total_tracked_jobs": len(job_store),
+                "state": job_store.snapshot(),
+                "rate_limit_keys": len(rate_limit_attempts)
+            },
+            "storage": {
+                "r2_transfers": transfer_stats.snapshot()
+            },
+            "openai": {
+                "scheduler": openai_scheduler.snapshot(),
+                "rate_limiter": openai_limiter.snapshot(),
+                "batch": openai_batch.snapshot() if openai_batch is not None else None,
+                "analysis_cache": analysis_cache.snapshot() if analysis_cache else None
             }
         }
         
@@ -1943,7 +2020,7 @@ async def send_account_creation_email_endpoint(
         print(f"📧 Account creation email requested for user {target_user_id} ({target_email})")
         
         # FIRST: Check user_profiles column (faster, primary source of truth)
-        user_profile_result = supabase.rpc(
+        user_profile_result = await db.rpc(
             "get_user_profile_for_backend",
             {"user_uuid": target_user_id}
         ).execute()
@@ -1977,7 +2054,7 @@ async def send_account_creation_email_endpoint(
             }
         
         # Get first name for email personalization
-        user_profile_result = supabase.rpc(
+        user_profile_result = await db.rpc(
             "get_user_profile_for_backend",
             {"user_uuid": target_user_id}
         ).execute()
@@ -2044,133 +2121,199 @@ class ConversationURLRequest(BaseModel):
     url: str
 
 
-def _chunk_text(combined_text: str, source_id: str, progress_callback: Optional[Callable[[int, int], None]] = None) -> list:
-    """CPU-bound chunking logic — runs in a thread pool to avoid blocking the event loop."""
-    max_tokens_per_chunk = 100000
-    initial_chunk_size = 400000
-    overlap = 20000
-    total_length = len(combined_text)
-    chunks = []
-
-    if total_length > initial_chunk_size:
-        print(f"📦 Starting dynamic chunking: {total_length:,} chars, target {max_tokens_per_chunk:,} tokens/chunk")
-        chunk_count = 0
-        position = 0
-        while position < total_length:
-            chunk_end = min(position + initial_chunk_size, total_length)
-            chunk = combined_text[position:chunk_end]
-            chunk_tokens = count_tokens(chunk)
-            actual_chunk_size = len(chunk)
-
-            if chunk_tokens > max_tokens_per_chunk:
-                chars_per_token = len(chunk) / chunk_tokens
-                safe_size = int(max_tokens_per_chunk * chars_per_token * 0.90)
-                safe_size = max(safe_size, 30000)
-                chunk = combined_text[position:position + safe_size]
-                chunk_tokens = count_tokens(chunk)
-                actual_chunk_size = len(chunk)
-            else:
-                if chunk_count % 20 == 0:
-                    print(f"Chunk {chunk_count + 1}: {actual_chunk_size:,} chars, {chunk_tokens:,} tokens")
+# Maps update_source_status RPC parameters to the fields streamed to clients
+_STATUS_PARAM_FIELDS = {
+    "status_param": "status",
+    "progress_param": "progress",
+    "total_chunks_param": "total_chunks",
+    "processed_chunks_param": "processed_chunks",
+    "error_message_param": "error_message",
+}
 
-            chunks.append(chunk)
-            chunk_count += 1
 
-            advance_by = max(actual_chunk_size - overlap, initial_chunk_size // 4)
-            position += advance_by
+async def set_source_status(params: Dict[str, Any]) -> None:
+    """
+    Publish a source status update and queue it for the database.
+    
+    Streams see the update at once. The update_source_status write goes
+    through status_writer, which writes status changes immediately and
+    debounces progress-only updates; write errors are logged there.
+    
+    Args:
+        params: update_source_status RPC parameters (target_source_id, status_param, ...)
+    """
+    update = {field: params[param] for param, field in _STATUS_PARAM_FIELDS.items() if param in params}
+    if update:
+        progress_bus.publish(params["target_source_id"], update)
+    await status_writer.update(params)
 
-            if chunk_count % 10 == 0:
-                progress_pct = int((position / total_length) * 100)
-                print(f"Chunking progress: {chunk_count} chunks, {progress_pct}% complete")
-                if progress_callback:
-                    progress_callback(chunk_count, progress_pct)
 
-        if progress_callback and len(chunks) > 0:
-            final_progress = min(99, calculate_progress_percent(position, total_length, min_percent=20, max_percent=99))
-            progress_callback(len(chunks), final_progress)
-        print(f"✅ Created {len(chunks)} chunks for source {source_id}")
-    else:
-        chunks.append(combined_text)
-        chunk_tokens = count_tokens(combined_text)
-        total_length_val = len(combined_text)
-        if progress_callback:
-            progress_callback(1, 99)
-        print(f"Created 1 chunk for source {source_id} ({total_length_val:,} chars, {chunk_tokens:,} tokens)")
+async def extract_pdf_parallel(file_path: str, source_id: str) -> List[str]:
+    """
+    Page-parallel PDF extraction through the CPU worker pool.
+    
+    The page range is split into PDF_PAGES_PER_TASK-page tasks. At most one
+    task per pool worker is submitted at a time, so a very long PDF does not
+    queue its whole page range ahead of other users' jobs, and nothing more is
+    submitted once the time budget is spent. Results are consumed in page
+    order, so passages are appended (and de-duplicated) in document order as
+    each range completes.
+    
+    Raises:
+        ValueError: If the PDF exceeds PDF_MAX_PAGES or PDF_TIME_BUDGET_SECONDS
+    """
+    started = time.time()
+    deadline = started + PDF_TIME_BUDGET_SECONDS
+    total_pages = await cpu_pool.run(count_pdf_pages, file_path)
+    if PDF_MAX_PAGES and total_pages > PDF_MAX_PAGES:
+        raise ValueError(f"PDF has {total_pages:,} pages; the limit is {PDF_MAX_PAGES:,}")
+    
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, total_pages)) for start in range(0, total_pages, PDF_PAGES_PER_TASK)]
+    window = max(1, cpu_pool.max_workers)
+    print(f"📄 Extracting {total_pages} PDF pages for source {source_id} in {len(ranges)} tasks ({window} at a time)")
+    remaining = iter(ranges)
+    in_flight = deque()
+    
+    def submit_more():
+        while len(in_flight) < window and time.time() < deadline:
+            page_range = next(remaining, None)
+            if page_range is None:
+                return
+            start, end = page_range
+            in_flight.append((page_range, asyncio.create_task(
+                cpu_pool.run(extract_pdf_page_range, file_path, start, end, deadline)
+            )))
+    
+    extracted_texts = []
+    seen = set()
+    pages_done = 0
+    try:
+        submit_more()
+        while in_flight:
+            (start, end), task = in_flight.popleft()
+            # Small grace period so a worker can return the pages it finished before the deadline
+            timeout = max(1.0, deadline - time.time() + 5)
+            passages, range_pages_done = await asyncio.wait_for(task, timeout=timeout)
+            pages_done += range_pages_done
+            if range_pages_done < end - start:
+                raise asyncio.TimeoutError()
+            for passage in passages:
+                if passage not in seen:
+                    seen.add(passage)
+                    extracted_texts.append(passage)
+            submit_more()
+        if pages_done < total_pages:
+            # The budget ran out before the remaining ranges were submitted
+            raise asyncio.TimeoutError()
+    except asyncio.TimeoutError:
+        raise ValueError(
+            f"PDF extraction exceeded the {PDF_TIME_BUDGET_SECONDS}s time budget "
+            f"({pages_done}/{total_pages} pages extracted)"
+        )
+    finally:
+        for _, task in in_flight:
+            task.cancel()
+    
+    print(f"✅ Extracted {total_pages} PDF pages in {time.time() - started:.1f}s ({len(extracted_texts)} passages)")
+    return extracted_texts
 
-    return chunks
+
+async def _chunk_text(extracted_texts: List[str], source_id: str) -> Tuple[List[str], List[int]]:
+    """CPU-bound chunking logic — runs in the CPU worker pool to avoid blocking the event loop.
+    
+    Single tokenization pass (see chunker): chunks are cut on paragraph/message
+    boundaries by token budget, and their token counts are returned alongside.
+    """
+    total_length = sum(len(text) for text in extracted_texts)
+    print(f"📦 Chunking {total_length:,} chars, target {CHUNK_MAX_TOKENS:,} tokens/chunk ({CHUNK_OVERLAP_TOKENS:,} overlap)")
+    
+    chunks, chunk_tokens = await cpu_pool.run(
+        chunk_texts,
+        extracted_texts,
+        max_tokens=CHUNK_MAX_TOKENS,
+        overlap_tokens=CHUNK_OVERLAP_TOKENS
+    )
+    print(f"✅ Created {len(chunks)} chunks for source {source_id} ({sum(chunk_tokens):,} tokens)")
+    return chunks, chunk_tokens
 
 
-async def extract_and_chunk_source(pack_id: str, source_id: str, file_content: str, filename: str, user: AuthenticatedUser):
-    """Step 1: Extract and chunk the source (NO OpenAI calls, NO credit deduction)"""
+async def extract_and_chunk_source(pack_id: str, source_id: str, file_content: Optional[str], filename: str, user: AuthenticatedUser, file_path: Optional[str] = None, queued: bool = False):
+    """Step 1: Extract and chunk the source (NO OpenAI calls, NO credit deduction)
+    
+    Uploads are handed off by file_path (a spooled temp file, deleted when
+    this finishes) instead of as in-memory content.
+    
+    Args:
+        queued: Running as a queued job. file_path stays owned by the job (a
+            retry reads it again) and failures leave the source status to the queue.
+    """
     try:
         print(f"🔄 Extracting and chunking source {source_id} for pack {pack_id}")
         
         # Update status to processing (extracting and chunking)
         import asyncio
-        await asyncio.to_thread(
-            lambda: supabase.rpc("update_source_status", {
-                "user_uuid": user.user_id,
-                "target_source_id": source_id,
-                "status_param": "processing",
-                "progress_param": 10
-            }).execute()
-        )
+        await set_source_status({
+            "user_uuid": user.user_id,
+            "target_source_id": source_id,
+            "status_param": "processing",
+            "progress_param": 10
+        })
         
         # Step 1: Extract text
-        extracted_texts = await asyncio.to_thread(extract_from_text_content, file_content)
+        extracted_texts = None
+        if file_path and filename.lower().endswith('.pdf'):
+            extracted_texts = await extract_pdf_parallel(file_path, source_id)
+        elif file_path:
+            extracted_texts = await cpu_pool.run(extract_upload_content, file_path, filename)
+        if file_path and not queued:
+            discard_spooled_file(file_path)
+        if extracted_texts is None:
+            extracted_texts = await cpu_pool.run(extract_from_text_content, file_content)
+        file_content = None  # Not needed past extraction
         
         # Store extracted text in R2
         extracted_path = f"{user.r2_directory}/{pack_id}/{source_id}/extracted.txt"
         await asyncio.to_thread(upload_to_r2, extracted_path, "\n\n".join(extracted_texts))
         
         # Text extraction is done; chunking begins next.
-        await asyncio.to_thread(
-            lambda: supabase.rpc("update_source_status", {
-                "user_uuid": user.user_id,
-                "target_source_id": source_id,
-                "status_param": "processing",
-                "progress_param": 20
-            }).execute()
-        )
+        await set_source_status({
+            "user_uuid": user.user_id,
+            "target_source_id": source_id,
+            "status_param": "processing",
+            "progress_param": 20
+        })
         
-        # Step 2: Dynamic chunking (CPU-bound — runs off the event loop in a thread pool)
+        # Step 2: Token-budget chunking (CPU-bound — runs in the CPU worker pool)
         print(f"✂️ Chunking text for source {source_id}")
-        combined_text = "\n\n".join(extracted_texts)
-        total_length = len(combined_text)
+        total_length = sum(len(text) for text in extracted_texts)
 
-        def report_chunking_progress(chunk_count: int, progress_pct: int):
-            try:
-                supabase.rpc("update_source_status", {
-                    "user_uuid": user.user_id,
-                    "target_source_id": source_id,
-                    "status_param": "processing",
-                    "progress_param": max(20, min(99, progress_pct)),
-                    "total_chunks_param": chunk_count
-                }).execute()
-            except Exception as progress_error:
-                print(f"⚠️ Failed to persist chunking progress for {source_id}: {progress_error}", flush=True)
-
-        chunks = await asyncio.to_thread(_chunk_text, combined_text, source_id, report_chunking_progress)
-
-        chunk_tokens = count_tokens(chunks[0]) if chunks else 0
+        chunks, chunk_tokens = await _chunk_text(extracted_texts, source_id)
+        extracted_texts = None
         
-        # Store chunks in R2
+        # Store chunks in R2 (token counts go to a sidecar so chunked.json keeps its format)
         chunked_path = f"{user.r2_directory}/{pack_id}/{source_id}/chunked.json"
         chunks_json = json.dumps(chunks)
         await asyncio.to_thread(upload_to_r2, chunked_path, chunks_json)
+        chunks_json = None
+        chunk_tokens_path = f"{user.r2_directory}/{pack_id}/{source_id}/chunk_tokens.json"
+        await asyncio.to_thread(upload_to_r2, chunk_tokens_path, json.dumps({
+            "encoding": CHUNK_ENCODING,
+            "max_tokens": CHUNK_MAX_TOKENS,
+            "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+            "total_tokens": sum(chunk_tokens),
+            "token_counts": chunk_tokens
+        }))
         print(f"✅ Chunks uploaded successfully to R2", flush=True)
         
         # Update status to ready_for_analysis (extraction done, awaiting credit confirmation)
         print(f"📝 Updating source {source_id} status to ready_for_analysis...", flush=True)
-        await asyncio.to_thread(
-            lambda: supabase.rpc("update_source_status", {
-                "user_uuid": user.user_id,
-                "target_source_id": source_id,
-                "status_param": "ready_for_analysis",
-                "progress_param": 100,
-                "total_chunks_param": len(chunks)
-            }).execute()
-        )
+        await set_source_status({
+            "user_uuid": user.user_id,
+            "target_source_id": source_id,
+            "status_param": "ready_for_analysis",
+            "progress_param": 100,
+            "total_chunks_param": len(chunks)
+        })
         
         log_source_processing(source_id, "extraction", "completed", len(chunks), len(chunks))
         print(f"✅ Extraction and chunking complete: {len(chunks)} chunks ready for analysis", flush=True)
@@ -2183,15 +2326,17 @@ async def extract_and_chunk_source(pack_id: str, source_id: str, file_content: s
     except Exception as e:
         print(f"❌ Error extracting/chunking source {source_id}: {e}")
         await asyncio.to_thread(log_source_processing, source_id, "extraction", "failed", error=str(e))
-        await asyncio.to_thread(
-            lambda: supabase.rpc("update_source_status", {
+        if not queued:
+            await set_source_status({
                 "user_uuid": user.user_id,
                 "target_source_id": source_id,
                 "status_param": "failed",
                 "progress_param": 0
-            }).execute()
-        )
+            })
         raise ExtractionError(source_id, str(e))
+    finally:
+        if not queued:
+            discard_spooled_file(file_path)
 
 def apply_redaction_filters(text: str) -> str:
     """Lightweight redaction to mask obvious personal identifiers before analysis."""
@@ -2206,101 +2351,292 @@ def apply_redaction_filters(text: str) -> str:
         print(f"⚠️ Redaction filter failed: {redaction_error}")
         return text
 
+def _analysis_request(chunk: str, chunk_idx: int, total_chunks: int, filename: str, system_prompt: str) -> Dict[str, Any]:
+    """
+    Chat-completion body for analyzing one chunk (shared by the interactive and batch paths).
+    
+    Raises:
+        ValueError: If nothing is left of the chunk after sanitization
+    """
+    redacted_chunk = apply_redaction_filters(chunk)
+
+    # Sanitize: remove null bytes and non-JSON-safe control characters.
+    # Null bytes (\x00) and most C0 control chars cause OpenAI's server to reject
+    # the request with "could not parse the JSON body" (HTTP 400).
+    # We preserve legitimate whitespace: \t (9), \n (10), \r (13).
+    sanitized_chunk = "".join(
+        ch for ch in redacted_chunk
+        if ch == "\t" or ch == "\n" or ch == "\r" or ord(ch) >= 32
+    )
+
+    if not sanitized_chunk.strip():
+        # Nothing left after sanitization — skip silently.
+        raise ValueError(f"Chunk {chunk_idx + 1} is empty after sanitization, skipping.")
+
+    # Get appropriate prompt from prompts module
+    prompt = get_analysis_prompt(
+        chunk=sanitized_chunk,
+        total_chunks=total_chunks,
+        filename=filename,
+        chunk_idx=chunk_idx
+    )
+    
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.3,
+        "max_completion_tokens": 3000
+    }
+
+def _analysis_cache_key(body: Dict[str, Any]) -> Optional[str]:
+    if analysis_cache is None:
+        return None
+    system_prompt, prompt = (message["content"] for message in body["messages"])
+    return make_cache_key(prompt, system_prompt, body["model"], body["temperature"], body["max_completion_tokens"])
+
+async def _cached_analysis(cache_key: Optional[str], chunk_idx: int) -> Optional[dict]:
+    """Result for a request answered before (from the analysis cache), or None."""
+    if cache_key is None:
+        return None
+    cached = await asyncio.to_thread(analysis_cache.get, cache_key)
+    if not (cached and cached.get("analysis")):
+        return None
+    return {
+        "index": chunk_idx,
+        "analysis": cached["analysis"],
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cost": 0.0,
+        "cached": True,
+        "cached_input_tokens": cached.get("input_tokens", 0),
+        "cached_output_tokens": cached.get("output_tokens", 0),
+        "cached_cost": cached.get("cost", 0.0)
+    }
+
+async def _analysis_result(chunk_idx: int, analysis: str, input_tokens: int, output_tokens: int,
+                           model: str, cache_key: Optional[str], price_factor: float = 1.0) -> dict:
+    """
+    Turn a model answer into an analysis result (and cache it).
+    
+    Args:
+        price_factor: Fraction of the synchronous price billed (batch requests are discounted)
+    
+    Raises:
+        ContentPolicyError: If the model refused the chunk
+    """
+    # Check for content policy refusal
+    if analysis and ("cannot assist" in analysis.lower() or "i'm sorry" in analysis.lower()[:50]):
+        raise ContentPolicyError(chunk_idx)
+    
+    # Calculate cost
+    cost = ((input_tokens * 0.00015 / 1000) + (output_tokens * 0.0006 / 1000)) * price_factor
+    
+    if cache_key and analysis:
+        await asyncio.to_thread(analysis_cache.put, cache_key, {
+            "analysis": analysis,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cost": cost,
+            "model": model
+        })
+    
+    return {
+        "index": chunk_idx,
+        "analysis": analysis,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cost": cost
+    }
+
 async def _analyze_single_chunk(
     chunk: str,
     chunk_idx: int,
     total_chunks: int,
     filename: str,
     system_prompt: str,
-    openai_client: Any
+    openai_client: Any,
+    user_id: Optional[str] = None,
+    estimated_input_tokens: Optional[int] = None
 ) -> dict:
     """
-    Process a single chunk for analysis (used in concurrent batches).
+    Process a single chunk for analysis (scheduled through openai_scheduler).
+    
+    Args:
+        estimated_input_tokens: Prompt size from the chunker's counts, for the rate limiter
     
     Returns:
         dict with analysis, input_tokens, output_tokens, cost, index
     """
-    try:
-        redacted_chunk = apply_redaction_filters(chunk)
-
-        # Sanitize: remove null bytes and non-JSON-safe control characters.
-        # Null bytes (\x00) and most C0 control chars cause OpenAI's server to reject
-        # the request with "could not parse the JSON body" (HTTP 400).
-        # We preserve legitimate whitespace: \t (9), \n (10), \r (13).
-        sanitized_chunk = "".join(
-            ch for ch in redacted_chunk
-            if ch == "\t" or ch == "\n" or ch == "\r" or ord(ch) >= 32
-        )
-
-        if not sanitized_chunk.strip():
-            # Nothing left after sanitization — skip silently.
-            raise ValueError(f"Chunk {chunk_idx + 1} is empty after sanitization, skipping.")
+    body = _analysis_request(chunk, chunk_idx, total_chunks, filename, system_prompt)
+    
+    # Serve identical requests from the analysis cache
+    cache_key = _analysis_cache_key(body)
+    cached = await _cached_analysis(cache_key, chunk_idx)
+    if cached is not None:
+        return cached
+    
+    # Call OpenAI
+    response = await openai_call_with_retry(
+        openai_client,
+        user_id=user_id,
+        estimated_input_tokens=estimated_input_tokens,
+        timeout=OPENAI_ANALYSIS_TIMEOUT,
+        **body
+    )
+    
+    return await _analysis_result(
+        chunk_idx,
+        response.choices[0].message.content,
+        response.usage.prompt_tokens,
+        response.usage.completion_tokens,
+        body["model"],
+        cache_key
+    )
 
-        # Get appropriate prompt from prompts module
-        prompt = get_analysis_prompt(
-            chunk=sanitized_chunk,
-            total_chunks=total_chunks,
-            filename=filename,
-            chunk_idx=chunk_idx
-        )
-        
-        # Build messages
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt}
-        ]
-        
-        # Call OpenAI
-        response = await openai_call_with_retry(
-            openai_client,
-            max_retries=3,
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.3,
-            max_completion_tokens=3000
+async def _run_analysis_batch(
+    state_key: str,
+    pending: Dict[int, str],
+    fingerprints: List[str],
+    total_chunks: int,
+    filename: str,
+    system_prompt: str,
+    user: AuthenticatedUser,
+    source_id: str
+) -> Dict[int, Any]:
+    """
+    Analyze chunks through the OpenAI Batch API (see openai_batch.py).
+    
+    Args:
+        state_key: Where the running batch is recorded (a restart re-attaches to it)
+        pending: Chunks to analyze, by index
+        fingerprints: chunk_fingerprint() per index (part of each request's custom_id)
+    
+    Returns:
+        index -> result dict (or the exception for that chunk). Chunks the batch
+        answered with an error are left out, and go through the interactive path.
+    
+    Raises:
+        BatchCancelled: The source was cancelled while the batch ran
+        BatchFailed: The batch failed as a whole (the analysis fails or is retried)
+    """
+    results: Dict[int, Any] = {}
+    requests = []
+    requested: Dict[str, Tuple[int, Dict[str, Any], Optional[str]]] = {}
+    for chunk_idx, chunk in pending.items():
+        try:
+            body = _analysis_request(chunk, chunk_idx, total_chunks, filename, system_prompt)
+        except ValueError as e:
+            results[chunk_idx] = e
+            continue
+        cache_key = _analysis_cache_key(body)
+        cached = await _cached_analysis(cache_key, chunk_idx)
+        if cached is not None:
+            results[chunk_idx] = cached
+            continue
+        custom_id = f"chunk-{chunk_idx}-{fingerprints[chunk_idx][:16]}"
+        requests.append((custom_id, body))
+        requested[custom_id] = (chunk_idx, body, cache_key)
+    if not requests:
+        return results
+    
+    async def report_progress(done: int, total: int):
+        await set_source_status({
+            "user_uuid": user.user_id,
+            "target_source_id": source_id,
+            "status_param": "analyzing",
+            "progress_param": 15 + int((done / total) * 35) if total else 15
+        })
+    
+    print(f"📦 [BATCH ANALYSIS] Sending {len(requests)} chunks through the OpenAI Batch API")
+    try:
+        answers = await openai_batch.run(
+            state_key,
+            requests,
+            metadata={"source_id": source_id, "phase": "analysis"},
+            on_progress=report_progress,
+            should_stop=lambda: source_id in cancelled_jobs
         )
-        
-        analysis = response.choices[0].message.content
-        
-        # Check for content policy refusal
-        if analysis and ("cannot assist" in analysis.lower() or "i'm sorry" in analysis.lower()[:50]):
-            raise ContentPolicyError(chunk_idx)
-        
-        # Calculate cost
-        input_tokens = response.usage.prompt_tokens
-        output_tokens = response.usage.completion_tokens
-        cost = (input_tokens * 0.00015 / 1000) + (output_tokens * 0.0006 / 1000)
-        
-        return {
-            "index": chunk_idx,
-            "analysis": analysis,
-            "input_tokens": input_tokens,
-            "output_tokens": output_tokens,
-            "cost": cost
-        }
-        
-    except Exception as e:
-        # Re-raise so gather() can catch it
-        raise
+    except BatchSubmitError as e:
+        print(f"⚠️ Batch analysis not submitted, analyzing interactively instead: {e}")
+        return results
+    
+    for custom_id, answer in answers.items():
+        chunk_idx, body, cache_key = requested[custom_id]
+        if "error" in answer:
+            print(f"   ⚠️ Chunk {chunk_idx + 1} failed in batch ({answer['error']}); retrying interactively")
+            continue
+        response = answer["body"]
+        usage = response.get("usage") or {}
+        try:
+            content = response["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            print(f"   ⚠️ Chunk {chunk_idx + 1} has a malformed batch answer; retrying interactively")
+            continue
+        try:
+            results[chunk_idx] = await _analysis_result(
+                chunk_idx,
+                content,
+                usage.get("prompt_tokens", 0),
+                usage.get("completion_tokens", 0),
+                body["model"],
+                cache_key,
+                price_factor=OPENAI_BATCH_PRICE_FACTOR
+            )
+        except ContentPolicyError as e:
+            results[chunk_idx] = e
+    answered = sum(1 for custom_id in answers if requested[custom_id][0] in results)
+    print(f"📦 [BATCH ANALYSIS] {answered}/{len(requests)} answered by the batch")
+    return results
 
 
-async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, user: AuthenticatedUser, max_chunks: int = None, custom_system_prompt: Optional[str] = None):
+async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, user: AuthenticatedUser, max_chunks: int = None, custom_system_prompt: Optional[str] = None, queued: bool = False):
     """Step 2: Analyze the chunks (OpenAI calls, deduct credits)
     
     Args:
         max_chunks: Optional limit on number of chunks to analyze (for partial analysis with limited credits)
+        queued: Running as a queued job: errors are re-raised for the queue to retry
+            (from the checkpoints) instead of failing the source; the queue lease
+            recovers it if the worker dies, so no registry record is kept
+    
+    A cancel made in any process (see cancel_source_analysis) is polled by
+    watch_cancellation and stops the analysis at the next chunk.
     """
+    async def finish_job_record():
+        if not queued:
+            await asyncio.to_thread(analysis_jobs.finish, source_id)
+    
+    async def mark_cancelled(processed_chunks: int):
+        await set_source_status({
+            "user_uuid": user.user_id,
+            "target_source_id": source_id,
+            "status_param": "failed",
+            "progress_param": 0,
+            "processed_chunks_param": processed_chunks,
+            "error_message_param": "Cancelled by user"
+        })
+        await finish_job_record()
+    
+    if await source_cancelled(user.r2_directory, pack_id, source_id):
+        # Cancelled while queued (or before a resume): the source is already marked failed
+        print(f"🛑 Source {source_id} was cancelled before its analysis started")
+        await finish_job_record()
+        return
+    cancel_watch = asyncio.create_task(watch_cancellation(user.r2_directory, pack_id, source_id))
+    
     try:
         log_source_processing(source_id, "analysis", "started")
         print(f"Starting analysis for source {source_id}")
         
         # Update status to analyzing
-        await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
+        await set_source_status({
             "user_uuid": user.user_id,
             "target_source_id": source_id,
             "status_param": "analyzing",
             "progress_param": 10
-        }).execute())
+        })
         
         # Load chunks from R2 (async to avoid blocking other requests)
         chunked_path = f"{user.r2_directory}/{pack_id}/{source_id}/chunked.json"
@@ -2311,6 +2647,15 @@ async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, use
         
         all_chunks = json.loads(chunks_data)
         
+        # Token counts recorded by the chunker (older sources have none), used to size rate-limit reservations
+        chunk_token_counts = []
+        chunk_tokens_data = await download_from_r2_async(f"{user.r2_directory}/{pack_id}/{source_id}/chunk_tokens.json", silent_404=True)
+        if chunk_tokens_data:
+            try:
+                chunk_token_counts = json.loads(chunk_tokens_data).get("token_counts") or []
+            except (ValueError, AttributeError):
+                chunk_token_counts = []
+        
         # Limit chunks if max_chunks is specified
         if max_chunks is not None and max_chunks < len(all_chunks):
             chunks = all_chunks[:max_chunks]
@@ -2336,15 +2681,6 @@ async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, use
         pack_analyzed_path = f"{user.r2_directory}/{pack_id}/complete_analyzed.txt"
         analyzed_path = f"{user.r2_directory}/{pack_id}/{source_id}/analyzed.txt"
         
-        # Get existing pack content (if any) - async to avoid blocking
-        existing_pack_content = await download_from_r2_async(pack_analyzed_path, silent_404=True) or ""
-        
-        # Add source separator
-        if existing_pack_content:
-            source_header = f"\n\n--- SOURCE: {filename} ---\n\n"
-        else:
-            source_header = f"--- SOURCE: {filename} ---\n\n"
-        
         base_system_prompt = "You are a personal data analysis assistant analyzing user-owned documents. Extract key insights concisely and comprehensively."
         if custom_system_prompt:
             trimmed_custom_prompt = custom_system_prompt.strip()
@@ -2355,6 +2691,31 @@ async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, use
         else:
             system_prompt = base_system_prompt
         
+        # Durable job record (lets another process resume this analysis if we die; queued
+        # jobs have their lease instead) and per-chunk checkpoints from any earlier, interrupted run
+        if not queued:
+            await asyncio.to_thread(analysis_jobs.start, source_id, {
+                "pack_id": pack_id,
+                "filename": filename,
+                "user_id": user.user_id,
+                "email": user.email,
+                "r2_directory": user.r2_directory,
+                "max_chunks": max_chunks,
+                "custom_system_prompt": custom_system_prompt,
+                "total_chunks": len(chunks),
+            })
+        checkpoints = AnalysisCheckpoints(
+            f"{user.r2_directory}/{pack_id}/{source_id}/checkpoints",
+            put=upload_to_r2,
+            get_many=download_many_from_r2,
+            list_keys=list_r2_objects,
+            delete_many=r2_client.delete_many,
+        )
+        fingerprints = [chunk_fingerprint(chunk, system_prompt, filename, len(chunks)) for chunk in chunks]
+        resumed = await asyncio.to_thread(checkpoints.load, fingerprints)
+        if resumed:
+            print(f"⏯️ Resuming analysis: {len(resumed)}/{len(chunks)} chunks restored from checkpoints")
+        
         # Determine scope for memory tree (before chunk loop)
         if MEMORY_TREE_ENABLED and MEMORY_TREE_AVAILABLE:
             scope = get_scope_for_source(source_id, filename, "")
@@ -2363,143 +2724,218 @@ async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, use
             scope = None  # Not using memory tree
         
         # ============================================================================
-        # CONCURRENT CHUNK ANALYSIS (10x faster than sequential)
+        # CONCURRENT CHUNK ANALYSIS (process-wide scheduler, sliding window)
         # ============================================================================
-        
-        # Adaptive batch size based on total chunks for better progress feedback
-        if len(chunks) <= 7:
-            BATCH_SIZE = 3  # Very small files: more frequent updates
-        elif len(chunks) <= 15:
-            BATCH_SIZE = 2  # Small-medium files (including 10 chunks): optimal feedback
-        elif len(chunks) <= 50:
-            BATCH_SIZE = 5  # Medium files: balance speed and feedback
-        else:
-            BATCH_SIZE = 10  # Large files: maximum speed
+        # All chunks are submitted at once; openai_scheduler bounds how many are in flight
+        # across every user, so a slow chunk only holds its own slot.
         
         all_analyses = []  # Store all analysis results with their indices
         successfully_processed_chunks = 0  # Track chunks that were successfully analyzed
-        
-        print(f"\n🚀 [CONCURRENT ANALYSIS] Processing {len(chunks)} chunks in batches of {BATCH_SIZE}")
-        
-        # Process chunks in batches
-        for batch_start in range(0, len(chunks), BATCH_SIZE):
-            # Check for cancellation before processing batch
-            if source_id in cancelled_jobs:
-                print(f"🛑 Cancellation detected for source {source_id}. Stopping at chunk {batch_start+1}/{len(chunks)}")
-                await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
-                    "user_uuid": user.user_id,
-                    "target_source_id": source_id,
-                    "status_param": "failed",
-                    "progress_param": 0,
-                    "processed_chunks_param": batch_start
-                }).execute())
+        completed_chunks = 0
+        cache_hits = 0
+        total_cached_tokens = 0  # Input tokens served from the analysis cache
+        cost_savings_from_cache = 0.0
+        last_reported_progress = -1
+        
+        checkpoint_writes = []  # Background checkpoint uploads, awaited before the final write
+        
+        print(f"\n🚀 [CONCURRENT ANALYSIS] Submitting {len(chunks) - len(resumed)} chunks (window: {openai_scheduler.limit} in flight)")
+        
+        # Prompt tokens around the chunk text (system prompt + analysis template), counted once
+        prompt_overhead_tokens = None
+        if len(chunk_token_counts) >= len(chunks):
+            prompt_overhead_tokens = sum(await asyncio.to_thread(count_segment_tokens, [
+                system_prompt,
+                get_analysis_prompt(chunk="", total_chunks=len(chunks), filename=filename, chunk_idx=0)
+            ]))
+        
+        # Large non-interactive sources: answer what we can through the Batch API first;
+        # chunks it answers with an error fall through to the interactive calls below
+        batch_results = {}
+        batch_state_key = f"{user.r2_directory}/{pack_id}/{source_id}/batch_analysis.json"
+        use_batch = openai_batch is not None and len(chunks) >= OPENAI_BATCH_MIN_CHUNKS and len(resumed) < len(chunks)
+        if use_batch:
+            try:
+                batch_results = await _run_analysis_batch(
+                    batch_state_key,
+                    {i: chunk for i, chunk in enumerate(chunks) if i not in resumed},
+                    fingerprints,
+                    total_chunks=len(chunks),
+                    filename=filename,
+                    system_prompt=system_prompt,
+                    user=user,
+                    source_id=source_id
+                )
+            except BatchCancelled:
+                # Stop here: sending the chunks interactively would bill the whole source at full price
+                print(f"🛑 Cancellation detected for source {source_id}. Batch cancelled after {len(resumed)}/{len(chunks)} chunks")
+                await mark_cancelled(len(resumed))
                 return
-            
-            batch_end = min(batch_start + BATCH_SIZE, len(chunks))
-            batch = chunks[batch_start:batch_end]
-            batch_num = (batch_start // BATCH_SIZE) + 1
-            total_batches = (len(chunks) + BATCH_SIZE - 1) // BATCH_SIZE
-            
-            print(f"\n📦 [BATCH {batch_num}/{total_batches}] Processing chunks {batch_start + 1}-{batch_end}")
-           
-            # Create concurrent tasks for this batch
-            tasks = []
-            for i, chunk in enumerate(batch):
-                chunk_idx = batch_start + i
-                task = _analyze_single_chunk(
+        
+        async def run_chunk(chunk_idx: int, chunk: str):
+            if chunk_idx in resumed:
+                return chunk_idx, resumed[chunk_idx]
+            if chunk_idx in batch_results:
+                return chunk_idx, batch_results[chunk_idx]
+            try:
+                return chunk_idx, await _analyze_single_chunk(
                     chunk=chunk,
                     chunk_idx=chunk_idx,
                     total_chunks=len(chunks),
                     filename=filename,
                     system_prompt=system_prompt,
-                    openai_client=openai_client
+                    openai_client=openai_client,
+                    user_id=user.user_id,
+                    estimated_input_tokens=(
+                        chunk_token_counts[chunk_idx] + prompt_overhead_tokens
+                        if prompt_overhead_tokens is not None else None
+                    )
                 )
-                tasks.append(task)
-            
-            # Execute batch concurrently
-            try:
-                batch_results = await asyncio.gather(*tasks, return_exceptions=True)
+            except Exception as e:
+                return chunk_idx, e
+        
+        tasks = [asyncio.create_task(run_chunk(i, chunk)) for i, chunk in enumerate(chunks)]
+        
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                chunk_idx, result = await next_done
+                completed_chunks += 1
                 
-                # Process results
-                for i, result in enumerate(batch_results):
-                    chunk_idx = batch_start + i
-                    
-                    if isinstance(result, ContentPolicyError):
-                        # Content policy violation - don't retry, don't deduct credits
-                        print(f"   ⚠️ Chunk {chunk_idx + 1} failed: Content policy violation")
-                        failed_chunks_count += 1
-                        log_chunk_analysis(chunk_idx, 0, 0, False, error="Content policy violation")
-                        all_analyses.append({
-                            "index": chunk_idx,
-                            "analysis": f"[Chunk {chunk_idx+1} could not be analyzed due to content policy restrictions.]",
-                            "input_tokens": 0,
-                            "output_tokens": 0,
-                            "cost": 0.0
-                        })
-                    elif isinstance(result, Exception):
-                        # Other errors
-                        print(f"   ⚠️ Chunk {chunk_idx + 1} failed: {result}")
-                        failed_chunks_count += 1
-                        log_chunk_analysis(chunk_idx, 0, 0, False, error=str(result))
-                        all_analyses.append({
-                            "index": chunk_idx,
-                            "analysis": f"[Chunk {chunk_idx+1} could not be analyzed: {str(result)}]",
-                            "input_tokens": 0,
-                            "output_tokens": 0,
-                            "cost": 0.0
-                        })
-                    elif isinstance(result, dict):
-                        # Successful analysis
-                        all_analyses.append(result)
-                        successfully_processed_chunks += 1
-                        total_input_tokens += result["input_tokens"]
-                        total_output_tokens += result["output_tokens"]
-                        total_cost += result["cost"]
-                        log_chunk_analysis(
-                            chunk_idx,
-                            result["input_tokens"],
-                            result["output_tokens"],
-                            True,
-                            cost=result["cost"]
-                        )
-                        print(f"   ✅ Chunk {chunk_idx + 1}/{len(chunks)}: {result['output_tokens']} tokens out, {result['input_tokens']} tokens in")
+                if isinstance(result, dict) and chunk_idx not in resumed:
+                    # Checkpoint right away so a restart does not repeat this OpenAI call
+                    checkpoint_writes.append(asyncio.create_task(
+                        asyncio.to_thread(checkpoints.save, chunk_idx, fingerprints[chunk_idx], result)
+                    ))
                 
-                # Update progress
-                progress = 50 + int((batch_end / len(chunks)) * 40)
-                await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
-                    "user_uuid": user.user_id,
-                    "target_source_id": source_id,
-                    "status_param": "analyzing",
-                    "progress_param": progress,
-                    "processed_chunks_param": batch_end
-                }).execute())
+                if isinstance(result, ContentPolicyError):
+                    # Content policy violation - don't retry, don't deduct credits
+                    print(f"   ⚠️ Chunk {chunk_idx + 1} failed: Content policy violation")
+                    failed_chunks_count += 1
+                    log_chunk_analysis(chunk_idx, 0, 0, False, error="Content policy violation")
+                    all_analyses.append({
+                        "index": chunk_idx,
+                        "analysis": f"[Chunk {chunk_idx+1} could not be analyzed due to content policy restrictions.]",
+                        "input_tokens": 0,
+                        "output_tokens": 0,
+                        "cost": 0.0
+                    })
+                elif isinstance(result, Exception):
+                    # Other errors
+                    print(f"   ⚠️ Chunk {chunk_idx + 1} failed: {result}")
+                    failed_chunks_count += 1
+                    log_chunk_analysis(chunk_idx, 0, 0, False, error=str(result))
+                    all_analyses.append({
+                        "index": chunk_idx,
+                        "analysis": f"[Chunk {chunk_idx+1} could not be analyzed: {str(result)}]",
+                        "input_tokens": 0,
+                        "output_tokens": 0,
+                        "cost": 0.0
+                    })
+                elif isinstance(result, dict) and result.get("cached"):
+                    # Served from the analysis cache - no OpenAI call made
+                    all_analyses.append(result)
+                    successfully_processed_chunks += 1
+                    cache_hits += 1
+                    total_cached_tokens += result["cached_input_tokens"]
+                    cost_savings_from_cache += result["cached_cost"]
+                    print(f"   ♻️ Chunk {chunk_idx + 1}/{len(chunks)}: cache hit ({result['cached_input_tokens']} tokens in saved)")
+                elif isinstance(result, dict):
+                    # Successful analysis
+                    all_analyses.append(result)
+                    successfully_processed_chunks += 1
+                    total_input_tokens += result["input_tokens"]
+                    total_output_tokens += result["output_tokens"]
+                    total_cost += result["cost"]
+                    log_chunk_analysis(
+                        chunk_idx,
+                        result["input_tokens"],
+                        result["output_tokens"],
+                        True,
+                        cost=result["cost"]
+                    )
+                    print(f"   ✅ Chunk {chunk_idx + 1}/{len(chunks)}: {result['output_tokens']} tokens out, {result['input_tokens']} tokens in")
                 
-                print(f"   📊 Progress: {progress}% ({batch_end}/{len(chunks)} chunks complete)")
+                # Check for cancellation as results come in
+                if source_id in cancelled_jobs:
+                    print(f"🛑 Cancellation detected for source {source_id}. Stopping after {completed_chunks}/{len(chunks)} chunks")
+                    await mark_cancelled(completed_chunks)
+                    return
                 
-            except Exception as e:
-                print(f"   ❌ Batch processing error: {e}")
-                continue
-        
-        # Sort analyses by index to maintain correct order
-        all_analyses.sort(key=lambda x: x["index"])
+                # Update progress whenever the visible percentage changes
+                progress = 50 + int((completed_chunks / len(chunks)) * 40)
+                if progress != last_reported_progress or completed_chunks == len(chunks):
+                    last_reported_progress = progress
+                    await set_source_status({
+                        "user_uuid": user.user_id,
+                        "target_source_id": source_id,
+                        "status_param": "analyzing",
+                        "progress_param": progress,
+                        "processed_chunks_param": completed_chunks
+                    })
+                    print(f"   📊 Progress: {progress}% ({completed_chunks}/{len(chunks)} chunks complete)")
+        finally:
+            # Drop queued/in-flight chunks if we exit early (cancellation or error)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        
+        # Let pending checkpoints land before the final write (clear() runs after it)
+        await asyncio.gather(*checkpoint_writes)
+        if await source_cancelled(user.r2_directory, pack_id, source_id):
+            # Cancelled after the last chunk check: do not write "completed" over it
+            print(f"🛑 Cancellation detected for source {source_id} after all {len(chunks)} chunks")
+            await mark_cancelled(completed_chunks)
+            return
+        if use_batch:
+            # Batch answers are checkpointed now; a restart no longer needs the batch
+            await openai_batch.discard(batch_state_key)
         
-        # Write all analyses to files in correct order (async to avoid blocking)
+        # Write all analyses in chunk order with one upload per object
+        # (multipart for very large packs) instead of a download/upload round trip per chunk
         print(f"\n📝 Writing {len(all_analyses)} analyses to files...")
-        for i, analysis_result in enumerate(all_analyses):
-            chunk_sep = f"\n\n--- Chunk {analysis_result['index']+1}/{len(chunks)} ---\n\n" if len(chunks) > 1 else "\n\n"
-            
-            # Append to pack file (async)
-            if i == 0:
-                await upload_to_r2_async(pack_analyzed_path, existing_pack_content + source_header + analysis_result["analysis"])
-            else:
-                current = await download_from_r2_async(pack_analyzed_path) or ""
-                await upload_to_r2_async(pack_analyzed_path, current + chunk_sep + analysis_result["analysis"])
-            
-            # Append to individual source file (async)
-            current_source = await download_from_r2_async(analyzed_path, silent_404=True) or ""
-            await upload_to_r2_async(analyzed_path, current_source + chunk_sep + analysis_result["analysis"])
-        
-        print(f"✅ All analyses written to R2")
+        writer = AnalysisWriter(filename=filename, total_chunks=len(chunks))
+        for analysis_result in all_analyses:
+            writer.add(analysis_result["index"], analysis_result["analysis"])
+        
+        transfers_before = transfer_stats.snapshot()
+        write_ok = await asyncio.to_thread(
+            writer.commit,
+            source_key=analyzed_path,
+            pack_key=pack_analyzed_path,
+            upload=upload_to_r2,
+            download=lambda key: download_from_r2(key, silent_404=True),
+            multipart_upload=r2_client.multipart_upload,
+            multipart_threshold=R2_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+            part_size=R2_MULTIPART_PART_SIZE_MB * 1024 * 1024,
+        )
+        transfers = TransferStats.delta(transfers_before, transfer_stats.snapshot())
+        if not write_ok:
+            raise Exception("Failed to write analysis results to storage")
+        
+        print(f"✅ All analyses written to R2 (transfers: {transfers})")
+        
+        # Record usage and cache performance for /api/cache-performance/{source_id}
+        cache_hit_rate = round(cache_hits / len(chunks), 4) if chunks else 0
+        if cache_hits:
+            print(f"♻️ Analysis cache: {cache_hits}/{len(chunks)} chunks reused, ~${cost_savings_from_cache:.4f} saved")
+        analysis_summary = {
+            "job_id": source_id,
+            "pack_id": pack_id,
+            "processed_chunks": successfully_processed_chunks,
+            "total_chunks": len(chunks),
+            "total_input_tokens": total_input_tokens,
+            "total_output_tokens": total_output_tokens,
+            "total_cost": total_cost,
+            "cache_hits": cache_hits,
+            "total_cached_tokens": total_cached_tokens,
+            "cache_hit_rate": cache_hit_rate,
+            "cost_savings_from_cache": cost_savings_from_cache,
+            "completed_at": datetime.utcnow().isoformat()
+        }
+        await upload_to_r2_async(
+            f"{user.r2_directory}/{pack_id}/{source_id}/analysis_summary.json",
+            json.dumps(analysis_summary, indent=2)
+        )
         
         # Update source status to completed (whether full or partial analysis)
         # If user had limited credits, they successfully completed what they could afford
@@ -2508,7 +2944,7 @@ async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, use
         if failed_chunks_count > 0:
             warning_message = f"⚠️ WARNING: {failed_chunks_count} chunk(s) failed due to content policy restrictions. No credits were deducted for failed chunks. This may occur with documents containing sensitive personal information like receipts, invoices, or official records."
         
-        await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
+        await set_source_status({
             "user_uuid": user.user_id,
             "target_source_id": source_id,
             "status_param": "completed",
@@ -2519,7 +2955,14 @@ async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, use
             "total_output_tokens_param": total_output_tokens,
             "total_cost_param": total_cost,
             "error_message_param": warning_message  # Use error_message field for warning
-        }).execute())
+        })
+        
+        # The analysis is durable now: drop the job record and its checkpoints
+        await finish_job_record()
+        asyncio.create_task(asyncio.to_thread(checkpoints.clear))
+        
+        # Add this source to the pack's stored exports (only its analysis is downloaded)
+        asyncio.create_task(refresh_pack_exports(user, pack_id))
         
         # Note: chunks_analyzed counter removed (legacy only)
         # V2 packs track processed_chunks at pack_sources level
@@ -2537,12 +2980,12 @@ async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, use
         if MEMORY_TREE_ENABLED and MEMORY_TREE_AVAILABLE:
             try:
                 # Update status to show tree is building
-                await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
+                await set_source_status({
                     "user_uuid": user.user_id,
                     "target_source_id": source_id,
                     "status_param": "building_tree",
                     "progress_param": 95
-                }).execute())
+                })
                 
                 print(f"\n[MEMORY TREE] Starting second-pass tree extraction...")
                 print(f"   Pack ID: {pack_id}")
@@ -2556,26 +2999,31 @@ async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, use
                     max_tree_chunks=None  # Process all chunks by default
                 )
                 
+                if await source_cancelled(user.r2_directory, pack_id, source_id):
+                    # Tree building stopped and marked the source failed
+                    return
+                
                 # Mark as fully completed after tree building
-                await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
+                await set_source_status({
                     "user_uuid": user.user_id,
                     "target_source_id": source_id,
                     "status_param": "completed",
                     "progress_param": 100
-                }).execute())
+                })
                 print(f"✅ Source {source_id} marked as completed (progress: 100%)")
                 
             except Exception as tree_error:
                 print(f"❌ [TREE] Tree building failed (non-fatal): {tree_error}")
                 import traceback
                 print(f"   Traceback: {traceback.format_exc()}")
-                # Still mark as completed even if tree building fails
-                await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
+                # Still mark as completed (the analysis is stored), but say the tree is missing
+                await set_source_status({
                     "user_uuid": user.user_id,
                     "target_source_id": source_id,
                     "status_param": "completed",
-                    "progress_param": 100
-                }).execute())
+                    "progress_param": 100,
+                    "error_message_param": f"Analysis complete, but the memory tree could not be saved: {str(tree_error)[:300]}"
+                })
         else:
             print(f"⚠️ [TREE] Skipping second-pass tree extraction (feature disabled or unavailable)")
         
@@ -2585,7 +3033,7 @@ async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, use
                 # Get pack name from database (use default if query fails)
                 pack_name = "Your Pack"
                 try:
-                    pack_result = await asyncio.to_thread(lambda: supabase.table("packs_v2").select("pack_name").eq("pack_id", pack_id).execute())
+                    pack_result = await db.table("packs_v2").select("pack_name").eq("pack_id", pack_id).execute()
                     if pack_result.data:
                         pack_name = pack_result.data[0]["pack_name"]
                 except Exception as db_error:
@@ -2615,17 +3063,24 @@ async def analyze_source_chunks(pack_id: str, source_id: str, filename: str, use
     except Exception as e:
         print(f"❌ Error analyzing source {source_id}: {e}")
         
+        # Checkpoints are kept: a retry of the same source reuses them
+        await finish_job_record()
+        if queued:
+            raise
+        
         # Update source status to failed
-        await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
+        await set_source_status({
             "user_uuid": user.user_id,
             "target_source_id": source_id,
             "status_param": "failed",
             "error_message_param": str(e)
-        }).execute())
+        })
         
         
         # Note: Failure email notification not implemented yet
         # Users will see error in UI when they check back
+    finally:
+        cancel_watch.cancel()
 
 
 # Second-pass tree building from analysis text
@@ -2643,7 +3098,10 @@ async def build_tree_from_analysis(
     This runs AFTER analyze_source_chunks completes. It reads the
     high-quality narrative analysis and extracts structured facts into the tree.
    
-    NOW WITH CONCURRENT BATCH PROCESSING for 10x speedup on large files.
+    Chunks are submitted to the process-wide openai_scheduler, which bounds
+    concurrency across all users. Extracted facts are merged in memory by a
+    MemoryTreeBatch and merged into the stored nodes in bulk every
+    MEMORY_TREE_FLUSH_EVERY chunks.
    
     Args:
         pack_id: Pack identifier
@@ -2699,74 +3157,64 @@ async def build_tree_from_analysis(
     user_id = user.user_id
    
     # ============================================================================
-    # CONCURRENT BATCH PROCESSING (10x faster than sequential)
+    # CONCURRENT PROCESSING (process-wide scheduler, sliding window)
     # ============================================================================
     
-    # Adaptive batch size based on total chunks for better progress feedback
     total_chunks = len(chunk_analyses)
-    if total_chunks <= 7:
-        BATCH_SIZE = 3  # Very small files: more frequent updates
-    elif total_chunks <= 15:
-        BATCH_SIZE = 2  # Small-medium files (including 10 chunks): optimal feedback
-    elif total_chunks <= 50:
-        BATCH_SIZE = 5  # Medium files: balance speed and feedback
-    else:
-        BATCH_SIZE = 10  # Large files: maximum speed
-    
     total_nodes = 0
-    total_batches = (total_chunks + BATCH_SIZE - 1) // BATCH_SIZE
+    completed_chunks = 0
+    chunks_since_flush = 0
+    last_reported_progress = -1
     
-    print(f"🚀 [CONCURRENT] Processing {total_chunks} chunks in batches of {BATCH_SIZE}")
+    print(f"🚀 [CONCURRENT] Submitting {total_chunks} chunks (window: {openai_scheduler.limit} in flight)")
     
     # Start tree building at 95% progress (analysis was 0-90%)
     # Don't reset processed_chunks - maintain the count from analysis phase
-    try:
-        initial_message = f"Building tree.."
-        await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
-            "user_uuid": user_id,
-            "target_source_id": source_id,
-            "status_param": "building_tree",
-            "progress_param": 95,  # Start tree building at 95% (analysis complete)
-            "total_chunks_param": total_chunks,
-            "error_message_param": initial_message
-        }).execute())
-        print(f" Initial status: {initial_message}")
-    except:
-        pass
+    initial_message = f"Building tree.."
+    await set_source_status({
+        "user_uuid": user_id,
+        "target_source_id": source_id,
+        "status_param": "building_tree",
+        "progress_param": 95,  # Start tree building at 95% (analysis complete)
+        "total_chunks_param": total_chunks,
+        "error_message_param": initial_message
+    })
+    print(f" Initial status: {initial_message}")
     
-    # Process chunks in batches
-    for batch_start in range(0, total_chunks, BATCH_SIZE):
-        # CHECK FOR CANCELLATION before processing each batch
-        if source_id in cancelled_jobs:
-            print(f"\n🚫 [TREE] Cancellation detected - stopping tree building for source {source_id}")
-            try:
-                await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
-                    "user_uuid": user_id,
-                    "target_source_id": source_id,
-                    "status_param": "failed",
-                    "progress_param": 0,
-                    "total_chunks_param": total_chunks,
-                    "error_message_param": "Cancelled by user"
-                }).execute())
-                print(f"✅ Source {source_id} marked as failed (user cancelled)")
-            except Exception as e:
-                print(f"❌ Error updating cancelled status: {e}")
-            
-            # Remove from cancelled jobs set
+    # Large sources: extract through the Batch API first; chunks it answers with an error go interactive
+    batch_results = {}
+    batch_state_key = f"{user.r2_directory}/{pack_id}/{source_id}/batch_tree.json"
+    use_batch = openai_batch is not None and total_chunks >= OPENAI_BATCH_MIN_CHUNKS
+    if use_batch:
+        try:
+            batch_results = await _run_tree_batch(batch_state_key, chunk_analyses, scope, source_id)
+        except BatchCancelled:
+            print(f"\n🚫 [TREE] Cancellation detected - batch cancelled for source {source_id}")
+            await set_source_status({
+                "user_uuid": user_id,
+                "target_source_id": source_id,
+                "status_param": "failed",
+                "progress_param": 0,
+                "total_chunks_param": total_chunks,
+                "error_message_param": "Cancelled by user"
+            })
             cancelled_jobs.discard(source_id)
-            return  # Exit tree building immediately
-        
-        batch_end = min(batch_start + BATCH_SIZE, total_chunks)
-        batch = chunk_analyses[batch_start:batch_end]
-        batch_num = (batch_start // BATCH_SIZE) + 1
-        total_batches = (total_chunks + BATCH_SIZE - 1) // BATCH_SIZE
-        
-        print(f"\n📦 [BATCH {batch_num}/{total_batches}] Processing chunks {batch_start + 1}-{batch_end}")
-        
-        # Create tasks for concurrent processing
-        tasks = []
-        for chunk_analysis in batch:
-            task = _process_single_chunk_tree(
+            return
+    
+    # Preload node ids once the facts are about to arrive (a batch may have run for hours);
+    # facts are merged in memory and into the stored nodes on each flush
+    tree_batch = MemoryTreeBatch(user_id, pack_id, scope)
+    try:
+        await asyncio.to_thread(tree_batch.load)
+    except Exception as e:
+        # Optional: ids of nodes not preloaded are looked up on flush
+        print(f"⚠️ Failed to preload memory tree nodes, looking them up on flush: {e}")
+    
+    async def run_chunk(chunk_analysis: dict):
+        if chunk_analysis["index"] in batch_results:
+            return chunk_analysis["index"], batch_results[chunk_analysis["index"]]
+        try:
+            return chunk_analysis["index"], await _process_single_chunk_tree(
                 chunk_analysis=chunk_analysis,
                 scope=scope,
                 user=user,
@@ -2774,53 +3222,87 @@ async def build_tree_from_analysis(
                 source_id=source_id,
                 total_chunks=total_chunks
             )
-            tasks.append(task)
-        
-        # Execute batch concurrently
-        try:
-            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
+        except Exception as e:
+            return chunk_analysis["index"], e
+    
+    tasks = [asyncio.create_task(run_chunk(chunk_analysis)) for chunk_analysis in chunk_analyses]
+    
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            chunk_idx, result = await next_done
+            completed_chunks += 1
             
-            # Count successful extractions and handle errors
-            batch_nodes = 0
-            for i, result in enumerate(batch_results):
-                if isinstance(result, Exception):
-                    chunk_idx = batch[i]["index"]
-                    print(f"   ⚠️ Chunk {chunk_idx + 1} failed: {result}")
-                elif isinstance(result, int):
-                    batch_nodes += result
+            if isinstance(result, Exception):
+                print(f"   ⚠️ Chunk {chunk_idx + 1} failed: {result}")
+            elif isinstance(result, dict):
+                total_nodes += tree_batch.add_chunk(result, source_id, chunk_idx)
+                chunks_since_flush += 1
             
-            total_nodes += batch_nodes
-            print(f"   ✅ Batch complete: ~{batch_nodes} nodes extracted")
+            # CHECK FOR CANCELLATION as results come in
+            if source_id in cancelled_jobs:
+                print(f"\n🚫 [TREE] Cancellation detected - stopping tree building for source {source_id}")
+                # Keep what was already extracted
+                try:
+                    await asyncio.to_thread(tree_batch.flush)
+                except Exception as e:
+                    print(f"❌ Error flushing memory tree: {e}")
+                await set_source_status({
+                    "user_uuid": user_id,
+                    "target_source_id": source_id,
+                    "status_param": "failed",
+                    "progress_param": 0,
+                    "total_chunks_param": total_chunks,
+                    "error_message_param": "Cancelled by user"
+                })
+                print(f"✅ Source {source_id} marked as failed (user cancelled)")
+                
+                # Remove from cancelled jobs set
+                cancelled_jobs.discard(source_id)
+                return  # Exit tree building immediately
             
-            # Update progress AFTER batch completes with correct chunk count
             # Tree building uses 95-100% range (analysis was 0-90%)
-            chunks_processed = batch_end  # Chunks completed so far
-            tree_progress_percent = int((chunks_processed / total_chunks) * 100)
-            # Map 0-100% of tree building to 95-100% overall progress
+            tree_progress_percent = int((completed_chunks / total_chunks) * 100)
             overall_progress = 95 + int(tree_progress_percent * 0.05)
+            if chunks_since_flush >= MEMORY_TREE_FLUSH_EVERY:
+                try:
+                    await asyncio.to_thread(tree_batch.flush)
+                    chunks_since_flush = 0
+                except Exception as e:
+                    # Pending writes stay buffered and are retried on the next flush
+                    print(f"   ⚠️ Memory tree flush failed: {e}")
             
-            # Create detailed progress message
-            progress_message = f"Building tree: Batch {batch_num}/{total_batches} ({chunks_processed}/{total_chunks} chunks)"
+            if overall_progress == last_reported_progress and completed_chunks != total_chunks:
+                continue
+            last_reported_progress = overall_progress
             
-            try:
-                await asyncio.to_thread(lambda: supabase.rpc("update_source_status", {
-                    "user_uuid": user_id,
-                    "target_source_id": source_id,
-                    "status_param": "building_tree",
-                    "progress_param": overall_progress,  # 95-100% range
-                    "total_chunks_param": total_chunks,
-                    "error_message_param": progress_message
-                }).execute())
-                print(f"Progress: {progress_message} ({overall_progress}%)")
-            except:
-                pass
+            # Create detailed progress message
+            progress_message = f"Building tree: {completed_chunks}/{total_chunks} chunks"
             
-        except Exception as e:
-            print(f"   ❌ Batch processing error: {e}")
-            # Continue with next batch even if this one fails
-            continue
-   
-    print(f"\n🎉 Tree building complete: ~{total_nodes} nodes created from {total_chunks} chunks")
+            await set_source_status({
+                "user_uuid": user_id,
+                "target_source_id": source_id,
+                "status_param": "building_tree",
+                "progress_param": overall_progress,  # 95-100% range
+                "total_chunks_param": total_chunks,
+                "error_message_param": progress_message
+            })
+            print(f"Progress: {progress_message} ({overall_progress}%)")
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    
+    try:
+        await asyncio.to_thread(tree_batch.flush)
+    except Exception as e:
+        # Facts of unflushed chunks are lost with the batch: surface it instead of finishing quietly
+        raise Exception(f"Memory tree flush failed: {e}") from e
+    if use_batch:
+        await openai_batch.discard(batch_state_key)
+    
+    print(f"\n🎉 Tree building complete: {total_nodes} facts merged from {total_chunks} chunks "
+          f"({tree_batch.stats['nodes_inserted']} new nodes, {tree_batch.stats['nodes_updated']} updates, "
+          f"{tree_batch.stats['round_trips']} DB round trips)")
 
 
 async def _process_single_chunk_tree(
@@ -2830,75 +3312,110 @@ async def _process_single_chunk_tree(
     pack_id: str,
     source_id: str,
     total_chunks: int
-) -> int:
+) -> Optional[Dict[str, Any]]:
     """
-    Process a single chunk for tree extraction (used in concurrent batches).
+    Extract structured facts for a single chunk (scheduled through openai_scheduler).
+    
+    The caller merges the facts into its MemoryTreeBatch.
     
     Returns:
-        Number of nodes created from this chunk
+        Parsed structured facts, or None if the response was not valid JSON
     """
     idx = chunk_analysis["index"]
-    text = chunk_analysis["text"]
-    
-    # Get tree extraction prompt from prompts module
-    tree_prompt = get_tree_prompt(scope=scope, text=text)
-   
-# Define a global semaphore for limiting concurrent DB writes during tree building
-    # This prevents the Supabase connection pool from being exhausted
-    if not hasattr(_process_single_chunk_tree, "db_write_semaphore"):
-        _process_single_chunk_tree.db_write_semaphore = asyncio.Semaphore(2)
+    body = _tree_request(chunk_analysis["text"], scope)
 
     # Call OpenAI for tree extraction
     try:
         response = await openai_call_with_retry(
-            default_openai_client,
-            max_retries=3,
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You extract structured knowledge from analysis text."},
-                {"role": "user", "content": tree_prompt}
-            ],
-            temperature=0.2,
-            max_completion_tokens=1500
+            get_openai_client(),
+            user_id=getattr(user, "user_id", None),
+            timeout=OPENAI_TREE_TIMEOUT,
+            **body
         )
-       
-        tree_json_str = response.choices[0].message.content
-       
-        # Parse JSON
-        try:
-            # Clean up potential markdown formatting
-            cleaned = tree_json_str.strip()
-            if cleaned.startswith('```'):
-                lines = cleaned.split('\n')
-                cleaned = '\n'.join(lines[1:-1] if len(lines) > 2 else lines)
-           
-            structured = json.loads(cleaned)
-           
-            # Apply to memory tree using semaphore to prevent DB connection pool starvation
-            async with _process_single_chunk_tree.db_write_semaphore:
-                await asyncio.to_thread(
-                    apply_chunk_to_memory_tree,
-                    structured, # structured_facts
-                    scope,      # scope
-                    user,       # user
-                    pack_id,    # pack_id
-                    source_id,  # source_id
-                    idx         # chunk_index
-                )
-           
-            # Count nodes (rough estimate)
-            node_count = sum(len(v) if isinstance(v, list) else 1 for v in structured.values() if v)
-            return node_count
-           
-        except json.JSONDecodeError as e:
-            print(f"   ⚠️ Chunk {idx + 1} JSON parse error: {e}")
-            return 0
+        return _parse_tree_response(response.choices[0].message.content, idx)
            
     except Exception as e:
         print(f"   ❌ Chunk {idx + 1} extraction failed: {e}")
-        raise  # Re-raise for gather() to catch
+        raise  # Re-raise so the caller records the failure
+
+
+def _tree_request(text: str, scope: str) -> Dict[str, Any]:
+    """Chat-completion body extracting structured facts from one chunk analysis."""
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": "You extract structured knowledge from analysis text."},
+            {"role": "user", "content": get_tree_prompt(scope=scope, text=text)}
+        ],
+        "temperature": 0.2,
+        "max_completion_tokens": 1500
+    }
 
 
+def _parse_tree_response(content: Optional[str], idx: int) -> Optional[Dict[str, Any]]:
+    """Parse a tree extraction answer; None if it is not a JSON object."""
+    try:
+        # Clean up potential markdown formatting
+        cleaned = (content or "").strip()
+        if cleaned.startswith('```'):
+            lines = cleaned.split('\n')
+            cleaned = '\n'.join(lines[1:-1] if len(lines) > 2 else lines)
+       
+        structured = json.loads(cleaned)
+        return structured if isinstance(structured, dict) else None
+       
+    except json.JSONDecodeError as e:
+        print(f"   ⚠️ Chunk {idx + 1} JSON parse error: {e}")
+        return None
+
+
+async def _run_tree_batch(state_key: str, chunk_analyses: List[dict], scope: str, source_id: str) -> Dict[int, Any]:
+    """
+    Extract tree facts for chunk analyses through the OpenAI Batch API.
+    
+    Returns:
+        index -> parsed facts (or None for an unparseable answer). Chunks the
+        batch answered with an error are left out, and go through the interactive path.
+    
+    Raises:
+        BatchCancelled: The source was cancelled while the batch ran
+        BatchFailed: The batch failed as a whole
+    """
+    requests = []
+    requested: Dict[str, int] = {}
+    for chunk_analysis in chunk_analyses:
+        idx = chunk_analysis["index"]
+        digest = hashlib.sha256(chunk_analysis["text"].encode("utf-8")).hexdigest()[:16]
+        custom_id = f"tree-{idx}-{digest}"
+        requests.append((custom_id, _tree_request(chunk_analysis["text"], scope)))
+        requested[custom_id] = idx
+    
+    print(f"📦 [BATCH TREE] Sending {len(requests)} chunks through the OpenAI Batch API")
+    try:
+        answers = await openai_batch.run(
+            state_key,
+            requests,
+            metadata={"source_id": source_id, "phase": "tree"},
+            should_stop=lambda: source_id in cancelled_jobs
+        )
+    except BatchSubmitError as e:
+        print(f"⚠️ Batch tree extraction not submitted, extracting interactively instead: {e}")
+        return {}
+    
+    results: Dict[int, Any] = {}
+    for custom_id, answer in answers.items():
+        idx = requested[custom_id]
+        if "error" in answer:
+            print(f"   ⚠️ Chunk {idx + 1} failed in batch ({answer['error']}); retrying interactively")
+            continue
+        try:
+            content = answer["body"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            continue
+        results[idx] = _parse_tree_response(content, idx)
+    print(f"📦 [BATCH TREE] {len(results)}/{len(requests)} answered by the batch")
+    return results
+
 
 @app.get("/api/job-summary/{job_id}")
 async def get_job_summary(job_id: str, user: AuthenticatedUser = Depends(get_current_user)):
@@ -2977,7 +3494,7 @@ async def get_extraction_results(job_id: str, user: AuthenticatedUser = Depends(
             for attempt in range(3):  # Try 3 times with delays
                 try:
                     if supabase:  # Use global supabase client
-                        pack_result = supabase.table('packs').select('*').eq('job_id', job_id).eq('user_id', user.user_id).execute()
+                        pack_result = await db.table('packs').select('*').eq('job_id', job_id).eq('user_id', user.user_id).execute()
                         if pack_result.data:
                             pack_available = True
                             pack_info = pack_result.data[0]
@@ -3049,7 +3566,7 @@ async def get_payment_history(user: AuthenticatedUser = Depends(get_current_user
             return {"transactions": [], "summary": {}}
         
         # Get all transactions for the user
-        transactions = supabase.table("credit_transactions").select("*").eq("user_id", user.user_id).order("created_at", desc=True).limit(100).execute()
+        transactions = await db.table("credit_transactions").select("*").eq("user_id", user.user_id).order("created_at", desc=True).limit(100).execute()
         
         if not transactions.data:
             return {
@@ -3096,12 +3613,12 @@ async def purchase_credits(request: CreditPurchaseRequest, user: AuthenticatedUs
             raise HTTPException(status_code=400, detail="Amount must be greater than 0")
         
         # Get current user profile to validate
-        result = supabase.table("user_profiles").select("*").eq("id", user.user_id).execute()
+        result = await db.table("user_profiles").select("*").eq("id", user.user_id).execute()
         if not result.data:
             raise HTTPException(status_code=404, detail="User profile not found")
         
         # Use the database function to add credits (handles both transaction and balance update)
-        credit_result = supabase.rpc("add_credits_to_user", {
+        credit_result = await db.rpc("add_credits_to_user", {
             "user_uuid": user.user_id,
             "credits_to_add": request.credits,
             "transaction_description": f"Credit purchase - ${request.amount} for {request.credits} credits"
@@ -3142,7 +3659,7 @@ async def get_user_profile(user: AuthenticatedUser = Depends(get_current_user)):
             }
         
         # Get user profile using database function
-        result = supabase.rpc("get_user_profile_for_backend", {"user_uuid": user.user_id}).execute()
+        result = await db.rpc("get_user_profile_for_backend", {"user_uuid": user.user_id}).execute()
         
         if result.data:
             profile = result.data
@@ -3171,7 +3688,7 @@ async def get_user_profile(user: AuthenticatedUser = Depends(get_current_user)):
             }
         else:
             # Create profile if it doesn't exist
-            create_result = supabase.rpc("create_user_profile_for_backend", {
+            create_result = await db.rpc("create_user_profile_for_backend", {
                 "user_uuid": user.user_id,
                 "user_email": getattr(user, 'email', "unknown@example.com"),
                 "r2_dir": f"user_{user.user_id}"
@@ -3213,9 +3730,6 @@ async def get_user_profile(user: AuthenticatedUser = Depends(get_current_user)):
             "error": str(e)
         }
 
-# Global job cancellation tracking
-cancelled_jobs = set()
-
 @app.post("/api/cancel/{job_id}")
 async def cancel_job(job_id: str, user: AuthenticatedUser = Depends(get_current_user)):
     """Cancel a running analysis job"""
@@ -3338,27 +3852,28 @@ async def get_job_progress_stream(job_id: str, user: AuthenticatedUser = Depends
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/download/{job_id}/complete")
-async def download_complete_ucp(job_id: str, user: AuthenticatedUser = Depends(get_current_user)):
-    """Download complete UCP file from R2. Works with both legacy jobs and v2 packs."""
+async def download_complete_ucp(
+    job_id: str,
+    user: AuthenticatedUser = Depends(get_current_user)
+):
+    """Download complete UCP file from R2. Works with both legacy jobs and v2 packs. Streamed; no ETag, so no Range."""
     try:
         print(f"Attempting to download complete UCP for job/pack: {job_id}")
         
         # Try direct path first (legacy jobs)
-        content = download_from_r2_with_fallback(
+        part = await asyncio.to_thread(
+            find_r2_part_with_fallback,
             f"{user.r2_directory}/{job_id}/complete_ucp.txt",
             job_id,
-            "complete_ucp.txt",
-            silent_404=True
+            "complete_ucp.txt"
         )
+        parts = [part] if part else None
         
         # If not found, check if this is a v2 pack with sources
-        if not content and supabase:
+        if not parts and supabase:
             try:
                 print(f"Checking if {job_id} is a v2 pack...")
-                result = supabase.rpc("get_pack_details_v2", {
-                    "user_uuid": user.user_id,
-                    "target_pack_id": job_id
-                }).execute()
+                result = await db.get_pack_details_v2(user.user_id, job_id)
                 
                 print(f"Pack lookup result: {result.data is not None}")
                 if result.data:
@@ -3370,16 +3885,17 @@ async def download_complete_ucp(job_id: str, user: AuthenticatedUser = Depends(g
                     legacy_job_id = pack_data.get("legacy_job_id")
                     if legacy_job_id:
                         print(f"Pack has legacy_job_id: {legacy_job_id}, trying that path...")
-                        content = download_from_r2_with_fallback(
+                        part = await asyncio.to_thread(
+                            find_r2_part_with_fallback,
                             f"{user.r2_directory}/{legacy_job_id}/complete_ucp.txt",
                             legacy_job_id,
-                            "complete_ucp.txt",
-                            silent_404=True
+                            "complete_ucp.txt"
                         )
-                        if content:
+                        if part:
+                            parts = [part]
                             print(f"✅ Found complete_ucp.txt in legacy job {legacy_job_id}")
                     
-                    if not content:
+                    if not parts:
                         # Try to find complete_ucp.txt in any of the sources
                         for source in sources:
                             source_id = source.get("source_id")
@@ -3388,51 +3904,52 @@ async def download_complete_ucp(job_id: str, user: AuthenticatedUser = Depends(g
                             
                             if source_id:
                                 # Try the source's directory
-                                content = download_from_r2_with_fallback(
+                                part = await asyncio.to_thread(
+                                    find_r2_part_with_fallback,
                                     f"{user.r2_directory}/{source_id}/complete_ucp.txt",
                                     source_id,
-                                    "complete_ucp.txt",
-                                    silent_404=True
+                                    "complete_ucp.txt"
                                 )
-                                if content:
+                                if part:
+                                    parts = [part]
                                     print(f"✅ Found complete_ucp.txt in source {source_id}")
                                     break
                     
                     # If still not found, try to get the combined pack analysis
-                    if not content:
+                    if not parts:
                         pack_analyzed_path = f"{user.r2_directory}/{job_id}/complete_analyzed.txt"
-                        content = download_from_r2(pack_analyzed_path, silent_404=True)
-                        if content:
+                        part = await asyncio.to_thread(r2_download_part, pack_analyzed_path)
+                        if part:
+                            parts = [part]
                             print(f"✅ Found combined pack analysis")
                     
-                    # If still not found, generate UCP from analyzed sources
-                    if not content and sources:
+                    # If still not found, stream a UCP assembled from the analyzed sources
+                    if not parts and sources:
                         print("No pre-generated UCP found, creating from pack sources...")
-                        combined_content = []
                         pack_name = pack_data.get("pack_name", "Untitled Pack")
                         
-                        combined_content.append(f"UNIVERSAL CONTEXT PACK - {pack_name}")
-                        combined_content.append("=" * 80)
-                        combined_content.append(f"\nGenerated from {len(sources)} source(s)\n")
+                        # Size up every completed source's analysis concurrently
+                        completed_sources = [s for s in sources if s.get("status") == "completed"]
+                        analyzed_parts = await asyncio.to_thread(
+                            r2_download_parts,
+                            [f"{user.r2_directory}/{job_id}/{s.get('source_id')}/analyzed.txt" for s in completed_sources]
+                        )
                         
-                        for source in sources:
-                            if source.get("status") == "completed":
-                                source_id = source.get("source_id")
-                                source_name = source.get("source_name", "unknown")
-                                
-                                # Try to get analyzed content
-                                analyzed_path = f"{user.r2_directory}/{job_id}/{source_id}/analyzed.txt"
-                                analyzed_content = download_from_r2(analyzed_path, silent_404=True)
-                                
-                                if analyzed_content:
-                                    combined_content.append(f"\n{'='*80}")
-                                    combined_content.append(f"SOURCE: {source_name}")
-                                    combined_content.append('='*80 + '\n')
-                                    combined_content.append(analyzed_content)
+                        source_parts = []
+                        for source in completed_sources:
+                            source_id = source.get("source_id")
+                            source_name = source.get("source_name", "unknown")
+                            
+                            analyzed_part = analyzed_parts.get(f"{user.r2_directory}/{job_id}/{source_id}/analyzed.txt")
+                            
+                            if analyzed_part:
+                                source_parts.append(Part.text(f"\n\n{'='*80}\nSOURCE: {source_name}\n{'='*80}\n\n"))
+                                source_parts.append(analyzed_part)
                         
-                        if len(combined_content) > 3:  # Has content beyond header
-                            content = "\n".join(combined_content)
-                            print(f"✅ Generated UCP from {len([s for s in sources if s.get('status') == 'completed'])} completed sources")
+                        if source_parts:  # Has content beyond header
+                            header = f"UNIVERSAL CONTEXT PACK - {pack_name}\n{'=' * 80}\n\nGenerated from {len(sources)} source(s)\n"
+                            parts = [Part.text(header)] + source_parts
+                            print(f"✅ Streaming UCP from {len(source_parts) // 2} completed sources")
                 else:
                     print(f"No pack found with ID {job_id}")
             except Exception as e:
@@ -3440,64 +3957,56 @@ async def download_complete_ucp(job_id: str, user: AuthenticatedUser = Depends(g
                 import traceback
                 traceback.print_exc()
         
-        if content is None:
+        if not parts:
             raise HTTPException(status_code=404, detail="Complete UCP file not found")
         
-        return StreamingResponse(
-            io.BytesIO(content.encode('utf-8')),
-            media_type='text/plain',
-            headers={"Content-Disposition": f"attachment; filename=complete_ucp_{job_id}.txt"}
-        )
+        return stream_download_response(parts, f"complete_ucp_{job_id}.txt")
     except Exception as e:
         raise HTTPException(status_code=404, detail="File not found")
 
 @app.get("/api/download/{job_id}/standard")
-async def download_standard_ucp(job_id: str, user: AuthenticatedUser = Depends(get_current_user)):
-    """Download standard UCP file (~100k tokens). Works with both legacy jobs and v2 packs.""" 
+async def download_standard_ucp(
+    job_id: str,
+    user: AuthenticatedUser = Depends(get_current_user)
+):
+    """Download standard UCP file (~100k tokens). Works with both legacy jobs and v2 packs. Streamed; no ETag, so no Range.""" 
     try:
         print(f"Attempting to download standard UCP for job/pack: {job_id}")
         
         # Try direct path first (legacy jobs)
-        content = download_from_r2_with_fallback(
+        part = await asyncio.to_thread(
+            find_r2_part_with_fallback,
             f"{user.r2_directory}/{job_id}/standard_ucp.txt",
             job_id,
-            "standard_ucp.txt",
-            silent_404=True
+            "standard_ucp.txt"
         )
         
         # If not found, check if this is a v2 pack with sources
-        if not content and supabase:
+        if not part and supabase:
             try:
-                result = supabase.rpc("get_pack_details_v2", {
-                    "user_uuid": user.user_id,
-                    "target_pack_id": job_id
-                }).execute()
+                result = await db.get_pack_details_v2(user.user_id, job_id)
                 
                 if result.data:
                     sources = result.data.get("sources", [])
                     for source in sources:
                         source_id = source.get("source_id")
                         if source_id:
-                            content = download_from_r2_with_fallback(
+                            part = await asyncio.to_thread(
+                                find_r2_part_with_fallback,
                                 f"{user.r2_directory}/{source_id}/standard_ucp.txt",
                                 source_id,
-                                "standard_ucp.txt",
-                                silent_404=True
+                                "standard_ucp.txt"
                             )
-                            if content:
+                            if part:
                                 print(f"✅ Found standard_ucp.txt in source {source_id}")
                                 break
             except Exception as e:
                 print(f"Error checking pack sources: {e}")
         
-        if content is None:
+        if part is None:
             raise HTTPException(status_code=404, detail="Standard UCP not found")
         
-        return StreamingResponse(
-            io.BytesIO(content.encode('utf-8')),
-            media_type='text/plain',
-            headers={"Content-Disposition": f"attachment; filename=standard_ucp_{job_id}.txt"}
-        )
+        return stream_download_response([part], f"standard_ucp_{job_id}.txt")
     except HTTPException:
         raise
     except Exception as e:
@@ -3505,116 +4014,97 @@ async def download_standard_ucp(job_id: str, user: AuthenticatedUser = Depends(g
 
 @app.get("/api/download/{job_id}/pack")
 async def download_complete_pack(job_id: str, user: AuthenticatedUser = Depends(get_current_user)):
-    """Download complete pack as ZIP file containing all job files."""
+    """Download complete pack as ZIP file containing all job files (streamed while it is built)."""
     try:
-        import zipfile
-        import tempfile
-        
         print(f"Download pack request for job {job_id} by user {user.user_id} (directory: {user.r2_directory})")
         
-        # Create a temporary file for the ZIP
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_zip:
-            with zipfile.ZipFile(temp_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                
-                # List of files to include in the pack (only add if they exist)
-                file_mappings = [
-                    (f"{user.r2_directory}/{job_id}/extracted.txt", "extracted.txt"),
-                    (f"{user.r2_directory}/{job_id}/complete_ucp.txt", "complete_ucp.txt"),
-                    (f"{user.r2_directory}/{job_id}/summary.json", "summary.json"),
-                    (f"{user.r2_directory}/{job_id}/job_summary.json", "job_summary.json"),
-                    (f"{user.r2_directory}/{job_id}/chunks_metadata.json", "chunks_metadata.json"),
-                ]
-                
-                # Add main files (only if they exist)
-                files_added = 0
-                missing_files = []
-                for r2_key, zip_name in file_mappings:
-                    try:
-                        print(f"Attempting to download: {r2_key}")
-                        # Extract filename from the path for fallback function
-                        filename = zip_name  # Use the zip name as the filename
-                        content = download_from_r2_with_fallback(r2_key, job_id, filename)
-                        if content:
-                            zipf.writestr(zip_name, content)
-                            files_added += 1
-                            print(f"✅ Added {zip_name} to pack")
-                        else:
-                            missing_files.append(zip_name)
-                            print(f"❌ File not found: {zip_name}")
-                    except Exception as e:
-                        # Skip missing files
-                        missing_files.append(zip_name)
-                        print(f"❌ Error downloading {zip_name}: {e}")
-                        continue
-                
-                # Add all chunk files
-                chunk_metadata_content = download_from_r2_with_fallback(f"{user.r2_directory}/{job_id}/chunks_metadata.json", job_id, "chunks_metadata.json")
-                if chunk_metadata_content:
-                    chunk_metadata = json.loads(chunk_metadata_content)
-                    total_chunks = chunk_metadata.get("total_chunks", 0)
-                    print(f"Found chunk metadata with {total_chunks} chunks")
-                    
-                    # Create chunks directory in ZIP
-                    chunks_added = 0
-                    for i in range(1, total_chunks + 1):
-                        chunk_filename = f"chunk_{i:03d}.txt"
-                        chunk_content = download_from_r2_with_fallback(f"{user.r2_directory}/{job_id}/{chunk_filename}", job_id, chunk_filename)
-                        if chunk_content:
-                            zipf.writestr(f"chunks/{chunk_filename}", chunk_content)
-                            chunks_added += 1
-                    print(f"Added {chunks_added}/{total_chunks} chunk files")
-                else:
-                    print("No chunk metadata found")
-                
-                # Add all result files (only if they exist)
-                summary_content = download_from_r2_with_fallback(f"{user.r2_directory}/{job_id}/summary.json", job_id, "summary.json")
-                if summary_content:
-                    try:
-                        summary = json.loads(summary_content)
-                        processed_chunks = summary.get("processed_chunks", 0)
-                        print(f"Found summary with {processed_chunks} processed chunks")
-                        
-                        # Create results directory in ZIP only if we have processed chunks
-                        results_added = 0
-                        if processed_chunks > 0:
-                            for i in range(1, processed_chunks + 1):
-                                result_filename = f"result_{i:03d}.json"
-                                result_content = download_from_r2_with_fallback(f"{user.r2_directory}/{job_id}/{result_filename}", job_id, result_filename)
-                                if result_content:
-                                    zipf.writestr(f"results/{result_filename}", result_content)
-                                    results_added += 1
-                        print(f"Added {results_added}/{processed_chunks} result files")
-                    except (json.JSONDecodeError, KeyError):
-                        # Skip results if summary is invalid
-                        print("Invalid summary JSON, skipping results")
-                        pass
-                else:
-                    print("No summary found")
-                
-                # Check if we have any files in the ZIP
-                zip_files = zipf.namelist()
-                print(f"Total files in ZIP: {len(zip_files)}")
-                if len(zip_files) == 0:
-                    print(f"No files found for job {job_id} in directory {user.r2_directory}")
-                    print(f"Missing files: {missing_files}")
-                    raise HTTPException(
-                        status_code=404, 
-                        detail=f"No files found for job {job_id}. This job may not exist, may belong to a different user, or may not have completed processing yet."
-                    )
+        # List of files to include in the pack (only added if they exist)
+        file_mappings = [
+            (f"{user.r2_directory}/{job_id}/extracted.txt", "extracted.txt"),
+            (f"{user.r2_directory}/{job_id}/complete_ucp.txt", "complete_ucp.txt"),
+            (f"{user.r2_directory}/{job_id}/summary.json", "summary.json"),
+            (f"{user.r2_directory}/{job_id}/job_summary.json", "job_summary.json"),
+            (f"{user.r2_directory}/{job_id}/chunks_metadata.json", "chunks_metadata.json"),
+        ]
+        
+        def locate_main_files() -> Dict[str, Optional[Part]]:
+            # Concurrent HEADs for the primary keys; alternate layouts only for misses
+            parts = r2_download_parts([r2_key for r2_key, _ in file_mappings])
+            for r2_key, zip_name in file_mappings:
+                if parts.get(r2_key) is None:
+                    parts[r2_key] = find_r2_part_with_fallback(r2_key, job_id, zip_name)
+            return parts
+        
+        # Only the two small metadata files are read before streaming starts (they size the archive)
+        main_parts, chunk_metadata_content, summary_content = await asyncio.gather(
+            asyncio.to_thread(locate_main_files),
+            asyncio.to_thread(download_from_r2_with_fallback, f"{user.r2_directory}/{job_id}/chunks_metadata.json", job_id, "chunks_metadata.json"),
+            asyncio.to_thread(download_from_r2_with_fallback, f"{user.r2_directory}/{job_id}/summary.json", job_id, "summary.json")
+        )
+        
+        total_chunks = 0
+        if chunk_metadata_content:
+            total_chunks = json.loads(chunk_metadata_content).get("total_chunks", 0)
+            print(f"Found chunk metadata with {total_chunks} chunks")
+        else:
+            print("No chunk metadata found")
+        
+        processed_chunks = 0
+        if summary_content:
+            try:
+                processed_chunks = json.loads(summary_content).get("processed_chunks", 0)
+                print(f"Found summary with {processed_chunks} processed chunks")
+            except (json.JSONDecodeError, KeyError, AttributeError):
+                # Skip results if summary is invalid
+                print("Invalid summary JSON, skipping results")
+        else:
+            print("No summary found")
+        
+        missing_files = [zip_name for r2_key, zip_name in file_mappings if main_parts.get(r2_key) is None]
+        if len(missing_files) == len(file_mappings) and not total_chunks and not processed_chunks:
+            print(f"No files found for job {job_id} in directory {user.r2_directory}")
+            print(f"Missing files: {missing_files}")
+            raise HTTPException(
+                status_code=404, 
+                detail=f"No files found for job {job_id}. This job may not exist, may belong to a different user, or may not have completed processing yet."
+            )
+        
+        def load_job_file(filename: str) -> Optional[str]:
+            return download_from_r2_with_fallback(f"{user.r2_directory}/{job_id}/{filename}", job_id, filename, silent_404=True)
+        
+        def stream_part(part: Part) -> Callable[[], Iterable[bytes]]:
+            return lambda: DownloadStream([part], r2_client.iter_object).iter_bytes()
+        
+        def members() -> Iterator[ZipMember]:
+            for r2_key, zip_name in file_mappings:
+                part = main_parts.get(r2_key)
+                if part is not None:
+                    yield ZipMember(zip_name, stream_part(part))
+            for i in range(1, total_chunks + 1):
+                chunk_filename = f"chunk_{i:03d}.txt"
+                yield ZipMember(f"chunks/{chunk_filename}", functools.partial(load_job_file, chunk_filename))
+            for i in range(1, processed_chunks + 1):
+                result_filename = f"result_{i:03d}.json"
+                yield ZipMember(f"results/{result_filename}", functools.partial(load_job_file, result_filename))
         
-        # Read the ZIP file and return it
-        with open(temp_zip.name, 'rb') as f:
-            zip_data = f.read()
+        added = defaultdict(int)
         
-        # Clean up temp file
-        os.unlink(temp_zip.name)
+        def count_member(name: str, was_added: bool) -> None:
+            added[name.split("/")[0] if "/" in name else "files"] += was_added
+        
+        def archive() -> Iterator[bytes]:
+            yield from stream_zip(members(), prefetch=ZIP_PREFETCH, on_member=count_member)
+            print(f"✅ Streamed pack for job {job_id}: {dict(added)} "
+                  f"(of {len(file_mappings) - len(missing_files)} files, {total_chunks} chunks, {processed_chunks} results)")
         
         return StreamingResponse(
-            io.BytesIO(zip_data),
+            archive(),
             media_type='application/zip',
             headers={"Content-Disposition": f"attachment; filename=ucp_pack_{job_id}.zip"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error creating pack for job {job_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to create pack: {str(e)}")
@@ -3672,13 +4162,17 @@ def check_job_exists(job_id: str, user: AuthenticatedUser = Depends(get_current_
                 f"prod/{user.user_id}"
             ]
             
+            # Concurrent HEADs; layouts the lookups above just found missing are answered from the negative cache
+            sizes = key_resolver.probe_many(
+                f"{alt_dir}/{job_id}/{name}"
+                for alt_dir in alt_user_dirs
+                for name in ("job_summary.json", "chunks_metadata.json")
+            )
             for alt_dir in alt_user_dirs:
-                alt_job_summary = download_from_r2(f"{alt_dir}/{job_id}/job_summary.json", silent_404=True)
-                alt_chunks = download_from_r2(f"{alt_dir}/{job_id}/chunks_metadata.json", silent_404=True)
                 alternative_checks.append({
                     "path": alt_dir,
-                    "job_summary_exists": alt_job_summary is not None,
-                    "chunks_metadata_exists": alt_chunks is not None
+                    "job_summary_exists": sizes.get(f"{alt_dir}/{job_id}/job_summary.json") is not None,
+                    "chunks_metadata_exists": sizes.get(f"{alt_dir}/{job_id}/chunks_metadata.json") is not None
                 })
         
         return {
@@ -3711,8 +4205,13 @@ async def create_pack(request: CreatePackRequest, user: AuthenticatedUser = Depe
 # PACK V2 HELPER FUNCTIONS
 # ============================================================================
 
-async def process_conversation_url_for_pack(pack_id: str, source_id: str, url: str, platform: str, user: AuthenticatedUser):
-    """Background task for extracting conversation from URL for Pack V2 sources."""
+async def process_conversation_url_for_pack(pack_id: str, source_id: str, url: str, platform: str, user: AuthenticatedUser, queued: bool = False):
+    """Background task for extracting conversation from URL for Pack V2 sources.
+    
+    Args:
+        queued: Running as a queued job: fetch and chunking errors are re-raised
+            for the queue to retry instead of failing the source
+    """
     try:
         print(f"🔗 Starting URL extraction for source {source_id} in pack {pack_id}")
         
@@ -3720,12 +4219,12 @@ async def process_conversation_url_for_pack(pack_id: str, source_id: str, url: s
             raise Exception("Database not configured")
         
         # Update source status to extracting
-        supabase.rpc("update_source_status", {
+        await set_source_status({
             "user_uuid": user.user_id,
             "target_source_id": source_id,
             "status_param": "processing",  # align with DB constraint
             "progress_param": 10
-        }).execute()
+        })
         
         # Import the appropriate extractor
         try:
@@ -3740,16 +4239,16 @@ async def process_conversation_url_for_pack(pack_id: str, source_id: str, url: s
                 
         except ImportError as e:
             print("Could not import gpt extractor module")
-            supabase.rpc("update_source_status", {"user_uuid": user.user_id,"target_source_id": source_id,"status_param": "failed","progress_param": 0,"error_message_param": error_msg}).execute()
+            await set_source_status({"user_uuid": user.user_id,"target_source_id": source_id,"status_param": "failed","progress_param": 0,"error_message_param": error_msg})
             return
         
         # Update progress
-        supabase.rpc("update_source_status", {
+        await set_source_status({
             "user_uuid": user.user_id,
             "target_source_id": source_id,
             "status_param": "processing",  # align with DB constraint
             "progress_param": 30
-        }).execute()
+        })
         
         # Extract conversation
         try:
@@ -3760,31 +4259,33 @@ async def process_conversation_url_for_pack(pack_id: str, source_id: str, url: s
             if not result or not result.get('messages'):
                 error_msg = "No conversation found at the provided URL"
                 print(f"❌ {error_msg}")
-                supabase.rpc("update_source_status", {"target_source_id": source_id,"status_param": "failed","user_uuid": user.user_id,"progress_param": 0,"error_message_param": error_msg}).execute()
+                await set_source_status({"target_source_id": source_id,"status_param": "failed","user_uuid": user.user_id,"progress_param": 0,"error_message_param": error_msg})
                 return
                 
         except Exception as e:
             error_msg = f"Failed to extract conversation: {str(e)}"
             print(f"❌ {error_msg}")
-            supabase.rpc("update_source_status", {
+            if queued:
+                raise
+            await set_source_status({
                 "user_uuid": user.user_id,
                 "target_source_id": source_id,
                 "status_param": "failed",
                 "progress_param": 0,
                 "error_message_param": error_msg
-            }).execute()
+            })
             return
         
         message_count = len(result['messages'])
         print(f"✅ Extracted {message_count} messages from {platform} conversation")
         
         # Update progress
-        supabase.rpc("update_source_status", {
+        await set_source_status({
             "user_uuid": user.user_id,
             "target_source_id": source_id,
             "status_param": "processing",  # align with DB constraint
             "progress_param": 70
-        }).execute()
+        })
         
         # Convert to text format
         extracted_texts = []
@@ -3801,7 +4302,8 @@ async def process_conversation_url_for_pack(pack_id: str, source_id: str, url: s
             source_id=source_id,
             file_content=extracted_content,
             filename=f"{platform}_conversation.txt",
-            user=user
+            user=user,
+            queued=queued
         )
 
 
@@ -3809,16 +4311,15 @@ async def process_conversation_url_for_pack(pack_id: str, source_id: str, url: s
     except Exception as e:
         print(f"❌ Error processing URL for source {source_id}: {e}")
         traceback.print_exc()
-        try:
-            supabase.rpc("update_source_status", {
-                "user_uuid": user.user_id,
-                "target_source_id": source_id,
-                "status_param": "failed",
-                "progress_param": 0,
-                "error_message_param": str(e)
-            }).execute()
-        except Exception as update_error:
-            print(f"Failed to update source status: {update_error}")
+        if queued:
+            raise
+        await set_source_status({
+            "user_uuid": user.user_id,
+            "target_source_id": source_id,
+            "status_param": "failed",
+            "progress_param": 0,
+            "error_message_param": str(e)
+        })
 
 # ============================================================================
 # PACK V2 API ENDPOINTS (NotebookLM-style)
@@ -3850,11 +4351,9 @@ async def create_pack_v2(request: CreatePackRequest, user: AuthenticatedUser = D
         # Use RPC function to bypass permission issues
         try:
             import asyncio
-            result = await asyncio.to_thread(
-                lambda: supabase.rpc("check_user_has_active_processing", {
-                    "user_uuid": user.user_id
-                }).execute()
-            )
+            result = await db.rpc("check_user_has_active_processing", {
+                "user_uuid": user.user_id
+            }).execute()
             
             if result.data and result.data.get('has_active_processing', False):
                 raise HTTPException(
@@ -3885,16 +4384,14 @@ async def create_pack_v2(request: CreatePackRequest, user: AuthenticatedUser = D
         
         # Create pack in database
         import asyncio
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("create_pack_v2", {
-                "user_uuid": user.user_id,
-                "target_pack_id": pack_id,
-                "pack_name_param": resolved_pack_name,
-                "pack_description": request.description,
-                "custom_system_prompt_param": custom_prompt,
-                "r2_pack_directory_param": pack_directory
-            }).execute()
-        )
+        result = await db.rpc("create_pack_v2", {
+            "user_uuid": user.user_id,
+            "target_pack_id": pack_id,
+            "pack_name_param": resolved_pack_name,
+            "pack_description": request.description,
+            "custom_system_prompt_param": custom_prompt,
+            "r2_pack_directory_param": pack_directory
+        }).execute()
         
         if result.data and len(result.data) > 0:
             pack_data = result.data[0]
@@ -3927,11 +4424,9 @@ async def check_active_processing(user: AuthenticatedUser = Depends(get_current_
         # Check for any active processing using RPC to bypass permission issues
         try:
             import asyncio
-            result = await asyncio.to_thread(
-                lambda: supabase.rpc("check_user_has_active_processing", {
-                    "user_uuid": user.user_id
-                }).execute()
-            )
+            result = await db.rpc("check_user_has_active_processing", {
+                "user_uuid": user.user_id
+            }).execute()
             
             if result.data:
                 return result.data
@@ -3970,11 +4465,9 @@ async def list_packs_v2(user: AuthenticatedUser = Depends(get_current_user)):
         
         # Use RPC function with aggregated stats (bypasses RLS with SECURITY DEFINER)
         import asyncio
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("get_user_packs_v2_with_stats", {
-                "user_uuid": user.user_id
-            }).execute()
-        )
+        result = await db.rpc("get_user_packs_v2_with_stats", {
+            "user_uuid": user.user_id
+        }).execute()
         
         if not result.data:
             return []
@@ -4017,7 +4510,7 @@ async def login(request: LoginRequest):
             raise HTTPException(status_code=500, detail="Authentication service not configured")
         
         # Authenticate with Supabase
-        auth_response = supabase.auth.sign_in_with_password({
+        auth_response = await asyncio.to_thread(supabase.auth.sign_in_with_password, {
             "email": request.email,
             "password": request.password
         })
@@ -4057,29 +4550,21 @@ async def upload_chatgpt_conversation(
         pack_id = request.pack_id
         conversation = request.conversation
         
-        # Verify pack exists and belongs to user using RPC
-        packs_result = supabase.rpc("get_user_packs_v2", {
-            "user_uuid": user.user_id
-        }).execute()
-        
-        if not packs_result.data:
-            raise HTTPException(status_code=404, detail="Pack not found")
-        
-        # Find the specific pack
-        pack_data = next((p for p in packs_result.data if p.get("pack_id") == pack_id), None)
+        # Verify pack exists and belongs to user
+        pack_data = await db.get_owned_pack(user.user_id, pack_id)
         if not pack_data:
             raise HTTPException(status_code=404, detail="Pack not found")
         
         # Create a source for this conversation using add_pack_source RPC
         source_name = conversation.get("title", "ChatGPT Conversation")
         source_id = str(uuid.uuid4())
-        source_result = supabase.rpc("add_pack_source", {
-            "user_uuid": user.user_id,
-            "target_pack_id": pack_id,
-            "target_source_id": source_id,
-            "source_name_param": source_name,
-            "source_type_param": "chat_export"
-        }).execute()
+        source_result = await db.add_pack_source(
+            user_id=user.user_id,
+            pack_id=pack_id,
+            source_id=source_id,
+            source_name=source_name,
+            source_type="chat_export"
+        )
         
         if not source_result.data or len(source_result.data) == 0:
             raise HTTPException(status_code=500, detail="Failed to create source")
@@ -4096,12 +4581,12 @@ async def upload_chatgpt_conversation(
         
         # Start background processing (function already defined in this file at line ~1912)
         background_tasks.add_task(
-            extract_and_chunk_source,
+            submit_extraction,
             pack_id=pack_id,
             source_id=source_id,
-            file_content=conversation_text,
             filename=f"{source_name}.txt",
-            user=user
+            user=user,
+            file_content=conversation_text
         )
         
         return {
@@ -4124,16 +4609,8 @@ async def get_pack_memory_tree(pack_id: str, user: AuthenticatedUser = Depends(g
         if not supabase:
             raise HTTPException(status_code=500, detail="Database not configured")
         
-        # Verify pack exists and belongs to user using RPC
-        packs_result = supabase.rpc("get_user_packs_v2", {
-            "user_uuid": user.user_id
-        }).execute()
-        
-        if not packs_result.data:
-            raise HTTPException(status_code=404, detail="Pack not found")
-        
-        # Find the specific pack
-        pack_data = next((p for p in packs_result.data if p.get("pack_id") == pack_id), None)
+        # Verify pack exists and belongs to user
+        pack_data = await db.get_owned_pack(user.user_id, pack_id)
         if not pack_data:
             raise HTTPException(status_code=404, detail="Pack not found")
         
@@ -4202,12 +4679,7 @@ async def get_pack_details_v2(pack_id: str, user: AuthenticatedUser = Depends(ge
         
         # 1. Run main RPC in thread to avoid blocking loop
         # Use RPC function to get pack details (bypasses RLS)
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("get_pack_details_v2", {
-                "user_uuid": user.user_id,
-                "target_pack_id": pack_id
-            }).execute()
-        )
+        result = await db.get_pack_details_v2(user.user_id, pack_id)
         
         if not result.data:
             raise HTTPException(status_code=404, detail="Pack not found")
@@ -4239,12 +4711,7 @@ async def export_pack_json(pack_id: str, user: AuthenticatedUser = Depends(get_c
     try:
         import asyncio
         # Get pack details
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("get_pack_details_v2", {
-                "user_uuid": user.user_id,
-                "target_pack_id": pack_id
-            }).execute()
-        )
+        result = await db.get_pack_details_v2(user.user_id, pack_id)
         
         if not result.data:
             raise HTTPException(status_code=404, detail="Pack not found")
@@ -4253,9 +4720,9 @@ async def export_pack_json(pack_id: str, user: AuthenticatedUser = Depends(get_c
         if isinstance(pack_data, list) and len(pack_data) > 0:
             pack_data = pack_data[0]
         
-        # Return as JSON download
+        # Return as JSON download, encoded piece by piece as it is sent
         return StreamingResponse(
-            io.BytesIO(json.dumps(pack_data, indent=2).encode('utf-8')),
+            (piece.encode('utf-8') for piece in json.JSONEncoder(indent=2).iterencode(pack_data)),
             media_type='application/json',
             headers={"Content-Disposition": f"attachment; filename=pack_{pack_id}.json"}
         )
@@ -4293,15 +4760,13 @@ async def update_pack_v2(pack_id: str, request: Request, user: AuthenticatedUser
         
         # Update pack using RPC function (respects RLS policies)
         import asyncio
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("update_pack_v2", {
-                "user_uuid": user.user_id,
-                "target_pack_id": pack_id,
-                "pack_name_param": pack_name,
-                "pack_description": description,
-                "custom_system_prompt_param": custom_system_prompt
-            }).execute()
-        )
+        result = await db.rpc("update_pack_v2", {
+            "user_uuid": user.user_id,
+            "target_pack_id": pack_id,
+            "pack_name_param": pack_name,
+            "pack_description": description,
+            "custom_system_prompt_param": custom_system_prompt
+        }).execute()
         
         if result.data and len(result.data) > 0:
             print(f"✅ Pack updated successfully: {pack_id}")
@@ -4381,6 +4846,7 @@ async def upload_source_raw(
     This avoids multipart parsing overhead and supports streaming progress on the frontend.
     """
     import asyncio
+    spooled = None
     try:
         if not supabase:
             raise HTTPException(status_code=500, detail="Database not configured")
@@ -4392,52 +4858,36 @@ async def upload_source_raw(
 
         print(f"Raw upload: source={source_id}, pack={pack_id}, file={filename}, user={user.email}")
 
-        # Read raw bytes
-        content = await request.body()
-        file_size = len(content)
+        # Stream the body to disk in fixed-size pieces (hashed on the way)
+        spooled = await spool_stream(request.stream(), suffix=os.path.splitext(filename)[1], directory=UPLOAD_SPOOL_DIR)
+        file_size = spooled.size
+        print(f"Spooled {file_size:,} bytes to disk (sha256={spooled.sha256[:12]})")
 
         if file_size == 0:
             raise HTTPException(status_code=400, detail="Empty file")
 
-        # Parse content based on file extension (offloaded to thread)
-        filename_lower = filename.lower()
-        if filename_lower.endswith('.zip'):
-            file_content_str = await asyncio.to_thread(extract_text_from_zip, content)
-        elif filename_lower.endswith('.pdf'):
-            file_content_str = await asyncio.to_thread(extract_text_from_pdf, content)
-        elif filename_lower.endswith(('.docx', '.doc')):
-            file_content_str = await asyncio.to_thread(extract_text_from_docx, content)
-        else:
-            try:
-                file_content_str = content.decode('utf-8')
-            except UnicodeDecodeError:
-                file_content_str = content.decode('utf-8', errors='ignore')
-
         # Create source record
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("add_pack_source", {
-                "user_uuid": user.user_id,
-                "target_pack_id": pack_id,
-                "target_source_id": source_id,
-                "source_name_param": source_name,
-                "source_type_param": source_type,
-                "file_name_param": filename,
-                "file_size_param": file_size
-            }).execute()
+        result = await db.add_pack_source(
+            user_id=user.user_id,
+            pack_id=pack_id,
+            source_id=source_id,
+            source_name=source_name,
+            source_type=source_type,
+            file_name=filename,
+            file_size=file_size
         )
 
         if not result.data or len(result.data) == 0:
             raise HTTPException(status_code=500, detail="Failed to create source record")
 
-        # Kick off extraction in background
-        asyncio.create_task(
-            extract_and_chunk_source(
-                pack_id=pack_id,
-                source_id=source_id,
-                file_content=file_content_str,
-                filename=filename,
-                user=user
-            )
+        # Kick off extraction in background (hands off the spooled file by path)
+        spooled_path, spooled = spooled.path, None  # Owned by the background task now
+        await submit_extraction(
+            pack_id=pack_id,
+            source_id=source_id,
+            filename=filename,
+            user=user,
+            file_path=spooled_path
         )
 
         return {
@@ -4454,6 +4904,9 @@ async def upload_source_raw(
         print(f"Error in raw upload: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    finally:
+        if spooled:
+            spooled.discard()
 
 
 @app.post("/api/v2/packs/{pack_id}/sources")
@@ -4468,6 +4921,7 @@ async def add_source_to_pack(
     user: AuthenticatedUser = Depends(get_current_user)
     ):
     """Add a new source (file/chat export OR URL) to an existing pack"""
+    spooled = None
     try:
         if not supabase:
             raise HTTPException(status_code=500, detail="Database not configured")
@@ -4479,12 +4933,7 @@ async def add_source_to_pack(
             )
 
         import asyncio
-        pack_lookup = await asyncio.to_thread(
-            lambda: supabase.rpc("get_pack_details_v2", {
-                "user_uuid": user.user_id,
-                "target_pack_id": pack_id
-            }).execute()
-        )
+        pack_lookup = await db.get_pack_details_v2(user.user_id, pack_id)
         if not pack_lookup.data:
             raise HTTPException(status_code=404, detail="Pack not found")
 
@@ -4520,31 +4969,27 @@ async def add_source_to_pack(
             platform = 'ChatGPT'
             
             # Create source record in database with URL
-            result = await asyncio.to_thread(
-                lambda: supabase.rpc("add_pack_source", {
-                    "user_uuid": user.user_id,
-                    "target_pack_id": pack_id,
-                    "target_source_id": source_id,
-                    "source_name_param": source_name,
-                    "source_type_param": source_type,  # Use allowed source type for constraint
-                    "file_name_param": url,  # Store URL in file_name field
-                    "file_size_param": 0
-                }).execute()
+            result = await db.add_pack_source(
+                user_id=user.user_id,
+                pack_id=pack_id,
+                source_id=source_id,
+                source_name=source_name,
+                source_type=source_type,
+                file_name=url,
+                file_size=0
             )
             
             if not result.data or len(result.data) == 0:
                 raise HTTPException(status_code=500, detail="Failed to create source record")
             
             # Start background URL extraction and chunking
-            asyncio.create_task(
-                process_conversation_url_for_pack(
-                    pack_id=pack_id,
-                    source_id=source_id,
-                    url=url,
-                    platform=platform,
-                    user=user
-                )
-            )
+            await dispatch_job(JOB_IMPORT_URL, {
+                "pack_id": pack_id,
+                "source_id": source_id,
+                "url": url,
+                "platform": platform,
+                **user_payload(user)
+            })
             
             return {
                 "pack_id": pack_id,
@@ -4562,29 +5007,27 @@ async def add_source_to_pack(
             source_name = source_name or f"Pasted Text ({datetime.now().strftime('%I:%M:%S %p')})"
             
             # Create source record
-            result = await asyncio.to_thread(
-                lambda: supabase.rpc("add_pack_source", {
-                    "user_uuid": user.user_id,
-                    "target_pack_id": pack_id,
-                    "target_source_id": source_id,
-                    "source_name_param": source_name,
-                    "source_type_param": source_type,
-                    "file_name_param": "pasted_text.txt",
-                    "file_size_param": len(text_content)
-                }).execute()
+            result = await db.add_pack_source(
+                user_id=user.user_id,
+                pack_id=pack_id,
+                source_id=source_id,
+                source_name=source_name,
+                source_type=source_type,
+                file_name="pasted_text.txt",
+                file_size=len(text_content)
             )
             
             if not result.data or len(result.data) == 0:
                 raise HTTPException(status_code=500, detail="Failed to create source record")
             
             # Start background extraction
-            asyncio.create_task(extract_and_chunk_source(
+            await submit_extraction(
                 pack_id=pack_id,
                 source_id=source_id,
-                file_content=text_content,
                 filename="pasted_text.txt",
-                user=user
-            ))
+                user=user,
+                file_content=text_content
+            )
             
             return {
                 "pack_id": pack_id,
@@ -4596,73 +5039,34 @@ async def add_source_to_pack(
 
         # Handle file-based sources 
         elif file:
-            # Read file content
-            content = await file.read()
-            file_size = len(content)
-            
-            # Handle different file types
-            file_content_str = ""
-            filename_lower = file.filename.lower()
-            
-            if filename_lower.endswith('.zip'):
-                # Extract supported text files or ChatGPT conversations.json from ZIP
-                try:
-                    import asyncio
-                    print("Zip file extraction")
-                    file_content_str = await asyncio.to_thread(extract_text_from_zip, content)
-                except ValueError as e:
-                    raise HTTPException(status_code=400, detail=str(e))
-                
-            elif filename_lower.endswith('.pdf'):
-                # Extract text from PDF
-                try:
-                    import asyncio
-                    print("PDF file extraction")
-                    file_content_str = await asyncio.to_thread(extract_text_from_pdf, content)
-                except ValueError as e:
-                    raise HTTPException(status_code=400, detail=str(e))
-                    
-            elif filename_lower.endswith(('.docx', '.doc')):
-                # Extract text from DOCX
-                try:
-                    import asyncio
-                    print("DOCX file extraction")
-                    file_content_str = await asyncio.to_thread(extract_text_from_docx, content)
-                except ValueError as e:
-                    raise HTTPException(status_code=400, detail=str(e))
-            else:
-                # Plain text or other format - use UTF-8 decoding with error handling
-                try:
-                    file_content_str = content.decode('utf-8')
-                except UnicodeDecodeError:
-                    # Fall back to ignoring errors for binary/non-UTF8 files
-                    file_content_str = content.decode('utf-8', errors='ignore')
+            # Spool file content to disk in fixed-size pieces (hashed on the way)
+            spooled = await spool_stream(iter_upload_file(file), suffix=os.path.splitext(file.filename)[1], directory=UPLOAD_SPOOL_DIR)
+            file_size = spooled.size
+            print(f"Spooled {file.filename}: {file_size:,} bytes (sha256={spooled.sha256[:12]})")
             
             # Create source record in database
-            result = await asyncio.to_thread(
-                lambda: supabase.rpc("add_pack_source", {
-                    "user_uuid": user.user_id,
-                    "target_pack_id": pack_id,
-                    "target_source_id": source_id,
-                    "source_name_param": source_name,
-                    "source_type_param": source_type,
-                    "file_name_param": file.filename,
-                    "file_size_param": file_size
-                }).execute()
+            result = await db.add_pack_source(
+                user_id=user.user_id,
+                pack_id=pack_id,
+                source_id=source_id,
+                source_name=source_name,
+                source_type=source_type,
+                file_name=file.filename,
+                file_size=file_size
             )
             
             if not result.data or len(result.data) == 0:
                 raise HTTPException(status_code=500, detail="Failed to create source record")
             
             # Start background extraction and chunking (NO analysis yet, NO credit deduction)
-            asyncio.create_task(
-                extract_and_chunk_source(
-                    pack_id=pack_id,
-                    source_id=source_id,
-                    file_content=file_content_str,
-                    filename=file.filename,
-                    user=user
-                )
+            # The spooled file is handed off by path; ZIP/PDF/DOCX are extracted from it in the background
+            spooled_path, spooled = spooled.path, None  # Owned by the background task now
+            await submit_extraction(
+                pack_id=pack_id,
+                source_id=source_id,
+                filename=file.filename,
+                user=user,
+                file_path=spooled_path
             )
             
             return {
@@ -4684,6 +5088,9 @@ async def add_source_to_pack(
         print(f"Full traceback:")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to add source: {str(e)}")
+    finally:
+        if spooled:
+            spooled.discard()
 
 @app.delete("/api/v2/packs/{pack_id}")
 async def delete_pack(
@@ -4699,10 +5106,11 @@ async def delete_pack(
         
         # Delete all R2 files for this pack (user_id/pack_id/)
         r2_prefix = f"{user.r2_directory}/{pack_id}/"
-        delete_r2_directory(r2_prefix)
+        await asyncio.to_thread(delete_r2_directory, r2_prefix)
+        pack_exporter.forget(f"{user.r2_directory}/{pack_id}")
         
         # Use RPC function to delete pack from database (bypasses RLS)
-        result = supabase.rpc("delete_pack_v2", {
+        result = await db.rpc("delete_pack_v2", {
             "user_uuid": user.user_id,
             "target_pack_id": pack_id
         }).execute()
@@ -4736,16 +5144,13 @@ async def submit_pack_review(
             raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
         
         # Check if pack exists and belongs to user
-        pack_result = supabase.rpc("get_pack_details_v2", {
-            "user_uuid": user.user_id,
-            "target_pack_id": pack_id
-        }).execute()
+        pack_result = await db.get_pack_details_v2(user.user_id, pack_id)
         
         if not pack_result.data:
             raise HTTPException(status_code=404, detail="Pack not found")
         
         # Insert or update review (upsert on conflict)
-        result = supabase.table('pack_reviews').upsert({
+        result = await db.table('pack_reviews').upsert({
             'user_id': user.user_id,
             'pack_id': pack_id,
             'user_email': user.email,
@@ -4781,7 +5186,7 @@ async def get_reviews(
             min_rating = 4
         
         # Call database function to get recent reviews
-        result = supabase.rpc("get_recent_reviews", {
+        result = await db.rpc("get_recent_reviews", {
             "limit_count": limit,
             "min_rating": min_rating
         }).execute()
@@ -4804,7 +5209,7 @@ async def check_pack_review(
 ):
     """Check if user has reviewed this pack"""
     try:
-        result = supabase.rpc("has_reviewed_pack", {
+        result = await db.rpc("has_reviewed_pack", {
             "user_uuid": user.user_id,
             "target_pack_id": pack_id
         }).execute()
@@ -4832,12 +5237,7 @@ async def get_source_status(
         # Wrap in asyncio.to_thread so the sync Supabase call never blocks the
         # event loop — critical when the analysis threadpool is saturated.
         # Use RPC function to get source status (bypasses RLS)
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("get_source_status_v2", {
-                "user_uuid": user.user_id,
-                "target_source_id": source_id
-            }).execute()
-        )
+        result = await db.get_source_status_v2(user.user_id, source_id)
 
         if not result.data:
             raise HTTPException(status_code=404, detail="Source not found")
@@ -4893,24 +5293,24 @@ async def stream_source_progress(
     from fastapi.responses import StreamingResponse
     import json
     
+    async def fetch_source_status():
+        result = await db.get_source_status_v2(user.user_id, source_id)
+        return result.data
+    
     async def event_generator():
+        # Subscribe before the first read so no update between the two is missed
+        subscription = progress_bus.subscribe(source_id)
         try:
             last_progress = None
             last_status = None
+            source = await fetch_source_status()
             
             while True:
-                # Get current source status
-                result = supabase.rpc("get_source_status_v2", {
-                    "user_uuid": user.user_id,
-                    "target_source_id": source_id
-                }).execute()
-                
-                if not result.data:
+                if not source:
                     # Source not found or deleted
                     yield f"data: {json.dumps({'status': 'not_found'})}\n\n"
                     break
                 
-                source = result.data
                 current_status = source.get("status")
                 current_progress = source.get("progress", 0)
                 
@@ -4934,12 +5334,20 @@ async def stream_source_progress(
                 if current_status in ['ready_for_analysis', 'completed', 'failed', 'cancelled']:
                     break
                 
-                # Wait before next check (500ms for responsive updates)
-                await asyncio.sleep(0.5)
+                # Wait for the next published update. If none arrives (e.g. the job runs
+                # in another worker without Redis), re-read the database as a fallback.
+                update = await subscription.wait(PROGRESS_FALLBACK_POLL_SECONDS)
+                if update is None:
+                    yield ": keep-alive\n\n"
+                    source = await fetch_source_status()
+                else:
+                    source = {**source, **update}
                 
         except Exception as e:
             print(f"Error in SSE stream: {e}")
             yield f"data: {json.dumps({'status': 'error', 'error': str(e)})}\n\n"
+        finally:
+            progress_bus.unsubscribe(subscription)
     
     return StreamingResponse(
         event_generator(),
@@ -4966,14 +5374,14 @@ async def delete_source_from_pack(
     
     # Delete R2 files for this source (user_id/pack_id/source_id/)
     r2_prefix = f"{user.r2_directory}/{pack_id}/{source_id}/"
-    delete_r2_directory(r2_prefix)
+    await asyncio.to_thread(delete_r2_directory, r2_prefix)
     
     # Delete from database using RPC function (bypasses RLS, same as pack deletion)
     try:
         print(f"Attempting database delete for source {source_id}")
         
         # Use RPC function to delete source (bypasses RLS, just like delete_pack_v2)
-        result = supabase.rpc("delete_pack_source", {
+        result = await db.rpc("delete_pack_source", {
             "user_uuid": user.user_id,
             "target_pack_id": pack_id,
             "target_source_id": source_id
@@ -4987,6 +5395,9 @@ async def delete_source_from_pack(
     except Exception as db_error:
         print(f"⚠️ Database delete failed: {db_error}")
     
+    # Rebuild the pack's exports without this source
+    asyncio.create_task(refresh_pack_exports(user, pack_id))
+    
     # Always return success - the source is gone from R2 and UI will be updated
     return {"success": True, "message": "Source deleted successfully"}
 
@@ -5006,12 +5417,7 @@ async def check_source_credits(
         import asyncio
         
         # Get source status to find chunk count
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("get_source_status_v2", {
-                "user_uuid": user.user_id,
-                "target_source_id": source_id
-            }).execute()
-        )
+        result = await db.get_source_status_v2(user.user_id, source_id)
         
         if not result.data:
             raise HTTPException(status_code=404, detail="Source not found")
@@ -5023,13 +5429,11 @@ async def check_source_credits(
             raise HTTPException(status_code=400, detail="Source not yet chunked")
         
         # Get user's current credits and payment plan
-        user_result = await asyncio.to_thread(
-            lambda: supabase.table("user_profiles")
-                .select("credits_balance, payment_plan")
-                .eq("id", user.user_id)
-                .single()
-                .execute()
-        )
+        user_result = await db.table("user_profiles") \
+            .select("credits_balance, payment_plan") \
+            .eq("id", user.user_id) \
+            .single() \
+            .execute()
         user_credits = user_result.data.get("credits_balance", 0) if user_result.data else 0
         payment_plan = user_result.data.get("payment_plan", "credits") if user_result.data else "credits"
         
@@ -5073,12 +5477,7 @@ async def start_source_analysis(
         
         # Get source info
         import asyncio
-        result = await asyncio.to_thread(
-            lambda: supabase.rpc("get_source_status_v2", {
-                "user_uuid": user.user_id,
-                "target_source_id": source_id
-            }).execute()
-        )
+        result = await db.get_source_status_v2(user.user_id, source_id)
         
         if not result.data:
             raise HTTPException(status_code=404, detail="Source not found")
@@ -5093,9 +5492,7 @@ async def start_source_analysis(
             raise HTTPException(status_code=400, detail=f"Source not ready for analysis (status: {status})")
         
         # Check credits one more time and get payment plan
-        user_result = await asyncio.to_thread(
-            lambda: supabase.table("user_profiles").select("credits_balance, payment_plan").eq("id", user.user_id).single().execute()
-        )
+        user_result = await db.table("user_profiles").select("credits_balance, payment_plan").eq("id", user.user_id).single().execute()
         user_credits = user_result.data.get("credits_balance", 0) if user_result.data else 0
         payment_plan = user_result.data.get("payment_plan", "credits") if user_result.data else "credits"
         
@@ -5122,12 +5519,7 @@ async def start_source_analysis(
         custom_system_prompt = None
         try:
             # Use RPC function to get pack details (bypasses RLS)
-            pack_result = await asyncio.to_thread(
-                lambda: supabase.rpc("get_pack_details_v2", {
-                    "user_uuid": user.user_id,
-                    "target_pack_id": pack_id
-                }).execute()
-            )
+            pack_result = await db.get_pack_details_v2(user.user_id, pack_id)
             
             if pack_result.data:
                 pack_data = pack_result.data if isinstance(pack_result.data, dict) else pack_result.data[0]
@@ -5139,26 +5531,22 @@ async def start_source_analysis(
         print(f"🚀 Starting analysis: {chunks_to_analyze} of {total_chunks} chunks")
         
         # Update status to analyzing IMMEDIATELY so frontend sees it right away
-        await asyncio.to_thread(
-            lambda: supabase.rpc("update_source_status", {
-                "user_uuid": user.user_id,
-                "target_source_id": source_id,
-                "status_param": "analyzing",
-                "progress_param": 5
-            }).execute()
-        )
+        await set_source_status({
+            "user_uuid": user.user_id,
+            "target_source_id": source_id,
+            "status_param": "analyzing",
+            "progress_param": 5
+        })
         
-        # Start background analysis
-        asyncio.create_task(
-            analyze_source_chunks(
-                pack_id=pack_id,
-                source_id=source_id,
-                filename=filename,
-                user=user,
-                max_chunks=chunks_to_analyze,
-                custom_system_prompt=custom_system_prompt
-            )
-        )
+        # Start background analysis (here, or on a worker when a job queue is configured)
+        await dispatch_job(JOB_ANALYZE_SOURCE, {
+            "pack_id": pack_id,
+            "source_id": source_id,
+            "filename": filename,
+            **user_payload(user),
+            "max_chunks": chunks_to_analyze,
+            "custom_system_prompt": custom_system_prompt
+        })
         
         return {
             "source_id": source_id,
@@ -5182,28 +5570,29 @@ async def cancel_source_analysis(
 ):
     """Cancel a running source analysis or discard a ready_for_analysis source"""
     try:
-        # Signal the analysis loop (if running) to stop
+        # Signal the analysis loop (if running here) to stop
         cancelled_jobs.add(source_id)
         
         print(f"🚫 Source {source_id} cancellation requested by user {user.user_id}")
+        
+        # Leave the cancel marker for a worker or another web node running this source
+        result = await db.get_source_status_v2(user.user_id, source_id)
+        if isinstance(result.data, dict) and result.data.get("pack_id"):
+            marker_key = cancel_marker_key(user.r2_directory, result.data["pack_id"], source_id)
+            if not await upload_to_r2_async(marker_key, json.dumps({"cancelled_at": datetime.utcnow().isoformat()})):
+                print(f"⚠️ Could not store the cancel marker of source {source_id}; only this process will stop it")
 
         # Immediately mark the source as failed in the DB so it doesn't resurface
-        # on page reload. The analysis loop (if running) will also detect cancelled_jobs
+        # on page reload. The analysis loop (if running) will also detect the cancel
         # and may overwrite — both writes use 'failed', so there's no conflict.
-        try:
-            await asyncio.to_thread(
-                lambda: supabase.rpc("update_source_status", {
-                    "user_uuid": user.user_id,
-                    "target_source_id": source_id,
-                    "status_param": "failed",
-                    "progress_param": 0,
-                    "error_message_param": "Cancelled by user"
-                }).execute()
-            )
-            print(f"✅ Source {source_id} marked as failed (user cancelled)")
-        except Exception as db_err:
-            # Non-fatal: the analysis loop may still handle it
-            print(f"⚠️ Could not immediately update cancel status: {db_err}")
+        await set_source_status({
+            "user_uuid": user.user_id,
+            "target_source_id": source_id,
+            "status_param": "failed",
+            "progress_param": 0,
+            "error_message_param": "Cancelled by user"
+        })
+        print(f"✅ Source {source_id} marked as failed (user cancelled)")
         
         return {
             "source_id": source_id,
@@ -5217,13 +5606,44 @@ async def cancel_source_analysis(
 
 
 
+async def ensure_pack_exports(user: AuthenticatedUser, pack_id: str) -> Dict[str, Any]:
+    """
+    Make sure the stored compact/standard/complete exports match the pack's current sources.
+
+    Args:
+        user: Pack owner
+        pack_id: Pack to export
+
+    Returns:
+        Export manifest (version and per-type ETags)
+    """
+    pack_result = await db.get_pack_details_v2(user.user_id, pack_id)
+    sources = (pack_result.data or {}).get("sources", [])
+    exportable = pack_exporter.exportable(
+        sources,
+        lambda source_id: f"{user.r2_directory}/{pack_id}/{source_id}/analyzed.txt"
+    )
+    return await pack_exporter.ensure(f"{user.r2_directory}/{pack_id}", exportable)
+
+
+async def refresh_pack_exports(user: AuthenticatedUser, pack_id: str) -> None:
+    """Regenerate a pack's exports in the background after a source completes or is removed."""
+    try:
+        await ensure_pack_exports(user, pack_id)
+    except Exception as e:
+        print(f"⚠️ Failed to refresh exports for pack {pack_id}: {e}")
+
+
 @app.get("/api/v2/packs/{pack_id}/export/{export_type}")
 async def download_pack_export_v2(
     pack_id: str, 
     export_type: str,
-    user: AuthenticatedUser = Depends(get_current_user)
+    user: AuthenticatedUser = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None)
 ):
-    """Download a pack export (compact/standard/complete/tree)"""
+    """Download a pack export (compact/standard/complete/tree); supports If-None-Match and Range"""
     try:
         if export_type not in ['compact', 'standard', 'complete', 'tree']:
             raise HTTPException(status_code=400, detail="Invalid export type")
@@ -5256,7 +5676,7 @@ async def download_pack_export_v2(
         
         # Original export logic for compact/standard/complete
         # Check if it's a v2 pack or legacy
-        pack_result = supabase.rpc("get_pack_details", {
+        pack_result = await db.rpc("get_pack_details", {
             "user_uuid": user.user_id,
             "target_pack_id": pack_id
         }).execute()
@@ -5272,48 +5692,44 @@ async def download_pack_export_v2(
             if export_type == 'compact':
                 return await download_ultra_compact_ucp(pack_id, user)
             elif export_type == 'standard':
-                return await download_standard_ucp(pack_id, user)
+                return await download_standard_ucp(pack_id, user, range_header=range_header)
             else:
-                return await download_complete_ucp(pack_id, user)
-        
-        # For v2 packs, combine all sources
-        sources = pack_data.get("sources", [])
-        
-        # Combine all analyzed content from sources
-        combined_content = []
-        for source in sources:
-            # Include completed sources AND sources currently building tree (text analysis is done)
-            if source["status"] in ["completed", "building_tree"]:
-                # Download analyzed content from R2
-                analyzed_path = source.get("r2_analyzed_path")
-                if not analyzed_path:
-                    source_id = source.get("source_id")
-                    analyzed_path = f"{user.r2_directory}/{pack_id}/{source_id}/analyzed.txt"
-                
-                print(f"Downloading analyzed content from: {analyzed_path}")
-                if analyzed_path: # Still check in case source_id was also missing or path construction failed
-                    content = download_from_r2(analyzed_path)
-                    if content:
-                        combined_content.append(f"=== Source: {source['source_name']} ===\n\n{content}\n\n")
-        
-        # Generate export based on type
-        if export_type == "compact":
-            full_text = "\n".join(combined_content)
-            export_content = full_text
-        elif export_type == "standard":
-            export_content = "\n".join(combined_content)
-        else:  # complete
-            export_content = "\n".join(combined_content)
-        
-        # Return as downloadable file
-        return StreamingResponse(
-            iter([export_content.encode('utf-8')]),
-            media_type="text/plain",
-            headers={
-                "Content-Disposition": f"attachment; filename={export_type}_pack_{pack_id}.txt"
-            }
+                return await download_complete_ucp(pack_id, user, range_header=range_header)
+        
+        # For v2 packs, serve the stored export of the pack's current version
+        # (generated here only if no source completion/deletion has built it yet)
+        manifest = await ensure_pack_exports(user, pack_id)
+        prefix = f"{user.r2_directory}/{pack_id}"
+        etag = manifest["exports"][export_type]["etag"]
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+        
+        part = await asyncio.to_thread(
+            r2_download_part, pack_exporter.artifact_key(prefix, manifest["version"], export_type)
+        )
+        if part is None:
+            # A newer version replaced this one in the meantime - resolve it again
+            pack_exporter.forget(prefix)
+            manifest = await ensure_pack_exports(user, pack_id)
+            etag = manifest["exports"][export_type]["etag"]
+            part = await asyncio.to_thread(
+                r2_download_part, pack_exporter.artifact_key(prefix, manifest["version"], export_type)
+            )
+            if part is None:
+                raise HTTPException(status_code=503, detail="Export is being regenerated, please retry")
+        
+        # Stream the stored object (ranged for resumed downloads)
+        return stream_download_response(
+            [part],
+            f"{export_type}_pack_{pack_id}.txt",
+            range_header,
+            etag=etag,
+            if_range=if_range,
+            headers={"Cache-Control": "private, no-cache"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error downloading pack export: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to download export: {str(e)}")
@@ -5333,7 +5749,7 @@ async def get_pack_tree_nodes(
     """
     try:
         # Query memory_nodes with evidence counts
-        result = supabase.table("memory_nodes") \
+        result = await db.table("memory_nodes") \
             .select("*, memory_evidence(count)") \
             .eq("user_id", user.user_id) \
             .eq("pack_id", pack_id) \
@@ -5353,10 +5769,7 @@ async def get_pack_tree_nodes(
             }
         
         # Get pack name using RPC function (bypasses RLS)
-        pack_result = supabase.rpc("get_pack_details_v2", {
-            "user_uuid": user.user_id,
-            "target_pack_id": pack_id
-        }).execute()
+        pack_result = await db.get_pack_details_v2(user.user_id, pack_id)
         
         # RPC returns a dict with pack details
         pack_name = "Unknown Pack"
@@ -5433,7 +5846,7 @@ async def update_node(
             raise HTTPException(status_code=400, detail="No fields to update")
         
         # Update node
-        result = supabase.table("memory_nodes") \
+        result = await db.table("memory_nodes") \
             .update(update_dict) \
             .eq("id", node_id) \
             .eq("user_id", user.user_id) \
@@ -5443,7 +5856,7 @@ async def update_node(
         
         if not result.data:
             # Try to check if node exists at all
-            check_result = supabase.table("memory_nodes") \
+            check_result = await db.table("memory_nodes") \
                 .select("id, user_id") \
                 .eq("id", node_id) \
                 .execute()
@@ -5520,7 +5933,7 @@ async def create_node(
             "data": data
         }
         
-        result = supabase.table("memory_nodes").insert(new_node).execute()
+        result = await db.table("memory_nodes").insert(new_node).execute()
         
         if not result.data:
             raise HTTPException(status_code=500, detail="Failed to create node")
@@ -5563,7 +5976,7 @@ async def delete_node(
         print(f"Deleting node {node_id} for user {user.user_id}")
         
         # First, delete associated evidence
-        evidence_result = supabase.table("memory_evidence") \
+        evidence_result = await db.table("memory_evidence") \
             .delete() \
             .eq("node_id", node_id) \
             .eq("user_id", user.user_id) \
@@ -5572,7 +5985,7 @@ async def delete_node(
         print(f"Deleted {len(evidence_result.data or [])} evidence items")
         
         # Then delete the node
-        result = supabase.table("memory_nodes") \
+        result = await db.table("memory_nodes") \
             .delete() \
             .eq("id", node_id) \
             .eq("user_id", user.user_id) \
@@ -5600,7 +6013,7 @@ async def get_node_evidence(
     Get evidence (source snippets) for a specific node.
     """
     try:
-        result = supabase.table("memory_evidence") \
+        result = await db.table("memory_evidence") \
             .select("id, source_id, chunk_index, snippet, created_at") \
             .eq("user_id", user.user_id) \
             .eq("node_id", node_id) \
@@ -5613,7 +6026,7 @@ async def get_node_evidence(
             # Try to get source name
             source_name = None
             try:
-                source_result = supabase.table("pack_sources") \
+                source_result = await db.table("pack_sources") \
                     .select("file_name") \
                     .eq("source_id", ev["source_id"]) \
                     .single() \
@@ -5753,7 +6166,7 @@ async def get_user_profile_quick(current_user: AuthenticatedUser = Depends(get_c
                 "email": current_user.email,
                 "r2_user_directory": current_user.r2_directory,
                 "authenticated": True,
-                "analysis_in_progress": len(job_progress) > 0
+                "analysis_in_progress": len(job_store) > 0
             },
             "timestamp": time.time()
         }
@@ -5785,12 +6198,12 @@ async def get_user_profile(current_user: AuthenticatedUser = Depends(get_current
             }
         
         # During heavy analysis periods, return a lighter profile response
-        is_analysis_period = len(job_progress) > 0  # Check if any analysis is running
+        is_analysis_period = len(job_store) > 0  # Check if any analysis is running
         
         # Get user profile with shorter timeout during analysis
         profile_timeout = 5 if is_analysis_period else 15
         try:
-            profile_result = supabase.table('user_profiles').select('*').eq('id', current_user.user_id).limit(1).execute()
+            profile_result = await db.table('user_profiles').select('*').eq('id', current_user.user_id).limit(1).execute()
             
             if not profile_result.data:
                 # Create profile if it doesn't exist - but keep it simple
@@ -5834,7 +6247,7 @@ async def get_user_profile(current_user: AuthenticatedUser = Depends(get_current
             # Get packs with timeout and limit (only when not analyzing)
             try:
                 # Use a quick query with limit to prevent hanging
-                packs_result = supabase.table('packs').select('*').eq('user_id', current_user.user_id).order('created_at', desc=True).limit(5).execute()
+                packs_result = await db.table('packs').select('*').eq('user_id', current_user.user_id).order('created_at', desc=True).limit(5).execute()
                 packs = packs_result.data if packs_result.data else []
             except Exception as e:
                 print(f"⚠️ Packs query timeout: {e}")
@@ -5842,7 +6255,7 @@ async def get_user_profile(current_user: AuthenticatedUser = Depends(get_current
             
             # Get recent jobs with timeout and limit (only when not analyzing)
             try:
-                jobs_result = supabase.table('jobs').select('*').eq('user_id', current_user.user_id).order('created_at', desc=True).limit(5).execute()
+                jobs_result = await db.table('jobs').select('*').eq('user_id', current_user.user_id).order('created_at', desc=True).limit(5).execute()
                 jobs = jobs_result.data if jobs_result.data else []
             except Exception as e:
                 print(f"⚠️ Jobs query timeout: {e}")
@@ -6120,7 +6533,7 @@ async def process_stripe_session(
         amount = session.amount_total / 100 if session.amount_total else 0
         
         # Check if this session was already processed
-        existing = supabase.table("credit_transactions").select("id").eq("stripe_payment_id", session.id).execute()
+        existing = await db.table("credit_transactions").select("id").eq("stripe_payment_id", session.id).execute()
         if existing.data:
             return {
                 "success": True,
@@ -6201,7 +6614,7 @@ async def stripe_webhook(request: Request):
         # Log webhook attempt to database for audit trail
         if supabase:
             try:
-                supabase.table("webhook_logs").insert({
+                await db.table("webhook_logs").insert({
                     "webhook_id": webhook_id,
                     "event_type": "stripe_webhook",
                     "payload_size": len(payload),
@@ -6247,7 +6660,7 @@ async def stripe_webhook(request: Request):
             # Log payment failure to database for investigation
             if supabase and user_id:
                 try:
-                    supabase.table("payment_attempts").insert({
+                    await db.table("payment_attempts").insert({
                         "user_id": user_id,
                         "attempt_type": "payment_intent",
                         "credits_requested": int(payment_intent['metadata'].get('credits', 0)) if payment_intent.get('metadata') else 0,
@@ -6270,7 +6683,7 @@ async def stripe_webhook(request: Request):
             # Log payment failure to database
             if supabase and user_id:
                 try:
-                    supabase.table("payment_attempts").insert({
+                    await db.table("payment_attempts").insert({
                         "user_id": user_id,
                         "attempt_type": "checkout_session",
                         "credits_requested": int(session['metadata'].get('credits', 0)) if session.get('metadata') else 0,
@@ -6292,7 +6705,7 @@ async def stripe_webhook(request: Request):
             # Log session expiry to database
             if supabase and user_id:
                 try:
-                    supabase.table("payment_attempts").insert({
+                    await db.table("payment_attempts").insert({
                         "user_id": user_id,
                         "attempt_type": "checkout_session",
                         "credits_requested": int(session['metadata'].get('credits', 0)) if session.get('metadata') else 0,
@@ -6502,7 +6915,7 @@ async def stripe_webhook(request: Request):
         # Update webhook log with final status
         if supabase:
             try:
-                supabase.table("webhook_logs").update({
+                await db.table("webhook_logs").update({
                     "status": "success",
                     "stripe_event_type": event['type'],
                     "processed_data": {
@@ -6522,7 +6935,7 @@ async def stripe_webhook(request: Request):
         # Update webhook log with error status
         if supabase:
             try:
-                supabase.table("webhook_logs").update({
+                await db.table("webhook_logs").update({
                     "status": "failed",
                     "error_message": str(e),
                     "updated_at": datetime.utcnow().isoformat()
@@ -6562,14 +6975,14 @@ async def add_credits_to_user(user_id: str, credits: int, amount: float, stripe_
         print(f"💰 Amount: ${amount}, Stripe ID: {stripe_payment_id}")
         
         # Check if this payment was already processed (duplicate protection)
-        existing_payment = supabase.table("credit_transactions").select("id").eq("stripe_payment_id", stripe_payment_id).execute()
+        existing_payment = await db.table("credit_transactions").select("id").eq("stripe_payment_id", stripe_payment_id).execute()
         
         if existing_payment.data:
             print(f"⚠️ Payment {stripe_payment_id} already processed, skipping duplicate")
             return
         
         # Use the database function to add credits (handles both transaction and balance update)
-        result = supabase.rpc("add_credits_to_user", {
+        result = await db.rpc("add_credits_to_user", {
             "user_uuid": user_id,
             "credits_to_add": credits,
             "transaction_description": f"Stripe payment - ${amount} for {credits} credits (Payment ID: {stripe_payment_id})"
@@ -6608,7 +7021,7 @@ async def activate_subscription(user_id: str, subscription):
         print(f"🌟 Status: {status}")
         
         # Update user profile with subscription details
-        result = supabase.table('user_profiles').update({
+        result = await db.table('user_profiles').update({
             'payment_plan': 'unlimited',  # Keep as 'unlimited' for backend compatibility
             'subscription_id': subscription_id,
             'subscription_status': status,
@@ -6636,7 +7049,7 @@ async def update_subscription_status(user_id: str, subscription):
         
         print(f"🔄 Updating subscription status for user {user_id} to {status}")
         
-        supabase.table('user_profiles').update({
+        await db.table('user_profiles').update({
             'subscription_status': status,
             'current_period_end': datetime.fromtimestamp(current_period_end).isoformat(),
         }).eq('id', user_id).execute()
@@ -6657,7 +7070,7 @@ async def cancel_subscription(user_id: str, subscription):
         print(f"❌ Subscription ID: {subscription['id']}")
         
         # Downgrade to credit-based plan, remove unlimited access
-        supabase.table('user_profiles').update({
+        await db.table('user_profiles').update({
             'payment_plan': 'credits',  # Downgrade from unlimited
             'subscription_status': 'canceled',
             'subscription_id': None,
@@ -6679,7 +7092,7 @@ async def renew_subscription(subscription_id: str, invoice):
         print(f"💳 Processing monthly renewal for subscription {subscription_id}")
         
         # Find user by subscription_id
-        result = supabase.table('user_profiles').select('*').eq('subscription_id', subscription_id).execute()
+        result = await db.table('user_profiles').select('*').eq('subscription_id', subscription_id).execute()
         
         if result.data and len(result.data) > 0:
             user = result.data[0]
@@ -6688,7 +7101,7 @@ async def renew_subscription(subscription_id: str, invoice):
             print(f"💳 Renewing subscription for user {user_id}")
             
             # Ensure plan is still unlimited and status is active
-            supabase.table('user_profiles').update({
+            await db.table('user_profiles').update({
                 'subscription_status': 'active',
                 'payment_plan': 'unlimited',  # Ensure unlimited access continues
             }).eq('id', user_id).execute()
@@ -6710,7 +7123,7 @@ async def handle_failed_payment(subscription_id: str, invoice):
         print(f"⚠️ Payment failed for subscription {subscription_id}")
         
         # Find user by subscription_id
-        result = supabase.table('user_profiles').select('*').eq('subscription_id', subscription_id).execute()
+        result = await db.table('user_profiles').select('*').eq('subscription_id', subscription_id).execute()
         
         if result.data and len(result.data) > 0:
             user = result.data[0]
@@ -6720,7 +7133,7 @@ async def handle_failed_payment(subscription_id: str, invoice):
             
             # Mark as past_due but don't immediately revoke access
             # Stripe will retry and eventually cancel if payment keeps failing
-            supabase.table('user_profiles').update({
+            await db.table('user_profiles').update({
                 'subscription_status': 'past_due'
             }).eq('id', user_id).execute()
             
@@ -6742,7 +7155,7 @@ async def grant_unlimited_access(user_id: str, amount: float, stripe_payment_id:
         print(f"💰 Amount: ${amount}, Stripe ID: {stripe_payment_id}")
         
         # Check if this payment was already processed (duplicate protection)
-        existing_payment = supabase.table("credit_transactions").select("id").eq("stripe_payment_id", stripe_payment_id).execute()
+        existing_payment = await db.table("credit_transactions").select("id").eq("stripe_payment_id", stripe_payment_id).execute()
         
         if existing_payment.data:
             print(f"⚠️ Payment {stripe_payment_id} already processed, skipping duplicate")
@@ -6750,7 +7163,7 @@ async def grant_unlimited_access(user_id: str, amount: float, stripe_payment_id:
         
         # First, try using the database function
         try:
-            result = supabase.rpc("grant_unlimited_access", {
+            result = await db.rpc("grant_unlimited_access", {
                 "user_uuid": user_id,
                 "amount_paid": amount,
                 "stripe_payment_id": stripe_payment_id
@@ -6773,7 +7186,7 @@ async def grant_unlimited_access(user_id: str, amount: float, stripe_payment_id:
         print(f"🔧 Manually updating user {user_id} to unlimited plan...")
         
         # Update user profile
-        update_result = supabase.table("user_profiles").update({
+        update_result = await db.table("user_profiles").update({
             "payment_plan": "unlimited",
             "credits_balance": 999999,
             "subscription_status": "active",
@@ -6787,7 +7200,7 @@ async def grant_unlimited_access(user_id: str, amount: float, stripe_payment_id:
             print(f"✅ Successfully updated user profile to unlimited")
             
             # Log the transaction
-            transaction_result = supabase.table("credit_transactions").insert({
+            transaction_result = await db.table("credit_transactions").insert({
                 "user_id": user_id,
                 "transaction_type": "purchase",
                 "credits": 999999,
@@ -6814,7 +7227,7 @@ async def grant_unlimited_access(user_id: str, amount: float, stripe_payment_id:
         
         # Last resort: try to at least log the payment attempt
         try:
-            supabase.table("webhook_logs").insert({
+            await db.table("webhook_logs").insert({
                 "webhook_id": f"failed_unlimited_{user_id}_{stripe_payment_id[:8]}",
                 "event_type": "unlimited_grant_failed", 
                 "status": "failed",
@@ -6841,7 +7254,7 @@ async def debug_grant_unlimited(request: dict, user: AuthenticatedUser = Depends
             raise HTTPException(status_code=400, detail="Email required")
         
         # Find user by email
-        user_result = supabase.table("user_profiles").select("id, email, credits_balance, payment_plan").eq("email", target_email).execute()
+        user_result = await db.table("user_profiles").select("id, email, credits_balance, payment_plan").eq("email", target_email).execute()
         
         if not user_result.data:
             raise HTTPException(status_code=404, detail=f"User not found: {target_email}")
@@ -6853,7 +7266,7 @@ async def debug_grant_unlimited(request: dict, user: AuthenticatedUser = Depends
         await grant_unlimited_access(target_user["id"], 3.99, "manual_debug_grant")
         
         # Check the result
-        updated_user = supabase.table("user_profiles").select("id, email, credits_balance, payment_plan, subscription_status").eq("id", target_user["id"]).execute()
+        updated_user = await db.table("user_profiles").select("id, email, credits_balance, payment_plan, subscription_status").eq("id", target_user["id"]).execute()
         
         return {
             "success": True,
@@ -6876,7 +7289,7 @@ async def debug_check_user(email: str):
         print(f"🔍 Checking user: {email}")
         
         # Find user by email
-        user_result = supabase.table("user_profiles").select("*").eq("email", email).execute()
+        user_result = await db.table("user_profiles").select("*").eq("email", email).execute()
         
         if not user_result.data:
             return {"found": False, "email": email}
@@ -6885,7 +7298,7 @@ async def debug_check_user(email: str):
         print(f"👤 Found user: {user_data}")
         
         # Also check recent transactions
-        transactions = supabase.table("credit_transactions").select("*").eq("user_id", user_data["id"]).order("created_at", desc=True).limit(5).execute()
+        transactions = await db.table("credit_transactions").select("*").eq("user_id", user_data["id"]).order("created_at", desc=True).limit(5).execute()
         
         return {
             "found": True,
@@ -6907,7 +7320,7 @@ async def debug_grant_unlimited_by_email(email: str):
         print(f"🌟 Granting unlimited access to: {email}")
         
         # Find user by email
-        user_result = supabase.table("user_profiles").select("id, email, credits_balance, payment_plan").eq("email", email).execute()
+        user_result = await db.table("user_profiles").select("id, email, credits_balance, payment_plan").eq("email", email).execute()
         
         if not user_result.data:
             raise HTTPException(status_code=404, detail=f"User not found: {email}")
@@ -6919,7 +7332,7 @@ async def debug_grant_unlimited_by_email(email: str):
         await grant_unlimited_access(target_user["id"], 3.99, "manual_debug_grant_" + target_user["id"][:8])
         
         # Check the result
-        updated_user = supabase.table("user_profiles").select("id, email, credits_balance, payment_plan, subscription_status").eq("id", target_user["id"]).execute()
+        updated_user = await db.table("user_profiles").select("id, email, credits_balance, payment_plan, subscription_status").eq("id", target_user["id"]).execute()
         
         return {
             "success": True,
@@ -6934,10 +7347,20 @@ async def debug_grant_unlimited_by_email(email: str):
 
 @app.get("/api/cache-performance/{job_id}")
 async def get_cache_performance(job_id: str, user: AuthenticatedUser = Depends(get_current_user)):
-    """Get caching performance metrics for a job"""
+    """Get caching performance metrics for a job (legacy job id or v2 source id)"""
     try:
         # Download summary to check cache performance
-        summary_content = download_from_r2(f"{user.r2_directory}/{job_id}/summary.json")
+        summary_content = download_from_r2(f"{user.r2_directory}/{job_id}/summary.json", silent_404=True)
+        
+        # V2 sources keep their summary next to the analysis: {pack_id}/{source_id}/analysis_summary.json
+        if not summary_content and supabase:
+            source_result = await db.get_source_status_v2(user.user_id, job_id)
+            if source_result.data and source_result.data.get("pack_id"):
+                summary_content = await download_from_r2_async(
+                    f"{user.r2_directory}/{source_result.data['pack_id']}/{job_id}/analysis_summary.json",
+                    silent_404=True
+                )
+        
         if not summary_content:
             raise HTTPException(status_code=404, detail="Job summary not found")
         
@@ -6957,6 +7380,8 @@ async def get_cache_performance(job_id: str, user: AuthenticatedUser = Depends(g
         
     except json.JSONDecodeError:
         raise HTTPException(status_code=500, detail="Invalid summary data")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error fetching cache performance: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch cache performance")
@@ -6969,7 +7394,7 @@ async def get_payment_attempts(user: AuthenticatedUser = Depends(get_current_use
             raise HTTPException(status_code=500, detail="Database not available")
         
         # Get recent payment attempts for this user
-        result = supabase.table("payment_attempts").select("*").eq("user_id", user.user_id).order("created_at", desc=True).limit(10).execute()
+        result = await db.table("payment_attempts").select("*").eq("user_id", user.user_id).order("created_at", desc=True).limit(10).execute()
         
         attempts = []
         if result.data:
@@ -7013,7 +7438,7 @@ async def test_unlimited_webhook(request: dict, user: AuthenticatedUser = Depend
         
         # Check the result
         if supabase:
-            user_check = supabase.table("user_profiles").select("*").eq("id", user_id).execute()
+            user_check = await db.table("user_profiles").select("*").eq("id", user_id).execute()
             if user_check.data:
                 user_data = user_check.data[0]
                 return {
@@ -7073,7 +7498,7 @@ async def simulate_checkout_webhook(request: dict, user: AuthenticatedUser = Dep
         
         # Verify the result
         if supabase:
-            verification = supabase.table("user_profiles").select("*").eq("id", user_id).execute()
+            verification = await db.table("user_profiles").select("*").eq("id", user_id).execute()
             user_data = verification.data[0] if verification.data else None
         else:
             user_data = None
@@ -7101,11 +7526,11 @@ async def get_recent_webhook_events(user: AuthenticatedUser = Depends(get_curren
         if supabase:
             try:
                 # Query webhook_logs table if it exists
-                webhook_logs = supabase.table("webhook_logs").select("*").order("created_at", desc=True).limit(20).execute()
+                webhook_logs = await db.table("webhook_logs").select("*").order("created_at", desc=True).limit(20).execute()
                 logs = webhook_logs.data if webhook_logs.data else []
                 
                 # Also get recent payment-related events from user_payment_status
-                payment_logs = supabase.table("user_payment_status").select("*").order("updated_at", desc=True).limit(10).execute()
+                payment_logs = await db.table("user_payment_status").select("*").order("updated_at", desc=True).limit(10).execute()
                 payments = payment_logs.data if payment_logs.data else []
                 
                 return {
@@ -0,0 +1,205 @@
+"""
+Bounded in-memory state for jobs and rate limits.
+
+Job progress, progress history, cancellation flags and rate-limit attempts
+used to live in module-level dicts and sets that were never pruned, so they
+grew for as long as the server ran. The stores here expire entries after a
+TTL, cap the number of entries (least recently used first), and keep O(1)
+counters for health checks. A periodic sweep drops expired entries; reads
+also ignore them, so a late sweep never serves stale state.
+"""
+
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+class JobRecord:
+    """Latest progress, recent history and cancellation flag for one job or source."""
+
+    __slots__ = ("progress", "history", "cancelled", "expires_at")
+
+    def __init__(self, history_size: int, expires_at: float):
+        self.progress: Optional[Dict[str, Any]] = None
+        self.history: deque = deque(maxlen=history_size)
+        self.cancelled = False
+        self.expires_at = expires_at
+
+
+class CancelledJobs:
+    """Set-like view of the cancelled flags in a JobStore (add / discard / in)."""
+
+    __slots__ = ("_store",)
+
+    def __init__(self, store: "JobStore"):
+        self._store = store
+
+    def add(self, job_id: str) -> None:
+        self._store._record(job_id, create=True).cancelled = True
+
+    def discard(self, job_id: str) -> None:
+        record = self._store._record(job_id)
+        if record is not None:
+            record.cancelled = False
+
+    def __contains__(self, job_id: object) -> bool:
+        record = self._store._record(job_id, touch=False)
+        return record is not None and record.cancelled
+
+    def __len__(self) -> int:
+        return sum(1 for record in self._store._records.values() if record.cancelled)
+
+
+class JobStore:
+    """
+    TTL + LRU store of JobRecords keyed by job (or source) id.
+
+    Usage:
+        job_store = JobStore(ttl_seconds=6 * 3600, max_jobs=10000)
+        job_store.update_progress(job_id, {"step": "analyzing", "progress": 40, ...})
+        job_store.cancelled.add(job_id)
+        if job_id in job_store.cancelled: ...
+    """
+
+    def __init__(self, ttl_seconds: float, max_jobs: int, history_size: int = 50):
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max(1, max_jobs)
+        self.history_size = history_size
+        self._records: "OrderedDict[str, JobRecord]" = OrderedDict()
+        self._step_counts: Dict[str, int] = {}
+        self.cancelled = CancelledJobs(self)
+        self.stats: Dict[str, int] = {"expired": 0, "evicted": 0}
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _record(self, job_id: Hashable, create: bool = False, touch: bool = True) -> Optional[JobRecord]:
+        now = time.monotonic()
+        record = self._records.get(job_id)
+        if record is not None and record.expires_at <= now:
+            self._remove(job_id)
+            self.stats["expired"] += 1
+            record = None
+        if record is None:
+            if not create:
+                return None
+            record = self._records[job_id] = JobRecord(self.history_size, now + self.ttl_seconds)
+            while len(self._records) > self.max_jobs:
+                self._remove(next(iter(self._records)))
+                self.stats["evicted"] += 1
+        elif touch:
+            record.expires_at = now + self.ttl_seconds
+            self._records.move_to_end(job_id)
+        return record
+
+    def _remove(self, job_id: Hashable) -> None:
+        record = self._records.pop(job_id)
+        self._count_step(record.progress, -1)
+
+    def _count_step(self, progress: Optional[Dict[str, Any]], delta: int) -> None:
+        if not progress:
+            return
+        step = progress.get("step")
+        count = self._step_counts.get(step, 0) + delta
+        if count > 0:
+            self._step_counts[step] = count
+        else:
+            self._step_counts.pop(step, None)
+
+    def update_progress(self, job_id: str, entry: Dict[str, Any]) -> None:
+        """Set a job's latest progress and append it to its history."""
+        record = self._record(job_id, create=True)
+        self._count_step(record.progress, -1)
+        record.progress = entry
+        self._count_step(entry, 1)
+        record.history.append(entry)
+
+    def progress(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Latest progress entry, or None for unknown or expired jobs."""
+        record = self._record(job_id, touch=False)
+        return record.progress if record is not None else None
+
+    def history(self, job_id: str) -> List[Dict[str, Any]]:
+        """Recent progress entries, oldest first (at most history_size)."""
+        record = self._record(job_id, touch=False)
+        return list(record.history) if record is not None else []
+
+    def count_step(self, step: str) -> int:
+        """Number of tracked jobs whose latest progress is at step (O(1))."""
+        return self._step_counts.get(step, 0)
+
+    def sweep(self) -> int:
+        """
+        Drop expired records.
+
+        Returns:
+            Number of records removed
+        """
+        now = time.monotonic()
+        expired = [job_id for job_id, record in self._records.items() if record.expires_at <= now]
+        for job_id in expired:
+            self._remove(job_id)
+        self.stats["expired"] += len(expired)
+        return len(expired)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters for health/metrics endpoints."""
+        return {
+            "tracked_jobs": len(self._records),
+            "max_jobs": self.max_jobs,
+            "ttl_seconds": self.ttl_seconds,
+            "steps": dict(self._step_counts),
+            **self.stats,
+        }
+
+
+class AttemptLog:
+    """
+    Sliding-window attempt timestamps per key, for simple rate limits.
+
+    Keys whose newest attempt is older than ttl_seconds are dropped by
+    sweep(); at most max_keys keys are kept (least recently used first).
+    """
+
+    def __init__(self, ttl_seconds: float, max_keys: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max(1, max_keys)
+        self._attempts: "OrderedDict[Hashable, deque]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._attempts)
+
+    def try_acquire(self, key: Hashable, max_attempts: int, window_seconds: float) -> Tuple[bool, int]:
+        """
+        Record an attempt unless max_attempts were already made within the window.
+
+        Args:
+            key: e.g. (limit_type, user_id)
+            max_attempts: Attempts allowed per window
+            window_seconds: Sliding window length
+
+        Returns:
+            (allowed, attempt_count) - attempt_count includes this attempt when allowed
+        """
+        now = time.monotonic()
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            attempts = self._attempts[key] = deque()
+        self._attempts.move_to_end(key)
+        while attempts and attempts[0] <= now - window_seconds:
+            attempts.popleft()
+
+        if len(attempts) >= max_attempts:
+            return False, len(attempts)
+        attempts.append(now)
+        while len(self._attempts) > self.max_keys:
+            self._attempts.popitem(last=False)
+        return True, len(attempts)
+
+    def sweep(self) -> int:
+        """Drop keys with no attempt in the last ttl_seconds; returns the number removed."""
+        cutoff = time.monotonic() - self.ttl_seconds
+        stale = [key for key, attempts in self._attempts.items() if not attempts or attempts[-1] <= cutoff]
+        for key in stale:
+            del self._attempts[key]
+        return len(stale)
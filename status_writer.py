@@ -0,0 +1,158 @@
+"""
+Coalescing writer for source status updates.
+
+Analysis batches, tree batches and extraction milestones each report
+progress. Writing every report straight to the update_source_status RPC
+costs a database round trip per call, which adds up when several large
+sources are analysed at once. StatusWriter keeps the latest pending update
+per source and writes:
+
+- immediately when the status changes (e.g. analyzing -> completed), so
+  transitions are durable before the caller moves on
+- otherwise at most once per min_interval, with a trailing write that
+  carries the newest progress
+
+Write failures are retried and logged here, so callers never need their
+own error handling around status updates.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+# Statuses after which a source's writer state can be dropped
+TERMINAL_STATUSES = frozenset({"ready_for_analysis", "completed", "failed", "cancelled"})
+
+
+class _SourceState:
+    """Pending update and write bookkeeping for one source."""
+
+    __slots__ = ("pending", "status", "last_write", "timer", "lock")
+
+    def __init__(self):
+        self.pending: Optional[Dict[str, Any]] = None
+        self.status: Optional[str] = None
+        self.last_write = 0.0
+        self.timer: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+
+class StatusWriter:
+    """
+    Per-source debounced status writes.
+
+    Usage:
+        writer = StatusWriter(lambda params: db.update_source_status(params))
+        await writer.update({"target_source_id": sid, "status_param": "analyzing", "progress_param": 50})
+    """
+
+    def __init__(
+        self,
+        write: Callable[[Dict[str, Any]], Awaitable[Any]],
+        min_interval: float = 1.0,
+        retries: int = 2,
+        retry_delay: float = 0.5,
+    ):
+        """
+        Args:
+            write: Async callable performing one RPC with the given params
+            min_interval: Minimum seconds between two writes for the same source
+            retries: Extra attempts after a failed write
+            retry_delay: Initial backoff between attempts (doubles each retry)
+        """
+        self._write = write
+        self.min_interval = max(0.0, min_interval)
+        self.retries = max(0, retries)
+        self.retry_delay = retry_delay
+        self._states: Dict[str, _SourceState] = {}
+        self.stats: Dict[str, int] = {"requested": 0, "written": 0, "coalesced": 0, "failed": 0}
+
+    async def update(self, params: Dict[str, Any]) -> None:
+        """
+        Record a status update for params["target_source_id"].
+
+        Status changes are written before this returns. Progress-only
+        updates are merged into the pending update and written within
+        min_interval.
+
+        Args:
+            params: update_source_status RPC parameters
+        """
+        key = params["target_source_id"]
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _SourceState()
+        self.stats["requested"] += 1
+
+        if state.pending is not None:
+            self.stats["coalesced"] += 1
+        state.pending = {**state.pending, **params} if state.pending else dict(params)
+
+        status = params.get("status_param")
+        transition = status is not None and status != state.status
+        if status is not None:
+            state.status = status
+
+        wait = state.last_write + self.min_interval - time.monotonic()
+        if transition or (wait <= 0 and state.timer is None):
+            await self._flush(key, state)
+        elif state.timer is None:
+            state.timer = asyncio.create_task(self._flush_later(key, state, wait))
+
+    async def _flush_later(self, key: str, state: _SourceState, delay: float) -> None:
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            state.timer = None
+        await self._flush(key, state)
+
+    async def _flush(self, key: str, state: _SourceState) -> bool:
+        async with state.lock:
+            params, state.pending = state.pending, None
+            if params is None:
+                return True
+            state.last_write = time.monotonic()
+            if not await self._write_with_retry(params):
+                # Keep the update so the next flush retries it (newer fields win)
+                state.pending = {**params, **(state.pending or {})}
+                return False
+            if state.pending is None and state.timer is None and state.status in TERMINAL_STATUSES:
+                if self._states.get(key) is state:
+                    del self._states[key]
+            return True
+
+    async def _write_with_retry(self, params: Dict[str, Any]) -> bool:
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                await self._write(params)
+                self.stats["written"] += 1
+                return True
+            except Exception as e:
+                if attempt == self.retries:
+                    self.stats["failed"] += 1
+                    print(f"❌ Failed to update status for source {params.get('target_source_id')} "
+                          f"({params.get('status_param')}, {params.get('progress_param')}%): {e}")
+                    return False
+                print(f"⚠️ Status update failed, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+        return False
+
+    async def flush_all(self) -> None:
+        """Write every pending update now (called on shutdown)."""
+        for key, state in list(self._states.items()):
+            if state.timer is not None:
+                state.timer.cancel()
+                state.timer = None
+            await self._flush(key, state)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters for health/metrics endpoints."""
+        return {
+            "tracked_sources": len(self._states),
+            "pending": sum(1 for state in self._states.values() if state.pending is not None),
+            "min_interval_ms": int(self.min_interval * 1000),
+            **self.stats,
+        }
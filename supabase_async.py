@@ -0,0 +1,344 @@
+"""
+Async access to Supabase's PostgREST API.
+
+The supabase-py client is synchronous, so every query either blocks the
+event loop or takes a thread from the default executor. AsyncSupabase talks
+to PostgREST directly over one pooled httpx.AsyncClient. Its query builder
+covers the subset of the supabase-py chain API this backend uses, so call
+sites read the same with an await in front:
+
+    result = await db.table("user_profiles").select("*").eq("id", user_id).execute()
+    result = await db.rpc("get_pack_details_v2", {...}).execute()
+
+Every request is timed per table/RPC for the health endpoint. Pack and
+source lookups can be served from a MetadataCache, which is invalidated for
+the user whenever one of the pack/source write RPCs succeeds.
+"""
+
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from metadata_cache import MetadataCache
+
+
+# RPCs that change packs or sources: a successful call invalidates the caller's cached metadata
+WRITE_RPCS = frozenset({
+    "update_source_status",
+    "add_pack_source",
+    "delete_pack_source",
+    "create_pack_v2",
+    "update_pack_v2",
+    "delete_pack_v2",
+})
+
+
+class SupabaseError(Exception):
+    """PostgREST error response (mirrors postgrest's APIError fields)."""
+
+    def __init__(self, message: str, code: Optional[str] = None, details: Any = None,
+                 hint: Any = None, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.details = details
+        self.hint = hint
+        self.status_code = status_code
+
+    def __str__(self) -> str:
+        return str({"message": self.message, "code": self.code, "details": self.details, "hint": self.hint})
+
+
+@dataclass
+class QueryResult:
+    """Response of a query or RPC; .data matches supabase-py's APIResponse.data."""
+    data: Any
+
+
+def _filter_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    return str(value)
+
+
+class QueryBuilder:
+    """Chainable table query: select/insert/update/upsert/delete with eq/order/limit/single."""
+
+    def __init__(self, client: "AsyncSupabase", table: str):
+        self._client = client
+        self._table = table
+        self._method = "GET"
+        self._operation = "select"
+        self._params: List[Tuple[str, str]] = []
+        self._headers: Dict[str, str] = {}
+        self._body: Any = None
+        self._order: List[str] = []
+
+    def select(self, columns: str = "*") -> "QueryBuilder":
+        self._params.append(("select", columns.replace(" ", "")))
+        return self
+
+    def _write(self, method: str, operation: str, body: Any = None) -> "QueryBuilder":
+        self._method = method
+        self._operation = operation
+        self._body = body
+        self._headers["Prefer"] = "return=representation"
+        return self
+
+    def insert(self, data: Any) -> "QueryBuilder":
+        return self._write("POST", "insert", data)
+
+    def update(self, data: Dict[str, Any]) -> "QueryBuilder":
+        return self._write("PATCH", "update", data)
+
+    def upsert(self, data: Any, on_conflict: Optional[str] = None) -> "QueryBuilder":
+        self._write("POST", "upsert", data)
+        self._headers["Prefer"] = "return=representation,resolution=merge-duplicates"
+        if on_conflict:
+            self._params.append(("on_conflict", on_conflict))
+        return self
+
+    def delete(self) -> "QueryBuilder":
+        return self._write("DELETE", "delete")
+
+    def eq(self, column: str, value: Any) -> "QueryBuilder":
+        self._params.append((column, f"eq.{_filter_value(value)}"))
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "QueryBuilder":
+        self._order.append(f"{column}.{'desc' if desc else 'asc'}")
+        return self
+
+    def limit(self, count: int) -> "QueryBuilder":
+        self._params.append(("limit", str(count)))
+        return self
+
+    def single(self) -> "QueryBuilder":
+        """Return one row as a dict; errors unless exactly one row matches."""
+        self._headers["Accept"] = "application/vnd.pgrst.object+json"
+        return self
+
+    async def execute(self) -> QueryResult:
+        params = list(self._params)
+        if self._order:
+            params.append(("order", ",".join(self._order)))
+        data = await self._client.request(
+            self._method,
+            f"/rest/v1/{self._table}",
+            params=params,
+            body=self._body,
+            headers=self._headers,
+            metric=f"{self._operation}:{self._table}",
+        )
+        return QueryResult(data=data)
+
+
+class RpcCall:
+    """Pending call of a Postgres function exposed through PostgREST."""
+
+    def __init__(self, client: "AsyncSupabase", name: str, params: Optional[Dict[str, Any]]):
+        self._client = client
+        self._name = name
+        self._params = params or {}
+
+    async def execute(self) -> QueryResult:
+        data = await self._client.request(
+            "POST",
+            f"/rest/v1/rpc/{self._name}",
+            body=self._params,
+            metric=f"rpc:{self._name}",
+        )
+        if self._name in WRITE_RPCS:
+            self._client.invalidate_user(self._params.get("user_uuid"))
+        return QueryResult(data=data)
+
+
+class AsyncSupabase:
+    """
+    Pooled async PostgREST client authenticated with the service role key.
+
+    Usage:
+        db = AsyncSupabase(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+        status = await db.get_source_status_v2(user_id, source_id)
+        await db.aclose()
+    """
+
+    def __init__(self, url: str, key: str, max_connections: int = 50, timeout: float = 30.0,
+                 cache: Optional[MetadataCache] = None):
+        self.url = url.rstrip("/")
+        self.cache = cache
+        self._http = httpx.AsyncClient(
+            base_url=self.url,
+            headers={
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout),
+        )
+        self._metrics: Dict[str, Dict[str, float]] = {}
+
+    def table(self, name: str) -> QueryBuilder:
+        return QueryBuilder(self, name)
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> RpcCall:
+        return RpcCall(self, name, params)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[List[Tuple[str, str]]] = None,
+        body: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        metric: str = "request",
+    ) -> Any:
+        """
+        Send one PostgREST request and decode its JSON body.
+
+        Args:
+            method: HTTP method
+            path: Path below the project URL
+            params: Query string pairs (filters, select, order, ...)
+            body: JSON body
+            headers: Extra headers
+            metric: Name the timing is recorded under
+
+        Returns:
+            Decoded JSON response (None for empty bodies)
+
+        Raises:
+            SupabaseError: On a non-2xx response
+            httpx.HTTPError: On connection errors and timeouts
+        """
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = await self._http.request(
+                method,
+                path,
+                params=params,
+                content=json.dumps(body, default=str) if body is not None else None,
+                headers=headers,
+            )
+            if response.status_code >= 400:
+                raise self._error(response)
+            failed = False
+            return response.json() if response.content else None
+        finally:
+            self._record(metric, time.perf_counter() - start, failed)
+
+    @staticmethod
+    def _error(response: httpx.Response) -> SupabaseError:
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {"message": response.text}
+        if not isinstance(payload, dict):
+            payload = {"message": str(payload)}
+        return SupabaseError(
+            payload.get("message") or f"HTTP {response.status_code}",
+            code=payload.get("code"),
+            details=payload.get("details"),
+            hint=payload.get("hint"),
+            status_code=response.status_code,
+        )
+
+    def _record(self, metric: str, elapsed: float, failed: bool) -> None:
+        stats = self._metrics.get(metric)
+        if stats is None:
+            stats = self._metrics[metric] = {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+        elapsed_ms = elapsed * 1000
+        stats["calls"] += 1
+        stats["errors"] += failed
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    # ------------------------------------------------------------------
+    # Typed RPC helpers
+    # ------------------------------------------------------------------
+
+    async def _cached(self, kind: str, user_id: str, item_id: str, load) -> Any:
+        if self.cache is None:
+            return await load()
+        return await self.cache.get_or_load((kind, user_id, item_id), user_id, load)
+
+    def invalidate_user(self, user_id: Optional[str]) -> None:
+        """Drop cached pack/source metadata for user_id (after writes made outside WRITE_RPCS)."""
+        if self.cache is not None and user_id:
+            self.cache.invalidate_owner(user_id)
+
+    async def get_pack_details_v2(self, user_id: str, pack_id: str) -> QueryResult:
+        return await self._cached("pack_details", user_id, pack_id, lambda: self.rpc("get_pack_details_v2", {
+            "user_uuid": user_id,
+            "target_pack_id": pack_id
+        }).execute())
+
+    async def get_source_status_v2(self, user_id: str, source_id: str) -> QueryResult:
+        return await self._cached("source_status", user_id, source_id, lambda: self.rpc("get_source_status_v2", {
+            "user_uuid": user_id,
+            "target_source_id": source_id
+        }).execute())
+
+    async def get_owned_pack(self, user_id: str, pack_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch one v2 pack row if it belongs to user_id.
+
+        Args:
+            user_id: Owner to check
+            pack_id: Pack to look up
+
+        Returns:
+            The packs_v2 row, or None if the pack does not exist or is not the user's
+        """
+        result = await self._cached("owned_pack", user_id, pack_id, lambda: self.table("packs_v2")
+                                    .select("*").eq("pack_id", pack_id).eq("user_id", user_id).limit(1).execute())
+        return result.data[0] if result.data else None
+
+    async def update_source_status(self, params: Dict[str, Any]) -> QueryResult:
+        """params: user_uuid, target_source_id and any of status_param, progress_param, ..."""
+        return await self.rpc("update_source_status", params).execute()
+
+    async def add_pack_source(
+        self,
+        user_id: str,
+        pack_id: str,
+        source_id: str,
+        source_name: str,
+        source_type: str,
+        file_name: Optional[str] = None,
+        file_size: Optional[int] = None,
+    ) -> QueryResult:
+        params = {
+            "user_uuid": user_id,
+            "target_pack_id": pack_id,
+            "target_source_id": source_id,
+            "source_name_param": source_name,
+            "source_type_param": source_type,
+        }
+        if file_name is not None:
+            params["file_name_param"] = file_name
+        if file_size is not None:
+            params["file_size_param"] = file_size
+        return await self.rpc("add_pack_source", params).execute()
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Per table/RPC call counts and latencies, for health/metrics endpoints."""
+        return {
+            metric: {
+                "calls": int(stats["calls"]),
+                "errors": int(stats["errors"]),
+                "avg_ms": round(stats["total_ms"] / stats["calls"], 2) if stats["calls"] else 0,
+                "max_ms": round(stats["max_ms"], 2),
+            }
+            for metric, stats in sorted(self._metrics.items())
+        }
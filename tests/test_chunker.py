@@ -0,0 +1,102 @@
+"""
+Unit tests for chunker.py: segment splitting and chunk boundaries.
+
+Token counts use the length estimate (tiktoken disabled), so the tests run
+offline and the expected boundaries are easy to compute by hand.
+"""
+import pytest
+
+import chunker
+from chunker import chunk_texts, plan_chunks, split_segments
+
+
+pytestmark = pytest.mark.fast
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    """Count tokens as len // 4 instead of loading tiktoken."""
+    monkeypatch.setattr(chunker, "_encoding", False)
+
+
+class TestSplitSegments:
+    def test_segments_join_back_to_the_joined_texts(self):
+        texts = ["first message", "para one\n\npara two", "", "last"]
+        segments = split_segments(texts)
+        assert "".join(segments) == "\n\n".join(texts)
+
+    def test_paragraph_breaks_are_boundaries(self):
+        segments = split_segments(["alpha\n\nbeta\n\ngamma"])
+        assert segments == ["alpha\n\n", "beta\n\n", "gamma"]
+
+    def test_long_paragraph_is_split_on_soft_breaks(self):
+        text = "word " * 100
+        segments = split_segments([text], max_chars=50)
+        assert "".join(segments) == text
+        assert all(len(segment) <= 50 for segment in segments)
+        assert all(segment.endswith(" ") for segment in segments[:-1])
+
+    def test_hard_cut_without_soft_breaks(self):
+        segments = split_segments(["x" * 120], max_chars=50)
+        assert [len(segment) for segment in segments] == [50, 50, 20]
+
+
+class TestPlanChunks:
+    def test_empty(self):
+        assert plan_chunks([], max_tokens=10, overlap_tokens=2) == []
+
+    def test_everything_fits_in_one_chunk(self):
+        assert plan_chunks([3, 3, 4], max_tokens=10, overlap_tokens=2) == [(0, 3)]
+
+    def test_exact_budget_boundary(self):
+        # The first chunk ends exactly on the budget; the next starts inside it for overlap
+        assert plan_chunks([5, 5, 5, 5], max_tokens=10, overlap_tokens=5) == [(0, 2), (1, 3), (2, 4)]
+
+    def test_no_overlap(self):
+        assert plan_chunks([5, 5, 5, 5], max_tokens=10, overlap_tokens=0) == [(0, 2), (2, 4)]
+
+    def test_oversized_segment_gets_its_own_chunk(self):
+        assert plan_chunks([3, 50, 3], max_tokens=10, overlap_tokens=2) == [(0, 1), (1, 2), (2, 3)]
+
+    def test_chunks_respect_budget_and_overlap(self):
+        counts = [7, 3, 9, 1, 4, 6, 2, 8, 5, 5, 3]
+        ranges = plan_chunks(counts, max_tokens=15, overlap_tokens=4)
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(counts)
+        for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+            assert start < next_start <= end
+            assert sum(counts[next_start:end]) <= 4
+        for start, end in ranges:
+            assert end - start == 1 or sum(counts[start:end]) <= 15
+
+    def test_always_advances(self):
+        # Overlap larger than the budget must not stall on the same start
+        ranges = plan_chunks([4, 4, 4, 4], max_tokens=8, overlap_tokens=100)
+        starts = [start for start, _ in ranges]
+        assert starts == sorted(set(starts))
+        assert ranges[-1][1] == 4
+
+
+class TestChunkTexts:
+    def test_token_counts_match_chunks(self):
+        texts = ["a" * 40, "b" * 40, "c" * 40, "d" * 40]
+        chunks, tokens = chunk_texts(texts, max_tokens=25, overlap_tokens=0)
+        assert len(chunks) == len(tokens) == 2
+        # Per-chunk counts are sums of the segment counts, not a second tokenization
+        assert tokens == [sum(chunker.count_segment_tokens(split_segments([chunk]))) for chunk in chunks]
+        assert "".join(chunks) == "\n\n".join(texts)
+
+    def test_overlap_repeats_the_tail_of_the_previous_chunk(self):
+        texts = ["a" * 40, "b" * 40, "c" * 40]
+        chunks, _ = chunk_texts(texts, max_tokens=25, overlap_tokens=12)
+        assert len(chunks) == 2
+        assert chunks[1].startswith("b" * 40)
+        assert chunks[0].endswith("b" * 40 + "\n\n")
+
+    def test_no_text(self):
+        assert chunk_texts([]) == ([], [])
+
+    def test_progress_reports_completion(self):
+        calls = []
+        chunk_texts(["x" * 40] * 5, max_tokens=10, overlap_tokens=0,
+                    progress_callback=lambda count, pct: calls.append((count, pct)))
+        assert calls[-1] == (5, 99)
@@ -0,0 +1,108 @@
+"""
+Unit tests for download_stream.py: Range parsing, If-Range and ranged streaming.
+"""
+import pytest
+
+from download_stream import DownloadStream, Part, RangeNotSatisfiable, if_range_matches, is_strong_etag, parse_range
+
+
+pytestmark = pytest.mark.fast
+
+
+class TestParseRange:
+    @pytest.mark.parametrize("header, expected", [
+        ("bytes=0-9", (0, 9)),
+        ("bytes=5-", (5, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=-500", (0, 99)),
+        ("bytes=90-500", (90, 99)),
+        ("bytes=99-99", (99, 99)),
+        (" bytes = 3 - 4 ", (3, 4)),
+    ])
+    def test_single_ranges(self, header, expected):
+        assert parse_range(header, 100) == expected
+
+    @pytest.mark.parametrize("header", [None, "", "bytes=-", "bytes=0-1,5-6", "items=0-5", "bytes=a-b"])
+    def test_ignored_headers_serve_full_content(self, header):
+        assert parse_range(header, 100) is None
+
+    @pytest.mark.parametrize("header, total", [
+        ("bytes=100-", 100),
+        ("bytes=100-200", 100),
+        ("bytes=9-3", 100),
+        ("bytes=-0", 100),
+        ("bytes=-5", 0),
+        ("bytes=0-", 0),
+    ])
+    def test_unsatisfiable(self, header, total):
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range(header, total)
+
+
+class TestIfRange:
+    def test_is_strong_etag(self):
+        assert is_strong_etag('"abc"')
+        assert not is_strong_etag('W/"abc"')
+        assert not is_strong_etag(None)
+        assert not is_strong_etag("")
+
+    def test_without_if_range_a_strong_etag_allows_ranges(self):
+        assert if_range_matches(None, '"abc"')
+
+    def test_no_or_weak_etag_never_allows_ranges(self):
+        assert not if_range_matches(None, None)
+        assert not if_range_matches(None, 'W/"abc"')
+        assert not if_range_matches('W/"abc"', 'W/"abc"')
+
+    def test_strong_comparison(self):
+        assert if_range_matches('"abc"', '"abc"')
+        assert not if_range_matches('W/"abc"', '"abc"')
+        assert not if_range_matches('"abd"', '"abc"')
+        assert not if_range_matches("Wed, 21 Oct 2015 07:28:00 GMT", '"abc"')
+
+
+def fake_objects(objects):
+    """open_object over an in-memory {key: bytes}, recording every ranged GET."""
+    calls = []
+
+    def open_object(key, start, end, chunk_size):
+        calls.append((key, start, end))
+        data = objects[key][start:None if end is None else end + 1]
+        for position in range(0, len(data), chunk_size):
+            yield data[position:position + chunk_size]
+
+    return open_object, calls
+
+
+class TestDownloadStream:
+    def setup_method(self):
+        self.objects = {"a": b"0123456789", "b": b"abcdefghij"}
+        self.open_object, self.calls = fake_objects(self.objects)
+        self.stream = DownloadStream(
+            [Part.text("HEAD:"), Part.r2_object("a", 10), Part.text(""), Part.r2_object("b", 10)],
+            self.open_object,
+            chunk_size=4,
+        )
+
+    def test_full_body(self):
+        assert self.stream.size == 25
+        assert b"".join(self.stream.iter_bytes()) == b"HEAD:0123456789abcdefghij"
+        assert self.calls == [("a", 0, None), ("b", 0, None)]
+
+    def test_range_only_fetches_overlapping_parts(self):
+        assert b"".join(self.stream.iter_bytes(7, 16)) == b"23456789ab"
+        assert self.calls == [("a", 2, 9), ("b", 0, 1)]
+
+    def test_pieces_are_bounded_by_chunk_size(self):
+        assert all(len(piece) <= 4 for piece in self.stream.iter_bytes())
+
+    def test_object_shorter_than_recorded_size(self):
+        self.objects["b"] = b"abc"
+        with pytest.raises(RuntimeError):
+            b"".join(self.stream.iter_bytes())
+
+    def test_local_file(self, tmp_path):
+        path = tmp_path / "part.txt"
+        path.write_bytes(b"local file body")
+        stream = DownloadStream([Part.local_file(str(path), 15)], self.open_object, chunk_size=4)
+        assert b"".join(stream.iter_bytes(6, 9)) == b"file"
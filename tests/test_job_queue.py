@@ -0,0 +1,121 @@
+"""
+Unit tests for job_queue.py: the lease / complete / fail / retry flow on the SQLite backend.
+"""
+import asyncio
+import time
+
+import pytest
+
+import job_queue
+from job_queue import SQLiteJobQueue, retry_delay
+
+
+pytestmark = pytest.mark.fast
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteJobQueue(str(tmp_path / "queue.sqlite3"), backoff_base_seconds=10, backoff_max_seconds=900)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_runnable(queue, job_id):
+    """Move a job's retry time (or lease expiry) into the past."""
+    past = time.time() - 1
+    queue._write("UPDATE job_queue SET run_at = ?, lease_expires_at = ? WHERE job_id = ?", (past, past, job_id))
+
+
+class TestRetryDelay:
+    def test_exponential_with_jitter(self, monkeypatch):
+        monkeypatch.setattr(job_queue.random, "uniform", lambda low, high: high)
+        assert [retry_delay(n, 10, 900) for n in (1, 2, 3, 4)] == [10, 20, 40, 80]
+
+    def test_capped(self, monkeypatch):
+        monkeypatch.setattr(job_queue.random, "uniform", lambda low, high: high)
+        assert retry_delay(20, 10, 900) == 900
+
+    def test_jitter_keeps_at_least_half(self):
+        assert all(5 <= retry_delay(1, 10, 900) <= 10 for _ in range(50))
+
+
+class TestSQLiteJobQueue:
+    def test_lease_and_complete(self, queue):
+        job_id = run(queue.enqueue("extract", {"source_id": "s1"}))
+        job = run(queue.lease("w1"))
+        assert (job.job_id, job.kind, job.payload, job.attempts) == (job_id, "extract", {"source_id": "s1"}, 1)
+        assert run(queue.lease("w2")) is None
+        assert run(queue.complete(job))
+        assert run(queue.stats()) == {}
+        assert queue.snapshot()["completed"] == 1
+
+    def test_priority_then_run_at(self, queue):
+        low = run(queue.enqueue("extract", {}, priority=0))
+        high = run(queue.enqueue("extract", {}, priority=5))
+        assert run(queue.lease("w1")).job_id == high
+        assert run(queue.lease("w1")).job_id == low
+
+    def test_kinds_filter(self, queue):
+        run(queue.enqueue("extract", {}))
+        analyze = run(queue.enqueue("analyze", {}))
+        assert run(queue.lease("w1", kinds=["analyze"])).job_id == analyze
+        assert run(queue.lease("w1", kinds=["analyze"])) is None
+
+    def test_delayed_job_is_not_leased_early(self, queue):
+        run(queue.enqueue("extract", {}, delay_seconds=60))
+        assert run(queue.lease("w1")) is None
+
+    def test_failed_attempt_is_retried_after_backoff(self, queue):
+        job_id = run(queue.enqueue("extract", {}, max_attempts=3))
+        job = run(queue.lease("w1"))
+        assert run(queue.fail(job, "boom")) == "queued"
+        # Backoff: not runnable straight away
+        assert run(queue.lease("w1")) is None
+        make_runnable(queue, job_id)
+        retry = run(queue.lease("w1"))
+        assert retry.job_id == job_id and retry.attempts == 2
+        assert queue.snapshot()["retried"] == 1
+
+    def test_dead_after_max_attempts(self, queue):
+        job_id = run(queue.enqueue("extract", {}, max_attempts=2))
+        assert run(queue.fail(run(queue.lease("w1")), "first")) == "queued"
+        make_runnable(queue, job_id)
+        assert run(queue.fail(run(queue.lease("w1")), "second")) == "dead"
+        make_runnable(queue, job_id)
+        assert run(queue.lease("w1")) is None
+        assert run(queue.stats()) == {"dead": 1}
+
+    def test_expired_lease_is_taken_over_and_fences_the_old_worker(self, queue):
+        job_id = run(queue.enqueue("extract", {}, max_attempts=3))
+        stale = run(queue.lease("w1", visibility_timeout=60))
+        make_runnable(queue, job_id)
+        current = run(queue.lease("w2"))
+        assert current.job_id == job_id and current.attempts == 2
+        assert current.lease_token != stale.lease_token
+        # The first worker's token no longer counts
+        assert not run(queue.extend(stale))
+        assert not run(queue.complete(stale))
+        assert run(queue.fail(stale, "late")) is None
+        assert run(queue.complete(current))
+
+    def test_expired_lease_on_last_attempt_is_dead(self, queue):
+        job_id = run(queue.enqueue("extract", {}, max_attempts=1))
+        run(queue.lease("w1"))
+        make_runnable(queue, job_id)
+        assert run(queue.lease("w2")) is None
+        assert run(queue.stats()) == {"dead": 1}
+
+    def test_extend_keeps_the_lease(self, queue):
+        run(queue.enqueue("extract", {}))
+        job = run(queue.lease("w1", visibility_timeout=1))
+        assert run(queue.extend(job, visibility_timeout=300))
+        assert run(queue.lease("w2")) is None
+
+    def test_release_does_not_count_the_attempt(self, queue):
+        run(queue.enqueue("extract", {}))
+        job = run(queue.lease("w1"))
+        assert run(queue.release(job))
+        again = run(queue.lease("w1"))
+        assert again.job_id == job.job_id and again.attempts == 1
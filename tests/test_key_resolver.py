@@ -0,0 +1,105 @@
+"""
+Unit tests for key_resolver.py: layout candidates, resolution order and the negative cache.
+"""
+import pytest
+
+from key_resolver import KeyResolver, layout_candidates
+
+
+pytestmark = pytest.mark.fast
+
+USER_ID = "0123abcd-0000-4000-8000-0123456789ab"
+PRIMARY = f"user_{USER_ID}/job-1/summary.json"
+
+
+class FakeHead:
+    """HEAD over an in-memory {key: size}; keys in `broken` raise like a 5xx."""
+
+    def __init__(self, objects, broken=()):
+        self.objects = dict(objects)
+        self.broken = set(broken)
+        self.calls = []
+
+    def __call__(self, key):
+        self.calls.append(key)
+        if key in self.broken:
+            raise RuntimeError("503")
+        return self.objects.get(key)
+
+
+@pytest.fixture
+def make_resolver():
+    resolvers = []
+
+    def make(objects, **kwargs):
+        head = FakeHead(objects, kwargs.pop("broken", ()))
+        resolver = KeyResolver(head, **kwargs)
+        resolvers.append(resolver)
+        return resolver, head
+
+    yield make
+    for resolver in resolvers:
+        resolver.close()
+
+
+def test_layout_candidates():
+    keys = [key for _, key in layout_candidates(f"data/user_{USER_ID}/job-1/summary.json", "job-1", "summary.json")]
+    assert keys[0] == f"data/user_{USER_ID}/job-1/summary.json"
+    assert keys[1:] == [
+        f"user_{USER_ID}/job-1/summary.json",
+        f"{USER_ID}/job-1/summary.json",
+        f"users/{USER_ID}/job-1/summary.json",
+        f"prod/{USER_ID}/job-1/summary.json",
+    ]
+    # The primary key already uses a legacy layout: no duplicate
+    assert len(layout_candidates(PRIMARY, "job-1", "summary.json")) == 4
+
+
+class TestResolve:
+    def test_finds_a_legacy_layout_and_remembers_it(self, make_resolver):
+        legacy = f"prod/{USER_ID}/job-1/summary.json"
+        resolver, head = make_resolver({legacy: 42})
+        assert resolver.resolve(PRIMARY, "job-1", "summary.json") == (legacy, 42)
+        # The working layout is tried first for other files of the same user directory
+        candidates = resolver.candidates(f"user_{USER_ID}/job-2/other.json", "job-2", "other.json")
+        assert candidates[0][0] == "prod/{user_id}"
+
+    def test_missing_keys_are_negative_cached(self, make_resolver):
+        resolver, head = make_resolver({})
+        assert resolver.resolve(PRIMARY, "job-1", "summary.json") is None
+        probes = len(head.calls)
+        assert resolver.resolve(PRIMARY, "job-1", "summary.json") is None
+        assert len(head.calls) == probes
+        assert resolver.snapshot()["negative_hits"] == probes
+
+    def test_forget_clears_the_negative_entry(self, make_resolver):
+        resolver, head = make_resolver({})
+        resolver.resolve(PRIMARY, "job-1", "summary.json")
+        head.objects[PRIMARY] = 10
+        resolver.forget(PRIMARY)
+        assert resolver.resolve(PRIMARY, "job-1", "summary.json") == (PRIMARY, 10)
+
+    def test_failed_probes_are_not_cached(self, make_resolver):
+        resolver, head = make_resolver({}, broken={PRIMARY})
+        assert resolver.probe_many([PRIMARY]) == {PRIMARY: None}
+        assert resolver.probe_many([PRIMARY]) == {PRIMARY: None}
+        assert head.calls == [PRIMARY, PRIMARY]
+        assert resolver.snapshot()["probe_errors"] == 2
+
+
+class TestEmptyObjects:
+    def test_empty_object_is_reported_as_existing(self, make_resolver):
+        resolver, _ = make_resolver({PRIMARY: 0})
+        assert resolver.probe_many([PRIMARY]) == {PRIMARY: 0}
+
+    def test_empty_object_is_not_negative_cached(self, make_resolver):
+        resolver, head = make_resolver({PRIMARY: 0})
+        resolver.probe_many([PRIMARY])
+        head.objects[PRIMARY] = 7
+        assert resolver.probe_many([PRIMARY]) == {PRIMARY: 7}
+        assert resolver.snapshot()["negative_entries"] == 0
+
+    def test_non_empty_layout_is_preferred_over_an_empty_one(self, make_resolver):
+        legacy = f"{USER_ID}/job-1/summary.json"
+        resolver, _ = make_resolver({PRIMARY: 0, legacy: 5})
+        assert resolver.resolve(PRIMARY, "job-1", "summary.json") == (legacy, 5)
@@ -0,0 +1,190 @@
+"""
+Unit tests for memory_tree.py: fact merging, label lookup batches and MemoryTreeBatch.flush.
+
+The Supabase client is an in-memory fake that records every request.
+"""
+from urllib.parse import quote
+
+import pytest
+
+import memory_tree
+from memory_tree import LABEL_LOOKUP_MAX_LABELS, LABEL_LOOKUP_MAX_URL_CHARS, MemoryTreeBatch, label_batches, merge_data
+
+
+pytestmark = pytest.mark.fast
+
+
+class Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class Query:
+    """Chainable stand-in for a PostgREST table or RPC request."""
+
+    def __init__(self, client, table, rpc=None, params=None):
+        self.client = client
+        self.table = table
+        self.rpc = rpc
+        self.params = params
+        self.filters = {}
+        self.labels = None
+        self.rows = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def in_(self, column, values):
+        self.labels = list(values)
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def range(self, start, end):
+        return self
+
+    def insert(self, rows):
+        self.rows = rows
+        return self
+
+    def execute(self):
+        return self.client.execute(self)
+
+
+class FakeSupabase:
+    def __init__(self, nodes=None):
+        # id -> node row
+        self.nodes = {node["id"]: dict(node) for node in (nodes or [])}
+        self.evidence = []
+        self.lookups = []
+        self.fail_lookups = False
+
+    def table(self, name):
+        return Query(self, name)
+
+    def rpc(self, name, params):
+        return Query(self, None, rpc=name, params=params)
+
+    def execute(self, query):
+        if query.rpc == "merge_memory_nodes":
+            updated = []
+            for item in query.params["nodes_param"]:
+                node = self.nodes.get(item["id"])
+                if node is not None:
+                    node["data"] = merge_data(node["data"], item["data"])
+                    updated.append({"id": item["id"]})
+            return Result(updated)
+        if query.rows is not None:
+            if query.table == "memory_evidence":
+                self.evidence.extend(query.rows)
+                return Result(query.rows)
+            inserted = []
+            for row in query.rows:
+                node = {**row, "id": f"node-{len(self.nodes) + 1}"}
+                self.nodes[node["id"]] = node
+                inserted.append(node)
+            return Result(inserted)
+        if query.labels is not None:
+            self.lookups.append(query.labels)
+            if self.fail_lookups:
+                raise RuntimeError("414 Request-URI Too Large")
+            return Result([
+                {"id": node["id"], "node_type": node["node_type"], "label": node["label"]}
+                for node in self.nodes.values()
+                if node["label"] in query.labels and node["scope"] == query.filters.get("scope")
+            ])
+        return Result([
+            {"id": node["id"], "node_type": node["node_type"], "label": node["label"]}
+            for node in self.nodes.values()
+            if node["scope"] == query.filters.get("scope")
+        ])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeSupabase()
+    monkeypatch.setattr(memory_tree, "supabase", fake)
+    return fake
+
+
+def profile_facts(*preferences):
+    return {"preferences": list(preferences)}
+
+
+class TestMergeData:
+    def test_lists_are_unioned_in_first_seen_order(self):
+        assert merge_data({"tags": ["a", "b"]}, {"tags": ["b", "c"]}) == {"tags": ["a", "b", "c"]}
+
+    def test_scalars_take_the_new_value_and_missing_values_are_kept(self):
+        assert merge_data({"status": "old", "kept": 1}, {"status": "new"}) == {"status": "new", "kept": 1}
+
+
+class TestLabelBatches:
+    def test_batches_stay_within_label_and_url_limits(self):
+        labels = [f"{i:03d} " + "ü" * 116 for i in range(500)]
+        batches = label_batches(labels)
+        assert [label for batch in batches for label in batch] == labels
+        for batch in batches:
+            assert len(batch) <= LABEL_LOOKUP_MAX_LABELS
+            assert len(",".join(quote(f'"{label}"', safe="") for label in batch)) <= LABEL_LOOKUP_MAX_URL_CHARS
+
+    def test_short_labels_are_capped_by_count(self):
+        batches = label_batches([str(i) for i in range(120)])
+        assert [len(batch) for batch in batches] == [50, 50, 20]
+
+    def test_over_long_label_gets_its_own_batch(self):
+        assert label_batches(["a", "x" * 10000, "b"]) == [["a"], ["x" * 10000], ["b"]]
+
+
+class TestMemoryTreeBatch:
+    def test_first_flush_inserts_nodes_and_evidence(self, client):
+        batch = MemoryTreeBatch("user-1", "pack-1", "user_profile")
+        batch.add_chunk(profile_facts("likes tea", "likes tea"), "src-1", 0)
+        batch.flush()
+        assert [node["label"] for node in client.nodes.values()] == ["likes tea"]
+        assert len(client.evidence) == 2
+        assert {row["node_id"] for row in client.evidence} == {"node-1"}
+        assert not batch.has_pending
+
+    def test_later_flush_merges_into_existing_nodes(self, client):
+        client.nodes["node-9"] = {"id": "node-9", "scope": "user_profile", "node_type": "Project",
+                                  "label": "Atlas", "data": {"name": "Atlas", "tags": ["a"]}}
+        batch = MemoryTreeBatch("user-1", "pack-1", "user_profile")
+        batch.add_chunk({"projects": [{"name": "Atlas", "tags": ["b"]}]}, "src-1", 3)
+        batch.flush()
+        assert client.nodes["node-9"]["data"]["tags"] == ["a", "b"]
+        assert len(client.nodes) == 1
+        assert batch.stats["nodes_updated"] == 1
+
+    def test_node_deleted_meanwhile_is_re_created(self, client):
+        batch = MemoryTreeBatch("user-1", "pack-1", "user_profile")
+        batch.add_chunk(profile_facts("likes tea"), "src-1", 0)
+        batch.flush()
+        client.nodes.clear()
+        batch.add_chunk(profile_facts("likes tea"), "src-1", 1)
+        batch.flush()
+        assert [node["label"] for node in client.nodes.values()] == ["likes tea"]
+        assert client.evidence[-1]["node_id"] == next(iter(client.nodes))
+
+    def test_many_new_labels_are_looked_up_in_small_requests(self, client):
+        batch = MemoryTreeBatch("user-1", "pack-1", "user_profile")
+        batch.add_chunk(profile_facts(*(f"preference {i} " + "x" * 100 for i in range(300))), "src-1", 0)
+        batch.flush()
+        assert len(client.nodes) == 300
+        assert all(len(labels) <= LABEL_LOOKUP_MAX_LABELS for labels in client.lookups)
+
+    def test_failed_flush_keeps_pending_facts(self, client):
+        batch = MemoryTreeBatch("user-1", "pack-1", "user_profile")
+        batch.add_chunk(profile_facts("likes tea"), "src-1", 0)
+        client.fail_lookups = True
+        with pytest.raises(RuntimeError):
+            batch.flush()
+        assert batch.has_pending
+        client.fail_lookups = False
+        batch.flush()
+        assert [node["label"] for node in client.nodes.values()] == ["likes tea"]
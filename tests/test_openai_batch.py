@@ -0,0 +1,164 @@
+"""
+Unit tests for openai_batch.py: submit, re-attach, results, cancellation and failures.
+
+The transport is an in-memory fake with the same five coroutines as
+HttpBatchTransport; batch state lives in a dict instead of R2.
+"""
+import asyncio
+import json
+
+import pytest
+
+from openai_batch import BatchCancelled, BatchFailed, BatchRunner, BatchSubmitError, build_jsonl, parse_results
+
+
+pytestmark = pytest.mark.fast
+
+
+def output_line(custom_id, content="ok", status_code=200):
+    body = {"choices": [{"message": {"content": content}}]} if status_code == 200 else {"error": {"message": content}}
+    return json.dumps({"custom_id": custom_id, "response": {"status_code": status_code, "body": body}})
+
+
+class FakeTransport:
+    """Batches move through the statuses in `progress`, one per poll."""
+
+    def __init__(self, progress=("in_progress", "completed"), output=b"", fail_upload=False):
+        self.progress = list(progress)
+        self.output = output
+        self.fail_upload = fail_upload
+        self.created = []
+        self.cancelled = []
+        self.polls = 0
+
+    async def upload_file(self, filename, content):
+        if self.fail_upload:
+            raise RuntimeError("upload refused")
+        return "file-in"
+
+    async def create_batch(self, input_file_id, metadata):
+        self.created.append(metadata)
+        return {"id": f"batch-{len(self.created)}", "status": "validating"}
+
+    async def retrieve_batch(self, batch_id):
+        status = self.progress[min(self.polls, len(self.progress) - 1)]
+        self.polls += 1
+        batch = {"id": batch_id, "status": status, "request_counts": {"completed": 0, "failed": 0, "total": 2}}
+        if status in ("completed", "expired", "cancelled"):
+            batch["output_file_id"] = "file-out"
+        if status == "failed":
+            batch["errors"] = {"data": [{"message": "bad input"}]}
+        return batch
+
+    async def download_file(self, file_id):
+        return self.output
+
+    async def cancel_batch(self, batch_id):
+        self.cancelled.append(batch_id)
+        return {"id": batch_id, "status": "cancelling"}
+
+
+class Store:
+    def __init__(self, fail_put=False):
+        self.data = {}
+        self.fail_put = fail_put
+
+    def put(self, key, value):
+        if self.fail_put:
+            raise RuntimeError("R2 down")
+        self.data[key] = value
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        return self.data.pop(key, None) is not None
+
+
+REQUESTS = [("chunk-0", {"model": "m"}), ("chunk-1", {"model": "m"})]
+
+
+def make_runner(transport, store, **kwargs):
+    kwargs.setdefault("poll_interval_seconds", 0)
+    return BatchRunner(transport, store.put, store.get, store.delete, **kwargs)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestFiles:
+    def test_build_jsonl(self):
+        lines = build_jsonl(REQUESTS).decode().splitlines()
+        assert [json.loads(line)["custom_id"] for line in lines] == ["chunk-0", "chunk-1"]
+        assert json.loads(lines[0])["url"] == "/v1/chat/completions"
+
+    def test_parse_results(self):
+        output = (output_line("chunk-0") + "\n" + "not json\n").encode()
+        errors = output_line("chunk-1", "rate limited", status_code=429).encode()
+        results = parse_results(output, errors, None)
+        assert results["chunk-0"]["body"]["choices"][0]["message"]["content"] == "ok"
+        assert results["chunk-1"] == {"error": "rate limited"}
+
+
+class TestBatchRunner:
+    def test_completed_batch_returns_every_request(self):
+        transport = FakeTransport(output=output_line("chunk-0").encode())
+        store = Store()
+        results = run(make_runner(transport, store).run("state/key", REQUESTS))
+        assert "body" in results["chunk-0"]
+        assert results["chunk-1"] == {"error": "not answered (batch completed)"}
+        # State is kept until the caller has stored the results
+        assert json.loads(store.data["state/key"])["batch_id"] == "batch-1"
+
+    def test_reattaches_to_a_stored_batch(self):
+        transport = FakeTransport(output=output_line("chunk-0").encode())
+        store = Store()
+        store.put("state/key", json.dumps({"batch_id": "batch-7", "custom_ids": ["chunk-0", "chunk-1"]}))
+        runner = make_runner(transport, store)
+        run(runner.run("state/key", REQUESTS))
+        assert transport.created == []
+        assert runner.stats["reattached"] == 1
+
+    def test_should_stop_cancels_and_discards_state(self):
+        transport = FakeTransport(progress=("in_progress",))
+        store = Store()
+        runner = make_runner(transport, store)
+        with pytest.raises(BatchCancelled):
+            run(runner.run("state/key", REQUESTS, should_stop=lambda: True))
+        assert transport.cancelled == ["batch-1"]
+        assert "state/key" not in store.data
+        assert runner.stats["cancelled"] == 1
+
+    def test_deadline_cancels_and_raises_failed(self):
+        transport = FakeTransport(progress=("in_progress",))
+        store = Store()
+        with pytest.raises(BatchFailed):
+            run(make_runner(transport, store, max_wait_seconds=0).run("state/key", REQUESTS))
+        assert transport.cancelled == ["batch-1"]
+        assert "state/key" not in store.data
+
+    def test_failed_batch_raises_and_discards_state(self):
+        transport = FakeTransport(progress=("failed",))
+        store = Store()
+        with pytest.raises(BatchFailed, match="bad input"):
+            run(make_runner(transport, store).run("state/key", REQUESTS))
+        assert transport.cancelled == []
+        assert "state/key" not in store.data
+
+    def test_cancelled_batch_reports_unanswered_requests(self):
+        transport = FakeTransport(progress=("cancelled",), output=output_line("chunk-1").encode())
+        results = run(make_runner(transport, Store()).run("state/key", REQUESTS))
+        assert "body" in results["chunk-1"]
+        assert results["chunk-0"] == {"error": "not answered (batch cancelled)"}
+
+    def test_submit_error(self):
+        with pytest.raises(BatchSubmitError):
+            run(make_runner(FakeTransport(fail_upload=True), Store()).run("state/key", REQUESTS))
+
+    def test_unrecorded_batch_is_cancelled(self):
+        transport = FakeTransport()
+        with pytest.raises(BatchSubmitError):
+            run(make_runner(transport, Store(fail_put=True)).run("state/key", REQUESTS))
+        assert transport.cancelled == ["batch-1"]
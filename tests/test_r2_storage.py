@@ -0,0 +1,126 @@
+"""
+Unit tests for r2_storage.py: AnalysisWriter output, its single write-out, and transfer counters.
+"""
+import pytest
+
+from r2_storage import MULTIPART_MIN_PART_SIZE, AnalysisWriter, TransferStats, iter_byte_parts
+
+
+pytestmark = pytest.mark.fast
+
+
+class FakeStorage:
+    """In-memory object store recording every call."""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.uploads = []
+        self.multipart_uploads = []
+        self.downloads = []
+
+    def upload(self, key, text):
+        self.uploads.append(key)
+        self.objects[key] = text
+        return True
+
+    def download(self, key):
+        self.downloads.append(key)
+        return self.objects.get(key)
+
+    def multipart_upload(self, key, parts):
+        parts = list(parts)
+        self.multipart_uploads.append((key, [len(part) for part in parts]))
+        self.objects[key] = b"".join(parts).decode("utf-8")
+        return True
+
+
+def filled_writer(filename="notes.txt", analyses=("first", "second", "third")):
+    writer = AnalysisWriter(filename, total_chunks=len(analyses))
+    # Chunks finish out of order
+    for index in reversed(range(len(analyses))):
+        writer.add(index, analyses[index])
+    return writer
+
+
+class TestAnalysisWriterOutput:
+    def test_source_text_is_in_chunk_order_with_separators(self):
+        assert filled_writer().build_source_text() == (
+            "\n\n--- Chunk 1/3 ---\n\nfirst"
+            "\n\n--- Chunk 2/3 ---\n\nsecond"
+            "\n\n--- Chunk 3/3 ---\n\nthird"
+        )
+
+    def test_single_chunk_has_no_chunk_header(self):
+        writer = AnalysisWriter("one.txt", total_chunks=1)
+        writer.add(0, "only")
+        assert writer.build_source_text() == "\n\nonly"
+
+    def test_pack_text_for_a_new_pack(self):
+        assert filled_writer().build_pack_text("") == (
+            "--- SOURCE: notes.txt ---\n\n"
+            "first\n\n--- Chunk 2/3 ---\n\nsecond\n\n--- Chunk 3/3 ---\n\nthird"
+        )
+
+    def test_pack_text_appends_to_existing_content(self):
+        text = filled_writer("b.txt", ("x",)).build_pack_text("--- SOURCE: a.txt ---\n\nold")
+        assert text == "--- SOURCE: a.txt ---\n\nold\n\n--- SOURCE: b.txt ---\n\nx"
+
+    def test_partial_analysis_keeps_chunk_numbers(self):
+        writer = AnalysisWriter("notes.txt", total_chunks=4)
+        writer.add(2, "third")
+        writer.add(0, "first")
+        assert len(writer) == 2
+        assert writer.build_source_text() == "\n\n--- Chunk 1/4 ---\n\nfirst\n\n--- Chunk 3/4 ---\n\nthird"
+
+    def test_re_adding_a_chunk_replaces_it(self):
+        writer = filled_writer()
+        writer.add(1, "second, retried")
+        assert "second, retried" in writer.build_source_text()
+        assert len(writer) == 3
+
+
+class TestAnalysisWriterCommit:
+    def test_one_upload_per_object_and_one_pack_read(self):
+        storage = FakeStorage({"pack/complete_analyzed.txt": "--- SOURCE: a.txt ---\n\nold"})
+        ok = filled_writer().commit("src/analyzed.txt", "pack/complete_analyzed.txt", storage.upload, storage.download)
+        assert ok
+        assert storage.uploads == ["src/analyzed.txt", "pack/complete_analyzed.txt"]
+        assert storage.downloads == ["pack/complete_analyzed.txt"]
+        assert storage.objects["src/analyzed.txt"] == filled_writer().build_source_text()
+        assert storage.objects["pack/complete_analyzed.txt"].startswith("--- SOURCE: a.txt ---\n\nold\n\n--- SOURCE: notes.txt")
+
+    def test_large_objects_use_multipart(self):
+        storage = FakeStorage()
+        big = "é" * MULTIPART_MIN_PART_SIZE
+        writer = filled_writer(analyses=(big,))
+        ok = writer.commit("src/analyzed.txt", "pack/complete_analyzed.txt", storage.upload, storage.download,
+                           multipart_upload=storage.multipart_upload, multipart_threshold=1024, part_size=1)
+        assert ok
+        assert storage.uploads == []
+        assert [key for key, _ in storage.multipart_uploads] == ["src/analyzed.txt", "pack/complete_analyzed.txt"]
+        # part_size is raised to the S3 minimum; every part but the last has exactly that size
+        for _, sizes in storage.multipart_uploads:
+            assert all(size == MULTIPART_MIN_PART_SIZE for size in sizes[:-1])
+        assert storage.objects["src/analyzed.txt"] == writer.build_source_text()
+
+    def test_failed_upload_is_reported(self):
+        storage = FakeStorage()
+        ok = filled_writer().commit("src/analyzed.txt", "pack/complete_analyzed.txt",
+                                    lambda key, text: key.startswith("src/"), storage.download)
+        assert not ok
+
+
+class TestHelpers:
+    def test_iter_byte_parts_round_trips_multibyte_text(self):
+        text = "aé€😀" * 1000
+        parts = list(iter_byte_parts(text, 64))
+        assert b"".join(parts).decode("utf-8") == text
+        assert all(len(part) == 64 for part in parts[:-1])
+
+    def test_transfer_stats_delta(self):
+        stats = TransferStats()
+        before = stats.snapshot()
+        stats.record("get", bytes_in=10)
+        stats.record("put", bytes_out=5)
+        stats.record("put", bytes_out=5)
+        assert TransferStats.delta(before, stats.snapshot()) == {"get": 1, "put": 2, "bytes_in": 10, "bytes_out": 10}
@@ -0,0 +1,224 @@
+"""
+Disk spooling for uploaded files.
+
+Upload bodies are streamed to a temporary file in fixed-size pieces and
+hashed on the way, so a request never holds the whole file in memory.
+Extractors then read from the spooled file (memory-mapped where possible),
+and background jobs receive the path instead of the content.
+"""
+
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, Iterator, Optional
+
+
+# Bytes buffered before each write to disk
+SPOOL_PIECE_SIZE = 1024 * 1024
+
+
+@dataclass
+class SpooledUpload:
+    """An upload body written to disk."""
+    path: str
+    size: int
+    sha256: str
+
+    def discard(self) -> None:
+        """Delete the spooled file (safe to call more than once)."""
+        discard_spooled_file(self.path)
+
+
+def discard_spooled_file(path: Optional[str]) -> None:
+    """Delete a spooled file, ignoring files that are already gone."""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"⚠️ Could not remove spooled upload {path}: {e}")
+
+
+async def spool_stream(
+    chunks: AsyncIterator[bytes],
+    suffix: str = "",
+    directory: Optional[str] = None,
+    piece_size: int = SPOOL_PIECE_SIZE,
+    max_bytes: Optional[int] = None,
+) -> SpooledUpload:
+    """
+    Write an async byte stream to a temporary file.
+
+    Incoming chunks are collected into pieces of piece_size bytes; each piece
+    is hashed and written before the next one is collected, so memory use is
+    flat regardless of the upload size.
+
+    Args:
+        chunks: Async iterator of body chunks (e.g. Request.stream())
+        suffix: Temp file suffix (keeps the original extension)
+        directory: Spool directory (defaults to the system temp dir)
+        piece_size: Bytes buffered per write
+        max_bytes: Optional size limit
+
+    Returns:
+        SpooledUpload with the file path, size and SHA-256 digest
+
+    Raises:
+        ValueError: If the stream exceeds max_bytes
+    """
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=directory)
+    digest = hashlib.sha256()
+    size = 0
+    piece = bytearray()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise ValueError(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+                piece += chunk
+                if len(piece) >= piece_size:
+                    digest.update(piece)
+                    f.write(piece)
+                    piece.clear()
+            if piece:
+                digest.update(piece)
+                f.write(piece)
+    except BaseException:
+        discard_spooled_file(path)
+        raise
+
+    return SpooledUpload(path=path, size=size, sha256=digest.hexdigest())
+
+
+def spool_pieces(pieces: Iterable[bytes], suffix: str = "", directory: Optional[str] = None) -> SpooledUpload:
+    """
+    Write byte pieces (e.g. a streamed R2 object) to a temporary file, synchronously.
+
+    Args:
+        pieces: Content pieces in order
+        suffix: Temp file suffix (keeps the original extension)
+        directory: Spool directory (defaults to the system temp dir)
+
+    Returns:
+        SpooledUpload with the file path, size and SHA-256 digest
+    """
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=directory)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for piece in pieces:
+                digest.update(piece)
+                f.write(piece)
+                size += len(piece)
+    except BaseException:
+        discard_spooled_file(path)
+        raise
+    return SpooledUpload(path=path, size=size, sha256=digest.hexdigest())
+
+
+def iter_file_pieces(path: str, piece_size: int = SPOOL_PIECE_SIZE) -> Iterator[bytes]:
+    """Read a spooled file back in pieces of piece_size bytes."""
+    with open(path, "rb") as f:
+        while True:
+            piece = f.read(piece_size)
+            if not piece:
+                return
+            yield piece
+
+
+async def iter_upload_file(upload_file, piece_size: int = SPOOL_PIECE_SIZE) -> AsyncIterator[bytes]:
+    """
+    Read a FastAPI/Starlette UploadFile in pieces.
+
+    Args:
+        upload_file: Object with an async read(size) method
+        piece_size: Bytes per read
+
+    Yields:
+        File content pieces
+    """
+    while True:
+        data = await upload_file.read(piece_size)
+        if not data:
+            return
+        yield data
+
+
+class MappedFile(io.RawIOBase):
+    """Read-only, seekable file object over an mmap (zipfile/PyPDF2 compatible)."""
+
+    def __init__(self, mapped: mmap.mmap):
+        self._mapped = mapped
+        self._view = memoryview(mapped)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        end = min(self._pos + len(buffer), len(self._view))
+        count = max(0, end - self._pos)
+        buffer[:count] = self._view[self._pos:end]
+        self._pos += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+@contextmanager
+def open_spooled(path: str):
+    """
+    Open a spooled file for reading, memory-mapped where possible.
+
+    The mapping is wrapped in MappedFile, so it can be handed to zipfile,
+    PyPDF2 and python-docx like a regular binary file. Falls back to a plain
+    file object for empty files or platforms without mmap support.
+
+    Yields:
+        Seekable binary file-like object
+    """
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            yield f
+            return
+        stream = MappedFile(mapped)
+        try:
+            yield stream
+        finally:
+            stream.close()
+            mapped.close()
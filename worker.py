@@ -0,0 +1,157 @@
+"""
+Background job worker.
+
+Leases jobs from the queue configured by JOB_QUEUE_BACKEND (see
+job_queue.py) and runs them with the same code the web process uses
+inline: extraction, URL imports and analyses. Run it next to the web
+process:
+
+    uvicorn simple_backend:app ...     # web: enqueues
+    python worker.py                   # worker: leases and runs
+
+Each worker runs up to WORKER_CONCURRENCY jobs at once and extends their
+leases while they run. A job that raises is retried with backoff by the
+queue. On SIGTERM/SIGINT the worker stops leasing, interrupts its running
+jobs and hands them back to the queue. Interrupted analyses resume from
+their chunk checkpoints.
+
+A job whose source the user cancelled (the cancel marker, see
+backend.source_cancelled) is dropped: it is not started, its lease is no
+longer extended, and it is removed from the queue instead of retried.
+"""
+
+import asyncio
+import os
+import signal
+import socket
+from contextlib import suppress
+
+import simple_backend as backend
+
+
+async def keep_lease(queue, job, work: asyncio.Task, lost: asyncio.Event, dropped: asyncio.Event):
+    """
+    Extend the job's lease every third of the visibility timeout while checking for a cancel.
+
+    The work is stopped if the lease is lost. Once the job's source is cancelled the
+    lease is no longer extended; the work gets until the lease would have been
+    extended next to stop by itself (it sees the cancel too), then it is stopped.
+    """
+    loop = asyncio.get_running_loop()
+    interval = max(1.0, backend.JOB_VISIBILITY_TIMEOUT_SECONDS / 3)
+    extended_at = loop.time()
+    while True:
+        await asyncio.sleep(min(interval, backend.SOURCE_CANCEL_POLL_SECONDS))
+        if await backend.job_cancelled(job.payload):
+            print(f"🚫 Source of {job.kind} job {job.job_id} was cancelled; dropping the job")
+            dropped.set()
+            await asyncio.wait({work}, timeout=interval)
+            work.cancel()
+            return
+        if loop.time() - extended_at < interval:
+            continue
+        extended_at = loop.time()
+        try:
+            if await queue.extend(job, backend.JOB_VISIBILITY_TIMEOUT_SECONDS):
+                continue
+        except Exception as e:
+            print(f"⚠️ Could not extend lease of job {job.job_id}: {e}")
+            continue
+        print(f"⚠️ Lost lease of job {job.job_id}; stopping it (another worker owns it now)")
+        lost.set()
+        work.cancel()
+        return
+
+
+async def process_job(queue, job):
+    """Run one leased job and report the outcome to the queue."""
+    if await backend.job_cancelled(job.payload):
+        await queue.complete(job)
+        print(f"🚫 Dropped {job.kind} job {job.job_id}: its source was cancelled")
+        return
+    
+    print(f"⚙️ Running {job.kind} job {job.job_id} (attempt {job.attempts}/{job.max_attempts})")
+    work = asyncio.create_task(backend.run_job(job.kind, job.payload, queued=True))
+    lost = asyncio.Event()
+    dropped = asyncio.Event()
+    keeper = asyncio.create_task(keep_lease(queue, job, work, lost, dropped))
+    try:
+        await work
+    except asyncio.CancelledError:
+        if lost.is_set():
+            return
+        if not dropped.is_set():
+            # Worker shutting down: give the job back untried
+            work.cancel()
+            with suppress(Exception):
+                await queue.release(job)
+            raise
+    except Exception as e:
+        if not (dropped.is_set() or await backend.job_cancelled(job.payload)):
+            error = f"{type(e).__name__}: {e}"
+            status = await queue.fail(job, error)
+            print(f"❌ {job.kind} job {job.job_id} failed ({error}); {status or 'lease lost'}")
+            if status == "dead":
+                await backend.job_gave_up(job.kind, job.payload, error)
+            return
+        # Failed because it was cancelled: drop it instead of retrying
+        dropped.set()
+    finally:
+        keeper.cancel()
+
+    if not await queue.complete(job):
+        print(f"⚠️ {job.kind} job {job.job_id} finished after its lease was lost")
+    elif dropped.is_set():
+        print(f"🚫 Dropped {job.kind} job {job.job_id}: its source was cancelled")
+    else:
+        print(f"✅ {job.kind} job {job.job_id} done")
+
+
+async def run_worker():
+    queue = backend.job_queue
+    if queue is None:
+        raise SystemExit("JOB_QUEUE_BACKEND is 'inline': set it to 'postgres' or 'sqlite' to run workers")
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    slots = asyncio.Semaphore(max(1, backend.WORKER_CONCURRENCY))
+    running = set()
+
+    async with backend.lifespan(backend.app):
+        print(f"👷 Worker {worker_id} consuming the {queue.name} queue ({backend.WORKER_CONCURRENCY} concurrent jobs)")
+        while not stopping.is_set():
+            await slots.acquire()
+            job = None
+            if not stopping.is_set():
+                try:
+                    job = await queue.lease(worker_id, visibility_timeout=backend.JOB_VISIBILITY_TIMEOUT_SECONDS)
+                except Exception as e:
+                    print(f"⚠️ Failed to lease a job: {e}")
+            if job is None:
+                slots.release()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stopping.wait(), backend.WORKER_POLL_SECONDS)
+                continue
+
+            task = asyncio.create_task(process_job(queue, job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+        print(f"🛑 Worker {worker_id} stopping; handing back {len(running)} running job(s)")
+        for task in list(running):
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+def main():
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()
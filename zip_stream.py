@@ -0,0 +1,134 @@
+"""
+Streaming ZIP archives.
+
+The pack download used to fetch every member one at a time into a
+temporary ZIP file, then read the whole archive back into memory before
+sending the first byte. stream_zip yields the archive while it is being
+built instead. zipfile writes to a sink that is drained after every write
+(on a non-seekable sink zipfile emits data descriptors, so no seeking
+back is needed). Members are deflated on the fly and fetched ahead of the
+writer by a small thread pool, so the next few downloads overlap with the
+compression of the current one.
+
+Memory is bounded by the prefetch depth times the size of the members
+that are loaded whole. Members that are streamed (iterables of bytes) are
+never held in full.
+"""
+
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+
+# Members fetched ahead of the one being written
+DEFAULT_PREFETCH = 8
+
+MemberBody = Union[bytes, str, Iterable[bytes], None]
+
+
+class ZipMember(NamedTuple):
+    """
+    One archive entry.
+
+    load returns the contents (bytes/str loaded whole, or an iterable of
+    byte pieces to stream), or None to leave the member out.
+    """
+    name: str
+    load: Callable[[], MemberBody]
+
+
+class _Sink:
+    """Write-only, non-seekable buffer that zipfile writes into and stream_zip drains."""
+
+    def __init__(self):
+        self._pieces: List[bytes] = []
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._pieces.append(bytes(data))
+            self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        pieces, self._pieces = self._pieces, []
+        if pieces:
+            yield b"".join(pieces)
+
+
+def _prefetched(members: Iterable[ZipMember], pool: ThreadPoolExecutor, depth: int) -> Iterator[Tuple[str, MemberBody]]:
+    """Yield (name, body) in member order, keeping up to depth loads running ahead."""
+    pending = iter(members)
+    window: Deque[Tuple[str, Future]] = deque()
+
+    def submit_next() -> None:
+        member = next(pending, None)
+        if member is not None:
+            window.append((member.name, pool.submit(member.load)))
+
+    for _ in range(depth):
+        submit_next()
+    try:
+        while window:
+            name, future = window.popleft()
+            submit_next()
+            try:
+                body = future.result()
+            except Exception as e:
+                print(f"⚠️ Skipping {name} in ZIP: {e}")
+                body = None
+            yield name, body
+    finally:
+        for _, future in window:
+            future.cancel()
+
+
+def stream_zip(
+    members: Iterable[ZipMember],
+    prefetch: int = DEFAULT_PREFETCH,
+    compresslevel: int = 6,
+    on_member: Optional[Callable[[str, bool], None]] = None,
+) -> Iterator[bytes]:
+    """
+    Build a deflated ZIP archive and yield it as it is written.
+
+    Args:
+        members: Entries in archive order (may be a lazy iterable)
+        prefetch: Member loads running ahead of the writer
+        compresslevel: zlib compression level
+        on_member: Optional callback (name, added) after each member
+
+    Yields:
+        Consecutive pieces of the archive
+    """
+    sink = _Sink()
+    pool = ThreadPoolExecutor(max_workers=max(1, prefetch), thread_name_prefix="zip-prefetch")
+    try:
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as archive:
+            for name, body in _prefetched(members, pool, max(1, prefetch)):
+                if body is None or body == b"" or body == "":
+                    if on_member:
+                        on_member(name, False)
+                    continue
+                if isinstance(body, (bytes, str)):
+                    archive.writestr(name, body)
+                else:
+                    # Size unknown up front: allow ZIP64 in case the member is large
+                    with archive.open(name, "w", force_zip64=True) as dest:
+                        for piece in body:
+                            dest.write(piece)
+                            yield from sink.drain()
+                if on_member:
+                    on_member(name, True)
+                yield from sink.drain()
+        # Central directory
+        yield from sink.drain()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)